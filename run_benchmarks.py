@@ -0,0 +1,41 @@
+#!/usr/bin/env python2.7
+
+import os
+import sys
+
+source_dir = os.path.join(os.path.dirname(__file__), 'source')
+sys.path.insert(0, source_dir)
+
+from benchmarks import checker, logging_cost, payload, pusher, queue_ops, replay, resolver, stats
+
+SUITES = {
+    'redirect_checker': checker.main,
+    'dns': resolver.main,
+    'logging': logging_cost.main,
+    'notification_pusher': pusher.main,
+    'payload': payload.main,
+    'queue_ops': queue_ops.main,
+    'replay': replay.main,
+}
+
+
+def compare(argv):
+    baseline, candidate = stats.load_report(argv[0]), stats.load_report(argv[1])
+    for name, metric, old, new, change in stats.compare_reports(baseline, candidate):
+        sys.stdout.write('{:<28} {:<12} {:>12.4f} {:>12.4f} {:>+8.1f}%\n'.format(
+            name, metric, old, new, change
+        ))
+    return 0
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in SUITES and sys.argv[1] != 'compare':
+        sys.stderr.write('Usage: {} {{{}}} [options]\n'.format(
+            sys.argv[0], ','.join(sorted(SUITES) + ['compare'])
+        ))
+        sys.exit(2)
+
+    if sys.argv[1] == 'compare':
+        sys.exit(compare(sys.argv[2:]))
+
+    sys.exit(SUITES[sys.argv[1]](sys.argv[2:]))
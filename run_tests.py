@@ -17,7 +17,26 @@ from tests.Tests_for_redirect_checker.test_parse_cmd_args import ParseCmdArgsCas
 from tests.Tests_for_redirect_checker.test_spawn_workers import SpawnWorkersCase
 from tests.Tests_for_redirect_checker.test_get_tube import GetTubeCase
 from tests.Tests_for_redirect_checker.test_init import InitCase
+from tests.Tests_for_redirect_checker.test_update_config import UpdateConfigCase
 from tests.test_worker import WorkerCase
+from tests.test_benchmark_stats import BenchmarkStatsCase
+from tests.test_memory_queue import MemoryQueueCase, QueueServerCase
+from tests.test_capture import CaptureCase
+from tests.test_log import LogCase
+from tests.test_http_pool import SessionPoolCase
+from tests.test_curl_pool import CurlPoolCase
+from tests.test_dns_cache import DnsCacheCase
+from tests.test_concurrency import AimdLimiterCase
+from tests.test_timeouts import AdaptiveTimeoutsCase
+from tests.test_dedup import DeliveryLogCase
+from tests.test_rate_limit import RateLimitCase
+from tests.test_replay_buried import ReplayBuriedCase
+from tests.test_tarantool_pool import TarantoolPoolCase
+from tests.test_breaker import BreakerCase
+from tests.test_batching import BatcherCase
+from tests.test_ordering import SequencerCase
+from tests.test_lanes import LaneQueueCase
+from tests.test_codec import CodecCase
 
 if __name__ == '__main__':
     suite = unittest.TestSuite((
@@ -31,7 +50,27 @@ if __name__ == '__main__':
         unittest.makeSuite(SpawnWorkersCase),
         unittest.makeSuite(GetTubeCase),
         unittest.makeSuite(InitCase),
+        unittest.makeSuite(UpdateConfigCase),
         unittest.makeSuite(WorkerCase),
+        unittest.makeSuite(BenchmarkStatsCase),
+        unittest.makeSuite(MemoryQueueCase),
+        unittest.makeSuite(QueueServerCase),
+        unittest.makeSuite(CaptureCase),
+        unittest.makeSuite(LogCase),
+        unittest.makeSuite(SessionPoolCase),
+        unittest.makeSuite(CurlPoolCase),
+        unittest.makeSuite(DnsCacheCase),
+        unittest.makeSuite(AimdLimiterCase),
+        unittest.makeSuite(AdaptiveTimeoutsCase),
+        unittest.makeSuite(DeliveryLogCase),
+        unittest.makeSuite(RateLimitCase),
+        unittest.makeSuite(ReplayBuriedCase),
+        unittest.makeSuite(TarantoolPoolCase),
+        unittest.makeSuite(BreakerCase),
+        unittest.makeSuite(BatcherCase),
+        unittest.makeSuite(SequencerCase),
+        unittest.makeSuite(LaneQueueCase),
+        unittest.makeSuite(CodecCase),
     ))
     result = unittest.TextTestRunner().run(suite)
     sys.exit(not result.wasSuccessful())
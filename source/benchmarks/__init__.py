@@ -0,0 +1,7 @@
+# coding: utf-8
+"""
+Нагрузочные бенчмарки демонов.
+
+Каждый модуль пакета описывает один набор сценариев и предоставляет
+функцию main(argv), запускаемую через ./run_benchmarks.py.
+"""
@@ -0,0 +1,151 @@
+# coding: utf-8
+"""
+Бенчмарк проверки цепочек редиректов.
+
+Гоняет get_redirect_history (режим library) и полноценный lib.worker.worker
+(режим worker) против локального сервера цепочек.
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import sys
+import time
+
+import lib.worker
+from lib import get_redirect_history, memory_queue
+from lib.utils import Config
+
+from benchmarks import stats
+from benchmarks.servers import chain_server
+
+SCENARIOS = {
+    'http_hops': {'hops': 5, 'kind': 'http'},
+    'meta_hops': {'hops': 5, 'kind': 'meta'},
+    'mixed_hops': {'hops': 6, 'kind': 'mixed'},
+    'loop': {'hops': 3, 'loop': True},
+    'slow_host': {'hops': 3, 'delay': 0.05},
+    'large_body': {'hops': 1, 'body_size': 512 * 1024},
+    'counters': {'hops': 2, 'counters': True, 'body_size': 32 * 1024},
+}
+
+
+BENCH_SPACE = 901
+BENCH_INPUT_TUBE = 'bench.input'
+BENCH_OUTPUT_TUBE = 'bench.output'
+
+
+def wait_forever():
+    while True:
+        time.sleep(60)
+
+
+def run_library(url, count, timeout, max_redirects):
+    latencies = []
+    meter = stats.ResourceMeter().start()
+    for _ in xrange(count):
+        started_at = time.time()
+        get_redirect_history(url, timeout, max_redirects)
+        latencies.append(time.time() - started_at)
+    return latencies, meter.stop()
+
+
+def run_worker(url, count, timeout, max_redirects):
+    """
+    Прогоняет lib.worker.worker через очередь в памяти процесса. Воркер работает,
+    пока жив «родитель» — вспомогательный процесс, который останавливается,
+    как только все задачи входной трубы завершены.
+    """
+    memory_queue.drop_storage(BENCH_SPACE)
+    parent = multiprocessing.Process(target=wait_forever)
+    parent.daemon = True
+    parent.start()
+
+    def stop_parent():
+        parent.terminate()
+        parent.join()
+
+    tracker = stats.QueueTracker(BENCH_INPUT_TUBE, on_drained=stop_parent)
+    queue = memory_queue.Queue(space=BENCH_SPACE)
+    queue.storage.listeners.append(tracker)
+    input_tube = queue.tube(BENCH_INPUT_TUBE)
+    for number in xrange(count):
+        input_tube.put({'url': url, 'url_id': number})
+
+    config = Config()
+    config.QUEUE_BACKEND = 'memory'
+    config.INPUT_QUEUE_HOST = config.OUTPUT_QUEUE_HOST = 'localhost'
+    config.INPUT_QUEUE_PORT = config.OUTPUT_QUEUE_PORT = 0
+    config.INPUT_QUEUE_SPACE = config.OUTPUT_QUEUE_SPACE = BENCH_SPACE
+    config.INPUT_QUEUE_TUBE = BENCH_INPUT_TUBE
+    config.OUTPUT_QUEUE_TUBE = BENCH_OUTPUT_TUBE
+    config.QUEUE_TAKE_TIMEOUT = 0.1
+    config.HTTP_TIMEOUT = timeout
+    config.MAX_REDIRECTS = max_redirects
+    config.USER_AGENT = None
+    config.RECHECK_DELAY = 0
+
+    meter = stats.ResourceMeter().start()
+    lib.worker.worker(config, parent.pid)
+    usage = meter.stop()
+    memory_queue.drop_storage(BENCH_SPACE)
+    return tracker.latencies, usage
+
+
+def run(scenarios, modes, count, timeout, max_redirects):
+    server = chain_server(scenarios).start()
+    results = []
+    try:
+        for name in sorted(scenarios):
+            url = '{}/chain/{}/0'.format(server.base_url, name)
+            for mode in modes:
+                runner = run_library if mode == 'library' else run_worker
+                latencies, usage = runner(url, count, timeout, max_redirects)
+                result = stats.make_result(
+                    '{}.{}'.format(mode, name), len(latencies), latencies, usage,
+                    scenario=name, mode=mode, chain=scenarios[name]
+                )
+                results.append(result)
+                sys.stdout.write(stats.format_result(result).encode('utf-8') + '\n')
+    finally:
+        server.stop()
+    return results
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Redirect checker benchmark.')
+    parser.add_argument('-n', '--count', type=int, default=200, help='Chains per scenario.')
+    parser.add_argument('-s', '--scenario', action='append', dest='scenarios',
+                        help='Scenario name (may be repeated). All by default.')
+    parser.add_argument('--scenarios-file', help='JSON file with extra scenarios {name: chain params}.')
+    parser.add_argument('-m', '--mode', action='append', dest='modes', choices=('library', 'worker'),
+                        help='What to drive (may be repeated). Both by default.')
+    parser.add_argument('--timeout', type=int, default=3, help='HTTP timeout per url.')
+    parser.add_argument('--max-redirects', type=int, default=30)
+    parser.add_argument('-o', '--output', help='Path to JSON report.')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+
+    logging.getLogger('redirect_checker').setLevel(logging.CRITICAL)
+
+    scenarios = dict(SCENARIOS)
+    if args.scenarios_file:
+        with open(args.scenarios_file) as f:
+            scenarios.update(json.load(f))
+    if args.scenarios:
+        scenarios = dict((name, scenarios[name]) for name in args.scenarios)
+
+    modes = args.modes or ['library', 'worker']
+    results = run(scenarios, modes, args.count, args.timeout, args.max_redirects)
+
+    report = stats.make_report('redirect_checker', {
+        'count': args.count, 'timeout': args.timeout,
+        'max_redirects': args.max_redirects, 'modes': modes,
+    }, results)
+    path = args.output or stats.default_report_path('redirect_checker')
+    stats.save_report(report, path)
+    sys.stdout.write('Report saved to {}\n'.format(path))
+    return 0
@@ -0,0 +1,129 @@
+# coding: utf-8
+"""
+Бенчмарк стоимости логирования на одну задачу.
+
+Воспроизводит вызовы логгера, которые пушер делает на каждое уведомление,
+в двух вариантах: прежнем (format() до вызова логгера и переименование
+потока на каждую задачу) и текущем (отложенное форматирование через %),
+с синхронным StreamHandler и с lib.log.QueueHandler, на уровнях INFO и DEBUG.
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from threading import current_thread
+
+from lib.log import QueueHandler
+
+from benchmarks import stats
+
+URL = 'http://callback.example.com/api/v1/notify?app=42'
+
+
+class SlowStream(object):
+    """
+    Поток вывода, каждая запись в который занимает delay секунд
+    (как stderr, который медленно вычитывает сборщик логов).
+    """
+    def __init__(self, stream, delay):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, data):
+        if self.delay:
+            time.sleep(self.delay)
+        self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def eager_task(logger, task_id, number):
+    current_thread().name = "pusher.worker#{task_id}".format(task_id=task_id)
+    logger.debug('Get task from tube for worker#{number}.'.format(number=number))
+    logger.info('Start worker#{number} for task id={task_id}.'.format(task_id=task_id, number=number))
+    logger.info('Send data to callback url [{url}].'.format(url=URL))
+    logger.info('Callback url [{url}] response status code={status_code}.'.format(url=URL, status_code=200))
+    logger.debug('{name} task#{task_id}.'.format(name='ack'.capitalize(), task_id=task_id))
+
+
+def lazy_task(logger, task_id, number):
+    logger.debug('Get task from tube for worker#%s.', number)
+    logger.info('Start worker#%s for task id=%s.', number, task_id)
+    logger.info('Send data to callback url [%s].', URL)
+    logger.info('Callback url [%s] response status code=%s.', URL, 200)
+    logger.debug('%s task#%s.', 'ack'.capitalize(), task_id)
+
+
+TASKS = {'eager': eager_task, 'lazy': lazy_task}
+
+
+def make_logger(name, handler_kind, level, stream, capacity, drop):
+    console = logging.StreamHandler(stream)
+    console.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(threadName)s %(message)s'))
+    handler = console
+    if handler_kind == 'queued':
+        handler = QueueHandler(capacity=capacity, target=console, drop=drop)
+
+    logger = logging.getLogger('bench.logging.{}'.format(name))
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(level)
+    return logger, handler
+
+
+def run_scenario(args, style, handler_kind, level, stream):
+    name = '{}.{}.{}'.format(style, handler_kind, logging.getLevelName(level))
+    logger, handler = make_logger(name, handler_kind, level, stream, args.capacity, args.drop)
+    task = TASKS[style]
+
+    latencies = []
+    meter = stats.ResourceMeter().start()
+    for task_id in xrange(args.count):
+        started_at = time.time()
+        task(logger, task_id, task_id % 10)
+        latencies.append(time.time() - started_at)
+    handler.flush()
+    usage = meter.stop()
+    handler.close()
+
+    return stats.make_result(
+        name, args.count, latencies, usage,
+        style=style, handler=handler_kind, level=logging.getLevelName(level),
+        dropped=getattr(handler, 'dropped', 0)
+    )
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Per task logging cost benchmark.')
+    parser.add_argument('-n', '--count', type=int, default=20000, help='Tasks per scenario.')
+    parser.add_argument('--log-file', default=os.devnull, help='Where the console handler writes.')
+    parser.add_argument('--write-delay', type=float, default=0,
+                        help='Extra seconds per console write to emulate a slow stderr reader.')
+    parser.add_argument('--capacity', type=int, default=10000, help='QueueHandler capacity.')
+    parser.add_argument('--drop', default='new', choices=('new', 'old'), help='QueueHandler drop policy.')
+    parser.add_argument('-o', '--output', help='Path to JSON report.')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+
+    results = []
+    with open(args.log_file, 'a') as f:
+        stream = SlowStream(f, args.write_delay)
+        for level in (logging.INFO, logging.DEBUG):
+            for style in ('eager', 'lazy'):
+                for handler_kind in ('sync', 'queued'):
+                    result = run_scenario(args, style, handler_kind, level, stream)
+                    results.append(result)
+                    sys.stdout.write(stats.format_result(result).encode('utf-8') + '\n')
+
+    params = vars(args).copy()
+    params.pop('output')
+    report = stats.make_report('logging', params, results)
+    path = args.output or stats.default_report_path('logging')
+    stats.save_report(report, path)
+    sys.stdout.write('Report saved to {}\n'.format(path))
+    return 0
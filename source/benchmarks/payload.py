@@ -0,0 +1,91 @@
+# coding: utf-8
+"""
+Микробенчмарк кодирования тел уведомлений.
+
+Сравнивает прежний способ (копия данных задачи и json.dumps) с
+notification_pusher.encode_payload для каждого доступного кодека, а также
+повторную отправку задачи (retry, defer), когда тело уже закодировано.
+"""
+import argparse
+import sys
+import time
+
+import notification_pusher
+from lib import codec
+
+from benchmarks import stats
+
+
+class Task(object):
+    def __init__(self, task_id, data):
+        self.task_id = task_id
+        self.data = data
+
+
+def make_tasks(count, fields, value_size):
+    data = dict(('field_{}'.format(number), 'x' * value_size) for number in xrange(fields))
+    data.update({'callback_url': 'http://callback.example.com/api/v1/notify', 'amount': 12.5, 'user_id': 42})
+    return [Task(task_id, dict(data)) for task_id in xrange(count)]
+
+
+def copy_payload(task):
+    data = task.data.copy()
+    data.pop('callback_url')
+    data['id'] = task.task_id
+    return codec.json.dumps(data)
+
+
+def run_scenario(name, encode, tasks, **params):
+    latencies = []
+    meter = stats.ResourceMeter().start()
+    for task in tasks:
+        started_at = time.time()
+        encode(task)
+        latencies.append(time.time() - started_at)
+    usage = meter.stop()
+    return stats.make_result(name, len(tasks), latencies, usage, **params)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Notification body encoding benchmark.')
+    parser.add_argument('-n', '--count', type=int, default=20000, help='Tasks per scenario.')
+    parser.add_argument('--fields', type=int, default=10, help='String fields in task data.')
+    parser.add_argument('--value-size', type=int, default=32, help='Length of each string field.')
+    parser.add_argument('-o', '--output', help='Path to JSON report.')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+
+    scenarios = [('copy.json', copy_payload, None)]
+    for name in sorted(codec.CODECS):
+        if name != 'ujson' or codec.ujson is not None:
+            scenarios.append(('encode.{}'.format(name), notification_pusher.encode_payload, name))
+
+    results = []
+    for name, encode, codec_name in scenarios:
+        tasks = make_tasks(args.count, args.fields, args.value_size)
+        if codec_name is not None:
+            notification_pusher.json_codec = codec.get_codec(codec_name)
+            notification_pusher.MAX_CACHED_BODIES = args.count
+        notification_pusher.encoded_bodies.clear()
+
+        runs = [(name, {})]
+        if codec_name is not None:
+            runs.append(('{}.resend'.format(name), {'resend': True}))
+        for run_name, params in runs:
+            if params.get('resend'):
+                for task in tasks:
+                    notification_pusher.keep_payload(task, 'retry', encode(task))
+            result = run_scenario(run_name, encode, tasks, codec=codec_name or 'json', **params)
+            results.append(result)
+            sys.stdout.write(stats.format_result(result).encode('utf-8') + '\n')
+
+    params = vars(args).copy()
+    params.pop('output')
+    report = stats.make_report('payload', params, results)
+    path = args.output or stats.default_report_path('payload')
+    stats.save_report(report, path)
+    sys.stdout.write('Report saved to {}\n'.format(path))
+    return 0
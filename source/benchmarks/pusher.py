@@ -0,0 +1,295 @@
+# coding: utf-8
+"""
+Нагрузочный бенчмарк notification_pusher.
+
+Запускает notification_pusher.main_loop против очереди в памяти процесса
+(QUEUE_BACKEND = 'memory') и локальных серверов уведомлений с заданным
+распределением задержек, долей ошибок и долей медленных хостов, перебирая
+размеры пула обработчиков.
+
+С --processes пушер запускается в режиме prefork (notification_pusher.Supervisor)
+против сервера очереди в памяти в отдельном процессе. Задержки задач в этом
+режиме не замеряются, процессорное время - суммарное по процессам пушера.
+"""
+import argparse
+import gc
+import logging
+import resource
+import sys
+import time
+
+import gevent
+from gevent.event import Event
+from gevent.monkey import patch_all
+import greenlet
+
+import notification_pusher
+from lib import memory_queue, metrics
+from lib.breaker import HostGuard
+from lib.memory_queue import RemoteQueue
+from lib.utils import Config
+
+from benchmarks import stats
+from benchmarks.servers import QueueServerProcess, callback_server, latency_distribution
+
+BENCH_SPACE = 900
+BENCH_TUBE = 'bench.push_notifications'
+
+
+def count_greenlets():
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, greenlet.greenlet))
+
+
+def sample_greenlets(samples, interval):
+    while True:
+        samples.append(count_greenlets())
+        gevent.sleep(interval)
+
+
+def make_config(args, pool_size, hosts):
+    config = Config()
+    config.QUEUE_BACKEND = 'memory'
+    config.QUEUE_HOST = 'localhost'
+    config.QUEUE_PORT = 0
+    config.QUEUE_SPACE = BENCH_SPACE
+    config.QUEUE_TUBE = BENCH_TUBE
+    config.QUEUE_TAKE_TIMEOUT = 0.1
+    config.HTTP_CONNECTION_TIMEOUT = args.http_timeout
+    config.HTTP_ENGINE = args.http_engine
+    config.HTTP_MAX_CONNECTIONS_PER_HOST = args.max_connections_per_host
+    config.HTTP_IDLE_TIMEOUT = 30
+    config.HTTP_CONNECT_TIMEOUT = args.connect_timeout
+    config.HTTP_READ_TIMEOUT = args.read_timeout
+    config.ADAPTIVE_READ_TIMEOUT = args.adaptive_read_timeout
+    config.HTTP_READ_TIMEOUT_PERCENTILE = 0.99
+    config.HTTP_READ_TIMEOUT_FACTOR = args.read_timeout_factor
+    config.HTTP_READ_TIMEOUT_MIN = 0.05
+    config.HTTP_READ_TIMEOUT_MAX = args.http_timeout
+    config.DNS_RESOLVER = args.dns_resolver
+    config.DNS_CACHE_TTL = args.dns_cache_ttl
+    config.DNS_NEGATIVE_TTL = 5
+    config.DNS_PREFETCH = min(10, args.dns_cache_ttl / 2.0)
+    config.DNS_CACHE_SIZE = 10000
+    config.SLEEP = args.sleep
+    config.SLEEP_ON_FAIL = 1
+    config.SHUTDOWN_TIMEOUT = 10
+    config.WORKER_POOL_SIZE = pool_size
+    config.COMMIT_BATCH_SIZE = args.commit_batch_size
+    config.COMMIT_INTERVAL = args.commit_interval
+    config.COMMIT_RETRIES = 3
+    config.COMMIT_RETRY_DELAY = 0.1
+    config.RETRY_MAX_ATTEMPTS = args.retry_max_attempts
+    config.RETRY_DELAY = args.retry_delay
+    config.RETRY_MAX_DELAY = 300
+    config.HOST_MAX_CONCURRENCY = args.host_max_concurrency
+    config.HOST_DEFER_DELAY = args.host_defer_delay
+    config.HOST_RATE_LIMITS = {'*': tuple(args.host_rate_limit)} if args.host_rate_limit else {}
+    config.BREAKER_SLOW_CALL = args.breaker_slow_call
+    config.BREAKER_RESET_TIMEOUT = args.breaker_reset_timeout
+    config.BATCH_CALLBACKS = dict(
+        (host, (args.batch_size, args.batch_interval)) for host in hosts
+    ) if args.batch_size else {}
+    config.ADAPTIVE_CONCURRENCY = args.adaptive
+    config.CONCURRENCY_INTERVAL = args.concurrency_interval
+    config.CONCURRENCY_MIN = 2
+    config.CONCURRENCY_MAX = args.concurrency_max
+    config.CONCURRENCY_INCREASE = args.concurrency_increase
+    config.CONCURRENCY_DECREASE = 0.5
+    config.CONCURRENCY_LATENCY = args.concurrency_latency
+    config.CONCURRENCY_ERROR_RATE = 0.1
+    config.DEDUP_CACHE_SIZE = args.dedup_cache_size
+    config.DEDUP_FILE = args.dedup_file
+    config.METRICS_INTERVAL = 3600
+    return config
+
+
+def make_payloads(count, servers, shared_url=False, host=None):
+    return [
+        {'callback_url': 'http://{}:{}/callback/{}'.format(
+            host or servers[number % len(servers)].host, servers[number % len(servers)].port,
+            '' if shared_url else number
+        )}
+        for number in xrange(count)
+    ]
+
+
+def run_pool(args, pool_size, payloads):
+    memory_queue.drop_storage(BENCH_SPACE)
+    drained = Event()
+    tracker = stats.QueueTracker(BENCH_TUBE, on_drained=drained.set)
+    queue = memory_queue.Queue(space=BENCH_SPACE)
+    queue.storage.listeners.append(tracker)
+    tube = queue.tube(BENCH_TUBE)
+    for payload in payloads:
+        tube.put(payload)
+
+    hosts = set(HostGuard.host(payload['callback_url']) for payload in payloads)
+    config = make_config(args, pool_size, hosts)
+    samples = []
+
+    notification_pusher.run_application = True
+    metrics.reset()
+    meter = stats.ResourceMeter().start()
+    loop = gevent.spawn(notification_pusher.main_loop, config)
+    sampler = gevent.spawn(sample_greenlets, samples, args.sample_interval)
+    drained.wait(timeout=args.max_time)
+    notification_pusher.run_application = False
+    loop.join()
+    sampler.kill()
+    usage = meter.stop()
+
+    if loop.exception is not None:
+        raise loop.exception
+
+    finished = len(tracker.latencies)
+    return stats.make_result(
+        'pool_size={}'.format(pool_size), finished, tracker.latencies, usage,
+        pool_size=pool_size, events=tracker.events, unfinished=tracker.pending,
+        greenlets={'max': max(samples or [0]), 'mean': sum(samples) / float(len(samples) or 1)},
+        commit_lag=metrics.summary('pusher.commit_lag').snapshot(),
+        batches=metrics.counter('pusher.batches').value,
+        concurrency_limit=metrics.gauge('pusher.concurrency.limit').value,
+        throttled=metrics.counter('pusher.throttled').value
+    )
+
+
+def run_processes(args, pool_size, payloads, queue_server):
+    queue = RemoteQueue(queue_server.host, queue_server.port, BENCH_SPACE)
+    tube = queue.tube(BENCH_TUBE)
+    for payload in payloads:
+        tube.put(payload)
+
+    config = make_config(args, pool_size, set(HostGuard.host(payload['callback_url']) for payload in payloads))
+    config.QUEUE_BACKEND = 'memory_server'
+    config.QUEUE_HOST = queue_server.host
+    config.QUEUE_PORT = queue_server.port
+    config.PROCESSES = args.processes
+
+    notification_pusher.run_application = True
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    meter = stats.ResourceMeter().start()
+    supervisor = gevent.spawn(notification_pusher.Supervisor(config).run)
+    deadline = time.time() + args.max_time
+    statistics = tube.statistics()
+    while statistics['tasks']['total'] and time.time() < deadline:
+        gevent.sleep(0.05)
+        statistics = tube.statistics()
+    notification_pusher.run_application = False
+    supervisor.join()
+    usage = meter.stop()
+    queue.close()
+
+    if supervisor.exception is not None:
+        raise supervisor.exception
+
+    used = resource.getrusage(resource.RUSAGE_CHILDREN)
+    usage['cpu_user'] += used.ru_utime - children.ru_utime
+    usage['cpu_system'] += used.ru_stime - children.ru_stime
+    finished = statistics['ack'] + statistics['bury']
+    return stats.make_result(
+        'processes={} pool_size={}'.format(args.processes, pool_size), finished, [], usage,
+        pool_size=pool_size, processes=args.processes, unfinished=statistics['tasks']['total'],
+        events=dict((name, value) for name, value in statistics.iteritems() if name != 'tasks' and value)
+    )
+
+
+def start_servers(args):
+    slow_count = int(round(args.hosts * args.slow_fraction))
+    servers = []
+    for number in xrange(args.hosts):
+        mean = args.slow_latency if number < slow_count else args.latency
+        servers.append(callback_server(
+            latency_distribution(args.latency_dist, mean), error_rate=args.error_rate
+        ).start())
+    return servers
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Notification pusher benchmark.')
+    parser.add_argument('-n', '--count', type=int, default=2000, help='Notifications per pool size.')
+    parser.add_argument('-p', '--pool-sizes', default='1,10,50,100',
+                        help='Comma separated WORKER_POOL_SIZE values to sweep.')
+    parser.add_argument('--hosts', type=int, default=8, help='Number of callback hosts.')
+    parser.add_argument('--latency-dist', default='exponential', choices=('fixed', 'uniform', 'exponential'))
+    parser.add_argument('--latency', type=float, default=0.02, help='Mean callback latency, seconds.')
+    parser.add_argument('--slow-fraction', type=float, default=0.0, help='Fraction of slow callback hosts.')
+    parser.add_argument('--slow-latency', type=float, default=1.0, help='Mean latency of slow hosts, seconds.')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of 500 responses.')
+    parser.add_argument('--http-timeout', type=float, default=30, help='HTTP_CONNECTION_TIMEOUT.')
+    parser.add_argument('--connect-timeout', type=float, help='HTTP_CONNECT_TIMEOUT, --http-timeout by default.')
+    parser.add_argument('--read-timeout', type=float, help='HTTP_READ_TIMEOUT, --http-timeout by default.')
+    parser.add_argument('--adaptive-read-timeout', action='store_true',
+                        help='ADAPTIVE_READ_TIMEOUT: read timeout per host from its p99 latency.')
+    parser.add_argument('--read-timeout-factor', type=float, default=3, help='HTTP_READ_TIMEOUT_FACTOR.')
+    parser.add_argument('--http-engine', default='requests', choices=sorted(notification_pusher.HTTP_ENGINES),
+                        help='HTTP_ENGINE.')
+    parser.add_argument('--callback-host', help='Host name in callback urls instead of the server address, '
+                                                   'e.g. localhost to resolve it for every new connection.')
+    parser.add_argument('--dns-resolver', default='thread', help='DNS_RESOLVER.')
+    parser.add_argument('--dns-cache-ttl', type=float, default=60, help='DNS_CACHE_TTL, 0 - no cache.')
+    parser.add_argument('--max-connections-per-host', type=int, default=10,
+                        help='HTTP_MAX_CONNECTIONS_PER_HOST.')
+    parser.add_argument('--commit-batch-size', type=int, default=100, help='COMMIT_BATCH_SIZE.')
+    parser.add_argument('--commit-interval', type=float, default=0.05, help='COMMIT_INTERVAL.')
+    parser.add_argument('--retry-max-attempts', type=int, default=5, help='RETRY_MAX_ATTEMPTS.')
+    parser.add_argument('--retry-delay', type=float, default=0.1, help='RETRY_DELAY.')
+    parser.add_argument('--host-max-concurrency', type=int, help='HOST_MAX_CONCURRENCY, no limit by default.')
+    parser.add_argument('--host-defer-delay', type=float, default=0.5, help='HOST_DEFER_DELAY.')
+    parser.add_argument('--host-rate-limit', type=float, nargs=2, metavar=('RATE', 'BURST'),
+                        help='HOST_RATE_LIMITS of every callback host: requests per second and burst.')
+    parser.add_argument('--breaker-slow-call', type=float, default=5, help='BREAKER_SLOW_CALL.')
+    parser.add_argument('--breaker-reset-timeout', type=float, default=5, help='BREAKER_RESET_TIMEOUT.')
+    parser.add_argument('--batch-size', type=int, default=0,
+                        help='Send notifications to one url per host in batches of this size (BATCH_CALLBACKS).')
+    parser.add_argument('--batch-interval', type=float, default=0.1, help='Batch collection time, seconds.')
+    parser.add_argument('--adaptive', action='store_true',
+                        help='Adapt the worker pool (ADAPTIVE_CONCURRENCY) starting from each pool size.')
+    parser.add_argument('--concurrency-interval', type=float, default=0.5, help='CONCURRENCY_INTERVAL.')
+    parser.add_argument('--concurrency-max', type=int, default=200, help='CONCURRENCY_MAX.')
+    parser.add_argument('--concurrency-increase', type=int, default=5, help='CONCURRENCY_INCREASE.')
+    parser.add_argument('--concurrency-latency', type=float, default=1.0, help='CONCURRENCY_LATENCY.')
+    parser.add_argument('--dedup-cache-size', type=int, default=100000, help='DEDUP_CACHE_SIZE, 0 - no check.')
+    parser.add_argument('--dedup-file', help='DEDUP_FILE, in memory by default.')
+    parser.add_argument('--processes', type=int, default=0,
+                        help='Run the pusher in prefork mode with this many processes (PROCESSES).')
+    parser.add_argument('--sleep', type=float, default=0.1, help='SLEEP.')
+    parser.add_argument('--max-time', type=float, default=300, help='Time limit per pool size, seconds.')
+    parser.add_argument('--sample-interval', type=float, default=0.5, help='Greenlet count sampling interval.')
+    parser.add_argument('-o', '--output', help='Path to JSON report.')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    pool_sizes = [int(size) for size in args.pool_sizes.split(',')]
+
+    logging.getLogger('pusher').setLevel(logging.CRITICAL)
+
+    # callback and queue servers are forked before the hub is patched
+    servers = start_servers(args)
+    queue_server = QueueServerProcess().start() if args.processes else None
+    patch_all()
+
+    results = []
+    try:
+        payloads = make_payloads(args.count, servers, shared_url=bool(args.batch_size), host=args.callback_host)
+        for pool_size in pool_sizes:
+            if queue_server is not None:
+                result = run_processes(args, pool_size, payloads, queue_server)
+            else:
+                result = run_pool(args, pool_size, payloads)
+            results.append(result)
+            sys.stdout.write(stats.format_result(result).encode('utf-8') + '\n')
+    finally:
+        for server in servers:
+            server.stop()
+        if queue_server is not None:
+            queue_server.stop()
+
+    params = dict(vars(args), pool_sizes=pool_sizes)
+    params.pop('output')
+    report = stats.make_report('notification_pusher', params, results)
+    path = args.output or stats.default_report_path('notification_pusher')
+    stats.save_report(report, path)
+    sys.stdout.write('Report saved to {}\n'.format(path))
+    return 0
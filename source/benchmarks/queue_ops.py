@@ -0,0 +1,110 @@
+# coding: utf-8
+"""
+Бенчмарк операций с очередью: стоимость put, take и ack на стороне клиента
+для очереди в памяти процесса (memory), сервера очереди в памяти
+(memory_server) и, если он доступен, настоящего tarantool.
+"""
+import argparse
+import sys
+import threading
+import time
+
+from lib import memory_queue
+from lib.utils import create_queue
+
+from benchmarks import stats
+
+BENCH_SPACE = 902
+BENCH_TUBE = 'bench.queue_ops'
+
+
+def timed(operation, count):
+    latencies = []
+    results = []
+    meter = stats.ResourceMeter().start()
+    for number in xrange(count):
+        started_at = time.time()
+        results.append(operation(number))
+        latencies.append(time.time() - started_at)
+    return results, latencies, meter.stop()
+
+
+def run_backend(backend, host, port, space, count, payload_size, connections=None):
+    queue = create_queue(host, port, space, backend, connections if backend == 'tarantool' else None)
+    tube = queue.tube(BENCH_TUBE)
+    payload = {'callback_url': 'http://localhost/callback', 'body': 'x' * payload_size}
+
+    results = []
+    _, latencies, usage = timed(lambda number: tube.put(dict(payload, id=number)), count)
+    results.append(stats.make_result('{}.put'.format(backend), count, latencies, usage, backend=backend))
+
+    tasks, latencies, usage = timed(lambda number: tube.take(0), count)
+    tasks = [task for task in tasks if task is not None]
+    results.append(stats.make_result('{}.take'.format(backend), len(tasks), latencies, usage, backend=backend))
+
+    _, latencies, usage = timed(lambda number: tasks[number].ack(), len(tasks))
+    results.append(stats.make_result('{}.ack'.format(backend), len(tasks), latencies, usage, backend=backend))
+
+    if isinstance(queue, memory_queue.RemoteQueue):
+        queue.close()
+    return results
+
+
+def start_queue_server():
+    server = memory_queue.QueueServer(('127.0.0.1', 0))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Queue operations benchmark.')
+    parser.add_argument('-n', '--count', type=int, default=5000, help='Tasks per backend.')
+    parser.add_argument('-b', '--backend', action='append', dest='backends',
+                        choices=('memory', 'memory_server', 'tarantool'),
+                        help='Queue backend (may be repeated). memory and memory_server by default.')
+    parser.add_argument('--payload-size', type=int, default=256, help='Task payload size, bytes.')
+    parser.add_argument('--tarantool-host', default='localhost')
+    parser.add_argument('--tarantool-port', type=int, default=33013)
+    parser.add_argument('--tarantool-space', type=int, default=0)
+    parser.add_argument('--tarantool-connections', type=int,
+                        help='Use a pool of pipelined tarantool connections of this size (lib/tarantool_pool.py).')
+    parser.add_argument('-o', '--output', help='Path to JSON report.')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    backends = args.backends or ['memory', 'memory_server']
+
+    server = start_queue_server() if 'memory_server' in backends else None
+    results = []
+    try:
+        for backend in backends:
+            memory_queue.drop_storage(BENCH_SPACE)
+            if backend == 'tarantool':
+                host, port, space = args.tarantool_host, args.tarantool_port, args.tarantool_space
+            elif backend == 'memory_server':
+                (host, port), space = server.server_address, BENCH_SPACE
+            else:
+                host, port, space = 'localhost', 0, BENCH_SPACE
+            results_of_backend = run_backend(
+                backend, host, port, space, args.count, args.payload_size, args.tarantool_connections
+            )
+            for result in results_of_backend:
+                results.append(result)
+                sys.stdout.write(stats.format_result(result).encode('utf-8') + '\n')
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        memory_queue.drop_storage(BENCH_SPACE)
+
+    params = dict(vars(args), backends=backends)
+    params.pop('output')
+    report = stats.make_report('queue_ops', params, results)
+    path = args.output or stats.default_report_path('queue_ops')
+    stats.save_report(report, path)
+    sys.stdout.write('Report saved to {}\n'.format(path))
+    return 0
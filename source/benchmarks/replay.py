@@ -0,0 +1,336 @@
+# coding: utf-8
+"""
+Воспроизведение записанного трафика (lib/capture.py).
+
+Задачи из записи кладутся в очередь в памяти с исходными интервалами,
+ускоренными в --speed раз (0 — без пауз), а все HTTP-запросы демона уходят
+через переменную окружения http_proxy в локальный ответчик, который отдает
+записанные статусы, редиректы и тела ответов с записанными (также
+ускоренными) задержками. https-адреса переписываются на http, так как
+ответчик не умеет CONNECT.
+
+Уведомления пушера обрабатываются notification_pusher.main_loop в текущем
+процессе, проверка редиректов — процессами lib.worker.worker, подключенными
+к серверу очереди в памяти.
+"""
+import argparse
+from collections import defaultdict
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from urlparse import urlsplit
+
+from lib import capture, memory_queue
+from lib.utils import Config, spawn_workers
+
+from benchmarks import stats
+from benchmarks.checker import wait_forever
+from benchmarks.servers import QuietHandler, ServerProcess
+
+BENCH_SPACE = 903
+BENCH_INPUT_TUBE = 'replay.input'
+BENCH_OUTPUT_TUBE = 'replay.output'
+
+URL_FIELDS = {'pusher': 'callback_url', 'checker': 'url'}
+"""Поле задачи с адресом, по которому демон делает запрос"""
+
+
+def plain_http(url):
+    if url and url.startswith('https://'):
+        return 'http://' + url[len('https://'):]
+    return url
+
+
+class ReplayHandler(QuietHandler):
+    """
+    HTTP-прокси, отвечающий записанными ответами. Запросы к адресам, которых
+    нет в записи, получают пустой ответ 200 со средней задержкой хоста.
+    """
+    exchanges = {}
+    host_latency = {}
+    speed = 1.0
+    served = defaultdict(int)
+
+    def do_GET(self):
+        self.replay()
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        self.rfile.read(length)
+        self.replay()
+
+    def replay(self):
+        url = plain_http(self.path)
+        recorded = self.exchanges.get((self.command, url))
+        if recorded:
+            number = self.served[url]
+            self.served[url] = number + 1
+            exchange = recorded[number % len(recorded)]
+        else:
+            exchange = {'status': 200, 'elapsed': self.host_latency.get(urlsplit(url).netloc, 0)}
+
+        if self.speed and exchange['elapsed']:
+            time.sleep(exchange['elapsed'] / self.speed)
+
+        if exchange.get('error'):
+            self.close_connection = 1
+            return
+
+        headers = []
+        if exchange.get('location'):
+            headers.append(('Location', plain_http(exchange['location'])))
+        body = (exchange.get('body') or u'').encode('latin-1').replace('https://', 'http://')
+        self.send_body(exchange['status'] or 200, body, headers=headers)
+
+
+def replay_server(exchanges, speed, host='127.0.0.1', port=0):
+    """
+    Создает (но не запускает) ответчик по записанным HTTP-обменам.
+
+    :param exchanges: записи kind=http
+    :type exchanges: list
+    :param speed: ускорение задержек, 0 - отвечать сразу
+    :type speed: float
+
+    :rtype: ServerProcess
+    """
+    by_url = defaultdict(list)
+    host_elapsed = defaultdict(list)
+    for exchange in exchanges:
+        url = plain_http(exchange['url'])
+        by_url[(exchange['method'], url)].append(exchange)
+        host_elapsed[urlsplit(url).netloc].append(exchange['elapsed'])
+
+    class ConfiguredReplayHandler(ReplayHandler):
+        pass
+    ConfiguredReplayHandler.exchanges = dict(by_url)
+    ConfiguredReplayHandler.host_latency = dict(
+        (netloc, sum(values) / len(values)) for netloc, values in host_elapsed.iteritems()
+    )
+    ConfiguredReplayHandler.speed = speed
+    return ServerProcess(ConfiguredReplayHandler, host, port)
+
+
+class Feeder(threading.Thread):
+    """
+    Кладет задачи из записи в трубу с записанными интервалами, ускоренными в speed раз.
+    """
+    def __init__(self, tube, tasks, speed, on_finished):
+        super(Feeder, self).__init__()
+        self.daemon = True
+        self.tube = tube
+        self.tasks = tasks
+        self.speed = speed
+        self.on_finished = on_finished
+        self.finished = False
+        self.lag = []
+
+    def run(self):
+        started_at = time.time()
+        first_ts = self.tasks[0]['ts'] if self.tasks else 0
+        for record in self.tasks:
+            if self.speed:
+                due = started_at + (record['ts'] - first_ts) / self.speed
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    self.lag.append(-delay)
+            self.tube.put(record['data'], pri=record.get('pri', 0))
+        self.finished = True
+        self.on_finished()
+
+
+def prepare_tasks(records, source):
+    url_field = URL_FIELDS[source]
+    tasks = []
+    for record in records:
+        if record['kind'] != 'task' or record['source'] != source:
+            continue
+        data = dict(record['data'])
+        data[url_field] = plain_http(data.get(url_field))
+        tasks.append(dict(record, data=data))
+    return tasks
+
+
+class Completion(object):
+    """
+    Вызывает stop один раз, когда все задачи положены в очередь и завершены.
+    """
+    def __init__(self, stop):
+        self.stop = stop
+        self.lock = threading.Lock()
+        self.stopped = False
+        self.tracker = None
+        self.feeder = None
+
+    def check(self):
+        if not (self.feeder.finished and self.tracker.pending == 0):
+            return
+        with self.lock:
+            if self.stopped:
+                return
+            self.stopped = True
+        self.stop()
+
+
+def run_pusher(args, tasks):
+    from gevent.monkey import patch_all
+    import notification_pusher
+
+    patch_all()
+    logging.getLogger('pusher').setLevel(logging.CRITICAL)
+
+    done = threading.Event()
+    completion = Completion(done.set)
+    queue = memory_queue.Queue(space=BENCH_SPACE)
+    completion.tracker = stats.QueueTracker(BENCH_INPUT_TUBE, on_drained=completion.check)
+    queue.storage.listeners.append(completion.tracker)
+    completion.feeder = Feeder(queue.tube(BENCH_INPUT_TUBE), tasks, args.speed, completion.check)
+
+    config = Config()
+    config.QUEUE_BACKEND = 'memory'
+    config.QUEUE_HOST = 'localhost'
+    config.QUEUE_PORT = 0
+    config.QUEUE_SPACE = BENCH_SPACE
+    config.QUEUE_TUBE = BENCH_INPUT_TUBE
+    config.QUEUE_TAKE_TIMEOUT = 0.1
+    config.HTTP_CONNECTION_TIMEOUT = args.http_timeout
+    config.HTTP_MAX_CONNECTIONS_PER_HOST = args.pool_size
+    config.SLEEP = args.sleep
+    config.WORKER_POOL_SIZE = args.pool_size
+    config.COMMIT_BATCH_SIZE = 100
+    config.COMMIT_INTERVAL = 0.05
+    config.COMMIT_RETRIES = 3
+    config.COMMIT_RETRY_DELAY = 0.1
+    config.RETRY_MAX_ATTEMPTS = 5
+    config.RETRY_DELAY = 0.1
+    config.RETRY_MAX_DELAY = 300
+    config.HOST_MAX_CONCURRENCY = None
+    config.HOST_DEFER_DELAY = 0.5
+    config.METRICS_INTERVAL = 3600
+
+    notification_pusher.run_application = True
+    meter = stats.ResourceMeter().start()
+    completion.feeder.start()
+    loop = threading.Thread(target=notification_pusher.main_loop, args=(config,))
+    loop.start()
+    done.wait(args.max_time)
+    notification_pusher.run_application = False
+    loop.join()
+    return completion, meter.stop()
+
+
+def run_checker(args, tasks):
+    import lib.worker
+
+    logging.getLogger('redirect_checker').setLevel(logging.CRITICAL)
+
+    # workers run while this process is alive and exit once it is stopped
+    parent = multiprocessing.Process(target=wait_forever)
+    parent.daemon = True
+    parent.start()
+
+    server = memory_queue.QueueServer(('127.0.0.1', 0))
+    server_thread = threading.Thread(target=server.serve_forever)
+    server_thread.daemon = True
+    server_thread.start()
+    host, port = server.server_address
+
+    done = threading.Event()
+    completion = Completion(done.set)
+    queue = memory_queue.Queue(space=BENCH_SPACE)
+    completion.tracker = stats.QueueTracker(BENCH_INPUT_TUBE, on_drained=completion.check)
+    queue.storage.listeners.append(completion.tracker)
+    completion.feeder = Feeder(queue.tube(BENCH_INPUT_TUBE), tasks, args.speed, completion.check)
+
+    config = Config()
+    config.QUEUE_BACKEND = 'memory_server'
+    config.INPUT_QUEUE_HOST = config.OUTPUT_QUEUE_HOST = host
+    config.INPUT_QUEUE_PORT = config.OUTPUT_QUEUE_PORT = port
+    config.INPUT_QUEUE_SPACE = config.OUTPUT_QUEUE_SPACE = BENCH_SPACE
+    config.INPUT_QUEUE_TUBE = BENCH_INPUT_TUBE
+    config.OUTPUT_QUEUE_TUBE = BENCH_OUTPUT_TUBE
+    config.QUEUE_TAKE_TIMEOUT = 0.1
+    config.HTTP_TIMEOUT = int(args.http_timeout)
+    config.MAX_REDIRECTS = 30
+    config.USER_AGENT = None
+    config.RECHECK_DELAY = 0
+
+    meter = stats.ResourceMeter().start()
+    running = set(multiprocessing.active_children())
+    spawn_workers(num=args.pool_size, target=lib.worker.worker, args=(config,), parent_pid=parent.pid)
+    workers = set(multiprocessing.active_children()) - running
+    completion.feeder.start()
+    done.wait(args.max_time)
+    parent.terminate()
+    parent.join()
+    for child in workers:
+        child.join()
+    usage = meter.stop()
+
+    server.shutdown()
+    server.server_close()
+    return completion, usage
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='Replay captured traffic.')
+    parser.add_argument('captures', nargs='+', help='Capture files written with CAPTURE_FILE.')
+    parser.add_argument('--daemon', choices=('pusher', 'checker'),
+                        help='Which daemon to replay. Source of the first task in the capture by default.')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Speed up factor for task arrivals and recorded latencies, 0 - as fast as possible.')
+    parser.add_argument('--pool-size', type=int, default=10, help='WORKER_POOL_SIZE.')
+    parser.add_argument('--http-timeout', type=float, default=30, help='HTTP timeout.')
+    parser.add_argument('--sleep', type=float, default=0.1, help='SLEEP of the pusher.')
+    parser.add_argument('--max-time', type=float, default=3600, help='Time limit, seconds.')
+    parser.add_argument('-o', '--output', help='Path to JSON report.')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+
+    records = capture.read_capture(args.captures)
+    source = args.daemon
+    if source is None:
+        sources = [record['source'] for record in records if record['kind'] == 'task']
+        if not sources:
+            sys.stderr.write('No tasks in capture.\n')
+            return 1
+        source = sources[0]
+    tasks = prepare_tasks(records, source)
+    exchanges = [record for record in records if record['kind'] == 'http' and record['source'] == source]
+
+    # responder is forked before the pusher patches the hub
+    responder = replay_server(exchanges, args.speed).start()
+    os.environ['http_proxy'] = responder.base_url
+    os.environ.pop('no_proxy', None)
+    memory_queue.drop_storage(BENCH_SPACE)
+    try:
+        runner = run_pusher if source == 'pusher' else run_checker
+        completion, usage = runner(args, tasks)
+    finally:
+        responder.stop()
+        memory_queue.drop_storage(BENCH_SPACE)
+
+    tracker, feeder = completion.tracker, completion.feeder
+    result = stats.make_result(
+        'replay.{}'.format(source), len(tracker.latencies), tracker.latencies, usage,
+        source=source, speed=args.speed, tasks=len(tasks), exchanges=len(exchanges),
+        events=tracker.events, unfinished=tracker.pending,
+        feed_lag=stats.summarize_latencies(feeder.lag)
+    )
+    sys.stdout.write(stats.format_result(result).encode('utf-8') + '\n')
+
+    params = dict(vars(args), daemon=source)
+    params.pop('output')
+    report = stats.make_report('replay', params, [result])
+    path = args.output or stats.default_report_path('replay')
+    stats.save_report(report, path)
+    sys.stdout.write('Report saved to {}\n'.format(path))
+    return 0
@@ -0,0 +1,74 @@
+# coding: utf-8
+"""
+Микробенчмарк разрешения имен хостов уведомлений.
+
+concurrency greenlet'ов одновременно делают getaddrinfo по списку имен
+через резолверы gevent (thread, ares) с кэшем lib.dns_cache и без него.
+"""
+import argparse
+import sys
+import time
+
+import gevent
+from gevent.monkey import patch_all
+
+from lib import dns_cache
+
+from benchmarks import stats
+
+
+def resolve_many(resolver, hosts, count, latencies):
+    for number in xrange(count):
+        started_at = time.time()
+        resolver.getaddrinfo(hosts[number % len(hosts)], 80, 0, 1)
+        latencies.append(time.time() - started_at)
+
+
+def run_scenario(name, resolver, args, hosts, **params):
+    latencies = []
+    per_greenlet = args.count // args.concurrency
+    meter = stats.ResourceMeter().start()
+    gevent.joinall(
+        [gevent.spawn(resolve_many, resolver, hosts, per_greenlet, latencies) for _ in xrange(args.concurrency)],
+        raise_error=True
+    )
+    usage = meter.stop()
+    resolver.close()
+    return stats.make_result(name, len(latencies), latencies, usage, **params)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='DNS resolution benchmark.')
+    parser.add_argument('-n', '--count', type=int, default=20000, help='Lookups per scenario.')
+    parser.add_argument('-c', '--concurrency', type=int, default=100, help='Greenlets resolving at once.')
+    parser.add_argument('--hosts', default='localhost', help='Comma separated host names to resolve.')
+    parser.add_argument('-r', '--resolvers', default='thread', help='Comma separated gevent resolvers: thread, ares, block.')
+    parser.add_argument('-o', '--output', help='Path to JSON report.')
+    return parser.parse_args(argv)
+
+
+def main(argv):
+    args = parse_args(argv)
+    hosts = args.hosts.split(',')
+
+    patch_all()
+
+    results = []
+    for name in args.resolvers.split(','):
+        for cached in (False, True):
+            resolver = dns_cache.make_resolver(name)
+            if cached:
+                resolver = dns_cache.CachingResolver(resolver)
+            result = run_scenario(
+                '{}{}'.format(name, '.cache' if cached else ''), resolver, args, hosts, backend=name, cached=cached
+            )
+            results.append(result)
+            sys.stdout.write(stats.format_result(result).encode('utf-8') + '\n')
+
+    params = vars(args).copy()
+    params.pop('output')
+    report = stats.make_report('dns', params, results)
+    path = args.output or stats.default_report_path('dns')
+    stats.save_report(report, path)
+    sys.stdout.write('Report saved to {}\n'.format(path))
+    return 0
@@ -0,0 +1,233 @@
+# coding: utf-8
+"""
+Локальные HTTP-серверы, заменяющие внешние хосты в бенчмарках.
+
+Серверы работают в отдельном процессе, чтобы их процессорное время
+не попадало в замеры клиента.
+"""
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import multiprocessing
+import random
+import time
+
+from lib.memory_queue import QueueServer
+
+COUNTERS_HTML = (
+    '<script src="http://www.google-analytics.com/ga.js"></script>'
+    '<script src="//mc.yandex.ru/metrika/watch.js"></script>'
+    '<img src="http://top-fwz1.mail.ru/counter?id=1"/>'
+    '<a href="http://top.mail.ru/jump?from=1"></a>'
+    '<script src="//googleads.g.doubleclick.net/pagead/viewthroughconversion/1/"></script>'
+    '<script src="//a1.vdna-assets.com/analytics.js"></script>'
+    '<img src="//counter.yadro.ru/hit?t1"/>'
+    '<img src="http://counter.rambler.ru/top100.cnt?1"/>'
+)
+
+DEFAULT_CHAIN = {
+    'hops': 3,
+    'kind': 'http',
+    'delay': 0,
+    'body_size': 0,
+    'counters': False,
+    'loop': False,
+}
+"""
+Параметры цепочки:
+
++ hops - количество редиректов до конечной страницы
++ kind - тип редиректов: http, meta или mixed (чередование)
++ delay - задержка ответа на каждом шаге в секундах
++ body_size - размер тела конечной страницы в байтах
++ counters - добавлять ли на конечную страницу счетчики
++ loop - зациклить цепочку вместо конечной страницы
+"""
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ChainHandler(QuietHandler):
+    """
+    Отдает цепочки редиректов вида /chain/<сценарий>/<номер шага>.
+    """
+    chains = {}
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        if len(parts) != 3 or parts[0] != 'chain' or parts[1] not in self.chains:
+            self.send_body(404, 'not found')
+            return
+
+        name, hop = parts[1], int(parts[2])
+        chain = dict(DEFAULT_CHAIN, **self.chains[name])
+
+        if chain['delay']:
+            time.sleep(chain['delay'])
+
+        if chain['loop']:
+            next_hop = (hop + 1) % max(chain['hops'], 1)
+        elif hop < chain['hops']:
+            next_hop = hop + 1
+        else:
+            self.send_body(200, final_page(chain))
+            return
+
+        location = '/chain/{}/{}'.format(name, next_hop)
+        kind = chain['kind']
+        if kind == 'mixed':
+            kind = 'http' if hop % 2 == 0 else 'meta'
+
+        if kind == 'meta':
+            self.send_body(200, meta_page(location))
+        else:
+            self.send_body(302, '', headers=(('Location', location),))
+
+
+def meta_page(location):
+    return (
+        '<html><head><meta http-equiv="refresh" content="0; url={}"></head>'
+        '<body></body></html>'.format(location)
+    )
+
+
+def final_page(chain):
+    body = '<html><head><title>final</title></head><body>'
+    if chain['counters']:
+        body += COUNTERS_HTML
+    padding = chain['body_size'] - len(body) - len('</body></html>')
+    if padding > 0:
+        body += 'x' * padding
+    return body + '</body></html>'
+
+
+class CallbackHandler(QuietHandler):
+    """
+    Принимает POST-уведомления, отвечая с задержкой latency() и с вероятностью
+    error_rate возвращая 500.
+    """
+    latency = staticmethod(lambda: 0)
+    error_rate = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        self.rfile.read(length)
+
+        delay = self.latency()
+        if delay > 0:
+            time.sleep(delay)
+
+        if self.error_rate and random.random() < self.error_rate:
+            self.send_body(500, 'error')
+        else:
+            self.send_body(200, 'ok')
+
+
+def latency_distribution(kind, mean):
+    """
+    Возвращает функцию, генерирующую задержки ответа со средним mean секунд.
+
+    :param kind: fixed, uniform или exponential
+    :type kind: basestring
+    :param mean: средняя задержка
+    :type mean: float
+    """
+    if kind == 'fixed':
+        return lambda: mean
+    if kind == 'uniform':
+        return lambda: random.uniform(0, 2 * mean)
+    if kind == 'exponential':
+        return lambda: random.expovariate(1.0 / mean) if mean > 0 else 0
+    raise ValueError('Unknown latency distribution: {}'.format(kind))
+
+
+class ServerProcess(object):
+    """
+    Запускает HTTP-сервер в дочернем процессе на свободном порту 127.0.0.1.
+    """
+    def __init__(self, handler_class, host='127.0.0.1', port=0):
+        self.server = ThreadingHTTPServer((host, port), handler_class)
+        self.host, self.port = self.server.server_address
+        self.process = None
+
+    @property
+    def base_url(self):
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    def start(self):
+        self.process = multiprocessing.Process(target=self._serve)
+        self.process.daemon = True
+        self.process.start()
+        self.server.socket.close()
+        return self
+
+    def _serve(self):
+        random.seed()
+        self.server.serve_forever()
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+            self.process = None
+
+
+class QueueServerProcess(ServerProcess):
+    """
+    Запускает сервер очереди в памяти (lib.memory_queue.QueueServer) в дочернем процессе.
+    """
+    def __init__(self, host='127.0.0.1', port=0):
+        self.server = QueueServer((host, port))
+        self.host, self.port = self.server.server_address
+        self.process = None
+
+
+def chain_server(chains, host='127.0.0.1', port=0):
+    """
+    Создает (но не запускает) сервер цепочек редиректов.
+
+    :param chains: словарь {имя сценария: параметры цепочки}
+    :type chains: dict
+
+    :rtype: ServerProcess
+    """
+    class ConfiguredChainHandler(ChainHandler):
+        pass
+    ConfiguredChainHandler.chains = dict(chains)
+    return ServerProcess(ConfiguredChainHandler, host, port)
+
+
+def callback_server(latency, error_rate=0.0, host='127.0.0.1', port=0):
+    """
+    Создает (но не запускает) сервер, принимающий уведомления пушера.
+
+    :param latency: функция без аргументов, возвращающая задержку ответа в секундах
+    :param error_rate: доля ответов с кодом 500
+    :type error_rate: float
+
+    :rtype: ServerProcess
+    """
+    class ConfiguredCallbackHandler(CallbackHandler):
+        pass
+    ConfiguredCallbackHandler.latency = staticmethod(latency)
+    ConfiguredCallbackHandler.error_rate = error_rate
+    return ServerProcess(ConfiguredCallbackHandler, host, port)
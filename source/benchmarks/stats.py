@@ -0,0 +1,210 @@
+# coding: utf-8
+import json
+import os
+import platform
+import resource
+import sys
+import time
+
+
+def percentile(values, pct):
+    """
+    Возвращает перцентиль pct (0..100) для списка значений методом ближайшего ранга.
+
+    :param values: список значений
+    :type values: list
+    :param pct: перцентиль
+    :type pct: float
+
+    :rtype: float
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = int(round(pct / 100.0 * (len(ordered) - 1)))
+    return ordered[rank]
+
+
+def summarize_latencies(latencies):
+    """
+    Сводка по задержкам в секундах: среднее, p50, p95, p99 и максимум.
+    """
+    if not latencies:
+        return {'count': 0, 'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+    return {
+        'count': len(latencies),
+        'mean': sum(latencies) / len(latencies),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'max': max(latencies),
+    }
+
+
+def current_rss_kb():
+    """
+    Текущий RSS процесса в килобайтах (по /proc/self/status, если он доступен).
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except IOError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class ResourceMeter(object):
+    """
+    Замеряет время, процессорное время и память текущего процесса
+    между вызовами start() и stop().
+    """
+    def __init__(self):
+        self.started_at = None
+        self.usage = None
+        self.result = None
+
+    def start(self):
+        self.usage = resource.getrusage(resource.RUSAGE_SELF)
+        self.started_at = time.time()
+        return self
+
+    def stop(self):
+        elapsed = time.time() - self.started_at
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        self.result = {
+            'elapsed': elapsed,
+            'cpu_user': usage.ru_utime - self.usage.ru_utime,
+            'cpu_system': usage.ru_stime - self.usage.ru_stime,
+            'rss_kb': current_rss_kb(),
+            'max_rss_kb': usage.ru_maxrss,
+        }
+        return self.result
+
+
+TERMINAL_EVENTS = ('ack', 'bury', 'delete', 'done')
+
+
+class QueueTracker(object):
+    """
+    Слушатель lib.memory_queue.Storage: запоминает время взятия и завершения
+    задач трубы и вызывает on_drained, когда все положенные задачи завершены.
+    """
+    def __init__(self, tube, on_drained=None):
+        self.tube = tube
+        self.on_drained = on_drained
+        self.pending = 0
+        self.taken_at = {}
+        self.latencies = []
+        self.events = {}
+
+    def __call__(self, event, task_id, tube):
+        if tube != self.tube:
+            return
+        self.events[event] = self.events.get(event, 0) + 1
+        if event == 'put':
+            self.pending += 1
+        elif event == 'take':
+            self.taken_at.setdefault(task_id, time.time())
+        elif event in TERMINAL_EVENTS:
+            self.pending -= 1
+            taken_at = self.taken_at.pop(task_id, None)
+            if taken_at is not None:
+                self.latencies.append(time.time() - taken_at)
+            if self.pending == 0 and self.on_drained is not None:
+                self.on_drained()
+
+
+def make_result(name, count, latencies, usage, **extra):
+    """
+    Формирует запись о прогоне одного сценария.
+
+    :param name: имя сценария
+    :param count: количество обработанных единиц работы
+    :param latencies: список задержек в секундах
+    :param usage: результат ResourceMeter.stop()
+    :param extra: дополнительные поля записи
+    :rtype: dict
+    """
+    elapsed = usage['elapsed']
+    result = {
+        'name': name,
+        'count': count,
+        'per_second': count / elapsed if elapsed else 0.0,
+        'latency': summarize_latencies(latencies),
+    }
+    result.update(usage)
+    result.update(extra)
+    return result
+
+
+def make_report(suite, params, results):
+    return {
+        'suite': suite,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': platform.node(),
+        'python': sys.version.split()[0],
+        'params': params,
+        'results': results,
+    }
+
+
+def save_report(report, path):
+    """
+    Сохраняет отчет в JSON, чтобы прогоны можно было сравнивать между собой.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def default_report_path(suite):
+    return os.path.join(
+        'benchmark-results', '{}-{}.json'.format(suite, time.strftime('%Y%m%d-%H%M%S'))
+    )
+
+
+def format_result(result):
+    latency = result['latency']
+    return (
+        u'{name:<28} {count:>7} {per_second:>10.1f}/s  p50={p50:.4f}s p95={p95:.4f}s p99={p99:.4f}s '
+        u'cpu={cpu:.2f}s rss={rss_kb}KB'.format(
+            name=result['name'], count=result['count'], per_second=result['per_second'],
+            p50=latency['p50'], p95=latency['p95'], p99=latency['p99'],
+            cpu=result['cpu_user'] + result['cpu_system'], rss_kb=result['rss_kb']
+        )
+    )
+
+
+def compare_reports(baseline, candidate):
+    """
+    Сравнивает два отчета по сценариям с одинаковыми именами.
+
+    :rtype: list of (name, metric, baseline, candidate, change in percent)
+    """
+    baseline_results = dict((r['name'], r) for r in baseline['results'])
+    rows = []
+    for result in candidate['results']:
+        base = baseline_results.get(result['name'])
+        if base is None:
+            continue
+        pairs = (
+            ('per_second', base['per_second'], result['per_second']),
+            ('p50', base['latency']['p50'], result['latency']['p50']),
+            ('p95', base['latency']['p95'], result['latency']['p95']),
+            ('p99', base['latency']['p99'], result['latency']['p99']),
+            ('cpu', base['cpu_user'] + base['cpu_system'], result['cpu_user'] + result['cpu_system']),
+            ('max_rss_kb', base['max_rss_kb'], result['max_rss_kb']),
+        )
+        for metric, old, new in pairs:
+            change = (new - old) * 100.0 / old if old else 0.0
+            rows.append((result['name'], metric, old, new, change))
+    return rows
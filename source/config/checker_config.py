@@ -1,6 +1,12 @@
 import sys
 from codecs import getwriter
 
+# tarantool, memory (in-process, tests only) or memory_server (source/queue_server.py)
+QUEUE_BACKEND = 'tarantool'
+# pooled tarantool connections per worker shared by the input and output queues of one server
+# (lib/tarantool_pool.py), None - a connection per queue
+QUEUE_CONNECTIONS = 1
+
 INPUT_QUEUE_HOST = 'localhost'
 INPUT_QUEUE_PORT = 33013
 INPUT_QUEUE_SPACE = 0
@@ -24,6 +30,12 @@ USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Ge
 
 CHECK_URL = "http://t.mail.ru"
 
+# capture of taken tasks (and HTTP exchanges if CAPTURE_HTTP) for benchmarks/replay.py,
+# e.g. '/tmp/checker-{pid}.jsonl.gz'; {pid} is replaced with the process id
+CAPTURE_FILE = None
+CAPTURE_HTTP = False
+CAPTURE_BODY_LIMIT = 64 * 1024
+
 LOGGING = {
     'version': 1,
     'formatters': {
@@ -41,18 +53,26 @@ LOGGING = {
         'null': {
             'class': 'logging.NullHandler',
             'level': 'DEBUG'
+        },
+        # console output from a background thread; on overflow drops new ('new') or oldest ('old') records
+        'queue': {
+            'class': 'lib.log.QueueHandler',
+            'level': 'DEBUG',
+            'capacity': 10000,
+            'drop': 'new',
+            'target': 'console'
         }
     },
     'loggers': {
         'pusher': {
-            'handlers': ['console'],
+            'handlers': ['queue'],
             'level': 'DEBUG',
             'propagate': False,
         }
     },
     'root': {
         'propagate': False,
-        'handlers': ['console'],
+        'handlers': ['queue'],
         'level': 'DEBUG',
     },
 }
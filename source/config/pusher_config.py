@@ -1,18 +1,149 @@
 import sys
 from codecs import getwriter
 
+# tarantool, memory (in-process, tests only) or memory_server (source/queue_server.py)
+QUEUE_BACKEND = 'tarantool'
+
 QUEUE_HOST = 'localhost'
 QUEUE_PORT = 33013
 QUEUE_SPACE = 0
 QUEUE_TAKE_TIMEOUT = 0.1
 QUEUE_TUBE = 'api.push_notifications'
+# several tubes (lanes) instead of QUEUE_TUBE: {tube: (weight, reserved workers)}, e.g.
+# {'api.push_notifications': (4, 5), 'api.bulk_notifications': (1, 0)}; a free worker serves a lane below its
+# reserved workers first, otherwise a lane picked by weight among the lanes with tasks; workers reserved by
+# a lane with tasks queued or in flight are not used by other lanes beyond their own reserve, idle lanes
+# lend theirs; reserves above the number of workers are scaled down proportionally to fit it;
+# pusher.lane.<tube>.* metrics report the wait for a worker, the ready backlog and its lag
+QUEUE_LANES = {}
+# tarantool connections of a process (lib/tarantool_pool.py): requests of one connection are pipelined, so acks
+# do not wait behind a take; take and acks of taken tasks share the first connection (None - tarantool_queue's own)
+QUEUE_CONNECTIONS = 2
 
+# deadline of a whole notification request in seconds; HTTP_CONNECT_TIMEOUT limits connecting and
+# HTTP_READ_TIMEOUT waiting for the response once connected (None - up to the deadline)
 HTTP_CONNECTION_TIMEOUT = 30
+HTTP_CONNECT_TIMEOUT = 3
+HTTP_READ_TIMEOUT = None
+# with ADAPTIVE_READ_TIMEOUT the read timeout of each callback host is its p(HTTP_READ_TIMEOUT_PERCENTILE)
+# latency of recent requests times HTTP_READ_TIMEOUT_FACTOR, between HTTP_READ_TIMEOUT_MIN and
+# HTTP_READ_TIMEOUT_MAX seconds; HTTP_READ_TIMEOUT is used until a host has enough requests
+ADAPTIVE_READ_TIMEOUT = False
+HTTP_READ_TIMEOUT_PERCENTILE = 0.99
+HTTP_READ_TIMEOUT_FACTOR = 3
+HTTP_READ_TIMEOUT_MIN = 0.5
+HTTP_READ_TIMEOUT_MAX = 30
+# HTTP client of notifications: requests or curl (all requests of a process driven by one pycurl.CurlMulti)
+HTTP_ENGINE = 'requests'
+# keep-alive connections to one callback host and seconds before an idle one is closed
+HTTP_MAX_CONNECTIONS_PER_HOST = 10
+HTTP_IDLE_TIMEOUT = 30
+# DNS resolver of callback hosts: thread (gevent thread pool), ares (c-ares, asynchronous) or block;
+# addresses are cached for DNS_CACHE_TTL seconds (getaddrinfo gives no record TTL) and failed lookups
+# for DNS_NEGATIVE_TTL seconds, a host looked up within DNS_PREFETCH seconds of its expiry is resolved
+# again in the background; the curl engine resolves hosts and caches them in libcurl
+DNS_RESOLVER = 'thread'
+DNS_CACHE_TTL = 60
+DNS_NEGATIVE_TTL = 5
+DNS_PREFETCH = 10
+DNS_CACHE_SIZE = 10000
+# how long workers and the main loop wait for a task before checking stop and reload flags
 SLEEP = 0.1
 SLEEP_ON_FAIL = 10
+# on stop the pusher takes no new tasks and waits up to SHUTDOWN_TIMEOUT seconds for deliveries in flight;
+# tasks that did not finish are released back to the queue, then all acks are sent
+SHUTDOWN_TIMEOUT = 10
+
+# number of pusher processes, each with its own workers, connection pool and queue connection;
+# with more than 1 the started process only supervises them and restarts the ones that exited
+PROCESSES = 1
 
 WORKER_POOL_SIZE = 10
 
+# with ADAPTIVE_CONCURRENCY the number of workers starts at WORKER_POOL_SIZE and every CONCURRENCY_INTERVAL
+# seconds grows by CONCURRENCY_INCREASE while all workers are busy and requests are healthy, or is multiplied
+# by CONCURRENCY_DECREASE when CONCURRENCY_ERROR_RATE of the requests failed or their p90 latency reached
+# CONCURRENCY_LATENCY seconds; it stays between CONCURRENCY_MIN and CONCURRENCY_MAX
+ADAPTIVE_CONCURRENCY = False
+CONCURRENCY_INTERVAL = 1
+CONCURRENCY_MIN = 2
+CONCURRENCY_MAX = 200
+CONCURRENCY_INCREASE = 2
+CONCURRENCY_DECREASE = 0.5
+CONCURRENCY_LATENCY = 2
+CONCURRENCY_ERROR_RATE = 0.1
+
+# finished tasks are acked in batches of up to COMMIT_BATCH_SIZE tasks or every COMMIT_INTERVAL seconds;
+# failed acks are retried COMMIT_RETRIES times, the delay starts at COMMIT_RETRY_DELAY and doubles
+COMMIT_BATCH_SIZE = 100
+COMMIT_INTERVAL = 0.05
+COMMIT_RETRIES = 3
+COMMIT_RETRY_DELAY = 0.1
+
+# notifications failed with a connection error, a timeout, 5xx, 408 or 429 are put into the tube again
+# with the attempt count in the task data after RETRY_DELAY seconds doubling per attempt up to
+# RETRY_MAX_DELAY; after RETRY_MAX_ATTEMPTS (or max_attempts from the task data) the task is buried
+RETRY_MAX_ATTEMPTS = 5
+RETRY_DELAY = 1
+RETRY_MAX_DELAY = 300
+
+# at most HOST_MAX_CONCURRENCY requests in flight per callback host (None - no limit);
+# the circuit of a host opens when BREAKER_ERROR_RATE of the last BREAKER_WINDOW requests
+# (at least BREAKER_MIN_CALLS) failed or BREAKER_SLOW_RATE of them took BREAKER_SLOW_CALL seconds
+# or longer, and lets a probe request through after BREAKER_RESET_TIMEOUT seconds;
+# tasks of a busy host or a host with an open circuit are released for HOST_DEFER_DELAY seconds
+HOST_MAX_CONCURRENCY = None
+HOST_DEFER_DELAY = 5
+# request rate limits of callback hosts as token buckets {host or fnmatch pattern: (requests per second, burst)},
+# the exact host wins over patterns and a longer pattern over a shorter one, None lifts the limit, e.g.
+# {'partner.example.com': (10, 20), '*.example.org': (50, 50), 'fast.example.org': None};
+# tasks over the limit are released until the token reserved for them, not counting as attempts;
+# every process keeps its own buckets, so with PROCESSES > 1 each gets rate / PROCESSES and burst / PROCESSES
+# (at least 1), while HOST_MAX_CONCURRENCY and the circuit breakers apply per process as they are
+HOST_RATE_LIMITS = {}
+BREAKER_WINDOW = 20
+BREAKER_MIN_CALLS = 10
+BREAKER_ERROR_RATE = 0.5
+BREAKER_SLOW_CALL = 5
+BREAKER_SLOW_RATE = 0.5
+BREAKER_RESET_TIMEOUT = 30
+
+# notifications to these hosts or callback urls are sent as one JSON array per url, a batch is sent
+# when it has size tasks or interval seconds after its first task, e.g. {'partner.example.com': (100, 1.0)};
+# a 2xx response may hold a JSON object {task id: status code} to ack, retry or bury tasks one by one
+BATCH_CALLBACKS = {}
+
+# notifications of one ordering key - 'ordering_key' of the task data or, for these hosts and callback urls,
+# the callback url - are delivered one at a time in the order the pusher took them (with PROCESSES = 1),
+# different keys concurrently; up to ORDERING_MAX_PENDING tasks of a key and ORDERING_MAX_TASKS in all wait
+# in memory, more are deferred; a failed ordered task is retried in place and holds its key, after its
+# attempts ORDERING_FAILURE 'skip' buries it and goes on, 'bury' also buries the tasks waiting behind it;
+# the ttr of ordered tasks waiting in memory is prolonged every ORDERING_TOUCH_INTERVAL seconds,
+# keep it well below the ttr of the tubes (60 seconds by default)
+ORDERED_CALLBACKS = ()
+ORDERING_MAX_PENDING = 100
+ORDERING_MAX_TASKS = 10000
+ORDERING_FAILURE = 'skip'
+ORDERING_TOUCH_INTERVAL = 20
+
+# JSON codec of notification bodies: json, ujson (optional dependency) or auto (ujson if installed)
+JSON_CODEC = 'auto'
+
+# a re-delivered task whose notification (task id and body hash) is among the last DEDUP_CACHE_SIZE
+# successful deliveries is acked without a request (0 - no check); with DEDUP_FILE, e.g.
+# '/var/lib/pusher/delivered.{process}.log', they survive restarts, {process} is the prefork process number
+DEDUP_CACHE_SIZE = 100000
+DEDUP_FILE = None
+
+# how often to log metrics (commit lag and counters), seconds
+METRICS_INTERVAL = 60
+
+# capture of taken tasks (and HTTP exchanges if CAPTURE_HTTP) for benchmarks/replay.py,
+# e.g. '/tmp/pusher.jsonl.gz'; {pid} is replaced with the process id
+CAPTURE_FILE = None
+CAPTURE_HTTP = False
+CAPTURE_BODY_LIMIT = 64 * 1024
+
 LOGGING = {
     'version': 1,
     'formatters': {
@@ -30,18 +161,26 @@ LOGGING = {
         'null': {
             'class': 'logging.NullHandler',
             'level': 'DEBUG'
+        },
+        # console output from a background thread; on overflow drops new ('new') or oldest ('old') records
+        'queue': {
+            'class': 'lib.log.QueueHandler',
+            'level': 'DEBUG',
+            'capacity': 10000,
+            'drop': 'new',
+            'target': 'console'
         }
     },
     'loggers': {
         'pusher': {
-            'handlers': ['console'],
+            'handlers': ['queue'],
             'level': 'DEBUG',
             'propagate': False,
         }
     },
     'root': {
         'propagate': False,
-        'handlers': ['console'],
+        'handlers': ['queue'],
         'level': 'DEBUG',
     },
 }
@@ -2,12 +2,15 @@
 from StringIO import StringIO
 from logging import getLogger, NullHandler
 import re
+import time
 from urllib import quote, quote_plus
 from urlparse import urljoin, urlsplit, urlparse, urlunparse
 
 from bs4 import BeautifulSoup
 import pycurl
 
+from . import capture
+
 logger = getLogger('redirect_checker')
 logger.addHandler(NullHandler())
 
@@ -90,9 +93,19 @@ def make_pycurl_request(url, timeout, useragent=None):
     curl.setopt(curl.FOLLOWLOCATION, False)
     # curl.setopt(curl.CONNECTTIMEOUT, timeout)
     curl.setopt(curl.TIMEOUT, timeout)
-    curl.perform()
+    started_at = time.time()
+    try:
+        curl.perform()
+    except pycurl.error as exc:
+        capture.record_http('GET', prepared_url, time.time() - started_at, error=str(exc))
+        raise
     content = buff.getvalue()
     redirect_url = curl.getinfo(curl.REDIRECT_URL)
+    if capture.http_enabled():
+        capture.record_http(
+            'GET', prepared_url, curl.getinfo(curl.TOTAL_TIME), status=curl.getinfo(curl.RESPONSE_CODE),
+            location=redirect_url, body=content
+        )
     curl.close()
     if redirect_url is not None:
         redirect_url = to_unicode(redirect_url, 'ignore')
@@ -107,7 +120,7 @@ def get_url(url, timeout, user_agent=None):
     try:
         content, new_redirect_url = make_pycurl_request(url, timeout, user_agent)
     except (pycurl.error, ValueError) as e:
-        logger.error(u'error in url {} {}'.format(url, e))
+        logger.error(u'error in url %s %s', url, e)
         return url, 'ERROR', content  # TODO add exception in ERROR
 
     redirect_type = None
@@ -0,0 +1,96 @@
+# coding: utf-8
+"""
+Сборка уведомлений с одинаковым callback_url в пачки, которые отправляются
+одним запросом с JSON-массивом.
+
+Пачка отправляется, когда в ней набралось size задач или с первой задачи
+прошло interval секунд. Какие адреса собирать в пачки, задается правилами
+для хоста или для конкретного адреса.
+"""
+from collections import namedtuple
+import time
+from urlparse import urlsplit
+
+Batch = namedtuple('Batch', 'url tasks')
+"""Пачка задач для отправки на url одним запросом"""
+
+
+class Batcher(object):
+    """
+    Пачки задач по адресам уведомлений.
+
+    :param rules: {хост или callback_url: (максимум задач в пачке, сколько секунд собирать пачку)};
+        правило адреса важнее правила его хоста, адреса без правил в пачки не собираются
+    :type rules: dict
+    """
+    def __init__(self, rules=None):
+        self.rules = {}
+        for key, rule in (rules or {}).iteritems():
+            self.rules[key if '/' in key else key.lower()] = rule
+        self.pending = {}
+
+    def rule(self, url):
+        """
+        :return: правило (size, interval) для url или None, если url не собирается в пачки
+        :rtype: tuple or None
+        """
+        if not url or not self.rules:
+            return None
+        rule = self.rules.get(url)
+        if rule is None:
+            rule = self.rules.get(urlsplit(url).netloc.lower())
+        return rule
+
+    def add(self, url, task, now=None):
+        """
+        Добавляет задачу в пачку url. Размер и время сбора пачки определяются
+        правилом на момент первой задачи.
+
+        :return: заполненная пачка или None, если пачка еще собирается
+        :rtype: Batch or None
+        """
+        pending = self.pending.get(url)
+        if pending is None:
+            size, interval = self.rule(url)
+            deadline = (time.time() if now is None else now) + interval
+            pending = self.pending[url] = (deadline, size, [])
+
+        _, size, tasks = pending
+        tasks.append(task)
+        if len(tasks) >= size:
+            del self.pending[url]
+            return Batch(url, tasks)
+        return None
+
+    def due(self, now=None):
+        """
+        Забирает пачки, время сбора которых вышло.
+
+        :rtype: list
+        """
+        now = time.time() if now is None else now
+        expired = [url for url, pending in self.pending.iteritems() if pending[0] <= now]
+        return [Batch(url, self.pending.pop(url)[2]) for url in expired]
+
+    def drain(self):
+        """
+        Забирает все собираемые пачки, не дожидаясь конца сбора.
+
+        :rtype: list
+        """
+        return self.due(now=float('inf'))
+
+    def wait(self, limit, now=None):
+        """
+        Сколько секунд до конца сбора ближайшей пачки, но не больше limit.
+
+        :rtype: float
+        """
+        if not self.pending:
+            return limit
+        now = time.time() if now is None else now
+        deadline = min(pending[0] for pending in self.pending.itervalues())
+        return max(0, min(limit, deadline - now))
+
+    def __len__(self):
+        return sum(len(pending[2]) for pending in self.pending.itervalues())
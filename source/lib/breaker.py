@@ -0,0 +1,229 @@
+# coding: utf-8
+"""
+Защита обработчиков от медленных и неработающих хостов: ограничение числа
+одновременных запросов к хосту (bulkhead), размыкатель цепи (circuit breaker)
+и ограничение частоты запросов (lib.rate_limit).
+
+Размыкатель хоста размыкается, когда среди последних window запросов (но не
+меньше min_calls) доля ошибок достигает error_rate или доля запросов дольше
+slow_call секунд достигает slow_rate. Через reset_timeout секунд размыкатель
+пропускает один пробный запрос: если он успешен, цепь замыкается, иначе
+снова размыкается.
+"""
+from collections import defaultdict, deque
+from logging import getLogger
+import time
+from urlparse import urlsplit
+
+from lib import metrics
+from lib.rate_limit import RateLimits
+
+logger = getLogger('pusher.breaker')
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+BUSY = 'busy'
+"""Причина отказа, когда у хоста уже max_concurrency запросов"""
+
+RATE_LIMITED = 'rate_limited'
+"""Причина отказа, когда у хоста кончились маркеры ограничения частоты"""
+
+
+class CircuitBreaker(object):
+    """
+    Размыкатель цепи одного хоста.
+    """
+    def __init__(self, window=20, min_calls=10, error_rate=0.5, slow_call=5.0, slow_rate=0.5, reset_timeout=30.0):
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.reset_timeout = reset_timeout
+        self.outcomes = deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = None
+        self.probing = False
+
+    def allow(self, now):
+        """
+        Можно ли сейчас отправить запрос. В полуоткрытом состоянии пропускает
+        только один пробный запрос.
+
+        :rtype: bool
+        """
+        if self.state == OPEN:
+            if now - self.opened_at < self.reset_timeout:
+                return False
+            self.state = HALF_OPEN
+            self.probing = False
+        if self.state == HALF_OPEN:
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def record(self, failed, elapsed, now):
+        """
+        Учитывает результат запроса.
+
+        :param failed: запрос завершился ошибкой соединения, таймаутом или 5xx
+        :type failed: bool
+        :param elapsed: длительность запроса, секунды
+        :type elapsed: float
+        """
+        slow = elapsed >= self.slow_call
+        if self.state == HALF_OPEN:
+            self.probing = False
+            if failed or slow:
+                self.open(now)
+            else:
+                self.close()
+            return
+        if self.state == OPEN:
+            return
+
+        self.outcomes.append((failed, slow))
+        calls = len(self.outcomes)
+        if calls < self.min_calls:
+            return
+        failures = sum(1 for outcome in self.outcomes if outcome[0])
+        slows = sum(1 for outcome in self.outcomes if outcome[1])
+        if failures >= self.error_rate * calls or slows >= self.slow_rate * calls:
+            self.open(now)
+
+    def open(self, now):
+        self.state = OPEN
+        self.opened_at = now
+        self.outcomes.clear()
+
+    def close(self):
+        self.state = CLOSED
+        self.opened_at = None
+        self.outcomes.clear()
+
+    def snapshot(self):
+        return {
+            'state': self.state,
+            'calls': len(self.outcomes),
+            'failures': sum(1 for outcome in self.outcomes if outcome[0]),
+            'slow': sum(1 for outcome in self.outcomes if outcome[1]),
+            'opened_at': self.opened_at,
+        }
+
+
+class HostGuard(object):
+    """
+    Ограничения запросов по хостам: не больше max_concurrency одновременных
+    запросов к хосту (None - без ограничения), частота запросов по rate_limits
+    и размыкатель цепи для каждого хоста.
+
+    Состояние размыкателя хоста публикуется метрикой pusher.breaker.<хост>.
+
+    :param rate_limits: правила RateLimits {хост или шаблон: (rate, burst)}
+    :type rate_limits: dict
+    :param breaker_settings: параметры CircuitBreaker
+    """
+    def __init__(self, max_concurrency=None, rate_limits=None, **breaker_settings):
+        self.max_concurrency = max_concurrency
+        self.rate_limits = RateLimits(rate_limits)
+        self.breaker_settings = breaker_settings
+        self.breakers = {}
+        self.in_flight = defaultdict(int)
+
+    @staticmethod
+    def host(url):
+        return urlsplit(url).netloc.lower()
+
+    def breaker(self, host):
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = self.breakers[host] = CircuitBreaker(**self.breaker_settings)
+        return breaker
+
+    def acquire(self, host, now=None):
+        """
+        Занимает место для запроса к хосту.
+
+        :return: None, если запрос можно отправить, иначе причина отказа: BUSY, RATE_LIMITED
+            или состояние размыкателя
+        :rtype: str or None
+        """
+        if self.max_concurrency is not None and self.in_flight[host] >= self.max_concurrency:
+            return BUSY
+
+        now = time.time() if now is None else now
+        # маркер забирается, только если размыкатель пропустит запрос
+        bucket = self.rate_limits.bucket(host, now) if self.rate_limits else None
+        if bucket is not None and not bucket.ready(now):
+            return RATE_LIMITED
+
+        breaker = self.breaker(host)
+        state = breaker.state
+        allowed = breaker.allow(now)
+        self.report(host, state, breaker.state)
+        if not allowed:
+            return breaker.state
+
+        if bucket is not None:
+            bucket.take(now)
+        self.in_flight[host] += 1
+        return None
+
+    def throttle_delay(self, host, now=None):
+        """
+        Откладывает запрос к хосту, которому не хватило маркера (см. TokenBucket.reserve).
+
+        :return: через сколько секунд повторить запрос
+        :rtype: float
+        """
+        bucket = self.rate_limits.bucket(host, now) if self.rate_limits else None
+        if bucket is None:
+            return 0
+        return bucket.reserve(now)
+
+    def retry_after(self, host, now=None):
+        """
+        Через сколько секунд размыкатель хоста пропустит пробный запрос (0, если цепь не разомкнута).
+
+        :rtype: float
+        """
+        breaker = self.breakers.get(host)
+        if breaker is None or breaker.state != OPEN:
+            return 0
+        now = time.time() if now is None else now
+        return max(0, breaker.opened_at + breaker.reset_timeout - now)
+
+    def release(self, host, failed, elapsed, now=None):
+        """
+        Освобождает место, занятое acquire(), и учитывает результат запроса.
+        """
+        self.in_flight[host] -= 1
+        if not self.in_flight[host]:
+            del self.in_flight[host]
+
+        breaker = self.breaker(host)
+        state = breaker.state
+        breaker.record(failed, elapsed, time.time() if now is None else now)
+        self.report(host, state, breaker.state)
+
+    def report(self, host, old_state, new_state):
+        if old_state == new_state:
+            return
+        if new_state == OPEN:
+            logger.warning('Circuit of host %s is open.', host)
+        else:
+            logger.info('Circuit of host %s is %s.', host, new_state)
+        metrics.gauge('pusher.breaker.{}'.format(host)).set(new_state)
+
+    def states(self):
+        """
+        Возвращает состояние размыкателей и число запросов в работе по хостам.
+
+        :rtype: dict
+        """
+        states = {}
+        for host, breaker in self.breakers.iteritems():
+            states[host] = dict(breaker.snapshot(), in_flight=self.in_flight.get(host, 0))
+        return states
@@ -0,0 +1,182 @@
+# coding: utf-8
+"""
+Запись трафика демонов для последующего воспроизведения (benchmarks/replay.py).
+
+Запись — gzip-файл, в котором каждая строка является JSON-объектом:
+
++ kind=task - задача, взятая из очереди: tube, pri и data
++ kind=http - HTTP-обмен: method, url, status, location, elapsed, error и, для
+  проверки редиректов, тело ответа body (не длиннее CAPTURE_BODY_LIMIT байт)
+
+У каждой записи есть поля ts (время записи) и source (pusher или checker).
+"""
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+from logging import getLogger
+
+logger = getLogger('capture')
+
+FLUSH_INTERVAL = 1.0
+"""Как часто (в секундах) сбрасывать сжатые данные на диск"""
+
+recorder = None
+"""Запись, в которую пишет текущий процесс, или None, если запись выключена"""
+
+
+class Capture(object):
+    """
+    Пишет записи о задачах и HTTP-обменах в gzip-файл, добавляя к нему новый
+    gzip-блок при каждом открытии.
+    """
+    def __init__(self, path, source, http=False, body_limit=64 * 1024):
+        self.path = path
+        self.source = source
+        self.http = http
+        self.body_limit = body_limit
+        self.file = gzip.open(path, 'ab')
+        self.lock = threading.Lock()
+        self.flushed_at = time.time()
+        self.skipped = 0
+
+    def write(self, record):
+        record['ts'] = time.time()
+        record['source'] = self.source
+        try:
+            line = json.dumps(record, ensure_ascii=False)
+        except (TypeError, UnicodeDecodeError):
+            self.skipped += 1
+            return
+        if isinstance(line, unicode):
+            line = line.encode('utf-8')
+        with self.lock:
+            self.file.write(line + '\n')
+            if record['ts'] - self.flushed_at > FLUSH_INTERVAL:
+                self.file.flush()
+                self.flushed_at = record['ts']
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+        if self.skipped:
+            logger.warning('Capture %s: skipped %s records that are not JSON serializable.', self.path, self.skipped)
+
+
+def open_capture(config, source):
+    """
+    Открывает запись по настройкам CAPTURE_* или возвращает None, если запись выключена.
+
+    В CAPTURE_FILE можно указать {pid}, чтобы каждый процесс писал в свой файл.
+
+    :param config: конфигурация
+    :type config: Config
+    :param source: имя демона
+    :type source: basestring
+
+    :rtype: Capture
+    """
+    path = getattr(config, 'CAPTURE_FILE', None)
+    if not path:
+        return None
+    path = path.format(pid=os.getpid())
+    logger.info('Capture taken tasks to %s.', path)
+    return Capture(
+        path, source,
+        http=getattr(config, 'CAPTURE_HTTP', False),
+        body_limit=getattr(config, 'CAPTURE_BODY_LIMIT', 64 * 1024)
+    )
+
+
+def install(capture):
+    global recorder
+    recorder = capture
+
+
+def close():
+    global recorder
+    if recorder is not None:
+        recorder.close()
+        recorder = None
+
+
+def http_enabled():
+    return recorder is not None and recorder.http
+
+
+def record_task(task):
+    """
+    Записывает взятую задачу, если запись включена.
+
+    :param task: задача
+    :type task: tarantool_queue.Task
+    """
+    if recorder is None:
+        return
+    recorder.write({'kind': 'task', 'tube': task.tube, 'pri': task.meta()['pri'], 'data': task.data})
+
+
+def record_http(method, url, elapsed, status=None, location=None, body=None, error=None):
+    """
+    Записывает HTTP-обмен, если включена запись HTTP.
+
+    Тело ответа хранится как latin-1, чтобы при воспроизведении получить те же байты.
+    """
+    if not http_enabled():
+        return
+    if body is not None:
+        body = body[:recorder.body_limit].decode('latin-1')
+    recorder.write({
+        'kind': 'http', 'method': method, 'url': url, 'status': status, 'location': location,
+        'elapsed': elapsed, 'body': body, 'error': error,
+    })
+
+
+def read_lines(path, chunk_size=64 * 1024):
+    """
+    Читает строки записи, в том числе файла из нескольких gzip-блоков
+    и файла, оборванного на середине (если процесс был убит).
+    """
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    tail = ''
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            while chunk:
+                try:
+                    data = decompressor.decompress(chunk)
+                except zlib.error as exc:
+                    logger.warning('Capture %s is corrupted: %s.', path, exc)
+                    return
+                chunk = decompressor.unused_data
+                if chunk:
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                lines = (tail + data).split('\n')
+                tail = lines.pop()
+                for line in lines:
+                    if line:
+                        yield line
+
+
+def read_capture(paths):
+    """
+    Возвращает записи из одного или нескольких файлов, упорядоченные по времени.
+
+    :param paths: пути до файлов записи
+    :type paths: list
+
+    :rtype: list of dict
+    """
+    records = []
+    for path in paths:
+        for line in read_lines(path):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                logger.warning('Skip broken capture line in %s.', path)
+    records.sort(key=lambda record: record['ts'])
+    return records
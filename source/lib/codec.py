@@ -0,0 +1,57 @@
+# coding: utf-8
+"""
+JSON-кодеки для тел уведомлений и ответов на них.
+
+ujson заметно быстрее стандартного json, но это необязательная зависимость:
+если он не установлен, используется json. Значения, с которыми ujson не справляется
+(целые больше 64 бит, inf и nan), кодируются и разбираются стандартным json.
+"""
+from collections import namedtuple
+import json
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+AUTO = 'auto'
+"""ujson, если установлен, иначе json"""
+
+Codec = namedtuple('Codec', 'name dumps loads')
+
+
+def ujson_dumps(obj):
+    try:
+        return ujson.dumps(obj)
+    except OverflowError:
+        return json.dumps(obj)
+
+
+def ujson_loads(data):
+    try:
+        return ujson.loads(data)
+    except ValueError:
+        return json.loads(data)
+
+
+CODECS = {
+    'json': lambda: Codec('json', json.dumps, json.loads),
+    'ujson': lambda: Codec('ujson', ujson_dumps, ujson_loads),
+}
+
+
+def get_codec(name=AUTO):
+    """
+    Возвращает кодек по имени: json, ujson или auto.
+
+    :type name: basestring
+
+    :rtype: Codec
+    """
+    if name == AUTO:
+        name = 'json' if ujson is None else 'ujson'
+    if name not in CODECS:
+        raise ValueError('Unknown JSON codec: {}'.format(name))
+    if name == 'ujson' and ujson is None:
+        raise ImportError('JSON codec ujson is not installed')
+    return CODECS[name]()
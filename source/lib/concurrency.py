@@ -0,0 +1,92 @@
+# coding: utf-8
+"""
+Адаптивное число обработчиков по принципу AIMD (additive increase,
+multiplicative decrease), как окно перегрузки TCP.
+
+Ограничитель собирает длительность и исход запросов к хостам уведомлений.
+Раз в интервал он пересчитывает лимит: если доля неудачных запросов или
+перцентиль длительности превысили порог, лимит умножается на decrease;
+если запросы здоровы, а все обработчики были заняты, лимит растет на increase.
+Лимит остается в пределах [min_limit, max_limit].
+"""
+from collections import deque
+
+WINDOW_SIZE = 1000
+"""Сколько последних запросов интервала учитывать"""
+
+LATENCY_PERCENTILE = 0.9
+"""Перцентиль длительности запросов, который сравнивается с порогом"""
+
+
+class AimdLimiter(object):
+    """
+    Лимит одновременно работающих обработчиков.
+
+    :param limit: начальный лимит
+    :param min_limit: наименьший лимит
+    :param max_limit: наибольший лимит
+    :param increase: на сколько увеличивать лимит
+    :param decrease: во сколько раз уменьшать лимит (множитель меньше 1)
+    :param latency: порог перцентиля LATENCY_PERCENTILE длительности запросов, секунды
+    :param error_rate: порог доли неудачных запросов
+    :param min_calls: сколько запросов нужно за интервал, чтобы судить о здоровье
+    """
+    def __init__(self, limit, min_limit=1, max_limit=100, increase=1, decrease=0.5, latency=1.0, error_rate=0.1,
+                 min_calls=10):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency = latency
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.limit = max(min_limit, min(max_limit, limit))
+        self.outcomes = deque(maxlen=WINDOW_SIZE)
+        self.reason = None
+
+    def observe(self, duration, failed):
+        """
+        Учитывает завершенный запрос.
+
+        :param duration: длительность запроса, секунды
+        :type duration: float
+        :param failed: закончился ли запрос ошибкой, таймаутом или ответом, после которого задача повторяется
+        :type failed: bool
+        """
+        self.outcomes.append((duration, failed))
+
+    def update(self, saturated):
+        """
+        Пересчитывает лимит по запросам, завершившимся с прошлого вызова.
+
+        :param saturated: были ли за интервал заняты все обработчики
+        :type saturated: bool
+
+        :return: (новый лимит, причина) или None, если лимит не изменился
+        :rtype: tuple or None
+        """
+        outcomes, self.outcomes = self.outcomes, deque(maxlen=WINDOW_SIZE)
+        if len(outcomes) < self.min_calls:
+            return None
+
+        latencies = sorted(duration for duration, _ in outcomes)
+        latency = latencies[int(LATENCY_PERCENTILE * (len(latencies) - 1))]
+        error_rate = sum(1 for _, failed in outcomes if failed) / float(len(outcomes))
+        health = 'p{:.0f} latency {:.3f}s, error rate {:.2f} of {} requests'.format(
+            LATENCY_PERCENTILE * 100, latency, error_rate, len(outcomes)
+        )
+
+        if error_rate >= self.error_rate or latency >= self.latency:
+            limit = max(self.min_limit, int(self.limit * self.decrease))
+            reason = 'degraded: {}'.format(health)
+        elif saturated:
+            limit = min(self.max_limit, self.limit + self.increase)
+            reason = 'all workers busy, healthy: {}'.format(health)
+        else:
+            return None
+
+        if limit == self.limit:
+            return None
+        self.limit = limit
+        self.reason = reason
+        return limit, reason
@@ -0,0 +1,242 @@
+# coding: utf-8
+"""
+HTTP-движок на pycurl: все запросы в работе ведет один pycurl.CurlMulti,
+встроенный в цикл событий gevent.
+
+libcurl сообщает, какие сокеты и когда ему нужно ждать (M_SOCKETFUNCTION,
+M_TIMERFUNCTION), пул ставит на них наблюдатели gevent и, когда сокет готов
+или вышел таймер, вызывает socket_action. Соединения с хостами хранятся
+в кэше CurlMulti и переиспользуются запросами к тому же хосту.
+
+Интерфейс тот же, что у lib.http_pool.SessionPool: post() возвращает ответ
+с кодом и прочитанным телом, ошибки - исключения requests, поэтому
+обработчики уведомлений не зависят от выбранного движка.
+"""
+import gevent
+from gevent.event import AsyncResult
+import pycurl
+import requests
+from requests.sessions import DEFAULT_REDIRECT_LIMIT
+
+from . import to_str
+from .http_pool import request_timeouts
+
+MAXAGE_CONN = getattr(pycurl, 'MAXAGE_CONN', 288)
+"""CURLOPT_MAXAGE_CONN (libcurl 7.65), которой нет в старых pycurl"""
+
+CONNECTION_ERRORS = frozenset((
+    pycurl.E_COULDNT_RESOLVE_PROXY, pycurl.E_COULDNT_RESOLVE_HOST, pycurl.E_COULDNT_CONNECT,
+    pycurl.E_PARTIAL_FILE, pycurl.E_SSL_CONNECT_ERROR, pycurl.E_GOT_NOTHING,
+    pycurl.E_SEND_ERROR, pycurl.E_RECV_ERROR,
+))
+"""Ошибки libcurl, после которых уведомление стоит отправить еще раз, как после requests.ConnectionError"""
+
+# requests не посылает ни Content-Type, ни Expect: 100-continue
+HEADERS = ['Content-Type:', 'Expect:']
+
+
+class CurlResponse(object):
+    """
+    Ответ на запрос через CurlPool: код ответа и тело (None, если оно длиннее drain_limit).
+    """
+    def __init__(self, url, status_code, content):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+
+
+class Transfer(object):
+    """
+    Запрос в работе: тело ответа и результат, которого ждет post().
+    """
+    def __init__(self, url, drain_limit):
+        self.url = url
+        self.drain_limit = drain_limit
+        self.chunks = []
+        self.read = 0
+        self.overflow = False
+        self.result = AsyncResult()
+
+    def write(self, chunk):
+        self.read += len(chunk)
+        if self.read > self.drain_limit:
+            # libcurl прерывает запрос с E_WRITE_ERROR и закрывает соединение
+            self.overflow = True
+            return 0
+        self.chunks.append(chunk)
+        return None
+
+
+def request_error(url, errno, message):
+    """
+    Исключение requests для ошибки libcurl.
+
+    :rtype: requests.RequestException
+    """
+    message = 'Request to {} failed: {}'.format(url, message)
+    if errno == pycurl.E_OPERATION_TIMEDOUT:
+        return requests.Timeout(message)
+    if errno in CONNECTION_ERRORS:
+        return requests.ConnectionError(message)
+    if errno == pycurl.E_TOO_MANY_REDIRECTS:
+        return requests.TooManyRedirects(message)
+    return requests.RequestException(message)
+
+
+class CurlPool(object):
+    """
+    Пул соединений libcurl с хостами уведомлений.
+
+    :param max_connections: максимум соединений с одним хостом, остальные запросы ждут
+        в очереди libcurl (ожидание входит в timeout запроса)
+    :param idle_timeout: сколько секунд простоявшее соединение можно переиспользовать
+    :param drain_limit: сколько байт тела ответа читать; если тело длиннее, соединение
+        закрывается, а content ответа - None
+    :param connect_timeout: таймаут установки соединения, None - таймаут запроса
+    """
+    def __init__(self, max_connections=10, idle_timeout=30, drain_limit=64 * 1024, connect_timeout=None):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.drain_limit = drain_limit
+        self.connect_timeout = connect_timeout
+        self.loop = gevent.get_hub().loop
+        self.multi = pycurl.CurlMulti()
+        self.multi.setopt(pycurl.M_SOCKETFUNCTION, self.on_socket)
+        self.multi.setopt(pycurl.M_TIMERFUNCTION, self.on_timer)
+        self.multi.setopt(pycurl.M_MAX_HOST_CONNECTIONS, max_connections)
+        self.watchers = {}
+        self.timer = None
+        self.transfers = {}
+        self.free = []
+        self.closed = False
+
+    def on_socket(self, what, fd, multi, data):
+        """
+        M_SOCKETFUNCTION: libcurl просит ждать событий what на сокете fd или забыть его.
+        События POLL_IN и POLL_OUT совпадают с READ и WRITE наблюдателей gevent.
+        """
+        watcher = self.watchers.pop(fd, None)
+        if watcher is not None:
+            watcher.stop()
+        if what == pycurl.POLL_REMOVE:
+            return
+        watcher = self.watchers[fd] = self.loop.io(fd, what)
+        watcher.start(self.socket_action, fd)
+
+    def on_timer(self, timeout_ms):
+        """
+        M_TIMERFUNCTION: libcurl просит вызвать socket_action(SOCKET_TIMEOUT)
+        через timeout_ms миллисекунд, -1 - отменить таймер.
+        """
+        if self.timer is not None:
+            self.timer.stop()
+            self.timer = None
+        if timeout_ms >= 0:
+            self.timer = self.loop.timer(timeout_ms / 1000.0)
+            self.timer.start(self.socket_action, pycurl.SOCKET_TIMEOUT)
+
+    def socket_action(self, fd):
+        # libcurl сам проверяет, какие события готовы на сокете
+        self.multi.socket_action(fd, 0)
+        self.finish_transfers()
+
+    def finish_transfers(self):
+        """
+        Отдает результаты завершенных запросов ожидающим их post().
+        """
+        while True:
+            queued, succeeded, failed = self.multi.info_read()
+            for curl in succeeded:
+                self.finish(curl)
+            for curl, errno, message in failed:
+                self.finish(curl, errno, message)
+            if not queued:
+                return
+
+    def finish(self, curl, errno=None, message=None):
+        transfer = self.transfers.get(curl)
+        if transfer is None:
+            return
+        if errno is None or transfer.overflow and errno == pycurl.E_WRITE_ERROR:
+            content = None if transfer.overflow else ''.join(transfer.chunks)
+            transfer.result.set(CurlResponse(transfer.url, curl.getinfo(pycurl.RESPONSE_CODE), content))
+        else:
+            transfer.result.set_exception(request_error(transfer.url, errno, message))
+
+    def make_curl(self, url, data, timeout, read_timeout, verify, transfer):
+        curl = self.free.pop() if self.free else pycurl.Curl()
+        curl.setopt(pycurl.URL, to_str(url))
+        curl.setopt(pycurl.POST, 1)
+        curl.setopt(pycurl.POSTFIELDSIZE, len(data))
+        curl.setopt(pycurl.POSTFIELDS, data)
+        curl.setopt(pycurl.HTTPHEADER, HEADERS)
+        # переходы по редиректам как в requests: после 301/302/303 - GET, не больше 30 переходов
+        curl.setopt(pycurl.FOLLOWLOCATION, 1)
+        curl.setopt(pycurl.MAXREDIRS, DEFAULT_REDIRECT_LIMIT)
+        curl.setopt(pycurl.WRITEFUNCTION, transfer.write)
+        curl.setopt(pycurl.NOSIGNAL, 1)
+        curl.setopt(MAXAGE_CONN, int(self.idle_timeout))
+        connect_timeout, timeout = request_timeouts(timeout, self.connect_timeout, read_timeout)
+        curl.setopt(pycurl.CONNECTTIMEOUT_MS, int(connect_timeout * 1000) if connect_timeout else 0)
+        curl.setopt(pycurl.TIMEOUT_MS, int(timeout * 1000) if timeout else 0)
+        curl.setopt(pycurl.SSL_VERIFYPEER, 1 if verify else 0)
+        curl.setopt(pycurl.SSL_VERIFYHOST, 2 if verify else 0)
+        return curl
+
+    def post(self, url, data=None, timeout=None, verify=True, read_timeout=None):
+        """
+        Делает POST-запрос и ждет ответа, не блокируя другие greenlet'ы.
+        Весь запрос, вместе с ожиданием соединения и чтением ответа,
+        ограничен timeout секундами, а после установки соединения - еще и
+        read_timeout секундами (см. lib.http_pool.request_timeouts).
+
+        :param url: адрес
+        :type url: basestring
+        :param data: тело запроса
+        :type data: str
+        :param timeout: таймаут в секундах, None - без таймаута
+        :type timeout: float
+        :param verify: проверять ли сертификат сервера
+        :type verify: bool
+        :param read_timeout: сколько ждать ответа после установки соединения, None - до timeout
+        :type read_timeout: float
+
+        :rtype: CurlResponse
+        """
+        transfer = Transfer(url, self.drain_limit)
+        curl = self.make_curl(url, data or '', timeout, read_timeout, verify, transfer)
+        self.transfers[curl] = transfer
+        self.multi.add_handle(curl)
+        # libcurl не всегда заводит таймер при add_handle, запрос запускается первым socket_action
+        self.on_timer(0)
+        try:
+            return transfer.result.get()
+        finally:
+            del self.transfers[curl]
+            self.multi.remove_handle(curl)
+            # не держим тело ответа и запроса до следующего запроса через этот curl
+            curl.setopt(pycurl.WRITEFUNCTION, len)
+            curl.setopt(pycurl.POSTFIELDS, '')
+            self.free.append(curl)
+            if self.closed and not self.transfers:
+                self.shutdown()
+
+    def close(self):
+        """
+        Закрывает соединения, когда завершатся запросы в работе.
+        """
+        self.closed = True
+        if not self.transfers:
+            self.shutdown()
+
+    def shutdown(self):
+        for watcher in self.watchers.values():
+            watcher.stop()
+        self.watchers.clear()
+        if self.timer is not None:
+            self.timer.stop()
+            self.timer = None
+        for curl in self.free:
+            curl.close()
+        self.free = []
+        self.multi.close()
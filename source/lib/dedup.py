@@ -0,0 +1,105 @@
+# coding: utf-8
+"""
+Журнал недавно доставленных уведомлений.
+
+Очередь выдает задачу повторно, если пушер упал, не успев ее подтвердить, или если
+медленная отправка не уложилась в TTR. Ключ журнала - id задачи и хэш тела уведомления,
+так что задача с тем же телом, уже доставленная успешно, повторно не отправляется.
+Хранятся max_size последних ключей.
+
+Если задан path, ключи дописываются в файл и читаются из него при открытии, поэтому
+журнал переживает перезапуск. Когда строк в файле становится вдвое больше max_size,
+файл переписывается с текущими ключами.
+"""
+from collections import OrderedDict
+import hashlib
+import os
+
+from . import to_str
+
+
+class DeliveryLog(object):
+    """
+    Ключи последних доставленных уведомлений.
+
+    :param max_size: сколько ключей хранить, старые вытесняются
+    :param path: файл журнала, None - только в памяти
+    """
+    def __init__(self, max_size=100000, path=None):
+        self.max_size = max_size
+        self.path = path
+        self.keys = OrderedDict()
+        self.lines = 0
+        self.file = None
+        if path is not None:
+            self.load()
+            self.file = open(path, 'a')
+
+    @staticmethod
+    def key(task_id, body):
+        return '{} {}'.format(task_id, hashlib.sha1(to_str(body)).hexdigest())
+
+    def seen(self, task_id, body):
+        """
+        :return: доставлялось ли уведомление задачи с этим телом
+        :rtype: bool
+        """
+        return self.key(task_id, body) in self.keys
+
+    def add(self, task_id, body):
+        """
+        Запоминает доставленное уведомление.
+
+        :param task_id: id задачи
+        :param body: тело уведомления
+        :type body: str
+        """
+        key = self.key(task_id, body)
+        self.remember(key)
+        if self.file is None:
+            return
+
+        self.file.write(key + '\n')
+        self.file.flush()
+        self.lines += 1
+        if self.lines > 2 * self.max_size:
+            self.compact()
+
+    def remember(self, key):
+        self.keys.pop(key, None)
+        self.keys[key] = None
+        if len(self.keys) > self.max_size:
+            self.keys.popitem(last=False)
+
+    def load(self):
+        """
+        Читает ключи из файла журнала, если он есть.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as log_file:
+            for line in log_file:
+                line = line.strip()
+                if line:
+                    self.remember(line)
+                    self.lines += 1
+
+    def compact(self):
+        """
+        Переписывает файл журнала, оставляя в нем только хранимые ключи.
+        """
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as temp_file:
+            temp_file.writelines(key + '\n' for key in self.keys)
+        self.file.close()
+        os.rename(temp_path, self.path)
+        self.file = open(self.path, 'a')
+        self.lines = len(self.keys)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __len__(self):
+        return len(self.keys)
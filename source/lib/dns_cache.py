@@ -0,0 +1,147 @@
+# coding: utf-8
+"""
+Кэш DNS для greenlet'ов процесса.
+
+CachingResolver ставится резолвером хаба gevent, поэтому через него идут
+все getaddrinfo пропатченного модуля socket, в том числе соединения requests.
+Ответы хранятся ttl секунд, ошибки - negative_ttl секунд. Одновременные запросы
+одного имени ждут один запрос к резолверу. Имя, к которому обратились меньше
+чем за prefetch секунд до истечения записи, заново разрешается в фоне, так что
+часто используемые хосты не ждут резолвер.
+
+getaddrinfo не сообщает TTL записей DNS, поэтому время жизни записи задается
+настройкой, а не берется из ответа.
+"""
+from collections import OrderedDict
+from importlib import import_module
+import socket
+import time
+
+import gevent
+from gevent.event import AsyncResult
+
+from lib import metrics
+
+RESOLVERS = {
+    'thread': 'gevent.resolver_thread.Resolver',
+    'ares': 'gevent.resolver_ares.Resolver',
+    'block': 'gevent.socket.BlockingResolver',
+}
+"""Резолверы gevent: пул потоков, c-ares (асинхронный) и блокирующий"""
+
+resolve_time = metrics.summary('pusher.dns.resolve_time')
+cache_hits = metrics.counter('pusher.dns.hits')
+cache_misses = metrics.counter('pusher.dns.misses')
+resolve_errors = metrics.counter('pusher.dns.errors')
+prefetches = metrics.counter('pusher.dns.prefetches')
+
+
+def make_resolver(name, hub=None):
+    """
+    Создает резолвер gevent по имени: thread, ares или block.
+
+    :type name: basestring
+
+    :raises ValueError: неизвестное имя
+    :raises ImportError: gevent собран без c-ares
+    """
+    if name not in RESOLVERS:
+        raise ValueError('Unknown DNS resolver: {}'.format(name))
+    module, cls = RESOLVERS[name].rsplit('.', 1)
+    return getattr(import_module(module), cls)(hub=hub)
+
+
+class CachingResolver(object):
+    """
+    Резолвер gevent с кэшем getaddrinfo. Остальные методы передаются resolver без кэша.
+
+    :param resolver: резолвер gevent, который делает запросы
+    :param ttl: сколько секунд хранить ответ
+    :param negative_ttl: сколько секунд хранить ошибку (socket.gaierror)
+    :param prefetch: за сколько секунд до истечения записи обращение к ней
+        запускает фоновое обновление, 0 - не обновлять
+    :param max_size: сколько имен хранить, старые записи вытесняются
+    """
+    def __init__(self, resolver, ttl=60, negative_ttl=5, prefetch=10, max_size=10000):
+        self.resolver = resolver
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.prefetch = prefetch
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.refreshing = set()
+
+    def __getattr__(self, name):
+        return getattr(self.resolver, name)
+
+    def getaddrinfo(self, host, port, family=0, socktype=0, proto=0, flags=0):
+        key = (host, port, family, socktype, proto, flags)
+        now = time.time()
+
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > now:
+            expires_at, result, error = entry
+            cache_hits.inc()
+            if error is None and expires_at - now < self.prefetch and key not in self.refreshing:
+                prefetches.inc()
+                self.refreshing.add(key)
+                gevent.spawn(self.refresh, key)
+            if error is not None:
+                raise error
+            return result
+
+        cache_misses.inc()
+        return self.lookup(key)
+
+    def lookup(self, key):
+        """
+        Спрашивает резолвер и запоминает ответ или ошибку. Если имя уже
+        разрешается, ждет тот же запрос.
+        """
+        pending = self.pending.get(key)
+        if pending is not None:
+            return pending.get()
+
+        pending = self.pending[key] = AsyncResult()
+        started_at = time.time()
+        try:
+            result = self.resolver.getaddrinfo(*key)
+        except socket.gaierror as exc:
+            resolve_errors.inc()
+            self.store(key, None, exc, self.negative_ttl)
+            pending.set_exception(exc)
+            raise
+        except BaseException as exc:
+            pending.set_exception(exc)
+            raise
+        else:
+            self.store(key, result, None, self.ttl)
+            pending.set(result)
+            return result
+        finally:
+            resolve_time.observe(time.time() - started_at)
+            del self.pending[key]
+
+    def refresh(self, key):
+        """
+        Обновляет запись в фоне. При ошибке остается прежний ответ до истечения его срока.
+        """
+        entry = self.entries.get(key)
+        try:
+            self.lookup(key)
+        except socket.gaierror:
+            if entry is not None:
+                self.entries[key] = entry
+        finally:
+            self.refreshing.discard(key)
+
+    def store(self, key, result, error, ttl):
+        self.entries.pop(key, None)
+        self.entries[key] = (time.time() + ttl, result, error)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def close(self):
+        self.entries.clear()
+        self.resolver.close()
@@ -0,0 +1,221 @@
+# coding: utf-8
+"""
+Пул HTTP-сессий requests с keep-alive соединениями для каждого хоста.
+
+Каждая сессия держит одно соединение, поэтому число сессий хоста, выданных
+одновременно, и есть число соединений с ним. Ответ читается потоком и сразу
+закрывается, чтобы соединение вернулось в пул до окончания обработки задачи.
+Сессии, простаивающие дольше idle_timeout, закрываются.
+"""
+from collections import deque
+import time
+from urlparse import urlsplit
+
+import gevent
+from gevent.lock import BoundedSemaphore
+import requests
+from requests.adapters import HTTPAdapter
+
+CHUNK_SIZE = 8 * 1024
+
+
+def request_timeouts(timeout, connect_timeout=None, read_timeout=None):
+    """
+    Считает таймаут установки соединения и таймаут всего запроса: соединение
+    плюс ответ, но не больше timeout. Без таймаута соединения время ответа
+    ограничивает только timeout.
+
+    :param timeout: наибольшая длительность всего запроса, None - без ограничения
+    :param connect_timeout: таймаут установки соединения, None - timeout
+    :param read_timeout: сколько ждать ответа после установки соединения, None - до timeout
+
+    :return: (таймаут соединения, таймаут запроса), None - без ограничения
+    :rtype: tuple
+    """
+    if connect_timeout is None or timeout is not None and timeout < connect_timeout:
+        connect_timeout = timeout
+    if read_timeout is not None and connect_timeout is not None:
+        if timeout is None or connect_timeout + read_timeout < timeout:
+            timeout = connect_timeout + read_timeout
+    return connect_timeout, timeout
+
+
+class HostSessions(object):
+    """
+    Сессии одного хоста: свободные (последняя использованная в конце), счетчики выданных
+    сессий и ждущих свободного соединения запросов.
+    """
+    def __init__(self, max_connections):
+        self.semaphore = BoundedSemaphore(max_connections)
+        self.idle = deque()
+        self.in_use = 0
+        self.waiting = 0
+
+    @property
+    def unused(self):
+        return not self.idle and not self.in_use and not self.waiting
+
+
+class SessionPool(object):
+    """
+    Пул сессий requests по хостам (схема и netloc адреса).
+
+    :param max_connections: максимум соединений с одним хостом, post() ждет освобождения
+    :param idle_timeout: через сколько секунд простоя сессия закрывается
+    :param drain_limit: сколько байт тела ответа дочитывать, чтобы переиспользовать соединение;
+        если тело длиннее, сессия закрывается вместе с соединением
+    :param connect_timeout: таймаут установки соединения, None - таймаут запроса
+    """
+    def __init__(self, max_connections=10, idle_timeout=30, drain_limit=64 * 1024, connect_timeout=None):
+        self.max_connections = max_connections
+        self.idle_timeout = idle_timeout
+        self.drain_limit = drain_limit
+        self.connect_timeout = connect_timeout
+        self.hosts = {}
+        self.evicted_at = time.time()
+        self.closed = False
+
+    @staticmethod
+    def host_key(url):
+        parts = urlsplit(url)
+        return parts.scheme.lower(), parts.netloc.lower()
+
+    def make_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def acquire(self, key):
+        """
+        Возвращает свободную сессию хоста или создает новую, ожидая,
+        пока число выданных сессий хоста не станет меньше max_connections.
+
+        :param key: ключ хоста из host_key()
+        :type key: tuple
+
+        :rtype: requests.Session
+        """
+        host = self.hosts.get(key)
+        if host is None:
+            host = self.hosts[key] = HostSessions(self.max_connections)
+        # хост с ждущими запросами не забывается, даже если выданных сессий не осталось
+        host.waiting += 1
+        try:
+            host.semaphore.acquire()
+        finally:
+            host.waiting -= 1
+        host.in_use += 1
+
+        self.evict_idle()
+        if host.idle:
+            session, _ = host.idle.pop()
+            return session
+        return self.make_session()
+
+    def release(self, key, session, reusable=True):
+        """
+        Возвращает сессию в пул. Сессия, соединение которой нельзя переиспользовать, закрывается.
+
+        :param key: ключ хоста из host_key()
+        :type key: tuple
+        :type session: requests.Session
+        :type reusable: bool
+        """
+        host = self.hosts[key]
+        host.in_use -= 1
+        if reusable and not self.closed:
+            host.idle.append((session, time.time()))
+        else:
+            session.close()
+        host.semaphore.release()
+        self.evict_idle()
+
+    def evict_idle(self, now=None):
+        """
+        Закрывает сессии, простаивающие дольше idle_timeout, и забывает хосты без сессий.
+        Проходит по всем хостам не чаще раза в idle_timeout секунд.
+        """
+        now = time.time() if now is None else now
+        if now - self.evicted_at < self.idle_timeout:
+            return
+        self.evicted_at = now
+
+        for key, host in self.hosts.items():
+            while host.idle and now - host.idle[0][1] >= self.idle_timeout:
+                session, _ = host.idle.popleft()
+                session.close()
+            if host.unused:
+                del self.hosts[key]
+
+    def drain(self, response):
+        """
+        Дочитывает тело ответа, если оно не длиннее drain_limit, и освобождает соединение.
+        Прочитанное тело остается в response.content, у более длинного ответа content - None.
+
+        :type response: requests.Response
+
+        :return: можно ли переиспользовать соединение
+        :rtype: bool
+        """
+        # requests отдает content из _content, не перечитывая поток
+        response._content = None
+
+        length = response.headers.get('content-length')
+        if length is not None and length.isdigit() and int(length) > self.drain_limit:
+            return False
+
+        chunks = []
+        read = 0
+        for chunk in response.iter_content(CHUNK_SIZE):
+            read += len(chunk)
+            if read > self.drain_limit:
+                return False
+            chunks.append(chunk)
+        response.close()
+        response._content = ''.join(chunks)
+        return True
+
+    def post(self, url, *args, **kwargs):
+        """
+        Делает POST-запрос через сессию хоста url. Тело ответа к возврату
+        уже прочитано: не длиннее drain_limit - в response.content, иначе отброшено.
+
+        Аргументы те же, что у requests.post, и read_timeout - сколько ждать ответа
+        после установки соединения. При stream=True requests применяет timeout только
+        к установке соединения, поэтому ему передается таймаут соединения, а весь запрос
+        вместе с ожиданием свободного соединения и чтением ответа ограничивается через
+        gevent.Timeout (см. request_timeouts).
+
+        :rtype: requests.Response
+        """
+        key = self.host_key(url)
+        connect_timeout, timeout = request_timeouts(
+            kwargs.pop('timeout', None), self.connect_timeout, kwargs.pop('read_timeout', None)
+        )
+        if connect_timeout is not None:
+            kwargs['timeout'] = connect_timeout
+        session = None
+        reusable = False
+        try:
+            with gevent.Timeout(timeout, requests.Timeout('Request to {} timed out after {}s'.format(url, timeout))):
+                # ожидание свободного соединения входит в timeout, как в очереди libcurl у CurlPool
+                session = self.acquire(key)
+                response = session.post(url, stream=True, *args, **kwargs)
+                reusable = self.drain(response)
+        finally:
+            if session is not None:
+                self.release(key, session, reusable)
+        return response
+
+    def close(self):
+        """
+        Закрывает свободные сессии. Выданные сессии закрываются при возврате.
+        """
+        self.closed = True
+        for host in self.hosts.values():
+            while host.idle:
+                session, _ = host.idle.pop()
+                session.close()
+        self.hosts = dict((key, host) for key, host in self.hosts.iteritems() if not host.unused)
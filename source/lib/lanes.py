@@ -0,0 +1,208 @@
+# coding: utf-8
+"""
+Полосы (lanes) пушера: несколько труб очереди с весами и зарезервированными обработчиками.
+
+Взятые задачи каждой трубы ждут обработчика в своей очереди вместимостью maxsize, поэтому
+накопившиеся задачи одной трубы не мешают брать задачи из других. Свободный обработчик
+берет задачу из полосы, которую выбирает LaneQueue.pick:
+ * сначала - из полос, у которых в работе меньше reserved задач;
+ * иначе - плавным взвешенным round-robin по weight (как upstream в nginx);
+ * полоса сверх своего резерва не занимает обработчиков, зарезервированных за другими
+   активными полосами (с задачами в очереди или в работе). Резерв простаивающей полосы
+   отдается взаймы остальным и возвращается ей по мере завершения их задач.
+Если обработчиков меньше, чем зарезервировано за всеми полосами, резервы уменьшаются
+пропорционально, чтобы в сумме не превышать число обработчиков.
+"""
+from collections import OrderedDict
+import time
+
+from gevent import queue as gevent_queue
+from gevent.event import Event
+
+from lib import metrics
+from lib.batching import Batch
+
+
+class Lane(object):
+    """
+    Полоса одной трубы.
+
+    :param name: имя трубы
+    :param weight: доля свободных обработчиков, когда задачи есть у нескольких полос
+    :param reserved: сколько обработчиков оставлять за полосой, пока она активна
+    :param maxsize: сколько взятых задач может ждать обработчика
+    """
+    def __init__(self, name, weight=1, reserved=0, maxsize=None):
+        self.name = name
+        self.weight = weight
+        # заданный резерв и действующий, урезанный LaneQueue до числа обработчиков
+        self.configured_reserve = reserved
+        self.reserved = reserved
+        self.queue = gevent_queue.Queue(maxsize)
+        self.busy = 0
+        self.current = 0
+        self.taken = 0
+        self.waits = metrics.summary('pusher.lane.{}.wait'.format(name))
+        self.busy_gauge = metrics.gauge('pusher.lane.{}.busy'.format(name))
+        self.ready_gauge = metrics.gauge('pusher.lane.{}.ready'.format(name))
+        self.lag_gauge = metrics.gauge('pusher.lane.{}.lag'.format(name))
+
+    @property
+    def active(self):
+        return self.busy > 0 or not self.queue.empty()
+
+    def report(self, ready, elapsed):
+        """
+        Обновляет метрики отставания полосы: ready - сколько задач трубы готовы к выдаче,
+        elapsed - секунды с прошлого отчета. Отставание оценивается как время, за которое
+        пушер разберет ready задач с темпом взятия за прошедший интервал (закон Литтла);
+        если за интервал не взято ни одной задачи, а готовые есть, - не меньше интервала.
+        """
+        rate = self.taken / float(elapsed) if elapsed > 0 else 0
+        self.taken = 0
+        self.ready_gauge.set(ready)
+        self.lag_gauge.set(ready / rate if rate else (elapsed if ready else 0.0))
+
+
+class LaneQueue(object):
+    """
+    Очередь взятых задач из нескольких полос с интерфейсом gevent.queue.Queue, который нужен
+    take_tasks, flush_batches и Workers. Задача попадает в полосу своей трубы (task.tube), пачка -
+    в полосу своих задач, задача неизвестной трубы - в первую полосу. Workers сообщает о начале
+    и завершении обработки (start, finish), по ним считаются задачи полос в работе.
+
+    :param lanes: полосы
+    :type lanes: list
+    :param maxsize: вместимость каждой полосы
+    """
+    def __init__(self, lanes, maxsize=None):
+        self.lanes = OrderedDict((lane.name, lane) for lane in lanes)
+        self.default = lanes[0]
+        self.ready = Event()
+        self.maxsize = maxsize
+
+    @property
+    def maxsize(self):
+        """
+        Число обработчиков: вместимость каждой полосы и основа расчета резервов.
+        """
+        return self._maxsize
+
+    @maxsize.setter
+    def maxsize(self, size):
+        self._maxsize = size
+        for lane in self.lanes.itervalues():
+            lane.queue.maxsize = size
+        self.scale_reserves()
+
+    def scale_reserves(self):
+        """
+        Урезает резервы полос до числа обработчиков: если заданные резервы в сумме больше maxsize,
+        maxsize обработчиков делится между полосами пропорционально заданным резервам
+        (методом наибольших остатков), иначе действуют заданные резервы.
+        """
+        lanes = self.lanes.values()
+        total = sum(lane.configured_reserve for lane in lanes)
+        if not self.maxsize or total <= self.maxsize:
+            for lane in lanes:
+                lane.reserved = lane.configured_reserve
+            return
+
+        shares = [(lane, lane.configured_reserve * self.maxsize / float(total)) for lane in lanes]
+        for lane, share in shares:
+            lane.reserved = int(share)
+        left = self.maxsize - sum(lane.reserved for lane in lanes)
+        for lane, share in sorted(shares, key=lambda item: item[0].reserved - item[1])[:left]:
+            lane.reserved += 1
+
+    def lane(self, item):
+        """
+        :rtype: Lane
+        """
+        task = item.tasks[0] if isinstance(item, Batch) else item
+        return self.lanes.get(getattr(task, 'tube', None), self.default)
+
+    def put(self, item, block=True, timeout=None):
+        lane = self.lane(item)
+        lane.queue.put((item, time.time()), block, timeout)
+        lane.taken += 1
+        self.ready.set()
+
+    def get(self, block=True, timeout=None):
+        """
+        Ждет задачу, которую можно отдать обработчику (см. pick), не дольше timeout секунд.
+
+        :raises gevent.queue.Empty: если такой задачи нет
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            lane = self.pick()
+            if lane is not None:
+                item, put_at = lane.queue.get_nowait()
+                lane.waits.observe(time.time() - put_at)
+                return item
+
+            remaining = None if deadline is None else deadline - time.time()
+            if not block or remaining is not None and remaining <= 0:
+                raise gevent_queue.Empty
+            self.ready.clear()
+            self.ready.wait(remaining)
+
+    def get_nowait(self):
+        """
+        Берет задачу из первой непустой полосы без учета весов и резервов (при остановке).
+        """
+        for lane in self.lanes.itervalues():
+            if not lane.queue.empty():
+                return lane.queue.get_nowait()[0]
+        raise gevent_queue.Empty
+
+    def empty(self):
+        return all(lane.queue.empty() for lane in self.lanes.itervalues())
+
+    def qsize(self):
+        return sum(lane.queue.qsize() for lane in self.lanes.itervalues())
+
+    def pick(self):
+        """
+        Выбирает полосу для свободного обработчика.
+
+        :return: полоса или None, если задач нет или все обработчики, кроме занятых,
+            зарезервированы за другими активными полосами
+        :rtype: Lane
+        """
+        candidates = [lane for lane in self.lanes.itervalues() if not lane.queue.empty()]
+        if not candidates:
+            return None
+
+        below_reserve = [lane for lane in candidates if lane.busy < lane.reserved]
+        if below_reserve:
+            candidates = below_reserve
+        elif self.maxsize:
+            claimed = sum(
+                max(lane.busy, lane.reserved if lane.active else 0) for lane in self.lanes.itervalues()
+            )
+            if claimed >= self.maxsize:
+                return None
+
+        total = 0
+        chosen = None
+        for lane in candidates:
+            lane.current += lane.weight
+            total += lane.weight
+            if chosen is None or lane.current > chosen.current:
+                chosen = lane
+        chosen.current -= total
+        return chosen
+
+    def start(self, item):
+        lane = self.lane(item)
+        lane.busy += 1
+        lane.busy_gauge.set(lane.busy)
+
+    def finish(self, item):
+        lane = self.lane(item)
+        lane.busy -= 1
+        lane.busy_gauge.set(lane.busy)
+        # обработчик освободился: полоса, упершаяся в резервы, может получить задачу
+        self.ready.set()
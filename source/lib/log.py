@@ -0,0 +1,143 @@
+# coding: utf-8
+"""
+Неблокирующее логирование: записи складываются в ограниченный буфер,
+а в целевой обработчик их пишет отдельный поток ОС.
+"""
+from collections import deque
+import logging
+import logging.handlers
+import os
+
+DROP_NEW = 'new'
+DROP_OLD = 'old'
+DROP_POLICIES = (DROP_NEW, DROP_OLD)
+"""При переполнении буфера отбрасывается новая запись (new) или самая старая (old)"""
+
+
+def get_original(module_name, name):
+    """
+    Возвращает исходный (не подмененный gevent.monkey) объект модуля.
+    Поток записи должен быть настоящим потоком ОС, чтобы запись в файлы
+    и stderr не блокировала цикл событий gevent.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return getattr(__import__(module_name), name)
+    return monkey.get_original(module_name, name)
+
+
+class QueueHandler(logging.handlers.MemoryHandler):
+    """
+    Обработчик, который только кладет запись в буфер. Отдельный поток раз в interval
+    секунд передает накопленные записи обработчику target.
+
+    Наследуется от MemoryHandler, чтобы в dictConfig можно было указать target
+    по имени обработчика. Записи уровня flushLevel и выше пишутся сразу.
+    Количество отброшенных при переполнении записей хранится в dropped
+    и периодически сообщается в target предупреждением.
+    """
+    def __init__(self, capacity=10000, flushLevel=logging.CRITICAL, target=None, drop=DROP_NEW, interval=0.05):
+        if drop not in DROP_POLICIES:
+            raise ValueError('Unknown drop policy: {}'.format(drop))
+        logging.handlers.MemoryHandler.__init__(self, capacity, flushLevel, target)
+        self.buffer = deque()
+        self.drop = drop
+        self.interval = interval
+        self.dropped = 0
+        self.reported = 0
+        self.stopped = False
+        self.pid = None
+        self.drain_lock = None
+
+    def start(self):
+        """
+        Запускает поток записи. Вызывается при первой записи и заново после fork,
+        так как потоки родителя в дочернем процессе не существуют, а записи
+        из буфера родителя им же и будут записаны.
+        """
+        self.pid = os.getpid()
+        self.buffer.clear()
+        self.drain_lock = get_original('thread', 'allocate_lock')()
+        get_original('thread', 'start_new_thread')(self.run, (self.pid,))
+
+    def run(self, pid):
+        sleep = get_original('time', 'sleep')
+        while not self.stopped and self.pid == pid:
+            sleep(self.interval)
+            self.drain()
+
+    def prepare(self, record):
+        """
+        Подставляет аргументы в сообщение и форматирует исключение сразу,
+        пока аргументы и стек не изменились.
+        """
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging._defaultFormatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        if self.pid != os.getpid():
+            self.start()
+        try:
+            self.prepare(record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        if len(self.buffer) >= self.capacity:
+            self.dropped += 1
+            if self.drop == DROP_NEW:
+                return
+            try:
+                self.buffer.popleft()
+            except IndexError:
+                pass
+        self.buffer.append(record)
+
+        if record.levelno >= self.flushLevel:
+            self.flush()
+
+    def drain(self):
+        if self.drain_lock is None:
+            return
+        with self.drain_lock:
+            target = self.target
+            if target is None:
+                return
+            while True:
+                try:
+                    record = self.buffer.popleft()
+                except IndexError:
+                    break
+                target.handle(record)
+            dropped = self.dropped
+            if dropped != self.reported:
+                target.handle(logging.makeLogRecord({
+                    'name': 'log', 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                    'msg': 'Log buffer overflow: dropped %s records (%s total).',
+                    'args': (dropped - self.reported, dropped),
+                }))
+                self.reported = dropped
+
+    def flush(self):
+        self.drain()
+
+    def close(self):
+        self.stopped = True
+        logging.handlers.MemoryHandler.close(self)
+
+
+def queue_handlers():
+    """
+    Возвращает все созданные QueueHandler (например, чтобы собрать счетчики отброшенных записей).
+    """
+    handlers = []
+    for reference in logging._handlerList:
+        handler = reference()
+        if isinstance(handler, QueueHandler):
+            handlers.append(handler)
+    return handlers
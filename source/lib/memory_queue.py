@@ -0,0 +1,585 @@
+# coding: utf-8
+"""
+Очередь задач в памяти с API tarantool_queue.
+
+Queue работает внутри процесса, RemoteQueue подключается к QueueServer по TCP,
+поэтому одну очередь могут разделять несколько процессов (например, воркеры
+redirect_checker). Поддерживаются приоритеты, задержки, TTL, TTR и статистика
+в формате tarantool_queue.Queue.statistics().
+"""
+from itertools import count
+import heapq
+import socket
+import SocketServer
+import threading
+import time
+import uuid
+
+import msgpack
+
+STATUS_READY = 'ready'
+STATUS_DELAYED = 'delayed'
+STATUS_TAKEN = 'taken'
+STATUS_BURIED = 'buried'
+STATUS_DONE = 'done'
+
+STATUSES = (STATUS_READY, STATUS_DELAYED, STATUS_TAKEN, STATUS_BURIED, STATUS_DONE)
+
+
+class QueueError(Exception):
+    pass
+
+
+def to_time64(value):
+    return int(value * 1000000)
+
+
+def make_event():
+    """
+    Событие для ожидания задачи: кооперативное, если threading пропатчен gevent,
+    иначе обычное threading.Event.
+    """
+    try:
+        from gevent import monkey
+        from gevent.event import Event
+    except ImportError:
+        return threading.Event()
+    return Event() if 'threading' in monkey.saved else threading.Event()
+
+
+class _Record(object):
+    __slots__ = ('task_id', 'tube', 'status', 'raw_data', 'urgent', 'pri', 'created',
+                 'ttl', 'ttr', 'event', 'cbury', 'ctaken', 'version')
+
+    def __init__(self, tube, raw_data, pri, urgent, ttl, ttr, now):
+        self.task_id = uuid.uuid4().hex
+        self.tube = tube
+        self.status = STATUS_READY
+        self.raw_data = raw_data
+        self.urgent = urgent
+        self.pri = pri
+        self.created = now
+        self.ttl = ttl
+        self.ttr = ttr
+        self.event = None
+        self.cbury = 0
+        self.ctaken = 0
+        self.version = 0
+
+    def row(self):
+        return [self.task_id, self.tube, self.status, self.raw_data]
+
+
+class Storage(object):
+    """
+    Хранилище задач одного space.
+
+    Методы хранилища соответствуют вызовам queue.* из provision/init.lua и
+    возвращают строки вида [task_id, tube, status, raw_data].
+    """
+    def __init__(self):
+        self.records = {}
+        self.ready = {}
+        self.events = []
+        self.stats = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.waiters = []
+        self._sequence = count()
+
+    def _tube_stats(self, tube):
+        if tube not in self.stats:
+            self.stats[tube] = dict.fromkeys(
+                ('put', 'urgent', 'take', 'take_timeout', 'ack', 'release', 'bury',
+                 'dig', 'kick', 'delete', 'done', 'touch', 'meta', 'requeue', 'ttl', 'ttr'), 0
+            )
+        return self.stats[tube]
+
+    def _inc(self, tube, name):
+        self._tube_stats(tube)[name] += 1
+
+    def _notify(self, event, record):
+        for listener in self.listeners:
+            listener(event, record.task_id, record.tube)
+
+    def _schedule(self, record, at):
+        record.version += 1
+        record.event = at
+        if at is not None:
+            heapq.heappush(self.events, (at, record.version, record.task_id))
+
+    def _make_ready(self, record, now):
+        record.status = STATUS_READY
+        record.version += 1
+        record.event = record.created + record.ttl if record.ttl else None
+        if record.event is not None:
+            heapq.heappush(self.events, (record.event, record.version, record.task_id))
+        priority = (0 if record.urgent else 1, -record.pri, next(self._sequence))
+        heapq.heappush(self.ready.setdefault(record.tube, []), priority + (record.version, record.task_id))
+        for waiter in self.waiters:
+            waiter.set()
+        del self.waiters[:]
+
+    def _process(self, now):
+        """
+        Обрабатывает наступившие события: задержки, истекшие TTR и TTL.
+        """
+        while self.events and self.events[0][0] <= now:
+            at, version, task_id = heapq.heappop(self.events)
+            record = self.records.get(task_id)
+            if record is None or record.version != version:
+                continue
+            expired = record.ttl and record.created + record.ttl <= now
+            if expired and record.status in (STATUS_READY, STATUS_DELAYED, STATUS_BURIED):
+                self._inc(record.tube, 'ttl')
+                del self.records[task_id]
+            elif record.status == STATUS_DELAYED:
+                self._make_ready(record, now)
+            elif record.status == STATUS_TAKEN:
+                self._inc(record.tube, 'ttr')
+                self._make_ready(record, now)
+
+    def _next_event(self):
+        return self.events[0][0] if self.events else None
+
+    def _get(self, task_id, status=None):
+        record = self.records.get(task_id)
+        if record is None:
+            raise QueueError('Task not found')
+        if status is not None and record.status != status:
+            raise QueueError('Task is not {}'.format(status))
+        return record
+
+    def put(self, tube, delay=0, ttl=0, ttr=0, pri=0, raw_data=None, urgent=False):
+        with self.lock:
+            now = time.time()
+            delay, ttl, ttr, pri = float(delay), float(ttl), float(ttr), int(pri)
+            record = _Record(tube, raw_data, pri, urgent, ttl + delay if ttl else 0, ttr, now)
+            self.records[record.task_id] = record
+            self._inc(tube, 'urgent' if urgent else 'put')
+            self._notify('put', record)
+            if delay > 0:
+                record.status = STATUS_DELAYED
+                self._schedule(record, now + delay)
+            else:
+                self._make_ready(record, now)
+            return record.row()
+
+    def take(self, tube, timeout=None):
+        with self.lock:
+            deadline = None if timeout is None else time.time() + float(timeout)
+            while True:
+                now = time.time()
+                self._process(now)
+                heap = self.ready.get(tube)
+                while heap:
+                    entry = heapq.heappop(heap)
+                    record = self.records.get(entry[-1])
+                    if record is None or record.version != entry[-2] or record.status != STATUS_READY:
+                        continue
+                    record.status = STATUS_TAKEN
+                    record.ctaken += 1
+                    self._schedule(record, now + record.ttr if record.ttr else None)
+                    self._inc(tube, 'take')
+                    self._notify('take', record)
+                    return record.row()
+
+                if deadline is not None and now >= deadline:
+                    self._inc(tube, 'take_timeout')
+                    return None
+
+                wait_until = [at for at in (deadline, self._next_event()) if at is not None]
+                self._wait(min(wait_until) - now if wait_until else None)
+
+    def _wait(self, timeout):
+        """
+        Ждет появления готовой задачи, отпустив блокировку хранилища.
+        """
+        waiter = make_event()
+        self.waiters.append(waiter)
+        self.lock.release()
+        try:
+            waiter.wait(timeout)
+        finally:
+            self.lock.acquire()
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def _finish(self, task_id, event, status=STATUS_TAKEN):
+        record = self._get(task_id, status)
+        self._inc(record.tube, event)
+        self._notify(event, record)
+        return record
+
+    def ack(self, task_id):
+        with self.lock:
+            record = self._finish(task_id, 'ack')
+            del self.records[task_id]
+            return record.row()
+
+    def delete(self, task_id):
+        with self.lock:
+            record = self._get(task_id)
+            self._inc(record.tube, 'delete')
+            self._notify('delete', record)
+            del self.records[task_id]
+            return record.row()
+
+    def done(self, task_id, raw_data):
+        with self.lock:
+            record = self._finish(task_id, 'done')
+            record.raw_data = raw_data
+            record.status = STATUS_DONE
+            self._schedule(record, None)
+            return record.row()
+
+    def release(self, task_id, delay=0, ttl=0):
+        with self.lock:
+            now = time.time()
+            record = self._finish(task_id, 'release')
+            delay = float(delay)
+            if ttl and float(ttl) > 0:
+                record.ttl = now - record.created + delay + float(ttl)
+            if delay > 0:
+                record.status = STATUS_DELAYED
+                self._schedule(record, now + delay)
+            else:
+                self._make_ready(record, now)
+            return record.row()
+
+    def requeue(self, task_id):
+        with self.lock:
+            record = self._finish(task_id, 'requeue')
+            record.urgent = False
+            record.pri = min(
+                [-entry[1] for entry in self.ready.get(record.tube, [])] + [record.pri]
+            )
+            self._make_ready(record, time.time())
+            return record.row()
+
+    def bury(self, task_id):
+        with self.lock:
+            record = self._finish(task_id, 'bury')
+            record.status = STATUS_BURIED
+            record.cbury += 1
+            self._schedule(record, record.created + record.ttl if record.ttl else None)
+            return record.row()
+
+    def dig(self, task_id):
+        with self.lock:
+            record = self._finish(task_id, 'dig', STATUS_BURIED)
+            self._make_ready(record, time.time())
+            return record.row()
+
+    def kick(self, tube, count=1):
+        with self.lock:
+            buried = [r for r in self.records.itervalues() if r.tube == tube and r.status == STATUS_BURIED]
+            buried.sort(key=lambda r: r.created)
+            now = time.time()
+            for record in buried[:int(count or 1)]:
+                self._inc(tube, 'kick')
+                self._make_ready(record, now)
+            return len(buried[:int(count or 1)])
+
+    def touch(self, task_id):
+        with self.lock:
+            record = self._finish(task_id, 'touch')
+            if record.ttr:
+                self._schedule(record, time.time() + record.ttr)
+            return record.row()
+
+    def meta(self, task_id):
+        with self.lock:
+            record = self._get(task_id)
+            self._inc(record.tube, 'meta')
+            return {
+                'task_id': record.task_id,
+                'tube': record.tube,
+                'status': record.status,
+                'event': to_time64(record.event or 0),
+                'ipri': 0 if record.urgent else 1,
+                'pri': record.pri,
+                'cid': 0,
+                'created': to_time64(record.created),
+                'ttl': to_time64(record.ttl),
+                'ttr': to_time64(record.ttr),
+                'cbury': record.cbury,
+                'ctaken': record.ctaken,
+                'now': to_time64(time.time()),
+            }
+
+    def peek(self, task_id):
+        with self.lock:
+            return self._get(task_id).row()
+
+    def statistics(self, tube=None):
+        with self.lock:
+            self._process(time.time())
+            tubes = set(self.stats) | set(r.tube for r in self.records.itervalues())
+            result = {}
+            for name in tubes:
+                tasks = dict.fromkeys(STATUSES, 0)
+                for record in self.records.itervalues():
+                    if record.tube == name:
+                        tasks[record.status] += 1
+                tasks['total'] = sum(tasks.values())
+                result[name] = dict(self._tube_stats(name), tasks=tasks)
+            if tube is not None:
+                return result.get(tube, dict(self._tube_stats(tube), tasks=dict.fromkeys(STATUSES + ('total',), 0)))
+            return result
+
+    def buried(self, tube, offset=0, limit=None):
+        """
+        Строки закопанных задач трубы в порядке создания, начиная с offset, не больше limit.
+        """
+        with self.lock:
+            records = [r for r in self.records.itervalues() if r.tube == tube and r.status == STATUS_BURIED]
+            records.sort(key=lambda r: r.created)
+            end = None if limit is None else offset + limit
+            return [r.row() + [to_time64(r.created)] for r in records[offset:end]]
+
+    def call(self, method, args):
+        if method not in OPERATIONS:
+            raise QueueError('Unknown operation {}'.format(method))
+        return getattr(self, method)(*args)
+
+
+OPERATIONS = frozenset((
+    'put', 'take', 'ack', 'delete', 'done', 'release', 'requeue', 'bury', 'dig',
+    'kick', 'touch', 'meta', 'peek', 'statistics', 'buried'
+))
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(space=0):
+    """
+    Хранилище space внутри текущего процесса (создается при первом обращении).
+    """
+    with _storages_lock:
+        if space not in _storages:
+            _storages[space] = Storage()
+        return _storages[space]
+
+
+def drop_storage(space=0):
+    with _storages_lock:
+        _storages.pop(space, None)
+
+
+class Task(object):
+    """
+    Задача очереди в памяти, повторяющая API tarantool_queue.Task.
+    """
+    def __init__(self, queue, task_id, tube, status, raw_data):
+        self.queue = queue
+        self.space = queue.space
+        self.task_id = task_id
+        self.tube = tube
+        self.status = status
+        self.raw_data = raw_data
+
+    @classmethod
+    def from_row(cls, queue, row):
+        if row is None:
+            return None
+        return cls(queue, *row[:4])
+
+    @property
+    def data(self):
+        if self.raw_data is None:
+            return None
+        if not hasattr(self, '_decoded_data'):
+            self._decoded_data = self.queue.deserialize(self.raw_data)
+        return self._decoded_data
+
+    def _update(self, method, *args):
+        row = self.queue._call(method, self.task_id, *args)
+        self.status = row[2]
+        return True
+
+    def ack(self):
+        return self._update('ack')
+
+    def release(self, delay=0, ttl=0):
+        return self._update('release', delay, ttl)
+
+    def requeue(self):
+        return self._update('requeue')
+
+    def bury(self):
+        return self._update('bury')
+
+    def dig(self):
+        return self._update('dig')
+
+    def delete(self):
+        return self._update('delete')
+
+    def done(self, data):
+        return self._update('done', self.queue.serialize(data))
+
+    def touch(self):
+        return self._update('touch')
+
+    def meta(self):
+        return self.queue._call('meta', self.task_id)
+
+    def __str__(self):
+        return 'Task (id: {0}, tube:{1}, status: {2}, space:{3})'.format(
+            self.task_id, self.tube, self.status, self.space
+        )
+
+
+class Tube(object):
+    """
+    Труба очереди в памяти, повторяющая API tarantool_queue.Tube.
+    """
+    def __init__(self, queue, name, **kwargs):
+        self.queue = queue
+        self.opt = {'delay': 0, 'ttl': 0, 'ttr': 0, 'pri': 0, 'tube': name}
+        self.opt.update(kwargs)
+
+    def update_options(self, **kwargs):
+        self.opt.update(kwargs)
+
+    def put(self, data, **kwargs):
+        opt = dict(self.opt, **kwargs)
+        row = self.queue._call(
+            'put', opt['tube'], opt['delay'], opt['ttl'], opt['ttr'], opt['pri'],
+            self.queue.serialize(data), bool(opt.get('urgent'))
+        )
+        return Task.from_row(self.queue, row)
+
+    def urgent(self, data=None, **kwargs):
+        kwargs['urgent'] = True
+        return self.put(data, **kwargs)
+
+    def take(self, timeout=0):
+        return Task.from_row(self.queue, self.queue._call('take', self.opt['tube'], timeout))
+
+    def kick(self, count=None):
+        return self.queue._call('kick', self.opt['tube'], count or 1) > 0
+
+    def statistics(self):
+        return self.queue.statistics(tube=self.opt['tube'])
+
+
+class Queue(object):
+    """
+    Очередь в памяти текущего процесса. host и port принимаются для
+    совместимости с tarantool_queue.Queue и не используются.
+    """
+    serialize = staticmethod(msgpack.packb)
+    deserialize = staticmethod(msgpack.unpackb)
+
+    def __init__(self, host='localhost', port=33013, space=0):
+        self.host = host
+        self.port = port
+        self.space = space
+        self.tubes = {}
+        self.storage = get_storage(space)
+
+    def _call(self, method, *args):
+        return self.storage.call(method, args)
+
+    def tube(self, name, **kwargs):
+        if name in self.tubes:
+            self.tubes[name].update_options(**kwargs)
+        else:
+            self.tubes[name] = Tube(self, name, **kwargs)
+        return self.tubes[name]
+
+    def peek(self, task_id):
+        return Task.from_row(self, self._call('peek', task_id))
+
+    def statistics(self, tube=None):
+        return self._call('statistics', tube)
+
+    def buried(self, tube, offset=0, limit=None):
+        """
+        Закопанные задачи трубы: список (Task, время создания в микросекундах).
+        """
+        return [(Task.from_row(self, row), row[4]) for row in self._call('buried', tube, offset, limit)]
+
+
+class RemoteQueue(Queue):
+    """
+    Клиент QueueServer. Запросы и ответы передаются в msgpack, по одному
+    запросу на соединение за раз.
+    """
+    def __init__(self, host='localhost', port=33013, space=0, socket_timeout=None):
+        self.host = host
+        self.port = port
+        self.space = space
+        self.tubes = {}
+        self.socket_timeout = socket_timeout
+        self.lock = threading.Lock()
+        self._socket = None
+        self._unpacker = None
+
+    def connect(self):
+        self._socket = socket.create_connection((self.host, self.port), self.socket_timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._unpacker = msgpack.Unpacker()
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def _call(self, method, *args):
+        with self.lock:
+            if self._socket is None:
+                self.connect()
+            try:
+                self._socket.sendall(msgpack.packb([self.space, method, list(args)]))
+                ok, result = self._read_reply()
+            except socket.error:
+                self.close()
+                raise
+        if not ok:
+            raise QueueError(result)
+        return result
+
+    def _read_reply(self):
+        while True:
+            for reply in self._unpacker:
+                return reply
+            chunk = self._socket.recv(65536)
+            if not chunk:
+                raise socket.error('Connection closed by queue server')
+            self._unpacker.feed(chunk)
+
+
+class QueueRequestHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        unpacker = msgpack.Unpacker()
+        while True:
+            try:
+                chunk = self.request.recv(65536)
+            except socket.error:
+                # клиент завершился, не закрыв соединение
+                return
+            if not chunk:
+                return
+            unpacker.feed(chunk)
+            for space, method, args in unpacker:
+                try:
+                    reply = [True, get_storage(space).call(method, args)]
+                except (QueueError, TypeError, ValueError) as exc:
+                    reply = [False, str(exc)]
+                self.request.sendall(msgpack.packb(reply))
+
+
+class QueueServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    """
+    TCP-сервер, раздающий хранилища текущего процесса клиентам RemoteQueue.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        SocketServer.TCPServer.__init__(self, address, QueueRequestHandler)
@@ -0,0 +1,141 @@
+# coding: utf-8
+"""
+Метрики процесса: счетчики, текущие значения и распределения.
+
+Метрики создаются по имени при первом обращении и хранятся в реестре процесса.
+snapshot() возвращает их значения словарем (для бенчмарков и тестов),
+report() периодически пишет их в лог.
+"""
+from collections import deque
+import threading
+
+WINDOW_SIZE = 1024
+"""Сколько последних наблюдений распределения хранится для расчета перцентилей"""
+
+registry = {}
+registry_lock = threading.Lock()
+
+
+class Counter(object):
+    """
+    Монотонно растущий счетчик.
+    """
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+    def reset(self):
+        self.value = 0
+
+
+class Gauge(object):
+    """
+    Текущее значение величины.
+    """
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def snapshot(self):
+        return self.value
+
+    def reset(self):
+        self.value = 0
+
+
+class Summary(object):
+    """
+    Распределение величины: количество и сумма всех наблюдений,
+    максимум и перцентили по последним WINDOW_SIZE наблюдениям.
+    """
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.window = deque(maxlen=WINDOW_SIZE)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.window.append(value)
+
+    def snapshot(self):
+        values = sorted(self.window)
+        if not values:
+            return {'count': self.count, 'mean': 0.0, 'p50': 0.0, 'p99': 0.0, 'max': 0.0}
+        return {
+            'count': self.count,
+            'mean': self.total / self.count,
+            'p50': values[int(0.5 * (len(values) - 1))],
+            'p99': values[int(0.99 * (len(values) - 1))],
+            'max': values[-1],
+        }
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.window.clear()
+
+
+def get_metric(name, cls):
+    with registry_lock:
+        metric = registry.get(name)
+        if metric is None:
+            metric = registry[name] = cls()
+    if not isinstance(metric, cls):
+        raise TypeError('Metric {} is a {}, not a {}'.format(name, type(metric).__name__, cls.__name__))
+    return metric
+
+
+def counter(name):
+    return get_metric(name, Counter)
+
+
+def gauge(name):
+    return get_metric(name, Gauge)
+
+
+def summary(name):
+    return get_metric(name, Summary)
+
+
+def snapshot():
+    """
+    Возвращает значения всех метрик.
+
+    :rtype: dict
+    """
+    return dict((name, metric.snapshot()) for name, metric in registry.items())
+
+
+def reset():
+    """
+    Обнуляет все метрики (например, между прогонами бенчмарка).
+    """
+    for metric in registry.values():
+        metric.reset()
+
+
+def format_value(value):
+    if isinstance(value, dict):
+        return ' '.join(
+            '{}={}'.format(key, format_value(value[key])) for key in ('count', 'mean', 'p50', 'p99', 'max')
+        )
+    if isinstance(value, float):
+        return '{:.4f}'.format(value)
+    return str(value)
+
+
+def report(logger, prefix=''):
+    """
+    Пишет в лог значения метрик, имена которых начинаются с prefix.
+    """
+    for name, value in sorted(snapshot().iteritems()):
+        if name.startswith(prefix):
+            logger.info('Metric %s: %s.', name, format_value(value))
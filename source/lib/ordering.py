@@ -0,0 +1,168 @@
+# coding: utf-8
+"""
+Упорядоченная доставка уведомлений с одинаковым ключом.
+
+Ключ задачи - ordering_key из ее данных или, для адресов и хостов из правил, callback_url.
+В работе не больше одной задачи ключа (головной), следующие задачи ключа ждут ее
+завершения в порядке, в котором их взяли из очереди; задачи разных ключей
+обрабатываются одновременно. Ждут не больше max_pending задач ключа и max_tasks задач
+всех ключей (вместе с головными, ждущими повтора), лишние возвращаются в очередь.
+
+Ждущие в памяти задачи остаются взятыми в очереди, пушер продлевает их ttr (см. held_tasks).
+"""
+from collections import deque
+from urlparse import urlsplit
+
+RUN = 'run'
+"""Задачу можно обрабатывать: она головная для своего ключа"""
+
+WAIT = 'wait'
+"""Задача ждет завершения предыдущих задач ключа"""
+
+FULL = 'full'
+"""Задача не поместилась: ждущих задач ключа или всех ключей слишком много"""
+
+
+class KeyState(object):
+    __slots__ = ('head', 'waiting', 'attempts', 'delayed')
+
+    def __init__(self, head):
+        self.head = head
+        self.waiting = deque()
+        self.attempts = 0
+        self.delayed = False
+
+
+class Sequencer(object):
+    """
+    Очереди задач по ключам упорядочивания.
+
+    :param callbacks: хосты и callback_url, задачи которых упорядочиваются по адресу
+    :param max_pending: сколько задач одного ключа может ждать
+    :param max_tasks: сколько задач всех ключей может ждать
+    """
+    def __init__(self, callbacks=(), max_pending=100, max_tasks=10000):
+        self.callbacks = set(key if '/' in key else key.lower() for key in callbacks or ())
+        self.max_pending = max_pending
+        self.max_tasks = max_tasks
+        self.keys = {}
+        self.held = 0
+
+    def key(self, task):
+        """
+        :return: ключ упорядочивания задачи или None, если задача не упорядочивается
+        """
+        data = task.data
+        key = data.get('ordering_key')
+        if isinstance(key, (basestring, int, long)):
+            return key
+
+        url = data.get('callback_url')
+        if not self.callbacks or not url:
+            return None
+        if url in self.callbacks or urlsplit(url).netloc.lower() in self.callbacks:
+            return url
+        return None
+
+    def add(self, key, task):
+        """
+        Ставит задачу в очередь ключа.
+
+        :return: RUN, WAIT или FULL
+        :rtype: str
+        """
+        state = self.keys.get(key)
+        if state is None:
+            if self.held >= self.max_tasks:
+                return FULL
+            self.keys[key] = KeyState(task)
+            return RUN
+
+        if state.head is task:
+            # повтор головной задачи
+            if state.delayed:
+                state.delayed = False
+                self.held -= 1
+            return RUN
+
+        if len(state.waiting) >= self.max_pending or self.held >= self.max_tasks:
+            return FULL
+        state.waiting.append(task)
+        self.held += 1
+        return WAIT
+
+    def delay(self, key, failed=True):
+        """
+        Отмечает, что головная задача ключа ждет повтора (failed) или откладывания.
+
+        :return: сколько попыток головной задачи не удалось
+        :rtype: int
+        """
+        state = self.keys[key]
+        if failed:
+            state.attempts += 1
+        state.delayed = True
+        self.held += 1
+        return state.attempts
+
+    def attempts(self, key):
+        """
+        :return: сколько попыток головной задачи ключа не удалось
+        :rtype: int
+        """
+        return self.keys[key].attempts
+
+    def done(self, key):
+        """
+        Завершает головную задачу ключа.
+
+        :return: следующая задача ключа или None
+        """
+        state = self.keys[key]
+        if not state.waiting:
+            del self.keys[key]
+            return None
+        state.head = state.waiting.popleft()
+        state.attempts = 0
+        self.held -= 1
+        return state.head
+
+    def discard(self, key):
+        """
+        Завершает головную задачу ключа и убирает ключ.
+
+        :return: задачи, ждавшие своей очереди
+        :rtype: list
+        """
+        state = self.keys.pop(key)
+        self.held -= len(state.waiting)
+        return list(state.waiting)
+
+    def held_tasks(self):
+        """
+        Задачи, которые ждут в памяти: следующие задачи ключей и головные, ждущие повтора.
+
+        :rtype: list
+        """
+        tasks = []
+        for state in self.keys.itervalues():
+            if state.delayed:
+                tasks.append(state.head)
+            tasks.extend(state.waiting)
+        return tasks
+
+    def drain(self):
+        """
+        Забирает все ждущие задачи (головные задачи остаются у обработчиков).
+
+        :rtype: list
+        """
+        tasks = []
+        for state in self.keys.itervalues():
+            tasks.extend(state.waiting)
+        self.keys.clear()
+        self.held = 0
+        return tasks
+
+    def __len__(self):
+        return self.held
@@ -0,0 +1,117 @@
+# coding: utf-8
+"""
+Ограничение частоты запросов к хостам уведомлений маркерными корзинами (token bucket).
+
+Корзина хоста пополняется rate маркерами в секунду и вмещает не больше burst маркеров,
+каждый запрос забирает один маркер. Параметры корзины берутся из правил: сначала по
+имени хоста, затем по самому длинному подходящему шаблону fnmatch ('*.example.com', '*').
+Правило None снимает ограничение с хоста, подходящего под более общий шаблон.
+
+Задачи, которым не хватило маркера, возвращаются в очередь с задержкой, рассчитанной
+reserve(): отложенные задачи хоста распределяются по времени с частотой rate,
+а не возвращаются все разом.
+"""
+from fnmatch import fnmatchcase
+import time
+
+
+class TokenBucket(object):
+    """
+    Маркерная корзина одного хоста.
+
+    :param rate: сколько запросов в секунду разрешено в среднем
+    :param burst: сколько запросов можно отправить подряд
+    """
+    def __init__(self, rate, burst, now=None):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self.backlog = 0.0
+        self.updated_at = time.time() if now is None else now
+
+    def refill(self, now):
+        elapsed = max(0, now - self.updated_at)
+        self.updated_at = now
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.backlog = max(0, self.backlog - elapsed * self.rate)
+
+    def ready(self, now=None):
+        """
+        Есть ли маркер для запроса.
+
+        :rtype: bool
+        """
+        self.refill(time.time() if now is None else now)
+        return self.tokens >= 1
+
+    def take(self, now=None):
+        """
+        Забирает маркер, если он есть.
+
+        :return: удалось ли забрать маркер
+        :rtype: bool
+        """
+        if not self.ready(now):
+            return False
+        self.tokens -= 1
+        return True
+
+    def reserve(self, now=None):
+        """
+        Ставит отложенный запрос в очередь хоста.
+
+        :return: через сколько секунд для него освободится маркер
+        :rtype: float
+        """
+        self.refill(time.time() if now is None else now)
+        self.backlog += 1
+        return max(0, self.backlog - self.tokens) / self.rate
+
+    def snapshot(self):
+        return {'tokens': self.tokens, 'backlog': self.backlog}
+
+
+class RateLimits(object):
+    """
+    Маркерные корзины по хостам.
+
+    :param rules: {хост или шаблон fnmatch: (rate, burst) или None}
+    :type rules: dict
+    """
+    def __init__(self, rules=None):
+        self.hosts = {}
+        self.patterns = []
+        for key, rule in (rules or {}).iteritems():
+            key = key.lower()
+            if any(char in key for char in '*?['):
+                self.patterns.append((key, rule))
+            else:
+                self.hosts[key] = rule
+        self.patterns.sort(key=lambda pattern: len(pattern[0]), reverse=True)
+        self.buckets = {}
+
+    def rule(self, host):
+        """
+        :return: правило (rate, burst) для хоста или None, если частота не ограничена
+        :rtype: tuple or None
+        """
+        if host in self.hosts:
+            return self.hosts[host]
+        for pattern, rule in self.patterns:
+            if fnmatchcase(host, pattern):
+                return rule
+        return None
+
+    def bucket(self, host, now=None):
+        """
+        :return: корзина хоста или None, если частота запросов к нему не ограничена
+        :rtype: TokenBucket or None
+        """
+        if host in self.buckets:
+            return self.buckets[host]
+        rule = self.rule(host)
+        bucket = self.buckets[host] = None if rule is None else TokenBucket(rule[0], rule[1], now)
+        return bucket
+
+    def __nonzero__(self):
+        return bool(self.hosts or self.patterns)
@@ -0,0 +1,295 @@
+# coding: utf-8
+"""
+Соединения с tarantool для операций очереди: несколько запросов в одном соединении
+(pipelining) и небольшой пул соединений.
+
+В протоколе tarantool 1.5 ответ несет id запроса (request_id заголовка), а сервер выполняет
+запросы соединения в пуле файберов, так что ответы могут приходить не по порядку.
+MultiplexedConnection отправляет запрос, не дожидаясь ответов на предыдущие, и раздает ответы
+ожидающим по id: take, ждущий задачу, не задерживает ack и put других greenlet'ов. Ответы
+читает один из ожидающих greenlet'ов, отдельного читателя нет, поэтому соединение работает
+и без gevent.monkey (в воркерах redirect_checker).
+
+Задачи очереди привязаны к сессии, которая их взяла: ack, release или bury из другого
+соединения tarantool отвергает. Поэтому ConnectionPool выполняет take и операции над взятыми
+задачами в первом соединении, а остальные запросы (put, meta, statistics, select) - в наименее
+загруженном, подключая остальные соединения, когда подключенные заняты. При ошибке сети
+соединение закрывается, ожидающие запросы получают NetworkError, а следующий запрос
+переподключается не раньше чем через reconnect_delay секунд. Задачи, взятые закрытой
+сессией, tarantool сам возвращает в очередь.
+"""
+import errno
+from itertools import count
+from logging import getLogger
+import os
+import time
+
+import gevent
+from gevent import socket
+from gevent.event import Event
+from gevent.lock import Semaphore
+import tarantool
+from tarantool.const import RETRY_MAX_ATTEMPTS, struct_L
+from tarantool.error import DatabaseError, NetworkError
+from tarantool.response import Response
+from tarantool_queue import tarantool_queue
+
+logger = getLogger('queue')
+
+HEADER_SIZE = 12
+"""Заголовок пакета tarantool 1.5: тип запроса, длина тела, id запроса"""
+
+READ_SIZE = 65536
+
+SESSION_CALLS = frozenset((
+    'queue.take', 'queue.ack', 'queue.release', 'queue.bury', 'queue.done', 'queue.touch', 'queue.requeue'
+))
+"""Функции очереди, которые tarantool выполняет только для задач, взятых той же сессией"""
+
+
+class Waiter(object):
+    __slots__ = ('event', 'response')
+
+    def __init__(self):
+        self.event = Event()
+        self.response = None
+
+    def set(self, response):
+        self.response = response
+        self.event.set()
+
+
+class MultiplexedConnection(tarantool.Connection):
+    """
+    Соединение с tarantool, в котором запросы разных greenlet'ов выполняются одновременно.
+    Подключается при первом запросе.
+    """
+    def __init__(self, host, port, socket_timeout=None, reconnect_delay=0.1, schema=None):
+        super(MultiplexedConnection, self).__init__(
+            host, port, socket_timeout=socket_timeout, reconnect_delay=reconnect_delay,
+            connect_now=False, schema=schema
+        )
+        self.request_ids = count(1)
+        self.waiters = {}
+        self.send_lock = Semaphore()
+        self.connect_lock = Semaphore()
+        self.reading = False
+        self.buffer = ''
+        self.failed_at = None
+
+    @property
+    def busy(self):
+        """
+        Сколько запросов ждут ответа.
+        """
+        return len(self.waiters)
+
+    def connect(self):
+        try:
+            self.connected = True
+            if self._socket:
+                self._socket.close()
+            self._socket = socket.create_connection((self.host, self.port))
+            self._socket.setsockopt(socket.SOL_TCP, socket.TCP_NODELAY, 1)
+            self._socket.settimeout(self.socket_timeout)
+            self.buffer = ''
+        except socket.error as exc:
+            self.connected = False
+            self._socket = None
+            self.failed_at = time.time()
+            raise NetworkError(exc)
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+        self._socket = None
+        self.connected = False
+
+    def _send_request(self, request, space_name=None, field_defs=None, default_type=None):
+        # сервер просит повторить запрос, если completion_status == 1
+        for _ in xrange(RETRY_MAX_ATTEMPTS):
+            header, body = self.exchange(bytes(request))
+            response = Response(self, header, body, space_name, field_defs, default_type)
+            if response.completion_status != 1:
+                return response
+        raise DatabaseError(response.return_code, response.return_message)
+
+    def exchange(self, packet):
+        """
+        Отправляет пакет запроса и ждет ответ на него.
+
+        :return: заголовок и тело ответа
+        :rtype: tuple
+        """
+        # запрос считается в busy и пока соединение подключается, чтобы пул не отдал
+        # это соединение следующим запросам
+        request_id = next(self.request_ids) & 0xffffffff
+        waiter = self.waiters[request_id] = Waiter()
+        try:
+            if self._socket is None:
+                self.reconnect()
+            self.send(packet[:8] + struct_L.pack(request_id) + packet[HEADER_SIZE:])
+            return self.wait(waiter)
+        finally:
+            self.waiters.pop(request_id, None)
+
+    def reconnect(self):
+        with self.connect_lock:
+            if self._socket is not None:
+                return
+            if self.failed_at is not None:
+                gevent.sleep(max(0, self.failed_at + self.reconnect_delay - time.time()))
+            logger.info('Connect to tarantool on %s:%s.', self.host, self.port)
+            self.connect()
+            self.failed_at = None
+
+    def send(self, packet):
+        try:
+            with self.send_lock:
+                self._socket.sendall(packet)
+        except socket.error as exc:
+            self.fail(exc)
+            raise NetworkError(exc)
+        except BaseException as exc:
+            # прерванная отправка оставила в сокете часть пакета
+            self.fail(exc)
+            raise
+
+    def wait(self, waiter):
+        while waiter.response is None:
+            if self.reading:
+                waiter.event.wait()
+                waiter.event.clear()
+                continue
+
+            self.reading = True
+            try:
+                self.read(waiter)
+            finally:
+                self.reading = False
+                self.hand_over(waiter)
+
+        if isinstance(waiter.response, Exception):
+            raise waiter.response
+        return waiter.response
+
+    def read(self, waiter):
+        """
+        Читает ответы и раздает их ожидающим, пока не придет ответ waiter'а.
+        Прочитанная часть пакета остается в буфере, если читающий greenlet прервали.
+        """
+        try:
+            while waiter.response is None:
+                header, body = self.read_packet()
+                other = self.waiters.get(struct_L.unpack_from(header, 8)[0])
+                if other is not None:
+                    other.set((header, body))
+        except (socket.error, NetworkError) as exc:
+            self.fail(exc)
+
+    def read_packet(self):
+        while True:
+            if len(self.buffer) >= HEADER_SIZE:
+                size = HEADER_SIZE + struct_L.unpack_from(self.buffer, 4)[0]
+                if len(self.buffer) >= size:
+                    packet, self.buffer = self.buffer[:size], self.buffer[size:]
+                    return packet[:HEADER_SIZE], packet[HEADER_SIZE:]
+            data = self._socket.recv(READ_SIZE)
+            if not data:
+                raise NetworkError(socket.error(errno.ECONNRESET, 'Lost connection to server during query'))
+            self.buffer += data
+
+    def hand_over(self, reader):
+        """
+        Передает чтение ответов следующему ожидающему.
+        """
+        for waiter in self.waiters.itervalues():
+            if waiter is not reader and waiter.response is None:
+                waiter.event.set()
+                return
+
+    def fail(self, exc):
+        """
+        Закрывает соединение после ошибки: ожидающие запросы получают NetworkError.
+        """
+        logger.warning('Connection to tarantool on %s:%s failed: %s', self.host, self.port, exc)
+        self.close()
+        self.failed_at = time.time()
+        error = exc if isinstance(exc, NetworkError) else NetworkError(
+            socket.error(errno.ECONNRESET, 'Connection to server closed: {!r}'.format(exc))
+        )
+        for waiter in self.waiters.values():
+            if waiter.response is None:
+                waiter.set(error)
+
+
+class ConnectionPool(object):
+    """
+    Пул из size соединений MultiplexedConnection с одним сервером tarantool
+    с интерфейсом tarantool.Connection, нужным tarantool_queue (call и select).
+    """
+    def __init__(self, host, port, size=2, socket_timeout=None, reconnect_delay=0.1, schema=None):
+        self.host = host
+        self.port = port
+        self.connections = [
+            MultiplexedConnection(host, port, socket_timeout, reconnect_delay, schema) for _ in xrange(max(1, size))
+        ]
+
+    def connection(self, func_name=None):
+        """
+        Соединение для запроса: для операций над взятыми задачами - первое, для остальных -
+        с наименьшим числом запросов в работе. Из одинаково загруженных выбирается подключенное,
+        а еще не подключенное свободное соединение предпочитается занятому, так что пул
+        подключается по мере нагрузки. Соединения, отказавшие менее reconnect_delay секунд
+        назад, не выбираются, пока есть другие.
+
+        :rtype: MultiplexedConnection
+        """
+        if func_name in SESSION_CALLS:
+            return self.connections[0]
+        now = time.time()
+        healthy = [
+            connection for connection in self.connections
+            if connection.failed_at is None or now - connection.failed_at >= connection.reconnect_delay
+        ]
+        return min(healthy or self.connections, key=lambda connection: (connection.busy, not connection.connected))
+
+    def call(self, func_name, *args, **kwargs):
+        return self.connection(func_name).call(func_name, *args, **kwargs)
+
+    def select(self, space_name, values=None, **kwargs):
+        return self.connection().select(space_name, values, **kwargs)
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+
+
+class PooledQueue(tarantool_queue.Queue):
+    """
+    tarantool_queue.Queue, выполняющая запросы через общий ConnectionPool.
+    """
+    def __init__(self, host='localhost', port=33013, space=0, pool=None):
+        super(PooledQueue, self).__init__(host=host, port=port, space=space)
+        self.pool = pool or ConnectionPool(host, port)
+
+    @property
+    def tnt(self):
+        return self.pool
+
+
+_pools = {}
+
+
+def get_pool(host, port, size=2):
+    """
+    Общий пул соединений с сервером в текущем процессе: очереди одного сервера, например
+    входная и выходная очереди redirect_checker, используют одни соединения.
+    Пулы, унаследованные от родительского процесса, не используются.
+
+    :rtype: ConnectionPool
+    """
+    key = (os.getpid(), host, port, size)
+    if key not in _pools:
+        _pools[key] = ConnectionPool(host, port, size)
+    return _pools[key]
@@ -0,0 +1,112 @@
+# coding: utf-8
+"""
+Таймауты ответа хостов уведомлений по наблюдаемой длительности запросов.
+
+Для каждого хоста хранятся длительности последних window запросов, таймаут
+ответа - их перцентиль percentile, умноженный на factor, в пределах
+[floor, ceiling]. Пока запросов к хосту меньше min_samples, используется
+таймаут по умолчанию. Запросы, прерванные по таймауту, учитываются с длительностью
+таймаута, поэтому у хоста, ставшего медленнее, таймаут растет.
+
+FixedTimeouts - тот же интерфейс с одним таймаутом для всех хостов.
+"""
+from collections import deque
+
+RECOMPUTE_EVERY = 10
+"""Через сколько новых запросов к хосту пересчитывать его таймаут"""
+
+
+class HostLatencies(object):
+    """
+    Длительности последних запросов к хосту и рассчитанный по ним таймаут.
+    """
+    def __init__(self, window):
+        self.durations = deque(maxlen=window)
+        self.timeout = None
+        self.pending = 0
+
+
+class FixedTimeouts(object):
+    """
+    Один таймаут ответа для всех хостов.
+
+    :param default: таймаут ответа, секунды (None - без таймаута ответа)
+    """
+    def __init__(self, default=None):
+        self.default = default
+
+    def observe(self, host, elapsed):
+        pass
+
+    def read_timeout(self, host):
+        return self.default
+
+    def snapshot(self):
+        return {}
+
+
+class AdaptiveTimeouts(object):
+    """
+    Таймауты ответа по хостам.
+
+    :param default: таймаут хоста, по которому мало данных (None - без таймаута ответа)
+    :param percentile: перцентиль длительности запросов
+    :param factor: во сколько раз таймаут больше перцентиля
+    :param floor: наименьший таймаут, секунды
+    :param ceiling: наибольший таймаут, секунды
+    :param window: сколько последних запросов хоста учитывать
+    :param min_samples: со скольких запросов таймаут хоста рассчитывается по ним
+    """
+    def __init__(self, default=None, percentile=0.99, factor=3.0, floor=0.5, ceiling=30.0, window=200, min_samples=20):
+        self.default = default
+        self.percentile = percentile
+        self.factor = factor
+        self.floor = floor
+        self.ceiling = ceiling
+        self.window = window
+        self.min_samples = min_samples
+        self.hosts = {}
+
+    def observe(self, host, elapsed):
+        """
+        Учитывает длительность запроса к хосту, завершившегося ответом или таймаутом.
+
+        :type host: str
+        :param elapsed: длительность запроса, секунды
+        :type elapsed: float
+        """
+        latencies = self.hosts.get(host)
+        if latencies is None:
+            latencies = self.hosts[host] = HostLatencies(self.window)
+        latencies.durations.append(elapsed)
+        latencies.pending += 1
+
+        if len(latencies.durations) < self.min_samples:
+            return
+        if latencies.timeout is not None and latencies.pending < RECOMPUTE_EVERY:
+            return
+
+        durations = sorted(latencies.durations)
+        value = durations[int(self.percentile * (len(durations) - 1))] * self.factor
+        latencies.timeout = max(self.floor, min(self.ceiling, value))
+        latencies.pending = 0
+
+    def read_timeout(self, host):
+        """
+        :return: таймаут ответа хоста, секунды, или default
+        :rtype: float or None
+        """
+        latencies = self.hosts.get(host)
+        if latencies is None or latencies.timeout is None:
+            return self.default
+        return latencies.timeout
+
+    def snapshot(self):
+        """
+        Возвращает рассчитанные таймауты по хостам.
+
+        :rtype: dict
+        """
+        return dict(
+            (host, latencies.timeout) for host, latencies in self.hosts.iteritems() if latencies.timeout is not None
+        )
@@ -7,6 +7,9 @@ import urllib2
 
 from tarantool_queue import tarantool_queue
 
+import memory_queue
+import tarantool_pool
+
 
 def daemonize():
     """
@@ -58,9 +61,69 @@ def load_config_from_pyfile(filepath):
         if key.isupper():
             setattr(cfg, key, value)
 
+    cfg.filepath = filepath
+
     return cfg
 
 
+def comparable_setting(value):
+    """
+    Приводит значение настройки к виду, пригодному для сравнения: потоки вывода
+    (например, getwriter('utf-8')(sys.stderr) в LOGGING) создаются заново при каждой
+    загрузке файла, поэтому сравниваются по потоку, в который они пишут.
+    """
+    if isinstance(value, dict):
+        return dict((key, comparable_setting(item)) for key, item in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return [comparable_setting(item) for item in value]
+    if hasattr(value, 'write'):
+        return 'stream', getattr(value, 'stream', value)
+    return value
+
+
+def update_config(config, new_config, restart_required=()):
+    """
+    Переносит в config настройки из new_config, значения которых изменились.
+
+    :param config: текущая конфигурация
+    :type config: Config
+    :param new_config: заново загруженная конфигурация
+    :type new_config: Config
+    :param restart_required: имена настроек, которые применяются только при перезапуске,
+        такие настройки не переносятся
+    :type restart_required: tuple
+
+    :return: примененные изменения {имя: (старое значение, новое значение)}
+        и список измененных, но не примененных настроек
+    :rtype: tuple
+    """
+    changes = {}
+    skipped = []
+    for name in sorted(key for key in vars(new_config) if key.isupper()):
+        old, new = getattr(config, name, None), getattr(new_config, name)
+        if comparable_setting(old) == comparable_setting(new):
+            continue
+        if name in restart_required:
+            skipped.append(name)
+            continue
+        setattr(config, name, new)
+        changes[name] = (old, new)
+    return changes, skipped
+
+
+def log_config_changes(logger, changes, skipped):
+    for name in sorted(changes):
+        old, new = changes[name]
+        if name == 'LOGGING':
+            logger.info('Config %s changed.', name)
+        else:
+            logger.info('Config %s changed: %r -> %r.', name, old, new)
+    for name in skipped:
+        logger.warning('Config %s changed, restart is required to apply it.', name)
+    if not changes and not skipped:
+        logger.info('Config has not changed.')
+
+
 def parse_cmd_args(args, app_description=''):
     """
     Разбирает аргументы командной строки.
@@ -97,10 +160,30 @@ def parse_cmd_args(args, app_description=''):
     return parser.parse_args(args=args)
 
 
-def get_tube(host, port, space, name):
-    queue = tarantool_queue.Queue(
-        host=host, port=port, space=space
-    )
+def create_queue(host, port, space, backend='tarantool', connections=None):
+    """
+    Создает подключение к очереди задач.
+
+    :param backend: tarantool - сервер tarantool, memory - очередь в памяти текущего процесса,
+        memory_server - очередь в памяти процесса source/queue_server.py
+    :type backend: basestring
+    :param connections: размер общего пула соединений с сервером tarantool (см. lib.tarantool_pool),
+        None - одно соединение tarantool_queue без одновременных запросов
+    :type connections: int or None
+    """
+    if backend == 'tarantool':
+        if connections:
+            return tarantool_pool.PooledQueue(host, port, space, tarantool_pool.get_pool(host, port, connections))
+        return tarantool_queue.Queue(host=host, port=port, space=space)
+    if backend == 'memory':
+        return memory_queue.Queue(host=host, port=port, space=space)
+    if backend == 'memory_server':
+        return memory_queue.RemoteQueue(host=host, port=port, space=space)
+    raise ValueError('Unknown queue backend: {}'.format(backend))
+
+
+def get_tube(host, port, space, name, backend='tarantool', connections=None):
+    queue = create_queue(host, port, space, backend, connections)
     return queue.tube(name)
 
 
@@ -1,22 +1,35 @@
 # coding: utf-8
 from logging import getLogger
+from logging.config import dictConfig
 import os.path
+import signal
 
 from tarantool.error import DatabaseError
-from . import to_unicode, get_redirect_history
+from . import capture, to_unicode, get_redirect_history
 
-from utils import get_tube
+from utils import get_tube, load_config_from_pyfile, log_config_changes, update_config
 
 logger = getLogger('redirect_checker')
 
+QUEUE_SETTINGS = (
+    'QUEUE_BACKEND', 'QUEUE_CONNECTIONS',
+    'INPUT_QUEUE_HOST', 'INPUT_QUEUE_PORT', 'INPUT_QUEUE_SPACE', 'INPUT_QUEUE_TUBE',
+    'OUTPUT_QUEUE_HOST', 'OUTPUT_QUEUE_PORT', 'OUTPUT_QUEUE_SPACE', 'OUTPUT_QUEUE_TUBE',
+)
+"""Настройки, при изменении которых воркер переподключается к очередям"""
+
+reload_requested = False
+"""Флаг, определяющий, нужно ли перечитать файл конфигурации (SIGHUP)."""
+
+retire_requested = False
+"""Флаг, определяющий, нужно ли завершиться после текущей задачи (SIGUSR1)."""
+
 
 def get_redirect_history_from_task(task, timeout, max_redirects=30, user_agent=None):
     url = to_unicode(task.data['url'], 'ignore')
     is_recheck = bool(task.data.get('recheck'))
 
-    logger.info(u'Task id={} url={} url_id={} is_recheck={}'.format(
-        task.task_id, url, task.data["url_id"], is_recheck
-    ))
+    logger.info(u'Task id=%s url=%s url_id=%s is_recheck=%s', task.task_id, url, task.data["url_id"], is_recheck)
 
     history_types, history_urls, counters = get_redirect_history(
         url, timeout, max_redirects, user_agent
@@ -43,41 +56,100 @@ def get_tubes(config):
         host=config.INPUT_QUEUE_HOST,
         port=config.INPUT_QUEUE_PORT,
         space=config.INPUT_QUEUE_SPACE,
-        name=config.INPUT_QUEUE_TUBE
+        name=config.INPUT_QUEUE_TUBE,
+        backend=getattr(config, 'QUEUE_BACKEND', 'tarantool'),
+        connections=getattr(config, 'QUEUE_CONNECTIONS', None)
+    )
+    logger.info(
+        u'Connected to input queue server on %s:%s space #%s. name=%s',
+        input_tube.queue.host, input_tube.queue.port, input_tube.queue.space, input_tube.opt['tube']
     )
-    logger.info(u'Connected to input queue server on {host}:{port} space #{space}. name={name}'.format(
-        host=input_tube.queue.host,
-        port=input_tube.queue.port,
-        space=input_tube.queue.space,
-        name=input_tube.opt['tube']
-    ))
 
     output_tube = get_tube(
         host=config.OUTPUT_QUEUE_HOST,
         port=config.OUTPUT_QUEUE_PORT,
         space=config.OUTPUT_QUEUE_SPACE,
-        name=config.OUTPUT_QUEUE_TUBE
+        name=config.OUTPUT_QUEUE_TUBE,
+        backend=getattr(config, 'QUEUE_BACKEND', 'tarantool'),
+        connections=getattr(config, 'QUEUE_CONNECTIONS', None)
+    )
+    logger.info(
+        u'Connected to output queue server on %s:%s space #%s name=%s.',
+        output_tube.queue.host, output_tube.queue.port, output_tube.queue.space, output_tube.opt['tube']
     )
-    logger.info(u'Connected to output queue server on {host}:{port} space #{space} name={name}.'.format(
-        host=output_tube.queue.host,
-        port=output_tube.queue.port,
-        space=output_tube.queue.space,
-        name=output_tube.opt['tube']
-    ))
 
     return input_tube, output_tube
 
 
+def reload_handler(signum, frame):
+    global reload_requested
+    reload_requested = True
+
+
+def retire_handler(signum, frame):
+    global retire_requested
+    retire_requested = True
+
+
+def install_signal_handlers():
+    for signum, handler in ((signal.SIGHUP, reload_handler), (signal.SIGUSR1, retire_handler)):
+        signal.signal(signum, handler)
+        # the signal must not interrupt a blocking take or request in the middle of a task
+        signal.siginterrupt(signum, False)
+
+
+def reload_config(config):
+    """
+    Перечитывает файл конфигурации между задачами и применяет изменившиеся настройки.
+
+    :return: изменились ли настройки очередей
+    :rtype: bool
+    """
+    global reload_requested
+
+    reload_requested = False
+
+    try:
+        new_config = load_config_from_pyfile(config.filepath)
+    except Exception as e:
+        logger.error('Can not reload config, keep the current one.')
+        logger.exception(e)
+        return False
+
+    changes, skipped = update_config(config, new_config)
+
+    if 'LOGGING' in changes:
+        dictConfig(config.LOGGING)
+
+    log_config_changes(logger, changes, skipped)
+
+    if any(name.startswith('CAPTURE_') for name in changes):
+        capture.close()
+        capture.install(capture.open_capture(config, 'checker'))
+
+    return any(name in changes for name in QUEUE_SETTINGS)
+
+
 def worker(config, parent_pid):
+    install_signal_handlers()
+
     input_tube, output_tube = get_tubes(config)
 
     parent_proc = '/proc/{}'.format(parent_pid)
 
+    capture.install(capture.open_capture(config, 'checker'))
+
     # run while parent is alive
-    while os.path.exists(parent_proc):
+    while os.path.exists(parent_proc) and not retire_requested:
+        if reload_requested and reload_config(config):
+            input_tube, output_tube = get_tubes(config)
+
         task = input_tube.take(config.QUEUE_TAKE_TIMEOUT)
         if task:
-            logger.info(u'Starting task id={}.'.format(task.task_id))
+            logger.info(u'Starting task id=%s.', task.task_id)
+            # rechecks are put back by the worker itself and are not part of the incoming traffic
+            if not task.data.get('recheck'):
+                capture.record_task(task)
             result = get_redirect_history_from_task(
                 task,
                 config.HTTP_TIMEOUT,
@@ -94,12 +166,16 @@ def worker(config, parent_pid):
                     )
                 else:
                     output_tube.put(data)
-                logger.debug(u'Task id={} data:{}'.format(task.task_id, data))
+                logger.debug(u'Task id=%s data:%s', task.task_id, data)
             try:
                 task.ack()
-                logger.info(u'Task id={} done'.format(task.task_id))
+                logger.info(u'Task id=%s done', task.task_id)
             except DatabaseError as e:
                 logger.info('Task ack fail')
                 logger.exception(e)
     else:
-        logger.info('Parent is dead. exiting')
+        if retire_requested:
+            logger.info('Worker is retired. exiting')
+        else:
+            logger.info('Parent is dead. exiting')
+        capture.close()
@@ -2,23 +2,43 @@
 # coding: utf-8
 
 import argparse
-import json
+from collections import OrderedDict
+import copy
 import logging
+import multiprocessing
 import os
 import signal
+import socket
 import sys
+import time
 from logging.config import dictConfig
 from threading import current_thread
 
 import gevent
-from gevent import Greenlet
 from gevent import queue as gevent_queue
 from gevent import sleep
+from gevent.lock import DummySemaphore, Semaphore
 from gevent.monkey import patch_all
-from gevent.pool import Pool
+from gevent import GreenletExit
+from gevent.pool import Group, Pool
 import requests
 import tarantool
-import tarantool_queue
+
+from lib import capture, metrics
+from lib.batching import Batch, Batcher
+from lib.breaker import RATE_LIMITED, HostGuard
+from lib.codec import get_codec
+from lib.concurrency import AimdLimiter
+from lib.dedup import DeliveryLog
+from lib.curl_pool import CurlPool
+from lib.dns_cache import CachingResolver, make_resolver
+from lib.http_pool import SessionPool
+from lib.lanes import Lane, LaneQueue
+from lib.memory_queue import QueueError
+from lib.ordering import FULL, RUN, Sequencer
+from lib.tarantool_pool import PooledQueue
+from lib.timeouts import AdaptiveTimeouts, FixedTimeouts
+from lib.utils import create_queue, log_config_changes, update_config
 
 SIGNAL_EXIT_CODE_OFFSET = 128
 """Коды выхода рассчитываются как 128 + номер сигнала"""
@@ -29,67 +49,378 @@ run_application = True
 exit_code = 0
 """Код возврата приложения"""
 
+reload_requested = False
+"""Флаг, определяющий, нужно ли перечитать файл конфигурации."""
+
+signal_handlers = []
+"""Установленные обработчики сигналов gevent"""
+
+session_pool = None
+"""Пул keep-alive HTTP-сессий для отправки уведомлений"""
+
+HTTP_ENGINES = {
+    'requests': SessionPool,
+    'curl': CurlPool,
+}
+"""Пулы соединений по имени HTTP-движка из config.HTTP_ENGINE"""
+
+host_guard = None
+"""Ограничение одновременных запросов и размыкатели цепи по хостам уведомлений"""
+
+batcher = Batcher()
+"""Пачки уведомлений, отправляемых на один адрес одним запросом"""
+
+sequencer = Sequencer()
+"""Очереди задач, уведомления которых доставляются по порядку в пределах ключа"""
+
+json_codec = get_codec()
+"""Кодек JSON для тел уведомлений"""
+
+concurrency_limiter = None
+"""Адаптивное число обработчиков (None - постоянное config.WORKER_POOL_SIZE)"""
+
+read_timeouts = None
+"""Таймауты ответа по хостам уведомлений (None - только общий таймаут запроса)"""
+
+delivery_log = None
+"""Недавно доставленные уведомления (None - без проверки повторных задач)"""
+
+process_number = 0
+"""Номер процесса пушера в режиме prefork"""
+
+encoded_bodies = OrderedDict()
+"""Закодированные тела уведомлений повторяемых задач по id задачи"""
+
+RETRY_STATUS_CODES = (408, 429)
+"""Коды ответа 4xx, после которых уведомление стоит отправить еще раз"""
+
+ATTEMPTS_FIELD = 'pusher_attempts'
+"""Поле данных задачи с числом неудачных попыток (см. Committer.retry)"""
+
+ORIGIN_FIELD = 'pusher_origin_id'
+"""Поле данных повторной задачи с id исходной: он остается id уведомления"""
+
+MAX_TRACKED_REQUEUES = 100000
+"""Для скольких задач помнить поставленную копию, пока исходная не подтверждена"""
+
+MAX_CACHED_BODIES = 10000
+"""Для скольких повторяемых задач помнить закодированное тело уведомления"""
+
+COMMIT_PIPELINE = 16
+"""Сколько задач пачки подтверждать одновременно, если соединение с очередью допускает это"""
+
+QUEUE_ERRORS = (tarantool.DatabaseError, socket.error, QueueError)
+"""Ошибки запросов к очереди: после них take_tasks берет задачи снова, а Committer повторяет подтверждение"""
+
+RESTART_REQUIRED = (
+    'QUEUE_BACKEND', 'QUEUE_HOST', 'QUEUE_PORT', 'QUEUE_SPACE', 'QUEUE_TUBE', 'QUEUE_LANES', 'QUEUE_CONNECTIONS'
+)
+"""Настройки, которые применяются только при перезапуске приложения"""
+
 logger = logging.getLogger('pusher')
 
+commit_lag = metrics.summary('pusher.commit_lag')
+committed_tasks = metrics.counter('pusher.committed')
+commit_errors = metrics.counter('pusher.commit_errors')
+commit_backlog = metrics.gauge('pusher.commit_backlog')
+retried_tasks = metrics.counter('pusher.retried')
+deferred_tasks = metrics.counter('pusher.deferred')
+throttled_tasks = metrics.counter('pusher.throttled')
+sent_batches = metrics.counter('pusher.batches')
+released_tasks = metrics.counter('pusher.released')
+duplicate_deliveries = metrics.counter('pusher.duplicates')
+batch_size = metrics.summary('pusher.batch_size')
+concurrency_limit = metrics.gauge('pusher.concurrency.limit')
+concurrency_increases = metrics.counter('pusher.concurrency.increases')
+concurrency_decreases = metrics.counter('pusher.concurrency.decreases')
+read_timeout_values = metrics.summary('pusher.read_timeout')
+ordering_waiting = metrics.gauge('pusher.ordering.waiting')
+ordering_overflows = metrics.counter('pusher.ordering.overflows')
+ordering_touches = metrics.counter('pusher.ordering.touched')
+
+
+def response_action(status_code):
+    """
+    Выбирает, что сделать с задачей по коду ответа: 2xx - подтвердить (ack),
+    5xx, 408 и 429 - отправить еще раз позже (retry), остальные - закопать (bury).
+
+    :type status_code: int
+
+    :rtype: str
+    """
+    if 200 <= status_code < 300:
+        return 'ack'
+    if status_code >= 500 or status_code in RETRY_STATUS_CODES:
+        return 'retry'
+    return 'bury'
+
+
+def notification_id(task):
+    """
+    Возвращает id уведомления: id задачи или, у повторной задачи, id исходной.
+
+    :type task: tarantool_queue.Task
+    """
+    return task.data.get(ORIGIN_FIELD, task.task_id)
+
+
+def encode_payload(task):
+    """
+    Кодирует тело уведомления: данные задачи без callback_url и служебных полей
+    повтора и с id уведомления (см. notification_id).
+
+    Данные задачи не копируются, а меняются на время кодирования и сразу
+    восстанавливаются. Тело, сохраненное keep_payload(), берется готовым.
+
+    :type task: tarantool_queue.Task
+
+    :rtype: str
+    """
+    body = encoded_bodies.pop(task.task_id, None)
+    if body is not None:
+        return body
+
+    data = task.data
+    url = data.pop('callback_url')
+    service = dict((field, data.pop(field)) for field in (ATTEMPTS_FIELD, ORIGIN_FIELD) if field in data)
+    had_id, previous_id = 'id' in data, data.get('id')
+    data['id'] = service.get(ORIGIN_FIELD, task.task_id)
+    try:
+        return json_codec.dumps(data)
+    finally:
+        data['callback_url'] = url
+        data.update(service)
+        if had_id:
+            data['id'] = previous_id
+        else:
+            del data['id']
+
+
+def keep_payload(task, action, body):
+    """
+    Запоминает тело уведомления задачи, которая будет отправлена еще раз (retry, defer, throttle),
+    чтобы не кодировать его заново. Помнятся тела последних MAX_CACHED_BODIES таких задач.
+
+    :type task: tarantool_queue.Task
+    :param action: имя действия с задачей
+    :type action: str
+    :param body: тело уведомления или None, если оно не было закодировано
+    :type body: str or None
+    """
+    if body is None or action not in ('retry', 'defer', 'throttle'):
+        return
+    encoded_bodies[task.task_id] = body
+    if len(encoded_bodies) > MAX_CACHED_BODIES:
+        encoded_bodies.popitem(last=False)
+
+
+def is_delivered(task, body):
+    """
+    Проверяет по журналу delivery_log, доставлялось ли уже уведомление задачи с этим телом.
+
+    :type task: tarantool_queue.Task
+    :type body: str
+
+    :rtype: bool
+    """
+    if delivery_log is None or not delivery_log.seen(notification_id(task), body):
+        return False
+    logger.info('Task#%s is already delivered, ack it without a request.', task.task_id)
+    duplicate_deliveries.inc()
+    return True
+
+
+def remember_delivery(task, action, body):
+    """
+    Записывает в журнал delivery_log уведомление, доставленное успешно (ack).
+    """
+    if delivery_log is not None and action == 'ack':
+        delivery_log.add(notification_id(task), body)
+
 
 def notification_worker(task, task_queue, *args, **kwargs):
     """
     Обработчик задачи отправки уведомления.
 
+    Ошибки соединения и таймауты, как и ответы 5xx, приводят к повторной
+    отправке (см. Committer.retry), остальные ошибки запроса - к bury.
+    Если у хоста уже слишком много запросов в работе или цепь хоста разомкнута,
+    уведомление не отправляется, а задача откладывается (defer), а если у хоста кончились
+    маркеры ограничения частоты - откладывается до свободного маркера (throttle). Задача, уведомление
+    которой уже доставлено (см. is_delivered), подтверждается без запроса.
+
     :param task: задача
     :type task: tarantool_queue.Task
-    :param task_queue: очередь для обработанных задач
+    :param task_queue: очередь для кортежей (задача, имя действия, время завершения)
     :type task_queue: gevent.queue.Queue
     :param args:
     :param kwargs:
     """
+    body = None
     try:
-        current_thread().name = "pusher.worker#{task_id}".format(task_id=task.task_id)
-
-        data = task.data.copy()
+        url = task.data['callback_url']
+        body = encode_payload(task)
+        if is_delivered(task, body):
+            task_queue.put((task, 'ack', time.time()))
+            return
+
+        response, rejected = post_callback(url, body, *args, **kwargs)
+        if rejected:
+            logger.info('Defer task#%s, host of %s is %s.', task.task_id, url, rejected)
+            action = 'throttle' if rejected == RATE_LIMITED else 'defer'
+        else:
+            logger.info('Callback url [%s] response status code=%s.', url, response.status_code)
+            action = response_action(response.status_code)
+            remember_delivery(task, action, body)
+    except (requests.ConnectionError, requests.Timeout) as exc:
+        logger.exception(exc)
+        action = 'retry'
+    except requests.RequestException as exc:
+        logger.exception(exc)
+        action = 'bury'
 
-        url = data.pop('callback_url')
-        data['id'] = task.task_id
+    keep_payload(task, action, body)
+    task_queue.put((task, action, time.time()))
 
-        logger.info('Send data to callback url [{url}].'.format(url=url))
 
-        response = requests.post(
-            url, data=json.dumps(data), *args, **kwargs
-        )
+def batch_worker(batch, task_queue, *args, **kwargs):
+    """
+    Обработчик пачки уведомлений на один адрес: отправляет данные задач
+    JSON-массивом одним запросом.
 
-        logger.info('Callback url [{url}] response status code={status_code}.'.format(
-            url=url, status_code=response.status_code
-        ))
+    Действие с задачами выбирается по коду ответа, как в notification_worker.
+    Если ответ 2xx содержит JSON-объект {id задачи: код ответа}, действие
+    с задачей, упомянутой в нем, выбирается по ее коду. Уже доставленные
+    задачи подтверждаются и в запрос не попадают.
 
-        task_queue.put((task, 'ack'))
+    :param batch: пачка задач
+    :type batch: lib.batching.Batch
+    :param task_queue: очередь для кортежей (задача, имя действия, время завершения)
+    :type task_queue: gevent.queue.Queue
+    """
+    tasks = batch.tasks
+    bodies = [None] * len(tasks)
+    try:
+        bodies = [encode_payload(task) for task in tasks]
+        pending = []
+        for task, body in zip(tasks, bodies):
+            if is_delivered(task, body):
+                task_queue.put((task, 'ack', time.time()))
+            else:
+                pending.append((task, body))
+        if not pending:
+            return
+        tasks, bodies = [task for task, _ in pending], [body for _, body in pending]
+        body = '[{}]'.format(','.join(bodies))
+
+        response, rejected = post_callback(batch.url, body, *args, **kwargs)
+        if rejected:
+            logger.info('Defer batch of %s tasks, host of %s is %s.', len(tasks), batch.url, rejected)
+            actions = ['throttle' if rejected == RATE_LIMITED else 'defer'] * len(tasks)
+        else:
+            logger.info(
+                'Callback url [%s] response status code=%s for batch of %s tasks.',
+                batch.url, response.status_code, len(tasks)
+            )
+            sent_batches.inc()
+            batch_size.observe(len(tasks))
+            actions = batch_actions(tasks, response)
+            for task, action, body in zip(tasks, actions, bodies):
+                remember_delivery(task, action, body)
+    except (requests.ConnectionError, requests.Timeout) as exc:
+        logger.exception(exc)
+        actions = ['retry'] * len(tasks)
     except requests.RequestException as exc:
         logger.exception(exc)
-        task_queue.put((task, 'bury'))
+        actions = ['bury'] * len(tasks)
+
+    finished_at = time.time()
+    for task, action, body in zip(tasks, actions, bodies):
+        keep_payload(task, action, body)
+        task_queue.put((task, action, finished_at))
 
 
-def done_with_processed_tasks(task_queue):
+def batch_actions(tasks, response):
     """
-    Удаляет завешенные задачи.
+    Выбирает действия с задачами пачки по ответу на нее.
 
-    :param task_queue: очередь, хранящая кортежи (объект задачи, имя действия)
+    :type tasks: list
+    :type response: requests.Response
+
+    :rtype: list
     """
-    logger.debug('Send info about finished tasks to queue.')
+    action = response_action(response.status_code)
+    if action != 'ack':
+        return [action] * len(tasks)
 
-    for _ in xrange(task_queue.qsize()):
-        try:
-            task, action_name = task_queue.get_nowait()
+    try:
+        statuses = json_codec.loads(response.content or 'null')
+    except ValueError:
+        statuses = None
+    if not isinstance(statuses, dict):
+        return [action] * len(tasks)
 
-            logger.debug('{name} task#{task_id}.'.format(
-                name=action_name.capitalize(),
-                task_id=task.task_id
-            ))
+    actions = []
+    for task in tasks:
+        status_code = statuses.get(str(notification_id(task)))
+        actions.append(response_action(status_code) if isinstance(status_code, int) else action)
+    return actions
 
-            try:
-                getattr(task, action_name)()
-            except tarantool.DatabaseError as exc:
-                logger.exception(exc)
-        except gevent_queue.Empty:
-            break
+
+def post_callback(url, data, *args, **kwargs):
+    """
+    Отправляет data POST-запросом на url через пул сессий, если ограничения
+    хоста позволяют. Результат запроса учитывается размыкателем цепи хоста.
+
+    :param url: адрес уведомления
+    :type url: basestring
+    :param data: тело запроса
+    :type data: str
+
+    Длительность и исход запроса учитываются также адаптивным числом обработчиков.
+    Таймаут ответа берется из read_timeouts по хосту, а длительность запроса,
+    завершившегося ответом или таймаутом, учитывается в нем же. Общий таймаут
+    запроса (timeout) остается верхней границей.
+
+    :return: (ответ, None) или (None, причина отказа), если запрос не отправлен
+    :rtype: tuple
+    """
+    guard = host_guard
+    host = guard.host(url)
+    rejected = guard.acquire(host)
+    if rejected:
+        return None, rejected
+
+    logger.info('Send data to callback url [%s].', url)
+
+    timeouts = read_timeouts
+    if timeouts is not None:
+        kwargs['read_timeout'] = timeouts.read_timeout(host)
+        if kwargs['read_timeout'] is not None:
+            read_timeout_values.observe(kwargs['read_timeout'])
+
+    started_at = time.time()
+    failed = True
+    try:
+        response = session_pool.post(url, data=data, *args, **kwargs)
+        failed = response_action(response.status_code) == 'retry'
+    except requests.Timeout as exc:
+        capture.record_http('POST', url, time.time() - started_at, error=str(exc))
+        if timeouts is not None:
+            timeouts.observe(host, time.time() - started_at)
+        raise
+    except requests.RequestException as exc:
+        capture.record_http('POST', url, time.time() - started_at, error=str(exc))
+        raise
+    finally:
+        duration = time.time() - started_at
+        guard.release(host, failed, duration)
+        if concurrency_limiter is not None:
+            concurrency_limiter.observe(duration, failed)
+    capture.record_http('POST', url, time.time() - started_at, status=response.status_code)
+    if timeouts is not None:
+        timeouts.observe(host, duration)
+    return response, None
 
 
 def stop_handler(signum):
@@ -104,53 +435,1165 @@ def stop_handler(signum):
 
     current_thread().name = 'pusher.signal'
 
-    logger.info('Got signal #{signum}.'.format(signum=signum))
+    logger.info('Got signal #%s.', signum)
 
     run_application = False
     exit_code = SIGNAL_EXIT_CODE_OFFSET + signum
 
 
+def reload_handler(signum):
+    """
+    Обработчик сигнала перезагрузки конфигурации.
+
+    :param signum: номер сигнала
+    :type signum: int
+    """
+    global reload_requested
+
+    current_thread().name = 'pusher.signal'
+
+    logger.info('Got signal #%s, reload config.', signum)
+
+    reload_requested = True
+
+
+def reload_config(config, workers):
+    """
+    Перечитывает файл конфигурации и применяет изменившиеся настройки.
+
+    Таймауты и паузы читаются из config при каждом использовании, поэтому
+    достаточно обновить config. Число обработчиков, логирование и запись трафика
+    перенастраиваются на месте, без остановки обработчиков.
+
+    Пул HTTP-сессий, резолвер и кодек JSON создаются по новым настройкам до того,
+    как они попадут в config: если хотя бы один не создается (опечатка в HTTP_ENGINE,
+    недоступный JSON_CODEC или DNS_RESOLVER), config и текущие объекты остаются прежними.
+
+    :param config: конфигурация
+    :type config: Config
+    :param workers: обработчики уведомлений
+    :type workers: Workers
+    """
+    global reload_requested
+
+    reload_requested = False
+
+    try:
+        new_config = load_config_from_pyfile(config.filepath)
+    except Exception as exc:
+        logger.error('Can not reload config, keep the current one.')
+        logger.exception(exc)
+        return
+
+    staged = copy.copy(config)
+    changes, skipped = update_config(staged, new_config, RESTART_REQUIRED)
+    pool_changed = any(name in changes for name in (
+        'HTTP_ENGINE', 'HTTP_MAX_CONNECTIONS_PER_HOST', 'HTTP_IDLE_TIMEOUT', 'HTTP_CONNECT_TIMEOUT'))
+    resolver_changed = any(name.startswith('DNS_') for name in changes)
+
+    pool = resolver = codec = None
+    try:
+        if pool_changed:
+            pool = make_session_pool(staged)
+        if resolver_changed:
+            resolver = make_caching_resolver(staged)
+        if 'JSON_CODEC' in changes:
+            codec = get_codec(staged.JSON_CODEC)
+    except Exception as exc:
+        logger.error('Can not apply reloaded config, keep the current one.')
+        logger.exception(exc)
+        for built in (pool, resolver):
+            if built is not None:
+                built.close()
+        return
+
+    for name, (_, new) in changes.iteritems():
+        setattr(config, name, new)
+
+    if 'LOGGING' in changes:
+        dictConfig(config.LOGGING)
+
+    log_config_changes(logger, changes, skipped)
+
+    if any(name in changes for name in ('WORKER_POOL_SIZE', 'ADAPTIVE_CONCURRENCY')) or any(
+            name.startswith('CONCURRENCY_') for name in changes):
+        replace_concurrency_limiter(config)
+        workers.resize(config.WORKER_POOL_SIZE if concurrency_limiter is None else concurrency_limiter.limit)
+
+    if pool_changed:
+        replace_session_pool(config, pool)
+
+    if 'ADAPTIVE_READ_TIMEOUT' in changes or any(name.startswith('HTTP_READ_TIMEOUT') for name in changes):
+        replace_read_timeouts(config)
+
+    if resolver_changed:
+        replace_resolver(config, resolver)
+
+    if any(name.startswith(('HOST_', 'BREAKER_')) for name in changes):
+        replace_host_guard(config)
+
+    if 'BATCH_CALLBACKS' in changes:
+        replace_batcher(config)
+
+    if 'ORDERED_CALLBACKS' in changes or any(name.startswith('ORDERING_') for name in changes):
+        replace_sequencer(config)
+
+    if 'JSON_CODEC' in changes:
+        replace_json_codec(config, codec)
+
+    if any(name.startswith('DEDUP_') for name in changes):
+        replace_delivery_log(config)
+
+    if any(name.startswith('CAPTURE_') for name in changes):
+        capture.close()
+        capture.install(capture.open_capture(config, 'pusher'))
+
+
+def make_session_pool(config):
+    """
+    Создает пул HTTP-сессий по настройкам HTTP_*: requests (lib.http_pool) или
+    pycurl (lib.curl_pool) по config.HTTP_ENGINE. Установка соединения
+    ограничена config.HTTP_CONNECT_TIMEOUT секундами.
+
+    :param config: конфигурация
+    :type config: Config
+
+    :raises ValueError: если движок неизвестен
+    """
+    engine = getattr(config, 'HTTP_ENGINE', 'requests')
+    max_connections = getattr(config, 'HTTP_MAX_CONNECTIONS_PER_HOST', 10)
+    idle_timeout = getattr(config, 'HTTP_IDLE_TIMEOUT', 30)
+    connect_timeout = getattr(config, 'HTTP_CONNECT_TIMEOUT', None)
+
+    if engine not in HTTP_ENGINES:
+        raise ValueError('Unknown HTTP engine: {}'.format(engine))
+
+    logger.info(
+        'Create HTTP session pool (%s): %s connections per host, idle timeout=%s, connect timeout=%s.',
+        engine, max_connections, idle_timeout, connect_timeout
+    )
+
+    return HTTP_ENGINES[engine](
+        max_connections=max_connections, idle_timeout=idle_timeout, connect_timeout=connect_timeout
+    )
+
+
+def replace_session_pool(config, pool=None):
+    """
+    Ставит пул HTTP-сессий pool или, если он не задан, новый пул по настройкам
+    config (см. make_session_pool). Свободные сессии прежнего пула закрываются,
+    занятые — после завершения запроса.
+
+    :param config: конфигурация
+    :type config: Config
+    """
+    global session_pool
+
+    pool = make_session_pool(config) if pool is None else pool
+    if session_pool is not None:
+        session_pool.close()
+    session_pool = pool
+
+
+def replace_read_timeouts(config):
+    """
+    Задает таймауты ответа хостов: config.HTTP_READ_TIMEOUT для всех хостов или,
+    если задано config.ADAPTIVE_READ_TIMEOUT, по перцентилю длительности запросов
+    каждого хоста с настройками HTTP_READ_TIMEOUT_*. Рассчитанные таймауты не переносятся.
+
+    :param config: конфигурация
+    :type config: Config
+    """
+    global read_timeouts
+
+    default = getattr(config, 'HTTP_READ_TIMEOUT', None)
+
+    if not getattr(config, 'ADAPTIVE_READ_TIMEOUT', False):
+        read_timeouts = None if default is None else FixedTimeouts(default)
+        logger.info('Read timeout of callback responses=%s.', default)
+        return
+
+    read_timeouts = AdaptiveTimeouts(
+        default=default,
+        percentile=getattr(config, 'HTTP_READ_TIMEOUT_PERCENTILE', 0.99),
+        factor=getattr(config, 'HTTP_READ_TIMEOUT_FACTOR', 3.0),
+        floor=getattr(config, 'HTTP_READ_TIMEOUT_MIN', 0.5),
+        ceiling=getattr(config, 'HTTP_READ_TIMEOUT_MAX', 30.0)
+    )
+
+    logger.info(
+        'Adapt read timeouts per host: p%s x %s between %ss and %ss.',
+        read_timeouts.percentile * 100, read_timeouts.factor, read_timeouts.floor, read_timeouts.ceiling
+    )
+
+
+def make_caching_resolver(config):
+    """
+    Создает кэш DNS (lib.dns_cache) поверх резолвера config.DNS_RESOLVER с настройками DNS_*.
+
+    :param config: конфигурация
+    :type config: Config
+
+    :rtype: CachingResolver
+    """
+    name = getattr(config, 'DNS_RESOLVER', 'thread')
+    ttl = getattr(config, 'DNS_CACHE_TTL', 60)
+
+    resolver = CachingResolver(
+        make_resolver(name, gevent.get_hub()),
+        ttl=ttl,
+        negative_ttl=getattr(config, 'DNS_NEGATIVE_TTL', 5),
+        prefetch=getattr(config, 'DNS_PREFETCH', 10),
+        max_size=getattr(config, 'DNS_CACHE_SIZE', 10000)
+    )
+
+    logger.info('Resolve callback hosts with %s resolver, cache ttl=%s.', name, ttl)
+    return resolver
+
+
+def replace_resolver(config, resolver=None):
+    """
+    Ставит резолвером хаба gevent resolver или, если он не задан, новый кэш DNS
+    по настройкам config (см. make_caching_resolver). Прежний резолвер и его кэш закрываются.
+
+    :param config: конфигурация
+    :type config: Config
+    """
+    resolver = make_caching_resolver(config) if resolver is None else resolver
+
+    hub = gevent.get_hub()
+    previous, hub.resolver = hub.resolver, resolver
+    previous.close()
+
+
+def replace_host_guard(config):
+    """
+    Создает ограничения запросов по хостам по настройкам HOST_MAX_CONCURRENCY,
+    HOST_RATE_LIMITS и BREAKER_*. Состояние размыкателей и маркерных корзин
+    прежних ограничений не переносится.
+
+    Маркерные корзины у каждого процесса свои, поэтому при PROCESSES > 1 частота
+    и запас запросов к хосту делятся между процессами (запас - не меньше одного запроса).
+
+    :param config: конфигурация
+    :type config: Config
+    """
+    global host_guard
+
+    max_concurrency = getattr(config, 'HOST_MAX_CONCURRENCY', None)
+    rate_limits = getattr(config, 'HOST_RATE_LIMITS', None) or {}
+    processes = getattr(config, 'PROCESSES', 1)
+    if processes > 1:
+        rate_limits = dict(
+            (pattern, rule and (rule[0] / float(processes), max(1.0, rule[1] / float(processes))))
+            for pattern, rule in rate_limits.iteritems()
+        )
+
+    logger.info('Limit requests per host to %s.', max_concurrency)
+    for pattern, rule in sorted(rate_limits.iteritems()):
+        logger.info('Limit request rate of %s to %s (requests per second, burst) per process.', pattern, rule)
+
+    host_guard = HostGuard(
+        max_concurrency=max_concurrency,
+        rate_limits=rate_limits,
+        window=getattr(config, 'BREAKER_WINDOW', 20),
+        min_calls=getattr(config, 'BREAKER_MIN_CALLS', 10),
+        error_rate=getattr(config, 'BREAKER_ERROR_RATE', 0.5),
+        slow_call=getattr(config, 'BREAKER_SLOW_CALL', 5.0),
+        slow_rate=getattr(config, 'BREAKER_SLOW_RATE', 0.5),
+        reset_timeout=getattr(config, 'BREAKER_RESET_TIMEOUT', 30.0)
+    )
+
+
+def replace_batcher(config):
+    """
+    Задает адреса, уведомления на которые собираются в пачки, по настройке
+    BATCH_CALLBACKS. Уже собираемые пачки отправляются по прежним правилам.
+
+    :param config: конфигурация
+    :type config: Config
+    """
+    global batcher
+
+    rules = getattr(config, 'BATCH_CALLBACKS', None) or {}
+
+    if rules:
+        logger.info('Send notifications in batches to %s.', ', '.join(sorted(rules)))
+
+    new_batcher = Batcher(rules)
+    new_batcher.pending = batcher.pending
+    batcher = new_batcher
+
+
+def replace_sequencer(config):
+    """
+    Задает хосты и адреса, уведомления на которые доставляются по порядку, по настройке
+    ORDERED_CALLBACKS и ограничения ждущих задач ORDERING_*. Очереди ключей сохраняются.
+
+    :param config: конфигурация
+    :type config: Config
+    """
+    global sequencer
+
+    callbacks = getattr(config, 'ORDERED_CALLBACKS', None) or ()
+
+    if callbacks:
+        logger.info('Deliver notifications to %s in order.', ', '.join(sorted(callbacks)))
+
+    new_sequencer = Sequencer(
+        callbacks,
+        max_pending=getattr(config, 'ORDERING_MAX_PENDING', 100),
+        max_tasks=getattr(config, 'ORDERING_MAX_TASKS', 10000)
+    )
+    new_sequencer.keys = sequencer.keys
+    new_sequencer.held = sequencer.held
+    sequencer = new_sequencer
+
+
+def replace_concurrency_limiter(config):
+    """
+    Включает адаптивное число обработчиков, если задано config.ADAPTIVE_CONCURRENCY:
+    начиная с config.WORKER_POOL_SIZE, в пределах CONCURRENCY_MIN..CONCURRENCY_MAX.
+
+    :param config: конфигурация
+    :type config: Config
+    """
+    global concurrency_limiter
+
+    if not getattr(config, 'ADAPTIVE_CONCURRENCY', False):
+        concurrency_limiter = None
+        concurrency_limit.set(config.WORKER_POOL_SIZE)
+        return
+
+    concurrency_limiter = AimdLimiter(
+        config.WORKER_POOL_SIZE,
+        min_limit=getattr(config, 'CONCURRENCY_MIN', 1),
+        max_limit=getattr(config, 'CONCURRENCY_MAX', 100),
+        increase=getattr(config, 'CONCURRENCY_INCREASE', 1),
+        decrease=getattr(config, 'CONCURRENCY_DECREASE', 0.5),
+        latency=getattr(config, 'CONCURRENCY_LATENCY', 1.0),
+        error_rate=getattr(config, 'CONCURRENCY_ERROR_RATE', 0.1)
+    )
+    concurrency_limit.set(concurrency_limiter.limit)
+
+    logger.info(
+        'Adapt worker pool size between %s and %s, start with %s.',
+        concurrency_limiter.min_limit, concurrency_limiter.max_limit, concurrency_limiter.limit
+    )
+
+
+def adjust_concurrency(workers):
+    """
+    Меняет число обработчиков по решению адаптивного ограничителя
+    и пишет в лог причину изменения.
+
+    :param workers: обработчики уведомлений
+    :type workers: Workers
+    """
+    saturated = workers.take_peak_busy() >= workers.size
+    change = concurrency_limiter.update(saturated)
+    if change is None:
+        return
+
+    limit, reason = change
+    if limit > workers.size:
+        logger.info('Increase worker pool size %s -> %s: %s.', workers.size, limit, reason)
+        concurrency_increases.inc()
+    else:
+        logger.warning('Decrease worker pool size %s -> %s: %s.', workers.size, limit, reason)
+        concurrency_decreases.inc()
+
+    concurrency_limit.set(limit)
+    workers.resize(limit)
+
+
+def replace_json_codec(config, codec=None):
+    """
+    Ставит кодек JSON codec или, если он не задан, кодек по настройке JSON_CODEC: json, ujson или auto.
+
+    :param config: конфигурация
+    :type config: Config
+    """
+    global json_codec
+
+    json_codec = get_codec(getattr(config, 'JSON_CODEC', 'auto')) if codec is None else codec
+
+    logger.info('Encode notifications with %s.', json_codec.name)
+
+
+def replace_delivery_log(config):
+    """
+    Создает журнал доставленных уведомлений на config.DEDUP_CACHE_SIZE задач,
+    хранимый в файле config.DEDUP_FILE, если он задан. В имени файла можно указать
+    {process}, чтобы у каждого процесса пушера был свой файл. Ключи прежнего
+    журнала переносятся в новый, прежний журнал закрывается.
+
+    :param config: конфигурация
+    :type config: Config
+    """
+    global delivery_log
+
+    size = getattr(config, 'DEDUP_CACHE_SIZE', 0)
+    path = getattr(config, 'DEDUP_FILE', None)
+    if path:
+        path = path.format(process=process_number)
+
+    previous, delivery_log = delivery_log, None
+    if size:
+        logger.info('Skip tasks already delivered, remember %s deliveries in %s.', size, path or 'memory')
+        delivery_log = DeliveryLog(size, path)
+        for key in previous.keys if previous is not None else ():
+            delivery_log.remember(key)
+
+    if previous is not None:
+        previous.close()
+
+
+class Workers(object):
+    """
+    Постоянный набор обработчиков уведомлений. Обработчики берут задачи
+    и пачки задач из intake_queue и кладут результат в processed_task_queue.
+    Если intake_queue - LaneQueue, она узнает о начале и конце обработки каждой задачи.
+
+    Задачи с ключом упорядочивания (см. lib.ordering) проходят через sequencer: задача ждет,
+    пока не завершатся взятые раньше задачи ее ключа, и выполняется тем же обработчиком сразу
+    после предыдущей. Неудавшаяся упорядоченная задача не возвращается в очередь, а повторяется
+    здесь же по таймеру, задерживая свой ключ (см. sequence).
+
+    :param config: конфигурация
+    :type config: Config
+    :param intake_queue: очередь взятых из tarantool.queue задач
+    :type intake_queue: gevent.queue.Queue or lib.lanes.LaneQueue
+    :param processed_task_queue: очередь для обработанных задач
+    :type processed_task_queue: gevent.queue.Queue
+    """
+    def __init__(self, config, intake_queue, processed_task_queue):
+        self.config = config
+        self.intake_queue = intake_queue
+        self.processed_task_queue = processed_task_queue
+        self.group = Group()
+        self.running = 0
+        self.retiring = 0
+        self.spawned = 0
+        self.busy = 0
+        self.peak_busy = 0
+        self.current = {}
+        self.delayed = Group()
+        self.delayed_keys = {}
+        self.leftover = []
+
+    @property
+    def size(self):
+        """
+        Число обработчиков, которые останутся после завершения лишних.
+        """
+        return self.running - self.retiring
+
+    def take_peak_busy(self):
+        """
+        Наибольшее число одновременно занятых обработчиков с прошлого вызова.
+
+        :rtype: int
+        """
+        peak, self.peak_busy = self.peak_busy, self.busy
+        return peak
+
+    def resize(self, size):
+        """
+        Запускает недостающих обработчиков или просит лишних завершиться
+        после текущей задачи. Вместимость intake_queue равна числу обработчиков.
+
+        :type size: int
+        """
+        delta = size - self.size
+        if delta > 0:
+            cancelled = min(delta, self.retiring)
+            self.retiring -= cancelled
+            for _ in xrange(delta - cancelled):
+                self.running += 1
+                self.group.spawn(self.run, self.spawned)
+                self.spawned += 1
+        else:
+            self.retiring -= delta
+        self.intake_queue.maxsize = size
+
+    def run(self, number):
+        """
+        Цикл обработчика: ждет задачу не дольше config.SLEEP секунд, чтобы
+        вовремя заметить остановку приложения или уменьшение числа обработчиков.
+        """
+        try:
+            while run_application:
+                if self.retiring:
+                    self.retiring -= 1
+                    return
+                try:
+                    task = self.intake_queue.get(timeout=self.config.SLEEP)
+                except gevent_queue.Empty:
+                    continue
+
+                key = None
+                if not isinstance(task, Batch):
+                    try:
+                        if task.task_id in self.delayed_keys:
+                            key = self.delayed_keys.pop(task.task_id)
+                        else:
+                            key = sequencer.key(task)
+                    except Exception as exc:
+                        logger.error('Bury task#%s, its data can not be routed: %r', task.task_id, exc)
+                        self.processed_task_queue.put((task, 'bury', time.time()))
+                        continue
+                if key is None:
+                    self.process(number, task, self.processed_task_queue)
+                    continue
+
+                task = self.admit(key, task)
+                while task is not None:
+                    if not run_application:
+                        # следующую задачу ключа вернет в очередь drain
+                        self.leftover.append(task)
+                        break
+                    results = gevent_queue.Queue()
+                    self.process(number, task, results)
+                    task = self.sequence(key, task, results)
+        finally:
+            self.running -= 1
+
+    def process(self, number, task, task_queue):
+        """
+        Отправляет уведомление задачи или пачки, результат кладет в task_queue.
+        """
+        if isinstance(task, Batch):
+            logger.info('Start worker#%s for batch of %s tasks.', number, len(task.tasks))
+            worker = batch_worker
+        else:
+            logger.info('Start worker#%s for task id=%s.', number, task.task_id)
+            worker = notification_worker
+
+        lanes = self.intake_queue if isinstance(self.intake_queue, LaneQueue) else None
+        if lanes is not None:
+            lanes.start(task)
+        self.current[number] = task
+        self.busy += 1
+        self.peak_busy = max(self.peak_busy, self.busy)
+        try:
+            worker(
+                task,
+                task_queue,
+                timeout=self.config.HTTP_CONNECTION_TIMEOUT,
+                verify=False
+            )
+        except Exception as exc:
+            logger.exception(exc)
+        finally:
+            self.busy -= 1
+            self.current.pop(number, None)
+            if lanes is not None:
+                lanes.finish(task)
+
+    def admit(self, key, task):
+        """
+        Ставит упорядоченную задачу в очередь ее ключа. Задача, для которой нет места
+        (см. config.ORDERING_MAX_PENDING и config.ORDERING_MAX_TASKS), откладывается.
+
+        :return: задача, если ее можно выполнять сразу, иначе None
+        """
+        state = sequencer.add(key, task)
+        if state == FULL:
+            logger.info('Defer task#%s, too many tasks of ordering key %r wait.', task.task_id, key)
+            self.processed_task_queue.put((task, 'defer', time.time()))
+            ordering_overflows.inc()
+        ordering_waiting.set(len(sequencer))
+        return task if state == RUN else None
+
+    def sequence(self, key, task, results):
+        """
+        Применяет результат упорядоченной задачи. Подтверждение и закапывание отдаются
+        Committer'у, и ключ переходит к следующей задаче. Повтор и откладывание выполняются
+        по таймеру, а следующие задачи ключа ждут: задача, вернувшаяся в очередь, могла бы
+        прийти после них. Паузы повторов такие же, как у Committer.retry; после max_attempts
+        неудачных попыток задача закапывается (см. give_up).
+
+        :param results: очередь с результатом обработки задачи
+        :type results: gevent.queue.Queue
+
+        :return: следующая задача ключа или None
+        """
+        try:
+            task, action, finished_at = results.get_nowait()
+        except gevent_queue.Empty:
+            # обработчик упал, не выбрав действие
+            action, finished_at = 'retry', time.time()
+
+        if action == 'retry':
+            attempt = sequencer.attempts(key) + 1
+            max_attempts = task.data.get('max_attempts', self.config.RETRY_MAX_ATTEMPTS)
+            if attempt >= max_attempts:
+                return self.give_up(key, task, attempt, max_attempts)
+            sequencer.delay(key)
+            delay = min(self.config.RETRY_DELAY * 2 ** (attempt - 1), self.config.RETRY_MAX_DELAY)
+            logger.info(
+                'Retry ordered task#%s, attempt %s of %s in %s second(s).',
+                task.task_id, attempt + 1, max_attempts, delay
+            )
+            retried_tasks.inc()
+        elif action in ('defer', 'throttle'):
+            sequencer.delay(key, failed=False)
+            host = host_guard.host(task.data['callback_url'])
+            if action == 'defer':
+                delay = max(self.config.HOST_DEFER_DELAY, host_guard.retry_after(host))
+                deferred_tasks.inc()
+            else:
+                delay = host_guard.throttle_delay(host)
+                throttled_tasks.inc()
+        else:
+            self.processed_task_queue.put((task, action, finished_at))
+            task = sequencer.done(key)
+            ordering_waiting.set(len(sequencer))
+            return task
+
+        self.delayed_keys[task.task_id] = key
+        self.delayed.add(gevent.spawn_later(delay, self.intake_queue.put, task))
+        return None
+
+    def give_up(self, key, task, attempt, max_attempts):
+        """
+        Закапывает упорядоченную задачу после max_attempts неудачных попыток. По
+        config.ORDERING_FAILURE 'skip' ключ переходит к следующей задаче, 'bury' - закапываются
+        и ждущие задачи ключа, чтобы вернуть их в очередь вместе после устранения причины
+        (см. replay_buried.py).
+
+        :return: следующая задача ключа или None
+        """
+        finished_at = time.time()
+        self.processed_task_queue.put((task, 'bury', finished_at))
+
+        if getattr(self.config, 'ORDERING_FAILURE', 'skip') != 'bury':
+            logger.warning(
+                'Ordered task#%s failed %s of %s attempts, bury it and go on with key %r.',
+                task.task_id, attempt, max_attempts, key
+            )
+            task = sequencer.done(key)
+            ordering_waiting.set(len(sequencer))
+            return task
+
+        waiting = sequencer.discard(key)
+        logger.warning(
+            'Ordered task#%s failed %s of %s attempts, bury it and %s task(s) of key %r behind it.',
+            task.task_id, attempt, max_attempts, len(waiting), key
+        )
+        for other in waiting:
+            self.processed_task_queue.put((other, 'bury', finished_at))
+        ordering_waiting.set(len(sequencer))
+        return None
+
+    def drain(self, timeout):
+        """
+        Просит всех обработчиков завершиться после текущей задачи и ждет их
+        не дольше timeout секунд, затем останавливает оставшихся.
+
+        :param timeout: секунды
+        :type timeout: float
+
+        :return: задачи и пачки, которые обработчики не успели обработать или не брали из
+            intake_queue, и упорядоченные задачи, ждущие повтора
+        :rtype: list
+        """
+        self.retiring = self.running
+        self.group.join(timeout)
+
+        unfinished = self.current.values()
+        self.group.kill()
+        unfinished.extend(self.leftover)
+        self.leftover = []
+
+        # таймер, уже ждущий места в intake_queue, еще не положил задачу
+        unfinished.extend(timer.args[0] for timer in self.delayed)
+        self.delayed.kill()
+        self.delayed_keys.clear()
+
+        while not self.intake_queue.empty():
+            unfinished.append(self.intake_queue.get_nowait())
+        return unfinished
+
+    def kill(self):
+        self.group.kill()
+        self.delayed.kill()
+
+
+class Committer(object):
+    """
+    Подтверждает обработанные задачи (ack, bury, retry или defer) пачками. Пачка отправляется,
+    когда в ней набралось config.COMMIT_BATCH_SIZE задач или с первой задачи
+    прошло config.COMMIT_INTERVAL секунд. Вся пачка отправляется за один захват
+    соединения с очередью, по pipeline задач одновременно.
+
+    Задачи, на которых очередь ответила ошибкой (QUEUE_ERRORS), отправляются повторно до
+    config.COMMIT_RETRIES раз с паузой config.COMMIT_RETRY_DELAY секунд,
+    удваивающейся с каждой попыткой. Время от завершения задачи до подтверждения
+    записывается в метрику pusher.commit_lag.
+
+    :param config: конфигурация
+    :type config: Config
+    :param tube_lock: блокировка соединения с очередью, общего с take
+    :type tube_lock: gevent.lock.Semaphore
+    :param processed_task_queue: очередь обработанных задач
+    :type processed_task_queue: gevent.queue.Queue
+    :param pipeline: сколько задач подтверждать одновременно
+    :type pipeline: int
+    """
+    def __init__(self, config, tube_lock, processed_task_queue, pipeline=1):
+        self.config = config
+        self.tube_lock = tube_lock
+        self.pipeline = pipeline
+        self.processed_task_queue = processed_task_queue
+        self.stopped = False
+        self.requeued = OrderedDict()
+
+    def run(self):
+        """
+        Отправляет пачки, пока не вызван stop(), затем отправляет оставшиеся задачи.
+        """
+        while not self.stopped:
+            batch = self.collect(timeout=self.config.SLEEP)
+            if batch:
+                self.commit(batch)
+
+        batch = self.collect(timeout=None)
+        while batch:
+            self.commit(batch)
+            batch = self.collect(timeout=None)
+
+    def stop(self):
+        self.stopped = True
+
+    def collect(self, timeout):
+        """
+        Собирает пачку: ждет первую задачу не дольше timeout секунд (None - не ждет),
+        а следующие — пока пачка не заполнится или не выйдет config.COMMIT_INTERVAL.
+
+        :rtype: list
+        """
+        try:
+            if timeout is None:
+                batch = [self.processed_task_queue.get_nowait()]
+            else:
+                batch = [self.processed_task_queue.get(timeout=timeout)]
+        except gevent_queue.Empty:
+            return []
+
+        deadline = time.time() + self.config.COMMIT_INTERVAL
+        while len(batch) < self.config.COMMIT_BATCH_SIZE:
+            remaining = deadline - time.time()
+            try:
+                if remaining <= 0 or timeout is None:
+                    batch.append(self.processed_task_queue.get_nowait())
+                else:
+                    batch.append(self.processed_task_queue.get(timeout=remaining))
+            except gevent_queue.Empty:
+                break
+        return batch
+
+    def commit(self, batch):
+        """
+        Отправляет пачку, повторяя неудавшиеся задачи с паузой.
+
+        :param batch: кортежи (задача, имя действия, время завершения)
+        :type batch: list
+        """
+        logger.debug('Send info about %s finished tasks to queue.', len(batch))
+
+        delay = self.config.COMMIT_RETRY_DELAY
+        for attempt in xrange(self.config.COMMIT_RETRIES + 1):
+            if attempt:
+                logger.warning('Retry %s of %s failed tasks in %s second(s).', attempt, len(batch), delay)
+                sleep(delay)
+                delay *= 2
+
+            with self.tube_lock:
+                if self.pipeline > 1:
+                    committed = Pool(self.pipeline).map(lambda item: self.commit_task(*item), batch)
+                else:
+                    committed = [self.commit_task(*item) for item in batch]
+            batch = [item for item, done in zip(batch, committed) if not done]
+            if not batch:
+                break
+        else:
+            logger.error('Give up on %s tasks, they stay taken until the connection is closed.', len(batch))
+
+        commit_backlog.set(self.processed_task_queue.qsize())
+
+    def commit_task(self, task, action_name, finished_at):
+        """
+        :return: удалось ли подтвердить задачу
+        :rtype: bool
+        """
+        logger.debug('%s task#%s.', action_name.capitalize(), task.task_id)
+
+        try:
+            if action_name == 'retry':
+                self.retry(task)
+            elif action_name == 'defer':
+                self.defer(task)
+            elif action_name == 'throttle':
+                self.throttle(task)
+            else:
+                getattr(task, action_name)()
+                self.forget(task)
+        except QUEUE_ERRORS as exc:
+            logger.exception(exc)
+            commit_errors.inc()
+            return False
+
+        committed_tasks.inc()
+        commit_lag.observe(time.time() - finished_at)
+        return True
+
+    def forget(self, task):
+        """
+        Забывает закодированное тело завершенной задачи.
+        """
+        encoded_bodies.pop(task.task_id, None)
+
+    def retry(self, task):
+        """
+        Ставит задачу в очередь снова (см. requeue) с задержкой config.RETRY_DELAY секунд,
+        удваивающейся с каждой попыткой, но не больше config.RETRY_MAX_DELAY.
+
+        Число неудачных попыток хранится в данных задачи (ATTEMPTS_FIELD), поэтому его
+        видят все процессы и оно переживает перезапуски, а откладывания (defer, throttle)
+        его не меняют. После max_attempts попыток (из данных задачи, по умолчанию
+        config.RETRY_MAX_ATTEMPTS) задача закапывается.
+
+        :type task: tarantool_queue.Task
+        """
+        attempt = task.data.get(ATTEMPTS_FIELD, 0) + 1
+        max_attempts = task.data.get('max_attempts', self.config.RETRY_MAX_ATTEMPTS)
+
+        if attempt >= max_attempts:
+            logger.warning('Task#%s failed %s of %s attempts, bury it.', task.task_id, attempt, max_attempts)
+            task.bury()
+            self.forget(task)
+            return
+
+        delay = min(self.config.RETRY_DELAY * 2 ** (attempt - 1), self.config.RETRY_MAX_DELAY)
+
+        logger.info('Retry task#%s, attempt %s of %s in %s second(s).', task.task_id, attempt + 1, max_attempts, delay)
+
+        self.requeue(task, attempt, delay)
+        retried_tasks.inc()
+
+    def requeue(self, task, attempts, delay):
+        """
+        Кладет в трубу задачи копию с числом попыток attempts в данных через delay
+        секунд и подтверждает исходную. Копия получает оставшийся TTL, TTR и приоритет
+        исходной, а закодированное тело переходит к ней. Копия ставится один раз, даже
+        если подтверждение исходной повторяется после ошибки (см. commit_task).
+
+        Задача, TTL которой истечет раньше задержки, просто возвращается в очередь (release).
+
+        :type task: tarantool_queue.Task
+        :type attempts: int
+        :param delay: задержка в секундах
+        :type delay: float
+        """
+        if task.task_id not in self.requeued:
+            meta = task.meta()
+            ttl = 0
+            if meta and meta['ttl']:
+                ttl = (meta['created'] + meta['ttl'] - meta['now']) / 1e6 - delay
+            if not meta or ttl < 0:
+                task.release(delay=delay)
+                return
+
+            data = dict(task.data)
+            data[ATTEMPTS_FIELD] = attempts
+            data.setdefault(ORIGIN_FIELD, task.task_id)
+            retried = task.queue.tube(task.tube).put(
+                data, delay=delay, ttl=ttl, ttr=meta['ttr'] / 1e6, pri=meta['pri']
+            )
+            self.requeued[task.task_id] = retried.task_id
+            if len(self.requeued) > MAX_TRACKED_REQUEUES:
+                self.requeued.popitem(last=False)
+
+            body = encoded_bodies.pop(task.task_id, None)
+            if body is not None:
+                encoded_bodies[retried.task_id] = body
+
+        task.ack()
+        self.requeued.pop(task.task_id, None)
+
+    def defer(self, task):
+        """
+        Возвращает в очередь задачу, хост которой перегружен или недоступен:
+        на config.HOST_DEFER_DELAY секунд или, если цепь хоста разомкнута,
+        до пробного запроса. Откладывание не считается попыткой (см. retry).
+
+        :type task: tarantool_queue.Task
+        """
+        host = host_guard.host(task.data['callback_url'])
+        delay = max(self.config.HOST_DEFER_DELAY, host_guard.retry_after(host))
+
+        task.release(delay=delay)
+        deferred_tasks.inc()
+
+    def throttle(self, task):
+        """
+        Возвращает в очередь задачу, хосту которой не хватило маркера ограничения
+        частоты, до маркера, зарезервированного для нее (см. HostGuard.throttle_delay).
+        Как и откладывание, не считается попыткой.
+
+        :type task: tarantool_queue.Task
+        """
+        host = host_guard.host(task.data['callback_url'])
+
+        task.release(delay=host_guard.throttle_delay(host))
+        throttled_tasks.inc()
+
+
+def take_tasks(config, tube, tube_lock, intake_queue):
+    """
+    Берет задачи из tarantool.queue и кладет их в intake_queue, пока приложение работает.
+    Когда intake_queue заполнена, ждет, пока обработчики не разберут задачи.
+    Задачи для адресов из config.BATCH_CALLBACKS собираются в пачки, в intake_queue
+    попадают заполненные пачки, остальные отправляет flush_batches. Упорядоченные
+    задачи (см. lib.ordering) в пачки не собираются.
+
+    После ошибки соединения с очередью (QUEUE_ERRORS) ждет config.SLEEP_ON_FAIL секунд
+    и берет задачи снова: соединение переподключается при следующем запросе. Задача,
+    данные которой не удалось разобрать, передается обработчикам как есть, и они ее закапывают.
+
+    :param config: конфигурация
+    :type config: Config
+    :param tube: труба tarantool.queue
+    :type tube: tarantool_queue.Tube
+    :param tube_lock: блокировка соединения с очередью, общего с подтверждениями задач
+    :type tube_lock: gevent.lock.Semaphore
+    :param intake_queue: очередь взятых задач
+    :type intake_queue: gevent.queue.Queue
+
+    :return: задача или пачка, взятая, но не положенная в intake_queue к остановке greenlet'а
+    """
+    held = None
+    try:
+        while run_application:
+            try:
+                with tube_lock:
+                    task = tube.take(config.QUEUE_TAKE_TIMEOUT)
+                    held = task
+                    # meta() записи идет по тому же соединению, что и take
+                    if task:
+                        capture.record_task(task)
+            except QUEUE_ERRORS as exc:
+                logger.error('Can not take a task, retry in %s second(s).', config.SLEEP_ON_FAIL)
+                logger.exception(exc)
+                sleep(config.SLEEP_ON_FAIL)
+                continue
+
+            # пропускаем вперед подтверждения, ожидающие соединение
+            sleep(0)
+
+            if task:
+                try:
+                    url = task.data.get('callback_url')
+                    if batcher.rule(url) is not None and sequencer.key(task) is None:
+                        held = batcher.add(url, task)
+                except Exception as exc:
+                    # задачу с неожиданными данными закапывает обработчик (см. Workers.run)
+                    logger.warning('Can not route task#%s: %r', task.task_id, exc)
+                if held is not None:
+                    intake_queue.put(held)
+            held = None
+    except GreenletExit:
+        pass
+    return held
+
+
+def flush_batches(config, intake_queue):
+    """
+    Кладет в intake_queue пачки, время сбора которых вышло, пока приложение работает.
+    Несобранные к остановке пачки возвращаются в очередь задач при остановке (см. drain).
+
+    :param config: конфигурация
+    :type config: Config
+    :param intake_queue: очередь взятых задач
+    :type intake_queue: gevent.queue.Queue
+
+    :return: пачки, не положенные в intake_queue к остановке greenlet'а
+    :rtype: list
+    """
+    batches = []
+    try:
+        while run_application:
+            batches = batcher.due()
+            while batches:
+                intake_queue.put(batches[0])
+                del batches[0]
+            sleep(batcher.wait(config.SLEEP))
+    except GreenletExit:
+        pass
+    return batches
+
+
+def drain(config, tube_lock, takers, flusher, workers, processed_task_queue):
+    """
+    Останавливает обработку задач: перестает брать новые задачи, ждет отправки
+    начатых уведомлений не дольше config.SHUTDOWN_TIMEOUT секунд и отдает
+    Committer'у на возврат в очередь (release) задачи, которые не успели
+    обработать, в том числе из несобранных пачек и очередей ключей упорядочивания.
+
+    :param config: конфигурация
+    :type config: Config
+    :param tube_lock: блокировка соединения с очередью
+    :type tube_lock: gevent.lock.Semaphore
+    :param takers: greenlet'ы take_tasks по трубам
+    :type takers: list
+    :param flusher: greenlet flush_batches
+    :param workers: обработчики уведомлений
+    :type workers: Workers
+    :param processed_task_queue: очередь обработанных задач
+    :type processed_task_queue: gevent.queue.Queue
+    """
+    # пока соединение у нас, ни один taker не может быть внутри take, и взятая задача не потеряется;
+    # в соединении без блокировки (PooledQueue) задача, взятая прерванным take, вернется
+    # в очередь, когда tarantool закроет сессию пушера
+    with tube_lock:
+        for taker in takers:
+            taker.kill()
+    flusher.kill()
+
+    timeout = getattr(config, 'SHUTDOWN_TIMEOUT', 10)
+    logger.info('Wait up to %s second(s) for %s deliveries in flight.', timeout, workers.busy)
+    unfinished = workers.drain(timeout)
+    unfinished.extend(taker.value for taker in takers if taker.value is not None)
+    unfinished.extend(flusher.value or [])
+    unfinished.extend(batcher.drain())
+    unfinished.extend(sequencer.drain())
+
+    tasks = []
+    for item in unfinished:
+        tasks.extend(item.tasks if isinstance(item, Batch) else [item])
+    if tasks:
+        logger.warning('Release %s unfinished tasks.', len(tasks))
+
+    finished_at = time.time()
+    for task in tasks:
+        processed_task_queue.put((task, 'release', finished_at))
+    released_tasks.inc(len(tasks))
+
+
 def configure(config):
-    logger.info('Connect to queue server on {host}:{port} space #{space}.'.format(
-        host=config.QUEUE_HOST, port=config.QUEUE_PORT, space=config.QUEUE_SPACE
-    ))
-    queue = tarantool_queue.Queue(
-        host=config.QUEUE_HOST, port=config.QUEUE_PORT, space=config.QUEUE_SPACE
+    logger.info(
+        'Connect to queue server on %s:%s space #%s.', config.QUEUE_HOST, config.QUEUE_PORT, config.QUEUE_SPACE
+    )
+    queue = create_queue(
+        host=config.QUEUE_HOST, port=config.QUEUE_PORT, space=config.QUEUE_SPACE,
+        backend=getattr(config, 'QUEUE_BACKEND', 'tarantool'),
+        connections=getattr(config, 'QUEUE_CONNECTIONS', None)
     )
 
-    logger.info('Use tube [{tube}], take timeout={take_timeout}.'.format(
-        tube=config.QUEUE_TUBE,
-        take_timeout=config.QUEUE_TAKE_TIMEOUT
-    ))
+    lanes = getattr(config, 'QUEUE_LANES', None) or {}
+    names = sorted(lanes, key=lambda name: (-lanes[name][0], name)) or [config.QUEUE_TUBE]
 
-    tube = queue.tube(config.QUEUE_TUBE)
+    for name in names:
+        if lanes:
+            logger.info(
+                'Use tube [%s] with weight=%s, reserved workers=%s, take timeout=%s.',
+                name, lanes[name][0], lanes[name][1], config.QUEUE_TAKE_TIMEOUT
+            )
+        else:
+            logger.info('Use tube [%s], take timeout=%s.', name, config.QUEUE_TAKE_TIMEOUT)
 
-    logger.info('Create worker pool[{size}].'.format(size=config.WORKER_POOL_SIZE))
-    worker_pool = Pool(config.WORKER_POOL_SIZE)
+    tubes = [queue.tube(name) for name in names]
 
     processed_task_queue = gevent_queue.Queue()
 
-    logger.info('Run main loop. Worker pool size={count}. Sleep time is {sleep}.'.format(
-        count=config.WORKER_POOL_SIZE, sleep=config.SLEEP
-    ))
+    if lanes:
+        intake_queue = LaneQueue([Lane(name, *lanes[name]) for name in names], config.WORKER_POOL_SIZE)
+    else:
+        intake_queue = gevent_queue.Queue(config.WORKER_POOL_SIZE)
 
-    return tube, worker_pool, processed_task_queue
+    logger.info('Create worker pool[%s].', config.WORKER_POOL_SIZE)
+    workers = Workers(config, intake_queue, processed_task_queue)
 
+    replace_resolver(config)
+    replace_session_pool(config)
+    replace_read_timeouts(config)
+    replace_host_guard(config)
+    replace_batcher(config)
+    replace_sequencer(config)
+    replace_json_codec(config)
+    replace_delivery_log(config)
+    replace_concurrency_limiter(config)
 
-def add_worker(config, task, number, worker_pool, processed_task_queue):
-    logger.info('Start worker#{number} for task id={task_id}.'.format(
-        task_id=task.task_id, number=number
-    ))
+    logger.info('Run main loop. Worker pool size=%s.', config.WORKER_POOL_SIZE)
 
-    worker = Greenlet(
-        notification_worker,
-        task,
-        processed_task_queue,
-        timeout=config.HTTP_CONNECTION_TIMEOUT,
-        verify=False
-    )
-    worker_pool.add(worker)
-    worker.start()
+    return tubes, workers, processed_task_queue
+
+
+def report_lanes(tubes, lanes, elapsed):
+    """
+    Обновляет метрики отставания полос (см. Lane.report) по числу готовых задач их труб.
+
+    :param tubes: трубы полос
+    :type tubes: list
+    :type lanes: lib.lanes.LaneQueue
+    :param elapsed: секунды с прошлого отчета
+    :type elapsed: float
+    """
+    for tube in tubes:
+        try:
+            ready = int(tube.statistics()['tasks']['ready'])
+        except tarantool.DatabaseError as exc:
+            logger.warning('Can not get statistics of tube [%s]: %s', tube.opt['tube'], exc)
+            continue
+        lanes.lanes[tube.opt['tube']].report(ready, elapsed)
+
+
+def touch_held_tasks(tube_lock, pipeline=1):
+    """
+    Продлевает ttr упорядоченных задач, которые ждут в памяти (см. Sequencer.held_tasks).
+    Иначе очередь вернула бы их по истечении ttr, и пушер взял бы их снова: дважды и не по порядку.
+
+    :param tube_lock: блокировка соединения с очередью
+    :type tube_lock: gevent.lock.Semaphore
+    :param pipeline: сколько задач продлевать одновременно
+    :type pipeline: int
+    """
+    tasks = sequencer.held_tasks()
+    if not tasks:
+        return
+
+    def touch(task):
+        try:
+            task.touch()
+        except QUEUE_ERRORS as exc:
+            logger.warning('Can not touch ordered task#%s: %s', task.task_id, exc)
+
+    logger.debug('Touch %s ordered tasks waiting in memory.', len(tasks))
+    with tube_lock:
+        if pipeline > 1:
+            Pool(pipeline).map(touch, tasks)
+        else:
+            for task in tasks:
+                touch(task)
+    ordering_touches.inc(len(tasks))
+
+
+def respawn(greenlet, name, function, *args):
+    """
+    Перезапускает greenlet, завершившийся ошибкой: без takers и Committer'а пушер
+    перестал бы брать или подтверждать задачи, продолжая работать.
+
+    :param greenlet: greenlet, запущенный gevent.spawn(function, *args)
+    :param name: имя greenlet'а для лога
+
+    :return: тот же greenlet, если он работает, иначе новый
+    """
+    if not greenlet.ready():
+        return greenlet
+    logger.error('%s exited with %r, restart it.', name, greenlet.exception)
+    return gevent.spawn(function, *args)
 
 
 def main_loop(config):
@@ -162,33 +1605,286 @@ def main_loop(config):
 
     Алгоритм:
      * Открываем соединение с tarantool.queue, использую config.QUEUE_* настройки.
-     * Создаем пул обработчиков.
      * Создаем очередь куда обработчики будут помещать выполненные задачи.
-     * Пока количество обработчиков <= config.WORKER_POOL_SIZE, берем задачу из tarantool.queue
-       и запускаем greenlet для ее обработки.
-     * Посылаем уведомления о том, что задачи завершены в tarantool.queue.
+     * Ставим кэш DNS с настройками config.DNS_*.
+     * Создаем пул HTTP-сессий, config.HTTP_MAX_CONNECTIONS_PER_HOST соединений на хост.
+     * Запускаем config.WORKER_POOL_SIZE обработчиков и по greenlet'у на трубу, который
+       непрерывно берет задачи из tarantool.queue и передает их обработчикам через очередь
+       вместимостью config.WORKER_POOL_SIZE. Для нескольких труб из config.QUEUE_LANES
+       это LaneQueue, которая делит обработчиков между трубами по весам и резервам.
+     * Запускаем greenlet, который отдает обработчикам пачки уведомлений на адреса
+       из config.BATCH_CALLBACKS, время сбора которых вышло.
+     * Запускаем greenlet, который посылает уведомления о том, что задачи завершены,
+       в tarantool.queue пачками по config.COMMIT_BATCH_SIZE задач или раз
+       в config.COMMIT_INTERVAL секунд.
+     * Перезапускаем greenlet'ы, завершившиеся ошибкой.
+     * Если пришел SIGHUP, перечитываем конфигурацию.
+     * Раз в config.METRICS_INTERVAL секунд пишем метрики в лог, в том числе отставание полос.
+     * Раз в config.ORDERING_TOUCH_INTERVAL секунд продлеваем ttr упорядоченных задач, ждущих в памяти.
+     * Если задано config.ADAPTIVE_CONCURRENCY, раз в config.CONCURRENCY_INTERVAL секунд
+       меняем число обработчиков по длительности и ошибкам запросов.
      * Спим config.SLEEP секунд.
+     * При остановке перестаем брать задачи, ждем начатые уведомления не дольше
+       config.SHUTDOWN_TIMEOUT секунд, возвращаем в очередь незавершенные задачи
+       и дожидаемся отправки уведомлений о завершенных задачах.
+    """
+    tubes, workers, processed_task_queue = configure(config)
+
+    # в соединении tarantool_queue и очередях в памяти take и ack/bury нельзя выполнять одновременно,
+    # а в соединениях PooledQueue запросы выполняются одновременно
+    pipelined = isinstance(tubes[0].queue, PooledQueue)
+    tube_lock = DummySemaphore() if pipelined else Semaphore()
+    if len(tubes) > 1 and not pipelined:
+        logger.warning(
+            'Takes from %s tubes wait for each other, set QUEUE_CONNECTIONS to take concurrently.', len(tubes)
+        )
+
+    workers.resize(config.WORKER_POOL_SIZE if concurrency_limiter is None else concurrency_limiter.limit)
+    takers = [gevent.spawn(take_tasks, config, tube, tube_lock, workers.intake_queue) for tube in tubes]
+    flusher = gevent.spawn(flush_batches, config, workers.intake_queue)
+    committer = Committer(config, tube_lock, processed_task_queue, COMMIT_PIPELINE if pipelined else 1)
+    committer_greenlet = gevent.spawn(committer.run)
+
+    reported_at = adjusted_at = touched_at = time.time()
+    try:
+        while run_application:
+            committer_greenlet = respawn(committer_greenlet, 'Committer', committer.run)
+            for number, tube in enumerate(tubes):
+                takers[number] = respawn(
+                    takers[number], 'Taker#{}'.format(number),
+                    take_tasks, config, tube, tube_lock, workers.intake_queue
+                )
+
+            if reload_requested:
+                reload_config(config, workers)
+
+            if concurrency_limiter is not None and time.time() - adjusted_at >= config.CONCURRENCY_INTERVAL:
+                adjust_concurrency(workers)
+                adjusted_at = time.time()
+
+            if time.time() - reported_at >= config.METRICS_INTERVAL:
+                if isinstance(workers.intake_queue, LaneQueue):
+                    with tube_lock:
+                        report_lanes(tubes, workers.intake_queue, time.time() - reported_at)
+                metrics.report(logger, prefix='pusher.')
+                reported_at = time.time()
+
+            if time.time() - touched_at >= getattr(config, 'ORDERING_TOUCH_INTERVAL', 20):
+                touch_held_tasks(tube_lock, COMMIT_PIPELINE if pipelined else 1)
+                touched_at = time.time()
+
+            sleep(config.SLEEP)
+        else:
+            logger.info('Stop application loop.')
+    finally:
+        drain(config, tube_lock, takers, flusher, workers, processed_task_queue)
+        committer.stop()
+        committer_greenlet.join()
+
+
+def run(config):
     """
-    tube, worker_pool, processed_task_queue = configure(config)
+    Работа процесса пушера: основной цикл, который после ошибки
+    перезапускается через config.SLEEP_ON_FAIL секунд.
+
+    :param config: конфигурация
+    :type config: Config
+
+    :return: код возврата
+    :rtype: int
+    """
+    capture.install(capture.open_capture(config, 'pusher'))
 
     while run_application:
-        free_workers_count = worker_pool.free_count()
+        try:
+            main_loop(config)
+        except Exception as exc:
+            logger.error('Error in main loop. Go to sleep on %s second(s).', config.SLEEP_ON_FAIL)
+            logger.exception(exc)
 
-        logger.debug('Pool has {count} free workers.'.format(count=free_workers_count))
+            sleep(config.SLEEP_ON_FAIL)
+    else:
+        logger.info('Stop application loop in main.')
 
-        for number in xrange(free_workers_count):
-            logger.debug('Get task from tube for worker#{number}.'.format(number=number))
+    capture.close()
 
-            task = tube.take(config.QUEUE_TAKE_TIMEOUT)
+    if session_pool is not None:
+        session_pool.close()
 
-            if task:
-                add_worker(config, task, number, worker_pool, processed_task_queue)
+    if delivery_log is not None:
+        delivery_log.close()
 
-        done_with_processed_tasks(processed_task_queue)
+    return exit_code
+
+
+def run_process(config, number, parent_pid):
+    """
+    Точка входа процесса пушера в режиме prefork.
 
+    :param config: конфигурация
+    :type config: Config
+    :param number: номер процесса
+    :type number: int
+    :param parent_pid: pid супервизора
+    :type parent_pid: int
+    """
+    global process_number
+
+    current_thread().name = 'pusher.process#{}'.format(number)
+    process_number = number
+
+    install_signal_handlers()
+
+    gevent.spawn(watch_parent, config, parent_pid)
+
+    code = run(config)
+
+    # multiprocessing завершает процесс через os._exit, не дописав буферы логов
+    logging.shutdown()
+
+    sys.exit(code)
+
+
+def watch_parent(config, parent_pid):
+    """
+    Останавливает процесс, если супервизор завершился, не остановив его.
+    """
+    global run_application
+
+    while run_application:
+        if os.getppid() != parent_pid:
+            logger.error('Supervisor process %s is gone, stop.', parent_pid)
+            run_application = False
+            return
         sleep(config.SLEEP)
-    else:
-        logger.info('Stop application loop.')
+
+
+class Supervisor(object):
+    """
+    Супервизор режима prefork: держит config.PROCESSES процессов пушера, у каждого
+    свои обработчики, пул соединений и подключение к очереди.
+
+    Завершившийся процесс запускается заново, но не раньше чем через
+    config.SLEEP_ON_FAIL секунд после его предыдущего запуска. SIGHUP
+    пересылается процессам, лишние после уменьшения config.PROCESSES
+    процессы останавливаются. При остановке супервизор пересылает процессам
+    сигнал, которым остановлен сам (см. stop_handler), ждет их завершения
+    и возвращает общий код возврата.
+
+    :param config: конфигурация
+    :type config: Config
+    """
+    def __init__(self, config):
+        self.config = config
+        self.pid = os.getpid()
+        self.processes = {}
+        self.started_at = {}
+
+    def run(self):
+        """
+        :return: код возврата (см. stop())
+        :rtype: int
+        """
+        logger.info('Run supervisor of %s processes.', self.config.PROCESSES)
+
+        while run_application:
+            if reload_requested:
+                self.reload()
+
+            self.reap()
+            self.spawn()
+
+            sleep(self.config.SLEEP)
+        else:
+            logger.info('Stop supervisor loop.')
+
+        return self.stop()
+
+    def spawn(self):
+        now = time.time()
+        for number in xrange(self.config.PROCESSES):
+            if number in self.processes or now - self.started_at.get(number, 0) < self.config.SLEEP_ON_FAIL:
+                continue
+
+            process = multiprocessing.Process(
+                target=run_process, args=(self.config, number, self.pid), name='pusher.process#{}'.format(number)
+            )
+            process.daemon = True
+            process.start()
+
+            logger.info('Start process#%s, pid %s.', number, process.pid)
+
+            self.processes[number] = process
+            self.started_at[number] = now
+
+    def reap(self):
+        """
+        Забывает завершившиеся процессы. Процесс, который не должен был
+        завершаться, считается упавшим.
+        """
+        for number, process in self.processes.items():
+            if process.is_alive():
+                continue
+            del self.processes[number]
+            if number < self.config.PROCESSES:
+                logger.error('Process#%s, pid %s, exited with code %s.', number, process.pid, process.exitcode)
+            else:
+                logger.info('Process#%s, pid %s, retired with code %s.', number, process.pid, process.exitcode)
+
+    def reload(self):
+        """
+        Перечитывает файл конфигурации и пересылает SIGHUP процессам,
+        чтобы они перечитали его сами.
+        """
+        global reload_requested
+
+        reload_requested = False
+
+        try:
+            new_config = load_config_from_pyfile(self.config.filepath)
+        except Exception as exc:
+            logger.error('Can not reload config, keep the current one.')
+            logger.exception(exc)
+            return
+
+        changes, skipped = update_config(self.config, new_config, RESTART_REQUIRED)
+
+        if 'LOGGING' in changes:
+            dictConfig(self.config.LOGGING)
+
+        log_config_changes(logger, changes, skipped)
+
+        for number, process in self.processes.items():
+            if number < self.config.PROCESSES:
+                os.kill(process.pid, signal.SIGHUP)
+            else:
+                logger.info('Retire process#%s, pid %s.', number, process.pid)
+                os.kill(process.pid, signal.SIGTERM)
+
+    def stop(self):
+        """
+        Останавливает процессы тем же сигналом, что и супервизор, и ждет их завершения.
+
+        :return: код возврата супервизора (exit_code), если все процессы остановились
+            этим сигналом или завершились с кодом 0, иначе код первого процесса, завершившегося
+            иначе (для убитого сигналом - 128 + номер сигнала)
+        :rtype: int
+        """
+        signum = exit_code - SIGNAL_EXIT_CODE_OFFSET if exit_code else signal.SIGTERM
+        for process in self.processes.values():
+            if process.is_alive():
+                os.kill(process.pid, signum)
+
+        codes = []
+        for number, process in sorted(self.processes.items()):
+            process.join()
+            logger.info('Process#%s, pid %s, exited with code %s.', number, process.pid, process.exitcode)
+            code = process.exitcode
+            codes.append(SIGNAL_EXIT_CODE_OFFSET - code if code < 0 else code)
+        self.processes.clear()
+
+        failed = [status for status in codes if status not in (0, SIGNAL_EXIT_CODE_OFFSET + signum)]
+        return failed[0] if failed else exit_code
 
 
 def parse_cmd_args(args):
@@ -278,17 +1974,26 @@ def load_config_from_pyfile(filepath):
         if key.isupper():
             setattr(cfg, key, value)
 
+    cfg.filepath = filepath
+
     return cfg
 
 
 def install_signal_handlers():
     """
-    Устанавливает обработчики системных сигналов.
+    Устанавливает обработчики системных сигналов. Обработчики, установленные
+    раньше (в процессе режима prefork - унаследованные от супервизора), снимаются.
     """
     logger.info('Install signal handlers.')
 
-    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGQUIT):
-        gevent.signal(signum, stop_handler, signum)
+    for handler in signal_handlers:
+        handler.cancel()
+    del signal_handlers[:]
+
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGQUIT):
+        signal_handlers.append(gevent.signal(signum, stop_handler, signum))
+
+    signal_handlers.append(gevent.signal(signal.SIGHUP, reload_handler, signal.SIGHUP))
 
 
 def create_pidfile(pidfile_path):
@@ -301,6 +2006,7 @@ def main(argv):
     """
     Точка входа в приложение.
 
+    Если config.PROCESSES больше 1, запускает супервизор процессов пушера (см. Supervisor).
     В случае возникновения ошибки в приложении, оно засыпает на config.SLEEP_ON_FAIL секунд.
 
     :param argv: агрументы командной строки.
@@ -326,20 +2032,10 @@ def main(argv):
 
     install_signal_handlers()
 
-    while run_application:
-        try:
-            main_loop(config)
-        except Exception as exc:
-            logger.error(
-                'Error in main loop. Go to sleep on {} second(s).'.format(config.SLEEP_ON_FAIL)
-            )
-            logger.exception(exc)
-
-            sleep(config.SLEEP_ON_FAIL)
-    else:
-        logger.info('Stop application loop in main.')
+    if getattr(config, 'PROCESSES', 1) > 1:
+        return Supervisor(config).run()
 
-    return exit_code
+    return run(config)
 
 
 if __name__ == '__main__':
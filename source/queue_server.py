@@ -0,0 +1,67 @@
+#!/usr/bin/env python2.7
+# coding: utf-8
+import argparse
+import logging
+import sys
+
+from lib.memory_queue import QueueServer
+
+
+logger = logging.getLogger('queue_server')
+
+
+def parse_cmd_args(args):
+    """
+    Разбирает аргументы командной строки.
+
+    :param args: список аргументов
+    :type args: list
+
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        description='In-memory task queue server with the tarantool_queue API.'
+    )
+    parser.add_argument(
+        '-H',
+        '--host',
+        dest='host',
+        default='127.0.0.1',
+        help='Address to listen on.'
+    )
+    parser.add_argument(
+        '-p',
+        '--port',
+        dest='port',
+        type=int,
+        default=33013,
+        help='Port to listen on.'
+    )
+
+    return parser.parse_args(args=args)
+
+
+def main(argv):
+    """
+    Запускает сервер очереди в памяти. Демоны подключаются к нему
+    с настройкой QUEUE_BACKEND = 'memory_server'.
+    """
+    args = parse_cmd_args(argv[1:])
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    server = QueueServer((args.host, args.port))
+    logger.info('Serve in-memory queue on %s:%s.', args.host, args.port)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info('Stop queue server.')
+    finally:
+        server.server_close()
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
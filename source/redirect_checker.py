@@ -2,36 +2,84 @@
 # coding: utf-8
 import logging
 import os
+import signal
 import sys
 from logging.config import dictConfig
 from multiprocessing import active_children
 from time import sleep
 
-from lib.utils import (check_network_status, create_pidfile, daemonize,
-                       load_config_from_pyfile, parse_cmd_args, spawn_workers)
+from lib.utils import (check_network_status, create_pidfile, daemonize, load_config_from_pyfile,
+                       log_config_changes, parse_cmd_args, spawn_workers, update_config)
 from lib.worker import worker
 
 
 logger = logging.getLogger('redirect_checker')
 
+reload_requested = False
+"""Флаг, определяющий, нужно ли перечитать файл конфигурации (SIGHUP)."""
+
 
 def helper_test():
     return True
 
 
+def reload_handler(signum, frame):
+    global reload_requested
+    reload_requested = True
+
+
+def install_signal_handlers():
+    signal.signal(signal.SIGHUP, reload_handler)
+
+
+def reload_config(config):
+    """
+    Перечитывает файл конфигурации и применяет изменившиеся настройки.
+
+    Воркерам отправляется SIGHUP, и они перечитывают конфигурацию сами между задачами.
+    Если размер пула уменьшился, лишним воркерам отправляется SIGUSR1: они завершаются,
+    доделав текущую задачу. Недостающие воркеры запускает основной цикл.
+    """
+    global reload_requested
+
+    reload_requested = False
+
+    logger.info('Reload config.')
+
+    try:
+        new_config = load_config_from_pyfile(config.filepath)
+    except Exception as exc:
+        logger.error('Can not reload config, keep the current one.')
+        logger.exception(exc)
+        return
+
+    changes, skipped = update_config(config, new_config)
+
+    if 'LOGGING' in changes:
+        dictConfig(config.LOGGING)
+
+    log_config_changes(logger, changes, skipped)
+
+    children = active_children()
+    retired = children[config.WORKER_POOL_SIZE:]
+    if retired:
+        logger.info('Retire %s workers', len(retired))
+    for child in children:
+        os.kill(child.pid, signal.SIGUSR1 if child in retired else signal.SIGHUP)
+
+
 def main_loop(config):
-    logger.info(
-        u'Run main loop. Worker pool size={}. Sleep time is {}.'.format(
-            config.WORKER_POOL_SIZE, config.SLEEP
-        ))
+    logger.info(u'Run main loop. Worker pool size=%s. Sleep time is %s.', config.WORKER_POOL_SIZE, config.SLEEP)
     parent_pid = os.getpid()
     while helper_test():
+        if reload_requested:
+            reload_config(config)
+
         if check_network_status(config.CHECK_URL, config.HTTP_TIMEOUT):
             required_workers_count = config.WORKER_POOL_SIZE - len(
                 active_children())
             if required_workers_count > 0:
-                logger.info(
-                    'Spawning {} workers'.format(required_workers_count))
+                logger.info('Spawning %s workers', required_workers_count)
                 spawn_workers(
                     num=required_workers_count,
                     target=worker,
@@ -59,6 +107,7 @@ def main(argv):
         os.path.realpath(os.path.expanduser(args.config))
     )
     dictConfig(config.LOGGING)
+    install_signal_handlers()
     main_loop(config)
 
     return config.EXIT_CODE
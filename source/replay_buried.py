@@ -0,0 +1,384 @@
+#!/usr/bin/env python2.7
+# coding: utf-8
+"""
+Возврат закопанных задач пушера в очередь с ограниченной частотой.
+
+Сначала собираются id закопанных задач трубы, подходящих под фильтры (хост callback_url,
+возраст задачи), затем задачи откапываются (dig) не чаще rate в секунду, чтобы не создавать
+всплеск нагрузки на пушер и хосты уведомлений. Трубы обходятся по очереди: заданные --tube
+или трубы пушера - полосы config.QUEUE_LANES либо config.QUEUE_TUBE.
+
+Id откопанных задач дописываются в файл состояния: повторный запуск с тем же файлом
+продолжает прерванный и не откапывает задачи, которые пушер закопал снова. Откопанная
+задача сохраняет в данных счетчик попыток пушера, поэтому после новой неудачи он закапывает
+ее сразу, не повторяя всех попыток.
+"""
+import argparse
+from fnmatch import fnmatchcase
+import logging
+import os
+import sys
+import time
+
+import tarantool
+from tarantool_queue.tarantool_queue import Task as TarantoolTask, unpack_long_long
+
+from lib import memory_queue
+from lib.breaker import HostGuard
+from lib.rate_limit import TokenBucket
+from lib.utils import create_queue, load_config_from_pyfile
+
+logger = logging.getLogger('replay_buried')
+
+PAGE_SIZE = 1000
+"""Сколько закопанных задач читать из очереди за один запрос"""
+
+TARANTOOL_TUBE_INDEX = 1
+"""Индекс (tube, status, ipri, pri) space очереди в tarantool (см. provision/init.lua)"""
+
+TARANTOOL_BURIED = 'b'
+TARANTOOL_CREATED_FIELD = 7
+TARANTOOL_DATA_FIELD = 12
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def buried_tasks(queue, tube, offset, limit):
+    """
+    Страница закопанных задач трубы.
+
+    :return: список (задача, время создания в секундах)
+    :rtype: list
+    """
+    if isinstance(queue, memory_queue.Queue):
+        return [(task, created / 1e6) for task, created in queue.buried(tube, offset, limit)]
+
+    response = queue.tnt.select(
+        queue.space, [(tube, TARANTOOL_BURIED)], index=TARANTOOL_TUBE_INDEX, offset=offset, limit=limit
+    )
+    return [
+        (make_task(queue, row[0], row[1], row[TARANTOOL_DATA_FIELD]),
+         unpack_long_long(row[TARANTOOL_CREATED_FIELD]) / 1e6)
+        for row in response
+    ]
+
+
+def make_task(queue, task_id, tube, raw_data=None):
+    """
+    Закопанная задача очереди по id.
+    """
+    if isinstance(queue, memory_queue.Queue):
+        return memory_queue.Task(queue, task_id, tube, memory_queue.STATUS_BURIED, raw_data)
+    return TarantoolTask(queue, queue.space, task_id, tube, 'buried', raw_data)
+
+
+class TaskFilter(object):
+    """
+    Отбор закопанных задач: по хосту callback_url (шаблоны fnmatch) и по возрасту в секундах.
+    """
+    def __init__(self, hosts=None, min_age=None, max_age=None):
+        self.hosts = [host.lower() for host in hosts or ()]
+        self.min_age = min_age
+        self.max_age = max_age
+
+    def __call__(self, task, created, now):
+        age = now - created
+        if self.min_age is not None and age < self.min_age:
+            return False
+        if self.max_age is not None and age > self.max_age:
+            return False
+        if not self.hosts:
+            return True
+        data = task.data
+        host = HostGuard.host(data.get('callback_url', '')) if isinstance(data, dict) else ''
+        return any(fnmatchcase(host, pattern) for pattern in self.hosts)
+
+
+class Replay(object):
+    """
+    Откапывает закопанные задачи трубы с частотой rate задач в секунду (до burst подряд).
+
+    :param task_filter: какие задачи откапывать
+    :type task_filter: TaskFilter
+    :param state_path: файл с id откопанных задач, None - без возобновления
+    :param limit: сколько задач откопать, None - все
+    :param dry_run: только найти задачи, не откапывая их
+    :param progress_interval: как часто писать в лог ход работы, секунды
+    """
+    def __init__(self, queue, tube, task_filter, rate, burst=1, state_path=None, limit=None,
+                 dry_run=False, progress_interval=10):
+        self.queue = queue
+        self.tube = tube
+        self.task_filter = task_filter
+        self.bucket = TokenBucket(rate, burst)
+        self.state_path = state_path
+        self.limit = limit
+        self.dry_run = dry_run
+        self.progress_interval = progress_interval
+        self.replayed = set()
+        self.state_file = None
+        self.total = 0
+        self.done = 0
+        self.gone = 0
+        if state_path is not None:
+            self.load_state()
+
+    def load_state(self):
+        """
+        Читает id задач, откопанных прошлыми запусками.
+        """
+        if not os.path.exists(self.state_path):
+            return
+        with open(self.state_path) as state_file:
+            self.replayed.update(line.strip() for line in state_file if line.strip())
+        logger.info('Skip %s task(s) replayed before, see %s.', len(self.replayed), self.state_path)
+
+    def scan(self, now=None):
+        """
+        Собирает id закопанных задач, подходящих под фильтр и еще не откопанных.
+
+        :rtype: list
+        """
+        now = time.time() if now is None else now
+        task_ids = []
+        seen = set()
+        offset = 0
+        while self.limit is None or len(task_ids) < self.limit:
+            page = buried_tasks(self.queue, self.tube, offset, PAGE_SIZE)
+            offset += len(page)
+            for task, created in page:
+                # задача могла сдвинуться между страницами, если пушер закопал новые
+                if task.task_id in self.replayed or task.task_id in seen:
+                    continue
+                seen.add(task.task_id)
+                if self.task_filter(task, created, now):
+                    task_ids.append(task.task_id)
+            if len(page) < PAGE_SIZE:
+                break
+        task_ids = task_ids[:self.limit]
+        logger.info('Scanned %s buried task(s), %s to replay.', offset, len(task_ids))
+        return task_ids
+
+    def run(self):
+        """
+        Откапывает найденные задачи. Прерванную работу продолжает повторный запуск с тем же state_path.
+        """
+        task_ids = self.scan()
+        self.total = len(task_ids)
+        if self.dry_run or not task_ids:
+            return
+
+        if self.state_path is not None:
+            self.state_file = open(self.state_path, 'a')
+
+        started_at = reported_at = time.time()
+        for task_id in task_ids:
+            self.wait()
+            self.dig(task_id)
+
+            now = time.time()
+            if now - reported_at >= self.progress_interval:
+                self.report(now - started_at)
+                reported_at = now
+        self.report(time.time() - started_at)
+
+    def wait(self):
+        """
+        Ждет маркер частоты.
+        """
+        while not self.bucket.take():
+            time.sleep((1 - self.bucket.tokens) / self.bucket.rate)
+
+    def dig(self, task_id):
+        """
+        Откапывает задачу и запоминает ее в файле состояния. Задачу, которую уже
+        откопали, подтвердили или удалили, пропускает.
+        """
+        try:
+            dug = make_task(self.queue, task_id, self.tube).dig()
+        except (tarantool.DatabaseError, memory_queue.QueueError) as exc:
+            logger.debug('Task#%s is not buried anymore: %s', task_id, exc)
+            dug = False
+
+        if dug:
+            self.done += 1
+        else:
+            self.gone += 1
+
+        self.replayed.add(task_id)
+        if self.state_file is not None:
+            self.state_file.write(task_id + '\n')
+            self.state_file.flush()
+
+    def report(self, elapsed):
+        processed = self.done + self.gone
+        rate = processed / elapsed if elapsed > 0 else 0
+        left = (self.total - processed) / rate if rate else 0
+        logger.info(
+            'Replayed %s of %s task(s), %s not buried anymore, %.1f task(s)/s, %.0f second(s) left.',
+            self.done, self.total, self.gone, rate, left
+        )
+
+    def close(self):
+        if self.state_file is not None:
+            self.state_file.close()
+            self.state_file = None
+
+
+def pusher_tubes(config):
+    """
+    Трубы, из которых берет задачи пушер: полосы QUEUE_LANES в том же порядке, что и в пушере,
+    или QUEUE_TUBE.
+
+    :rtype: list
+    """
+    lanes = getattr(config, 'QUEUE_LANES', None) or {}
+    return sorted(lanes, key=lambda name: (-lanes[name][0], name)) or [config.QUEUE_TUBE]
+
+
+def duration(value):
+    """
+    Длительность в секундах из строки вида 90, 90s, 30m, 12h, 7d.
+
+    :rtype: float
+    """
+    unit = DURATION_UNITS.get(value[-1:].lower())
+    try:
+        return float(value[:-1] if unit else value) * (unit or 1)
+    except ValueError:
+        raise argparse.ArgumentTypeError('invalid duration: {!r}'.format(value))
+
+
+def parse_cmd_args(args):
+    """
+    Разбирает аргументы командной строки.
+
+    :param args: список аргументов
+    :type args: list
+
+    :rtype: argparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        description='Requeue buried push notification tasks at a limited rate.'
+    )
+    parser.add_argument(
+        '-c',
+        '--config',
+        dest='config',
+        required=True,
+        help='Path to the pusher configuration file.'
+    )
+    parser.add_argument(
+        '-t',
+        '--tube',
+        dest='tubes',
+        action='append',
+        help='Requeue tasks of this tube, may be repeated; default - QUEUE_LANES tubes or QUEUE_TUBE of the config.'
+    )
+    parser.add_argument(
+        '-r',
+        '--rate',
+        dest='rate',
+        type=float,
+        default=10,
+        help='Tasks requeued per second.'
+    )
+    parser.add_argument(
+        '--burst',
+        dest='burst',
+        type=int,
+        default=1,
+        help='Tasks requeued in a row before the rate applies.'
+    )
+    parser.add_argument(
+        '--host',
+        dest='hosts',
+        action='append',
+        help='Requeue only tasks of this callback host or fnmatch pattern, may be repeated.'
+    )
+    parser.add_argument(
+        '--min-age',
+        dest='min_age',
+        type=duration,
+        help='Requeue only tasks created at least this long ago, e.g. 30m.'
+    )
+    parser.add_argument(
+        '--max-age',
+        dest='max_age',
+        type=duration,
+        help='Requeue only tasks created at most this long ago, e.g. 2d.'
+    )
+    parser.add_argument(
+        '-n',
+        '--limit',
+        dest='limit',
+        type=int,
+        help='Requeue at most this many tasks.'
+    )
+    parser.add_argument(
+        '-s',
+        '--state',
+        dest='state',
+        help='File of requeued task ids; a run with the same file resumes the previous one.'
+    )
+    parser.add_argument(
+        '--progress',
+        dest='progress',
+        type=float,
+        default=10,
+        help='Seconds between progress reports.'
+    )
+    parser.add_argument(
+        '--dry-run',
+        dest='dry_run',
+        action='store_true',
+        help='Only count the tasks to requeue.'
+    )
+
+    return parser.parse_args(args=args)
+
+
+def main(argv):
+    """
+    Точка входа: откапывает закопанные задачи труб из --tube или труб пушера (см. pusher_tubes).
+    """
+    args = parse_cmd_args(argv[1:])
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    config = load_config_from_pyfile(os.path.realpath(os.path.expanduser(args.config)))
+    queue = create_queue(
+        config.QUEUE_HOST, config.QUEUE_PORT, config.QUEUE_SPACE,
+        backend=getattr(config, 'QUEUE_BACKEND', 'tarantool')
+    )
+
+    task_filter = TaskFilter(args.hosts, args.min_age, args.max_age)
+    processed = total = 0
+    for tube in args.tubes or pusher_tubes(config):
+        # limit - на все трубы вместе
+        limit = None if args.limit is None else args.limit - total
+        if limit == 0:
+            break
+
+        logger.info('Replay buried tasks of tube [%s].', tube)
+        replay = Replay(
+            queue, tube, task_filter, args.rate, burst=args.burst, state_path=args.state, limit=limit,
+            dry_run=args.dry_run, progress_interval=args.progress
+        )
+        try:
+            replay.run()
+        except KeyboardInterrupt:
+            logger.info(
+                'Interrupted after %s of %s task(s).', processed + replay.done + replay.gone, total + replay.total
+            )
+            return 1
+        finally:
+            replay.close()
+        processed += replay.done + replay.gone
+        total += replay.total
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -24,3 +24,4 @@ class LoadConfigFromPyfileCase(unittest.TestCase):
             self.assertEqual(config_test['HTTP_TIMEOUT'], config.HTTP_TIMEOUT)
             self.assertEqual(config_test['MAX_REDIRECTS'], config.MAX_REDIRECTS)
             self.assertFalse(hasattr(config, 'not_valid'))
+            self.assertEqual(filepath, config.filepath)
@@ -1,8 +1,10 @@
 import unittest
 import mock
 import os
+import signal
 
-from redirect_checker import (main, main_loop)
+import redirect_checker
+from redirect_checker import (main, main_loop, reload_config)
 
 
 flag = True
@@ -196,3 +198,24 @@ class RedirectCheckerTestCase(unittest.TestCase):
 
 
 
+
+    def test_reload_config(self):
+        config = mock.Mock()
+        config.filepath = '/test/'
+        config.WORKER_POOL_SIZE = 3
+        new_config = mock.Mock(spec=[])
+        new_config.WORKER_POOL_SIZE = 1
+        children = [mock.Mock(pid=number) for number in (11, 12, 13)]
+        kill_mock = mock.Mock()
+
+        with mock.patch('redirect_checker.load_config_from_pyfile', mock.Mock(return_value=new_config)):
+            with mock.patch('redirect_checker.active_children', mock.Mock(return_value=children)):
+                with mock.patch('redirect_checker.os.kill', kill_mock):
+                    with mock.patch('redirect_checker.reload_requested', True):
+                        reload_config(config)
+                        self.assertFalse(redirect_checker.reload_requested)
+
+        self.assertEqual(config.WORKER_POOL_SIZE, 1)
+        kill_mock.assert_has_calls([
+            mock.call(11, signal.SIGHUP), mock.call(12, signal.SIGUSR1), mock.call(13, signal.SIGUSR1)
+        ])
@@ -0,0 +1,63 @@
+import sys
+from codecs import getwriter
+import unittest
+import mock
+
+from lib.utils import Config, log_config_changes, update_config
+
+
+def make_config(**settings):
+    config = Config()
+    for name, value in settings.iteritems():
+        setattr(config, name, value)
+    return config
+
+
+class UpdateConfigCase(unittest.TestCase):
+    def test_update_changed(self):
+        config = make_config(SLEEP=10, HTTP_TIMEOUT=3)
+        new_config = make_config(SLEEP=5, HTTP_TIMEOUT=3, MAX_REDIRECTS=30)
+
+        changes, skipped = update_config(config, new_config)
+
+        self.assertEqual(changes, {'SLEEP': (10, 5), 'MAX_REDIRECTS': (None, 30)})
+        self.assertEqual(skipped, [])
+        self.assertEqual(config.SLEEP, 5)
+        self.assertEqual(config.MAX_REDIRECTS, 30)
+
+    def test_restart_required(self):
+        config = make_config(QUEUE_TUBE='old')
+
+        changes, skipped = update_config(config, make_config(QUEUE_TUBE='new'), ('QUEUE_TUBE',))
+
+        self.assertEqual(changes, {})
+        self.assertEqual(skipped, ['QUEUE_TUBE'])
+        self.assertEqual(config.QUEUE_TUBE, 'old')
+
+    def test_streams_are_compared_by_target(self):
+        def logging_settings():
+            return {'handlers': {'console': {'stream': getwriter('utf-8')(sys.stderr)}}}
+
+        config = make_config(LOGGING=logging_settings())
+
+        changes, skipped = update_config(config, make_config(LOGGING=logging_settings()))
+
+        self.assertEqual(changes, {})
+
+    def test_lowercase_attributes_are_ignored(self):
+        config = make_config(SLEEP=1)
+        config.filepath = '/old/'
+        new_config = make_config(SLEEP=1)
+        new_config.filepath = '/new/'
+
+        self.assertEqual(update_config(config, new_config), ({}, []))
+        self.assertEqual(config.filepath, '/old/')
+
+    def test_log_config_changes(self):
+        logger = mock.Mock()
+
+        log_config_changes(logger, {'SLEEP': (10, 5), 'LOGGING': ({}, {})}, ['QUEUE_TUBE'])
+
+        logger.info.assert_any_call('Config %s changed: %r -> %r.', 'SLEEP', 10, 5)
+        logger.info.assert_any_call('Config %s changed.', 'LOGGING')
+        logger.warning.assert_called_once_with('Config %s changed, restart is required to apply it.', 'QUEUE_TUBE')
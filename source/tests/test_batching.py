@@ -0,0 +1,57 @@
+import unittest
+
+from lib.batching import Batch, Batcher
+
+
+class BatcherCase(unittest.TestCase):
+    def setUp(self):
+        self.batcher = Batcher({
+            'Partner.example.com': (3, 1.0),
+            'http://partner.example.com/bulk': (2, 5.0),
+        })
+
+    def test_rule(self):
+        self.assertEqual(self.batcher.rule('http://partner.example.com/push'), (3, 1.0))
+        self.assertEqual(self.batcher.rule('http://partner.example.com/bulk'), (2, 5.0))
+        self.assertIsNone(self.batcher.rule('http://other.example.com/push'))
+        self.assertIsNone(self.batcher.rule(None))
+        self.assertIsNone(Batcher().rule('http://partner.example.com/push'))
+
+    def test_add_returns_full_batch(self):
+        url = 'http://partner.example.com/push'
+
+        self.assertIsNone(self.batcher.add(url, 1, now=0))
+        self.assertIsNone(self.batcher.add('http://partner.example.com/other', 2, now=0))
+        self.assertIsNone(self.batcher.add(url, 3, now=0))
+        self.assertEqual(self.batcher.add(url, 4, now=0), Batch(url, [1, 3, 4]))
+        self.assertEqual(len(self.batcher), 1)
+
+    def test_due(self):
+        self.batcher.add('http://partner.example.com/push', 1, now=0)
+        self.batcher.add('http://partner.example.com/bulk', 2, now=0)
+
+        self.assertEqual(self.batcher.due(now=0.5), [])
+        self.assertEqual(self.batcher.due(now=1), [Batch('http://partner.example.com/push', [1])])
+        self.assertEqual(len(self.batcher), 1)
+
+    def test_drain(self):
+        self.batcher.add('http://partner.example.com/push', 1, now=0)
+
+        self.assertEqual(self.batcher.drain(), [Batch('http://partner.example.com/push', [1])])
+        self.assertEqual(len(self.batcher), 0)
+
+    def test_rule_is_fixed_by_first_task(self):
+        url = 'http://partner.example.com/push'
+        self.batcher.add(url, 1, now=0)
+        self.batcher.rules = {}
+
+        self.assertIsNone(self.batcher.add(url, 2, now=0))
+        self.assertEqual(self.batcher.add(url, 3, now=0), Batch(url, [1, 2, 3]))
+
+    def test_wait(self):
+        self.assertEqual(self.batcher.wait(0.1, now=0), 0.1)
+
+        self.batcher.add('http://partner.example.com/push', 1, now=0)
+        self.assertEqual(self.batcher.wait(10, now=0.25), 0.75)
+        self.assertEqual(self.batcher.wait(0.1, now=0.25), 0.1)
+        self.assertEqual(self.batcher.wait(0.1, now=2), 0)
@@ -0,0 +1,33 @@
+import unittest
+
+from benchmarks import stats
+
+
+class BenchmarkStatsCase(unittest.TestCase):
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(stats.percentile(values, 50), 51)
+        self.assertEqual(stats.percentile(values, 99), 99)
+        self.assertEqual(stats.percentile([], 99), 0.0)
+
+    def test_summarize_latencies(self):
+        summary = stats.summarize_latencies([0.1, 0.2, 0.3])
+        self.assertEqual(summary['count'], 3)
+        self.assertEqual(summary['max'], 0.3)
+        self.assertEqual(summary['p50'], 0.2)
+
+    def test_make_result(self):
+        usage = {'elapsed': 2.0, 'cpu_user': 1, 'cpu_system': 0, 'rss_kb': 10, 'max_rss_kb': 10}
+        result = stats.make_result('test', 10, [0.1] * 10, usage, mode='library')
+        self.assertEqual(result['per_second'], 5.0)
+        self.assertEqual(result['mode'], 'library')
+
+    def test_compare_reports(self):
+        usage = {'elapsed': 1.0, 'cpu_user': 1, 'cpu_system': 0, 'rss_kb': 10, 'max_rss_kb': 10}
+        baseline = {'results': [stats.make_result('a', 10, [0.1], usage)]}
+        candidate = {'results': [stats.make_result('a', 20, [0.1], usage), stats.make_result('b', 1, [], usage)]}
+
+        rows = stats.compare_reports(baseline, candidate)
+
+        self.assertEqual(rows[0], ('a', 'per_second', 10.0, 20.0, 100.0))
+        self.assertEqual(len(rows), 6)
@@ -0,0 +1,135 @@
+import unittest
+
+from mock import patch
+
+from lib import metrics
+from lib.breaker import BUSY, CLOSED, HALF_OPEN, OPEN, RATE_LIMITED, CircuitBreaker, HostGuard
+
+
+class BreakerCase(unittest.TestCase):
+    def make_breaker(self):
+        return CircuitBreaker(window=4, min_calls=4, error_rate=0.5, slow_call=1.0, slow_rate=0.75, reset_timeout=10)
+
+    def test_breaker_stays_closed_below_min_calls(self):
+        breaker = self.make_breaker()
+
+        for _ in xrange(3):
+            breaker.record(True, 0.1, 0)
+
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow(0))
+
+    def test_breaker_opens_on_error_rate(self):
+        breaker = self.make_breaker()
+
+        for failed in (False, True, False, True):
+            breaker.record(failed, 0.1, 5)
+
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.opened_at, 5)
+        self.assertFalse(breaker.allow(14))
+
+    def test_breaker_opens_on_slow_calls(self):
+        breaker = self.make_breaker()
+
+        for elapsed in (0.1, 1.0, 2.0, 3.0):
+            breaker.record(False, elapsed, 0)
+
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_breaker_counts_only_window(self):
+        breaker = self.make_breaker()
+
+        for failed in (True, False, False, False, False, False, False, True):
+            breaker.record(failed, 0.1, 0)
+        self.assertEqual(breaker.state, CLOSED)
+
+        breaker.record(True, 0.1, 0)
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_breaker_half_open_probe_success_closes(self):
+        breaker = self.make_breaker()
+        breaker.open(0)
+
+        self.assertTrue(breaker.allow(10))
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertFalse(breaker.allow(10))
+
+        breaker.record(False, 0.1, 11)
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow(11))
+
+    def test_breaker_half_open_probe_failure_opens(self):
+        breaker = self.make_breaker()
+        breaker.open(0)
+        breaker.allow(10)
+
+        breaker.record(True, 0.1, 11)
+
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.opened_at, 11)
+        self.assertFalse(breaker.allow(20))
+
+    def test_guard_limits_concurrency(self):
+        guard = HostGuard(max_concurrency=2)
+
+        self.assertIsNone(guard.acquire('a.example.com'))
+        self.assertIsNone(guard.acquire('a.example.com'))
+        self.assertEqual(guard.acquire('a.example.com'), BUSY)
+        self.assertIsNone(guard.acquire('b.example.com'))
+
+        guard.release('a.example.com', False, 0.1)
+        self.assertIsNone(guard.acquire('a.example.com'))
+        self.assertEqual(guard.states()['a.example.com']['in_flight'], 2)
+
+    def test_guard_limits_rate(self):
+        guard = HostGuard(rate_limits={'a.example.com': (2, 2)})
+
+        self.assertIsNone(guard.acquire('a.example.com', now=0))
+        self.assertIsNone(guard.acquire('a.example.com', now=0))
+        self.assertEqual(guard.acquire('a.example.com', now=0), RATE_LIMITED)
+        self.assertIsNone(guard.acquire('b.example.com', now=0))
+        self.assertEqual(guard.throttle_delay('a.example.com', now=0), 0.5)
+        self.assertEqual(guard.throttle_delay('b.example.com', now=0), 0)
+
+        self.assertIsNone(guard.acquire('a.example.com', now=0.5))
+
+    def test_guard_keeps_tokens_of_open_circuit(self):
+        guard = HostGuard(rate_limits={'a.example.com': (1, 1)}, window=1, min_calls=1, reset_timeout=10)
+
+        with patch('lib.breaker.logger.warning'):
+            guard.acquire('a.example.com', now=0)
+            guard.release('a.example.com', True, 0.1, now=0)
+        self.assertEqual(guard.acquire('a.example.com', now=1), OPEN)
+
+        self.assertEqual(guard.rate_limits.bucket('a.example.com').tokens, 1)
+
+    def test_guard_rejects_open_circuit(self):
+        guard = HostGuard(window=2, min_calls=2, error_rate=0.5, reset_timeout=10)
+
+        with patch('lib.breaker.logger.warning') as warning_m:
+            for _ in xrange(2):
+                guard.acquire('a.example.com', now=0)
+                guard.release('a.example.com', True, 0.1, now=0)
+
+        self.assertTrue(warning_m.called)
+        self.assertEqual(guard.acquire('a.example.com', now=5), OPEN)
+        self.assertEqual(guard.states()['a.example.com']['state'], OPEN)
+        self.assertEqual(metrics.snapshot()['pusher.breaker.a.example.com'], OPEN)
+        self.assertEqual(guard.states()['a.example.com']['in_flight'], 0)
+
+        self.assertIsNone(guard.acquire('a.example.com', now=10))
+        self.assertEqual(guard.acquire('a.example.com', now=10), HALF_OPEN)
+        guard.release('a.example.com', False, 0.1, now=11)
+        self.assertEqual(metrics.snapshot()['pusher.breaker.a.example.com'], CLOSED)
+
+    def test_guard_retry_after(self):
+        guard = HostGuard(reset_timeout=10)
+
+        self.assertEqual(guard.retry_after('a.example.com', now=0), 0)
+        guard.breaker('a.example.com').open(100)
+        self.assertEqual(guard.retry_after('a.example.com', now=104), 6)
+        self.assertEqual(guard.retry_after('a.example.com', now=120), 0)
+
+    def test_host(self):
+        self.assertEqual(HostGuard.host('https://Partner.example.com:8443/callback?x=1'), 'partner.example.com:8443')
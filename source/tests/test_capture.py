@@ -0,0 +1,82 @@
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import Mock
+
+from lib import capture
+
+
+class CaptureCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'capture-{pid}.jsonl.gz')
+
+    def tearDown(self):
+        capture.close()
+        shutil.rmtree(self.directory)
+
+    def open(self, http=True):
+        config = Mock(None)
+        config.CAPTURE_FILE = self.path
+        config.CAPTURE_HTTP = http
+        config.CAPTURE_BODY_LIMIT = 4
+        recorder = capture.open_capture(config, 'checker')
+        capture.install(recorder)
+        return recorder
+
+    def test_open_capture_disabled(self):
+        config = Mock(None)
+        config.CAPTURE_FILE = None
+
+        self.assertIsNone(capture.open_capture(config, 'pusher'))
+
+    def test_record_without_capture(self):
+        capture.record_task(Mock(None))
+        capture.record_http('GET', 'http://example.com/', 0.1, status=200)
+
+        self.assertFalse(capture.http_enabled())
+
+    def test_roundtrip(self):
+        recorder = self.open()
+        task = Mock(None)
+        task.tube = 'url.queue'
+        task.data = {'url': 'http://example.com/', 'url_id': 1}
+        task.meta = Mock(return_value={'pri': 3})
+
+        capture.record_task(task)
+        capture.record_http('GET', 'http://example.com/', 0.1, status=200, body='\xff\x00abcdef')
+        capture.close()
+
+        records = capture.read_capture([recorder.path])
+
+        self.assertEqual(recorder.path, self.path.format(pid=os.getpid()))
+        self.assertEqual([record['kind'] for record in records], ['task', 'http'])
+        self.assertEqual(records[0]['data'], task.data)
+        self.assertEqual(records[0]['pri'], 3)
+        self.assertEqual(records[0]['source'], 'checker')
+        self.assertEqual(records[1]['body'].encode('latin-1'), '\xff\x00ab')
+
+    def test_http_is_not_recorded_by_default(self):
+        recorder = self.open(http=False)
+
+        capture.record_http('GET', 'http://example.com/', 0.1, status=200)
+        capture.close()
+
+        self.assertEqual(capture.read_capture([recorder.path]), [])
+
+    def test_read_appended_and_truncated_file(self):
+        path = os.path.join(self.directory, 'capture.jsonl.gz')
+        for number in xrange(2):
+            with gzip.open(path, 'ab') as f:
+                f.write('{"kind": "task", "ts": %d, "source": "pusher", "data": {}}\n' % number)
+        with open(path, 'rb') as f:
+            content = f.read()
+        with open(path, 'wb') as f:
+            f.write(content[:-4])
+
+        records = capture.read_capture([path])
+
+        self.assertEqual([record['ts'] for record in records], [0, 1])
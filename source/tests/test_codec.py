@@ -0,0 +1,31 @@
+import unittest
+
+from mock import patch
+
+from lib import codec
+
+
+class CodecCase(unittest.TestCase):
+    def test_json(self):
+        json_codec = codec.get_codec('json')
+
+        self.assertEqual(json_codec.name, 'json')
+        self.assertEqual(json_codec.loads(json_codec.dumps({'id': 1, 'text': u'\u043f'})), {'id': 1, 'text': u'\u043f'})
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            codec.get_codec('yaml')
+
+    @patch('lib.codec.ujson', None)
+    def test_auto_falls_back_to_json(self):
+        self.assertEqual(codec.get_codec().name, 'json')
+        with self.assertRaises(ImportError):
+            codec.get_codec('ujson')
+
+    @unittest.skipIf(codec.ujson is None, 'ujson is not installed')
+    def test_ujson(self):
+        ujson_codec = codec.get_codec('ujson')
+        data = {'id': 1, 'amount': 0.1 + 0.2, 'text': u'\u043f', 'big': 2 ** 70}
+
+        self.assertEqual(codec.get_codec().name, 'ujson')
+        self.assertEqual(ujson_codec.loads(ujson_codec.dumps(data)), data)
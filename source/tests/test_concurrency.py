@@ -0,0 +1,84 @@
+import unittest
+
+from lib import concurrency
+from lib.concurrency import AimdLimiter
+
+
+class AimdLimiterCase(unittest.TestCase):
+    def make_limiter(self, limit=10):
+        return AimdLimiter(
+            limit, min_limit=2, max_limit=12, increase=2, decrease=0.5, latency=1.0, error_rate=0.2, min_calls=5
+        )
+
+    def observe(self, limiter, count, duration=0.1, failures=0):
+        for number in xrange(count):
+            limiter.observe(duration, number < failures)
+
+    def test_limit_is_bounded(self):
+        self.assertEqual(self.make_limiter(100).limit, 12)
+        self.assertEqual(self.make_limiter(0).limit, 2)
+
+    def test_too_few_calls(self):
+        limiter = self.make_limiter()
+        self.observe(limiter, 4, failures=4)
+
+        self.assertIsNone(limiter.update(saturated=True))
+        self.assertEqual(limiter.limit, 10)
+        self.assertEqual(len(limiter.outcomes), 0)
+
+    def test_increase_when_saturated_and_healthy(self):
+        limiter = self.make_limiter()
+        self.observe(limiter, 10)
+
+        limit, reason = limiter.update(saturated=True)
+
+        self.assertEqual(limit, 12)
+        self.assertEqual(limiter.limit, 12)
+        self.assertIn('all workers busy', reason)
+        self.assertIs(limiter.reason, reason)
+
+    def test_no_increase_without_demand(self):
+        limiter = self.make_limiter()
+        self.observe(limiter, 10)
+
+        self.assertIsNone(limiter.update(saturated=False))
+        self.assertEqual(limiter.limit, 10)
+
+    def test_no_increase_above_max(self):
+        limiter = self.make_limiter(12)
+        self.observe(limiter, 10)
+
+        self.assertIsNone(limiter.update(saturated=True))
+
+    def test_decrease_on_errors(self):
+        limiter = self.make_limiter()
+        self.observe(limiter, 10, failures=2)
+
+        limit, reason = limiter.update(saturated=True)
+
+        self.assertEqual(limit, 5)
+        self.assertEqual(reason, 'degraded: p90 latency 0.100s, error rate 0.20 of 10 requests')
+
+    def test_decrease_on_latency(self):
+        limiter = self.make_limiter()
+        self.observe(limiter, 8)
+        self.observe(limiter, 2, duration=1.5)
+
+        limit, reason = limiter.update(saturated=False)
+
+        self.assertEqual(limit, 5)
+        self.assertIn('p90 latency 1.500s', reason)
+
+    def test_decrease_stops_at_min(self):
+        limiter = self.make_limiter(3)
+        self.observe(limiter, 10, failures=10)
+
+        self.assertEqual(limiter.update(saturated=True)[0], 2)
+        self.observe(limiter, 10, failures=10)
+        self.assertIsNone(limiter.update(saturated=True))
+
+    def test_window(self):
+        limiter = self.make_limiter()
+        self.observe(limiter, concurrency.WINDOW_SIZE + 10)
+
+        self.assertEqual(len(limiter.outcomes), concurrency.WINDOW_SIZE)
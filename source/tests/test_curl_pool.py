@@ -0,0 +1,180 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+import socket
+import threading
+import time
+import unittest
+
+import gevent
+from mock import patch
+import requests
+
+from lib.curl_pool import CurlPool, request_error
+from lib.http_pool import SessionPool
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass
+
+
+class CallbackHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+    requests = []
+    body = 'ok'
+    delay = 0
+
+    def do_POST(self):
+        self.connections.add(self.client_address)
+        self.requests.append((self.path, dict(self.headers), self.rfile.read(int(self.headers['Content-Length']))))
+        if self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/callback')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.respond()
+
+    def do_GET(self):
+        self.requests.append((self.path, dict(self.headers), None))
+        self.respond()
+
+    def respond(self):
+        time.sleep(self.delay)
+        self.send_response(201)
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@patch.dict('os.environ', {'no_proxy': '127.0.0.1'})
+class CurlPoolCase(unittest.TestCase):
+    def setUp(self):
+        CallbackHandler.connections = set()
+        CallbackHandler.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), CallbackHandler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:{}/callback'.format(self.server.server_address[1])
+        self.pool = CurlPool(max_connections=2, drain_limit=10)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_post(self):
+        response = self.pool.post(self.url, data='{"id": 1}', timeout=5)
+
+        self.assertEqual((response.status_code, response.content), (201, 'ok'))
+        path, headers, body = CallbackHandler.requests[0]
+        self.assertEqual((path, body), ('/callback', '{"id": 1}'))
+        self.assertNotIn('content-type', headers)
+        self.assertNotIn('expect', headers)
+
+    def test_keep_alive(self):
+        responses = [self.pool.post(u'{}/{}'.format(self.url, number), data='{}', timeout=5) for number in xrange(3)]
+
+        self.assertEqual([response.status_code for response in responses], [201] * 3)
+        self.assertEqual(len(CallbackHandler.connections), 1)
+        self.assertEqual(len(self.pool.free), 1)
+
+    def test_concurrent_posts_share_max_connections(self):
+        CallbackHandler.delay = 0.05
+        try:
+            greenlets = [gevent.spawn(self.pool.post, self.url, '{}', 5) for _ in xrange(6)]
+            gevent.joinall(greenlets)
+        finally:
+            CallbackHandler.delay = 0
+
+        self.assertEqual([greenlet.value.status_code for greenlet in greenlets], [201] * 6)
+        self.assertEqual(len(CallbackHandler.connections), 2)
+
+    def test_long_body_is_dropped(self):
+        CallbackHandler.body = 'x' * 11
+        try:
+            response = self.pool.post(self.url, data='{}', timeout=5)
+        finally:
+            CallbackHandler.body = 'ok'
+
+        self.assertEqual(response.status_code, 201)
+        self.assertIsNone(response.content)
+        self.assertEqual(self.pool.post(self.url, data='{}', timeout=5).content, 'ok')
+
+    def test_timeout(self):
+        CallbackHandler.delay = 0.5
+        try:
+            with self.assertRaises(requests.Timeout):
+                self.pool.post(self.url, data='{}', timeout=0.05)
+        finally:
+            CallbackHandler.delay = 0
+
+        self.assertEqual(self.pool.transfers, {})
+
+    def test_read_timeout(self):
+        CallbackHandler.delay = 0.5
+        self.pool.connect_timeout = 0.1
+        try:
+            with self.assertRaises(requests.Timeout):
+                self.pool.post(self.url, data='{}', timeout=5, read_timeout=0.05)
+        finally:
+            CallbackHandler.delay = 0
+
+        self.assertEqual(self.pool.transfers, {})
+
+    def test_connection_error(self):
+        listener = socket.socket()
+        listener.bind(('127.0.0.1', 0))
+        port = listener.getsockname()[1]
+        listener.close()
+
+        with self.assertRaises(requests.ConnectionError):
+            self.pool.post('http://127.0.0.1:{}/callback'.format(port), data='{}', timeout=5)
+
+    def test_killed_post_removes_transfer(self):
+        CallbackHandler.delay = 0.5
+        try:
+            greenlet = gevent.spawn(self.pool.post, self.url, '{}', 5)
+            gevent.sleep(0.05)
+            greenlet.kill()
+        finally:
+            CallbackHandler.delay = 0
+
+        self.assertEqual(self.pool.transfers, {})
+        self.assertEqual(len(self.pool.free), 1)
+
+    def test_close_waits_for_transfers(self):
+        greenlet = gevent.spawn(self.pool.post, self.url, '{}', 5)
+        gevent.sleep(0)
+        self.pool.close()
+
+        self.assertEqual(greenlet.get().content, 'ok')
+        self.assertEqual(self.pool.free, [])
+
+    def test_engines_follow_redirects_alike(self):
+        url = self.url.replace('/callback', '/redirect')
+        session_pool = SessionPool()
+
+        responses = [pool.post(url, data='{}', timeout=5) for pool in (self.pool, session_pool)]
+        session_pool.close()
+
+        self.assertEqual([(response.status_code, response.content) for response in responses], [(201, 'ok')] * 2)
+        self.assertEqual(
+            [(path, body) for path, _, body in CallbackHandler.requests],
+            [('/redirect', '{}'), ('/callback', None)] * 2
+        )
+
+    def test_request_error(self):
+        self.assertIsInstance(request_error('http://a/', 28, 'timed out'), requests.Timeout)
+        self.assertIsInstance(request_error('http://a/', 7, 'refused'), requests.ConnectionError)
+        self.assertIsInstance(request_error('http://a/', 47, 'redirects'), requests.TooManyRedirects)
+        error = request_error('http://a/', 3, 'malformed')
+        self.assertNotIsInstance(error, (requests.Timeout, requests.ConnectionError))
+        self.assertIsInstance(error, requests.RequestException)
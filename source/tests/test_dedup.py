@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from lib.dedup import DeliveryLog
+
+
+class DeliveryLogCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'delivered.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_lines(self):
+        with open(self.path) as log_file:
+            return log_file.read().splitlines()
+
+    def test_seen(self):
+        log = DeliveryLog(10)
+        log.add(1, '{"id": 1}')
+
+        self.assertTrue(log.seen(1, '{"id": 1}'))
+        self.assertFalse(log.seen(1, '{"id": 1, "a": 2}'))
+        self.assertFalse(log.seen(2, '{"id": 1}'))
+        self.assertTrue(log.seen(1, u'{"id": 1}'))
+
+    def test_oldest_keys_are_evicted(self):
+        log = DeliveryLog(2)
+        for task_id in (1, 2, 1, 3):
+            log.add(task_id, '{}')
+
+        self.assertEqual(len(log), 2)
+        self.assertTrue(log.seen(1, '{}'))
+        self.assertFalse(log.seen(2, '{}'))
+        self.assertTrue(log.seen(3, '{}'))
+
+    def test_file_survives_reopen(self):
+        log = DeliveryLog(10, self.path)
+        log.add(1, '{}')
+        log.add(2, '{}')
+        log.close()
+
+        log = DeliveryLog(10, self.path)
+        self.assertTrue(log.seen(1, '{}'))
+        self.assertTrue(log.seen(2, '{}'))
+        log.add(3, '{}')
+        log.close()
+
+        self.assertEqual(len(self.read_lines()), 3)
+
+    def test_partial_line_is_ignored(self):
+        with open(self.path, 'w') as log_file:
+            log_file.write('{}\n1 abc'.format(DeliveryLog.key(2, '{}')))
+
+        log = DeliveryLog(10, self.path)
+        log.close()
+
+        self.assertTrue(log.seen(2, '{}'))
+        self.assertFalse(log.seen(1, '{}'))
+
+    def test_file_is_compacted(self):
+        log = DeliveryLog(2, self.path)
+        for task_id in xrange(5):
+            log.add(task_id, '{}')
+        log.close()
+
+        self.assertEqual(self.read_lines(), [DeliveryLog.key(task_id, '{}') for task_id in (3, 4)])
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
@@ -0,0 +1,144 @@
+import socket
+import unittest
+
+import gevent
+from gevent.event import Event
+from mock import Mock, patch
+
+from lib import dns_cache
+from lib.dns_cache import CachingResolver, make_resolver
+
+ADDRESSES = [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('10.0.0.1', 80))]
+
+
+class DnsCacheCase(unittest.TestCase):
+    def setUp(self):
+        self.resolver = Mock(None)
+        self.resolver.getaddrinfo.return_value = ADDRESSES
+        self.cache = CachingResolver(self.resolver, ttl=60, negative_ttl=5, prefetch=10, max_size=2)
+
+    @patch('lib.dns_cache.time.time', Mock(return_value=1000))
+    def test_answer_is_cached(self):
+        self.assertEqual(self.cache.getaddrinfo('a.example.com', 80), ADDRESSES)
+        self.assertEqual(self.cache.getaddrinfo('a.example.com', 80), ADDRESSES)
+
+        self.resolver.getaddrinfo.assert_called_once_with('a.example.com', 80, 0, 0, 0, 0)
+
+    def test_answer_expires(self):
+        with patch('lib.dns_cache.time.time', Mock(return_value=1000)):
+            self.cache.getaddrinfo('a.example.com', 80)
+        with patch('lib.dns_cache.time.time', Mock(return_value=1060)):
+            self.cache.getaddrinfo('a.example.com', 80)
+
+        self.assertEqual(self.resolver.getaddrinfo.call_count, 2)
+
+    def test_arguments_are_part_of_key(self):
+        self.cache.getaddrinfo('a.example.com', 80)
+        self.cache.getaddrinfo('a.example.com', 443)
+        self.cache.getaddrinfo('a.example.com', 80, socket.AF_INET6)
+
+        self.assertEqual(self.resolver.getaddrinfo.call_count, 3)
+
+    def test_error_is_cached_for_negative_ttl(self):
+        self.resolver.getaddrinfo.side_effect = socket.gaierror(socket.EAI_NONAME, 'not found')
+
+        with patch('lib.dns_cache.time.time', Mock(return_value=1000)):
+            for _ in xrange(2):
+                with self.assertRaises(socket.gaierror):
+                    self.cache.getaddrinfo('missing.example.com', 80)
+        self.assertEqual(self.resolver.getaddrinfo.call_count, 1)
+
+        with patch('lib.dns_cache.time.time', Mock(return_value=1005)):
+            with self.assertRaises(socket.gaierror):
+                self.cache.getaddrinfo('missing.example.com', 80)
+        self.assertEqual(self.resolver.getaddrinfo.call_count, 2)
+
+    def test_other_errors_are_not_cached(self):
+        self.resolver.getaddrinfo.side_effect = [ValueError(), ADDRESSES]
+
+        with self.assertRaises(ValueError):
+            self.cache.getaddrinfo('a.example.com', 80)
+
+        self.assertEqual(self.cache.getaddrinfo('a.example.com', 80), ADDRESSES)
+        self.assertEqual(self.cache.pending, {})
+
+    def test_concurrent_lookups_share_request(self):
+        started = Event()
+        release = Event()
+
+        def getaddrinfo(*args):
+            started.set()
+            release.wait()
+            return ADDRESSES
+        self.resolver.getaddrinfo.side_effect = getaddrinfo
+
+        greenlets = [gevent.spawn(self.cache.getaddrinfo, 'a.example.com', 80) for _ in xrange(3)]
+        started.wait()
+        gevent.sleep(0)
+        release.set()
+        gevent.joinall(greenlets)
+
+        self.assertEqual([greenlet.value for greenlet in greenlets], [ADDRESSES] * 3)
+        self.assertEqual(self.resolver.getaddrinfo.call_count, 1)
+
+    def test_hot_entry_is_prefetched(self):
+        with patch('lib.dns_cache.time.time', Mock(return_value=1000)):
+            self.cache.getaddrinfo('a.example.com', 80)
+        with patch('lib.dns_cache.time.time', Mock(return_value=1049)):
+            self.cache.getaddrinfo('a.example.com', 80)
+        self.assertEqual(self.resolver.getaddrinfo.call_count, 1)
+
+        with patch('lib.dns_cache.time.time', Mock(return_value=1051)):
+            self.assertEqual(self.cache.getaddrinfo('a.example.com', 80), ADDRESSES)
+            self.cache.getaddrinfo('a.example.com', 80)
+            gevent.sleep(0)
+
+        self.assertEqual(self.resolver.getaddrinfo.call_count, 2)
+        self.assertEqual(self.cache.entries[('a.example.com', 80, 0, 0, 0, 0)][0], 1111)
+        self.assertEqual(self.cache.refreshing, set())
+
+    @patch('lib.dns_cache.time.time', Mock(return_value=1051))
+    def test_failed_prefetch_keeps_answer(self):
+        key = ('a.example.com', 80, 0, 0, 0, 0)
+        self.cache.entries[key] = (1060, ADDRESSES, None)
+        self.resolver.getaddrinfo.side_effect = socket.gaierror(socket.EAI_AGAIN, 'temporary failure')
+
+        self.cache.getaddrinfo('a.example.com', 80)
+        gevent.sleep(0)
+
+        self.assertEqual(self.cache.entries[key], (1060, ADDRESSES, None))
+        self.assertEqual(self.cache.getaddrinfo('a.example.com', 80), ADDRESSES)
+
+    def test_max_size(self):
+        for host in ('a', 'b', 'c'):
+            self.cache.getaddrinfo(host, 80)
+
+        self.assertEqual([key[0] for key in self.cache.entries], ['b', 'c'])
+
+    def test_other_methods_are_delegated(self):
+        self.resolver.gethostbyname = Mock(return_value='10.0.0.1')
+
+        self.assertEqual(self.cache.gethostbyname('a.example.com'), '10.0.0.1')
+
+    def test_close(self):
+        self.cache.getaddrinfo('a.example.com', 80)
+        self.cache.close()
+
+        self.assertEqual(len(self.cache.entries), 0)
+        self.assertTrue(self.resolver.close.called)
+
+    def test_metrics(self):
+        hits, misses = dns_cache.cache_hits.value, dns_cache.cache_misses.value
+        count = dns_cache.resolve_time.count
+
+        self.cache.getaddrinfo('a.example.com', 80)
+        self.cache.getaddrinfo('a.example.com', 80)
+
+        self.assertEqual(dns_cache.cache_hits.value - hits, 1)
+        self.assertEqual(dns_cache.cache_misses.value - misses, 1)
+        self.assertEqual(dns_cache.resolve_time.count - count, 1)
+
+    def test_make_resolver(self):
+        self.assertEqual(type(make_resolver('block')).__name__, 'BlockingResolver')
+        with self.assertRaises(ValueError):
+            make_resolver('dnspython')
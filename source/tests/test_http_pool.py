@@ -0,0 +1,213 @@
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import threading
+import unittest
+
+import gevent
+from mock import Mock, patch
+import requests
+
+from lib.http_pool import SessionPool, request_timeouts
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+    body = 'ok'
+
+    def do_POST(self):
+        self.connections.add(self.client_address)
+        self.rfile.read(int(self.headers.getheader('Content-Length') or 0))
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_response(body='', length=None):
+    response = Mock(None)
+    response.headers = {} if length is None else {'content-length': str(length)}
+    response.iter_content.return_value = [body] if body else []
+    return response
+
+
+class SessionPoolCase(unittest.TestCase):
+    def setUp(self):
+        self.pool = SessionPool(max_connections=2, idle_timeout=30, drain_limit=10)
+        self.sessions = []
+        self.pool.make_session = self.make_session
+
+    def make_session(self):
+        session = Mock(None)
+        session.post.return_value = make_response('ok', 2)
+        self.sessions.append(session)
+        return session
+
+    def test_host_key(self):
+        self.assertEqual(SessionPool.host_key('HTTPS://Example.com:8443/path?q=1'), ('https', 'example.com:8443'))
+
+    def test_post_reuses_session_of_host(self):
+        self.pool.post('http://a.example.com/1', data='{}', timeout=5)
+        self.pool.post('http://a.example.com/2', data='{}')
+
+        self.assertEqual(len(self.sessions), 1)
+        self.sessions[0].post.assert_called_with('http://a.example.com/2', stream=True, data='{}')
+        self.assertFalse(self.sessions[0].close.called)
+
+    def test_post_uses_session_per_host(self):
+        self.pool.post('http://a.example.com/')
+        self.pool.post('http://b.example.com/')
+
+        self.assertEqual(len(self.sessions), 2)
+        self.assertEqual(len(self.pool.hosts), 2)
+
+    def test_response_is_closed_after_drain(self):
+        response = self.pool.post('http://a.example.com/')
+
+        response.iter_content.assert_called_once_with(8 * 1024)
+        self.assertTrue(response.close.called)
+
+    def test_long_body_closes_session(self):
+        self.pool.post('http://a.example.com/')
+        self.sessions[0].post.return_value = make_response('x' * 11)
+        self.pool.post('http://a.example.com/')
+        self.pool.post('http://a.example.com/')
+
+        self.assertTrue(self.sessions[0].close.called)
+        self.assertEqual(len(self.sessions), 2)
+
+    def test_long_content_length_is_not_read(self):
+        response = make_response('x' * 100, 100)
+        self.assertFalse(self.pool.drain(response))
+        self.assertFalse(response.iter_content.called)
+        self.assertIsNone(response._content)
+
+    def test_drained_body_is_kept(self):
+        response = make_response('ok')
+        self.assertTrue(self.pool.drain(response))
+        self.assertEqual(response._content, 'ok')
+
+    def test_error_closes_session(self):
+        session = self.make_session()
+        session.post.side_effect = requests.ConnectionError()
+        self.pool.make_session = Mock(return_value=session)
+
+        with self.assertRaises(requests.ConnectionError):
+            self.pool.post('http://a.example.com/')
+
+        self.assertTrue(session.close.called)
+        host = self.pool.hosts[('http', 'a.example.com')]
+        self.assertEqual(host.in_use, 0)
+        self.assertEqual(len(host.idle), 0)
+        self.assertEqual(host.semaphore.counter, 2)
+
+    def test_timeout_covers_response(self):
+        session = self.make_session()
+        session.post.side_effect = lambda *args, **kwargs: gevent.sleep(1)
+        self.pool.make_session = Mock(return_value=session)
+
+        with self.assertRaises(requests.Timeout):
+            self.pool.post('http://a.example.com/', timeout=0.01)
+
+        self.assertTrue(session.close.called)
+
+    def test_read_timeout_limits_response(self):
+        session = self.make_session()
+        session.post.side_effect = lambda *args, **kwargs: gevent.sleep(1)
+        self.pool.make_session = Mock(return_value=session)
+        self.pool.connect_timeout = 0.01
+
+        with self.assertRaises(requests.Timeout):
+            self.pool.post('http://a.example.com/', timeout=5, read_timeout=0.01)
+
+        session.post.assert_called_once_with('http://a.example.com/', stream=True, timeout=0.01)
+
+    def test_request_timeouts(self):
+        self.assertEqual(request_timeouts(None), (None, None))
+        self.assertEqual(request_timeouts(5), (5, 5))
+        self.assertEqual(request_timeouts(5, connect_timeout=1), (1, 5))
+        self.assertEqual(request_timeouts(5, connect_timeout=10), (5, 5))
+        self.assertEqual(request_timeouts(5, connect_timeout=1, read_timeout=2), (1, 3))
+        self.assertEqual(request_timeouts(5, connect_timeout=1, read_timeout=10), (1, 5))
+        self.assertEqual(request_timeouts(None, connect_timeout=1, read_timeout=2), (1, 3))
+        self.assertEqual(request_timeouts(None, read_timeout=2), (None, None))
+
+    def test_max_connections(self):
+        key = ('http', 'a.example.com')
+        first = self.pool.acquire(key)
+        second = self.pool.acquire(key)
+
+        self.assertIsNot(first, second)
+        self.assertTrue(self.pool.hosts[key].semaphore.locked())
+
+        self.pool.release(key, first)
+        self.assertFalse(self.pool.hosts[key].semaphore.locked())
+        self.assertIs(self.pool.acquire(key), first)
+
+    def test_timeout_covers_wait_for_connection(self):
+        key = ('http', 'a.example.com')
+        sessions = [self.pool.acquire(key), self.pool.acquire(key)]
+        host = self.pool.hosts[key]
+
+        with self.assertRaises(requests.Timeout):
+            self.pool.post('http://a.example.com/', timeout=0.01)
+        self.assertEqual((host.in_use, host.waiting, host.semaphore.counter), (2, 0, 0))
+
+        waiting = gevent.spawn(self.pool.post, 'http://a.example.com/', timeout=1)
+        gevent.sleep(0)
+        self.assertEqual((host.in_use, host.waiting), (2, 1))
+        self.pool.release(key, sessions[0])
+        waiting.join(timeout=1)
+
+        sessions[0].post.assert_called_once_with('http://a.example.com/', stream=True, timeout=1)
+        self.assertIs(self.pool.hosts[key], host)
+        self.assertEqual((host.in_use, host.waiting, host.semaphore.counter), (1, 0, 1))
+
+    def test_evict_idle(self):
+        self.pool.post('http://a.example.com/')
+        self.pool.post('http://b.example.com/')
+        session_a, session_b = self.sessions
+        now = self.pool.hosts[('http', 'a.example.com')].idle[0][1]
+        self.pool.hosts[('http', 'a.example.com')].idle[0] = (session_a, now - 60)
+
+        self.pool.evict_idle(now + 1)
+        self.assertFalse(session_a.close.called)
+
+        self.pool.evict_idle(self.pool.evicted_at + 30)
+        self.assertTrue(session_a.close.called)
+        self.assertFalse(session_b.close.called)
+        self.assertEqual(self.pool.hosts.keys(), [('http', 'b.example.com')])
+
+    def test_close(self):
+        key = ('http', 'a.example.com')
+        self.pool.post('http://b.example.com/')
+        session = self.pool.acquire(key)
+
+        self.pool.close()
+        self.assertTrue(self.sessions[0].close.called)
+        self.assertFalse(session.close.called)
+
+        self.pool.release(key, session)
+        self.assertTrue(session.close.called)
+
+    @patch.dict('os.environ', {'no_proxy': '127.0.0.1'})
+    def test_keep_alive(self):
+        KeepAliveHandler.connections = set()
+        server = HTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        url = 'http://127.0.0.1:{}/callback'.format(server.server_address[1])
+        pool = SessionPool()
+
+        try:
+            responses = [pool.post(url, data='{}', timeout=5) for _ in xrange(3)]
+        finally:
+            pool.close()
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual([(response.status_code, response.content) for response in responses], [(200, 'ok')] * 3)
+        self.assertEqual(len(KeepAliveHandler.connections), 1)
@@ -0,0 +1,124 @@
+import unittest
+
+import gevent
+from gevent import queue as gevent_queue
+
+from lib.batching import Batch
+from lib.lanes import Lane, LaneQueue
+
+
+class Task(object):
+    def __init__(self, task_id, tube):
+        self.task_id = task_id
+        self.tube = tube
+
+
+class LaneQueueCase(unittest.TestCase):
+    def make_queue(self, lanes, maxsize=None):
+        return LaneQueue([Lane(name, weight, reserved) for name, weight, reserved in lanes], maxsize)
+
+    def fill(self, queue, tube, count):
+        tasks = [Task(number, tube) for number in xrange(count)]
+        for task in tasks:
+            queue.put(task)
+        return tasks
+
+    def test_tasks_go_to_lanes_of_their_tubes(self):
+        queue = self.make_queue([('urgent', 1, 0), ('bulk', 1, 0)], maxsize=2)
+        urgent, bulk, unknown = Task(1, 'urgent'), Task(2, 'bulk'), Task(3, 'other')
+
+        for item in (urgent, Batch('http://a.example.com/', [bulk]), unknown):
+            queue.put(item)
+
+        self.assertEqual([lane.queue.qsize() for lane in queue.lanes.values()], [2, 1])
+        self.assertEqual(queue.qsize(), 3)
+        self.assertIs(queue.lane(bulk), queue.lanes['bulk'])
+        self.assertIs(queue.get_nowait(), urgent)
+
+    def test_resize_changes_capacity_of_every_lane(self):
+        queue = self.make_queue([('urgent', 1, 0), ('bulk', 1, 0)], maxsize=2)
+
+        queue.maxsize = 5
+
+        self.assertEqual([lane.queue.maxsize for lane in queue.lanes.values()], [5, 5])
+
+    def test_reserves_shrink_with_pool(self):
+        queue = self.make_queue([('urgent', 1, 4), ('bulk', 1, 2), ('other', 1, 0)], maxsize=8)
+        reserves = lambda: [lane.reserved for lane in queue.lanes.values()]
+        self.assertEqual(reserves(), [4, 2, 0])
+
+        queue.maxsize = 4
+        self.assertEqual(reserves(), [3, 1, 0])
+        queue.maxsize = 2
+        self.assertEqual(reserves(), [1, 1, 0])
+
+        urgent, bulk = Task(1, 'urgent'), Task(2, 'bulk')
+        queue.start(urgent)
+        queue.start(bulk)
+        self.fill(queue, 'urgent', 1)
+        self.assertRaises(gevent_queue.Empty, queue.get, block=False)
+
+        queue.maxsize = 6
+        self.assertEqual(reserves(), [4, 2, 0])
+        self.assertEqual(queue.get(block=False).tube, 'urgent')
+
+    def test_lanes_are_served_by_weight(self):
+        queue = self.make_queue([('urgent', 3, 0), ('bulk', 1, 0)])
+        self.fill(queue, 'urgent', 10)
+        self.fill(queue, 'bulk', 10)
+
+        tubes = [queue.get(block=False).tube for _ in xrange(8)]
+
+        self.assertEqual(tubes.count('urgent'), 6)
+        self.assertEqual(tubes[:4].count('bulk'), 1)
+
+    def test_lane_below_reserve_goes_first(self):
+        queue = self.make_queue([('urgent', 1, 1), ('bulk', 10, 0)])
+        self.fill(queue, 'bulk', 3)
+        self.fill(queue, 'urgent', 3)
+
+        first = queue.get(block=False)
+        queue.start(first)
+
+        self.assertEqual(first.tube, 'urgent')
+        self.assertEqual(queue.get(block=False).tube, 'bulk')
+
+    def test_reserve_of_active_lane_is_kept(self):
+        queue = self.make_queue([('urgent', 1, 2), ('bulk', 1, 0)], maxsize=3)
+        urgent, bulk = Task(1, 'urgent'), Task(2, 'bulk')
+        queue.start(urgent)
+        queue.start(bulk)
+        self.fill(queue, 'bulk', 2)
+
+        self.assertRaises(gevent_queue.Empty, queue.get, block=False)
+
+        queue.finish(urgent)
+        self.assertEqual(queue.get(block=False).tube, 'bulk')
+
+    def test_get_waits_for_put_and_finish(self):
+        queue = self.make_queue([('urgent', 1, 1), ('bulk', 1, 0)], maxsize=1)
+        urgent = Task(1, 'urgent')
+        queue.start(urgent)
+        self.fill(queue, 'bulk', 1)
+
+        getter = gevent.spawn(queue.get, timeout=1)
+        gevent.sleep(0.01)
+        self.assertFalse(getter.ready())
+        queue.finish(urgent)
+        getter.join(timeout=1)
+
+        self.assertEqual(getter.value.tube, 'bulk')
+        self.assertRaises(gevent_queue.Empty, queue.get, timeout=0.01)
+
+    def test_report(self):
+        lane = Lane('report')
+        lane.taken = 20
+
+        lane.report(100, 10.0)
+        self.assertEqual((lane.ready_gauge.value, lane.lag_gauge.value, lane.taken), (100, 50.0, 0))
+
+        lane.report(100, 10.0)
+        self.assertEqual(lane.lag_gauge.value, 10.0)
+
+        lane.report(0, 10.0)
+        self.assertEqual(lane.lag_gauge.value, 0.0)
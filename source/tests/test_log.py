@@ -0,0 +1,111 @@
+import logging
+from logging.config import dictConfig
+import os
+import sys
+import unittest
+
+from mock import Mock, patch
+
+from lib.log import QueueHandler, queue_handlers
+
+
+def make_record(msg, *args):
+    return logging.makeLogRecord({'msg': msg, 'args': args, 'levelno': logging.INFO, 'levelname': 'INFO'})
+
+
+class LogCase(unittest.TestCase):
+    def setUp(self):
+        self.target = Mock(None)
+        self.target.handle = Mock(None)
+
+    def make_handler(self, **kwargs):
+        handler = QueueHandler(target=self.target, interval=60, **kwargs)
+        self.addCleanup(handler.close)
+        return handler
+
+    def test_records_are_written_by_flush(self):
+        handler = self.make_handler()
+
+        handler.handle(make_record('Task id=%s done', 1))
+        handler.flush()
+
+        record = self.target.handle.call_args[0][0]
+        self.assertEqual(record.msg, 'Task id=1 done')
+        self.assertIsNone(record.args)
+
+    def test_exception_is_formatted_on_emit(self):
+        handler = self.make_handler()
+        try:
+            raise ValueError('boom')
+        except ValueError:
+            record = make_record('failed')
+            record.exc_info = sys.exc_info()
+
+        handler.handle(record)
+
+        self.assertIsNone(record.exc_info)
+        self.assertIn('ValueError: boom', record.exc_text)
+
+    def test_drop_new(self):
+        handler = self.make_handler(capacity=2)
+
+        for number in xrange(4):
+            handler.handle(make_record('%s', number))
+        handler.flush()
+
+        messages = [call[0][0].getMessage() for call in self.target.handle.call_args_list]
+        self.assertEqual(handler.dropped, 2)
+        self.assertEqual(messages[:2], ['0', '1'])
+        self.assertEqual(messages[2], 'Log buffer overflow: dropped 2 records (2 total).')
+
+    def test_drop_old(self):
+        handler = self.make_handler(capacity=2, drop='old')
+
+        for number in xrange(4):
+            handler.handle(make_record('%s', number))
+        handler.flush()
+
+        messages = [call[0][0].getMessage() for call in self.target.handle.call_args_list]
+        self.assertEqual(handler.dropped, 2)
+        self.assertEqual(messages[:2], ['2', '3'])
+
+    def test_unknown_drop_policy(self):
+        self.assertRaises(ValueError, QueueHandler, drop='random')
+
+    def test_flush_level(self):
+        handler = self.make_handler(flushLevel=logging.ERROR)
+        record = make_record('fatal')
+        record.levelno = logging.ERROR
+
+        handler.handle(record)
+
+        self.target.handle.assert_called_once_with(record)
+
+    def test_restart_after_fork(self):
+        handler = self.make_handler()
+        handler.handle(make_record('parent'))
+
+        with patch('os.getpid', Mock(return_value=os.getpid() + 1)):
+            handler.handle(make_record('child'))
+            handler.flush()
+
+        self.assertEqual(handler.pid, os.getpid() + 1)
+        self.assertEqual(self.target.handle.call_count, 1)
+        self.assertEqual(self.target.handle.call_args[0][0].msg, 'child')
+
+    def test_dict_config_resolves_target(self):
+        dictConfig({
+            'version': 1,
+            'disable_existing_loggers': False,
+            'handlers': {
+                'null': {'class': 'logging.NullHandler'},
+                'queue': {'class': 'lib.log.QueueHandler', 'capacity': 5, 'drop': 'old', 'target': 'null'},
+            },
+            'loggers': {'log_case': {'handlers': ['queue'], 'propagate': False}},
+        })
+        handler = logging.getLogger('log_case').handlers[0]
+        self.addCleanup(handler.close)
+
+        self.assertIsInstance(handler.target, logging.NullHandler)
+        self.assertEqual(handler.capacity, 5)
+        self.assertIn(handler, queue_handlers())
@@ -0,0 +1,184 @@
+import threading
+import unittest
+
+import mock
+
+from lib import memory_queue as mq
+from lib.utils import create_queue
+
+
+class MemoryQueueCase(unittest.TestCase):
+    def setUp(self):
+        mq.drop_storage(42)
+        self.queue = mq.Queue(space=42)
+        self.tube = self.queue.tube('test')
+
+    def tearDown(self):
+        mq.drop_storage(42)
+
+    def test_put_take_ack(self):
+        self.tube.put({'url': 'http://example.com'})
+
+        task = self.tube.take(0)
+
+        self.assertEqual(task.data, {'url': 'http://example.com'})
+        self.assertEqual(task.status, 'taken')
+        self.assertTrue(task.ack())
+        self.assertIsNone(self.tube.take(0))
+
+    def test_take_respects_priority(self):
+        self.tube.put('low', pri=1)
+        self.tube.put('high', pri=10)
+        self.tube.urgent('urgent')
+
+        self.assertEqual(self.tube.take(0).data, 'urgent')
+        self.assertEqual(self.tube.take(0).data, 'high')
+        self.assertEqual(self.tube.take(0).data, 'low')
+
+    def test_take_is_fifo_for_same_priority(self):
+        for number in xrange(5):
+            self.tube.put(number)
+
+        self.assertEqual([self.tube.take(0).data for _ in xrange(5)], range(5))
+
+    def test_delayed_task(self):
+        with mock.patch('time.time', mock.Mock(return_value=100.0)):
+            self.tube.put('later', delay=10)
+            self.assertIsNone(self.tube.take(0))
+
+        with mock.patch('time.time', mock.Mock(return_value=110.0)):
+            self.assertEqual(self.tube.take(0).data, 'later')
+
+    def test_ttr_returns_task_to_ready(self):
+        with mock.patch('time.time', mock.Mock(return_value=100.0)):
+            self.tube.put('task', ttr=5)
+            task = self.tube.take(0)
+
+        with mock.patch('time.time', mock.Mock(return_value=106.0)):
+            again = self.tube.take(0)
+
+        self.assertEqual(again.task_id, task.task_id)
+        self.assertEqual(again.meta()['ctaken'], 2)
+
+    def test_touch_prolongs_ttr(self):
+        with mock.patch('time.time', mock.Mock(return_value=100.0)):
+            self.tube.put('task', ttr=5)
+            task = self.tube.take(0)
+        with mock.patch('time.time', mock.Mock(return_value=104.0)):
+            task.touch()
+        with mock.patch('time.time', mock.Mock(return_value=106.0)):
+            self.assertIsNone(self.tube.take(0))
+
+    def test_ttl_removes_task(self):
+        with mock.patch('time.time', mock.Mock(return_value=100.0)):
+            self.tube.put('task', ttl=5)
+        with mock.patch('time.time', mock.Mock(return_value=106.0)):
+            self.assertIsNone(self.tube.take(0))
+            self.assertEqual(self.tube.statistics()['tasks']['total'], 0)
+
+    def test_release_with_delay(self):
+        self.tube.put('task')
+        task = self.tube.take(0)
+
+        task.release(delay=60)
+
+        self.assertIsNone(self.tube.take(0))
+        self.assertEqual(self.tube.statistics()['tasks']['delayed'], 1)
+
+    def test_bury_dig_and_kick(self):
+        self.tube.put('first')
+        self.tube.put('second')
+        first, second = self.tube.take(0), self.tube.take(0)
+        first.bury()
+        second.bury()
+
+        self.assertEqual([task.data for task, created in self.queue.buried('test')], ['first', 'second'])
+        self.assertEqual([task.data for task, created in self.queue.buried('test', 1, 10)], ['second'])
+
+        first.dig()
+        self.assertEqual(self.tube.take(0).data, 'first')
+        self.assertTrue(self.tube.kick())
+        self.assertEqual(self.tube.take(0).data, 'second')
+        self.assertFalse(self.tube.kick())
+
+    def test_ack_of_not_taken_task(self):
+        task = self.tube.put('task')
+
+        self.assertRaises(mq.QueueError, task.ack)
+
+    def test_statistics(self):
+        self.tube.put('a')
+        self.tube.put('b')
+        self.tube.take(0).ack()
+        self.tube.take(0)
+        self.tube.take(0)
+
+        stat = self.tube.statistics()
+
+        self.assertEqual(stat['put'], 2)
+        self.assertEqual(stat['take'], 2)
+        self.assertEqual(stat['take_timeout'], 1)
+        self.assertEqual(stat['ack'], 1)
+        self.assertEqual(stat['tasks']['taken'], 1)
+        self.assertEqual(stat['tasks']['total'], 1)
+        self.assertIn('test', self.queue.statistics())
+
+    def test_take_waits_for_put(self):
+        def put_later():
+            mq.Queue(space=42).tube('test').put('late')
+
+        timer = threading.Timer(0.05, put_later)
+        timer.start()
+
+        task = self.tube.take(5)
+        timer.join()
+
+        self.assertEqual(task.data, 'late')
+
+    def test_listeners(self):
+        events = []
+        self.queue.storage.listeners.append(lambda event, task_id, tube: events.append(event))
+
+        self.tube.put('task')
+        self.tube.take(0).bury()
+
+        self.assertEqual(events, ['put', 'take', 'bury'])
+
+    def test_create_queue(self):
+        self.assertIsInstance(create_queue('localhost', 1, 42, 'memory'), mq.Queue)
+        self.assertIsInstance(create_queue('localhost', 1, 42, 'memory_server'), mq.RemoteQueue)
+        self.assertRaises(ValueError, create_queue, 'localhost', 1, 42, 'redis')
+
+
+class QueueServerCase(unittest.TestCase):
+    def setUp(self):
+        mq.drop_storage(43)
+        self.server = mq.QueueServer(('127.0.0.1', 0))
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        host, port = self.server.server_address
+        self.queue = mq.RemoteQueue(host=host, port=port, space=43)
+
+    def tearDown(self):
+        self.queue.close()
+        self.server.shutdown()
+        self.server.server_close()
+        mq.drop_storage(43)
+
+    def test_roundtrip(self):
+        tube = self.queue.tube('remote')
+        tube.put({'callback_url': 'http://example.com/'}, pri=5)
+
+        task = tube.take(0)
+
+        self.assertEqual(task.data, {'callback_url': 'http://example.com/'})
+        self.assertEqual(task.meta()['pri'], 5)
+        self.assertTrue(task.ack())
+        self.assertEqual(tube.statistics()['ack'], 1)
+        self.assertEqual(mq.get_storage(43).statistics('remote')['ack'], 1)
+
+    def test_error_is_raised_on_client(self):
+        task = self.queue.tube('remote').put('task')
+
+        self.assertRaises(mq.QueueError, task.bury)
@@ -1,12 +1,30 @@
 import unittest
 import argparse
+from collections import OrderedDict
+import json
+import os
+import shutil
+import socket
+import tempfile
+import time
 import mock
 from mock import patch, Mock
 import notification_pusher as np
+from lib.batching import Batch, Batcher
+from lib.breaker import HostGuard
+from lib.curl_pool import CurlPool
+from lib.dedup import DeliveryLog
+from lib.dns_cache import CachingResolver
+from lib.http_pool import SessionPool
+from lib.lanes import Lane, LaneQueue
+from lib.ordering import Sequencer
+from lib.timeouts import AdaptiveTimeouts, FixedTimeouts
 from Queue import Queue
 
 import tarantool
 import requests
+import gevent
+from gevent.event import Event
 from gevent import queue as gevent_queue
 
 
@@ -21,6 +39,16 @@ class Task:
 
 
 class NotificationPusherTestCase(unittest.TestCase):
+    def setUp(self):
+        for name, value in (
+            ('host_guard', HostGuard()), ('batcher', Batcher()), ('encoded_bodies', OrderedDict()),
+            ('concurrency_limiter', None), ('read_timeouts', None),
+            ('delivery_log', None), ('sequencer', Sequencer())
+        ):
+            patcher = patch('notification_pusher.' + name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
     def test_create_pidfile(self):
         pid = 42
         m_open = mock.mock_open()
@@ -36,10 +64,15 @@ class NotificationPusherTestCase(unittest.TestCase):
         task1 = Task(1, {'callback_url': 'fakeurl1.com'})
         task2 = Task(2, {'callback_url': 'fakeurl2.com'})
 
-        with patch('requests.post', Mock(None)):
+        pool_mock = Mock(None)
+        pool_mock.post.return_value.status_code = 200
+        with patch('notification_pusher.session_pool', pool_mock):
             with patch('notification_pusher.logger.info', Mock(return_value=Mock())):
                 np.notification_worker(task1, q)
-                np.notification_worker(task2, q)
+                np.notification_worker(task2, q, timeout=5)
+
+        self.assertEqual(pool_mock.post.call_count, 2)
+        pool_mock.post.assert_called_with('fakeurl2.com', data=mock.ANY, timeout=5)
 
         self.assertEqual(q.qsize(), 2)
         q.get()
@@ -47,50 +80,550 @@ class NotificationPusherTestCase(unittest.TestCase):
         self.assertEqual(resulting_task[0].data, task2.data)
         self.assertEqual(resulting_task[1], 'ack')
 
+    def test_encode_payload(self):
+        data = {'callback_url': 'fakeurl1.com', 'id': 'own', 'text': u'\u043f'}
+        task = Task(7, data)
+
+        body = np.encode_payload(task)
+
+        self.assertEqual(json.loads(body), {'id': 7, 'text': u'\u043f'})
+        self.assertEqual(task.data, {'callback_url': 'fakeurl1.com', 'id': 'own', 'text': u'\u043f'})
+        self.assertIs(task.data, data)
+
+    def test_encode_payload_of_retried_task(self):
+        data = {'callback_url': 'fakeurl1.com', 'text': 'hi', np.ATTEMPTS_FIELD: 2, np.ORIGIN_FIELD: 7}
+        task = Task(9, dict(data))
+
+        body = np.encode_payload(task)
+
+        self.assertEqual(json.loads(body), {'id': 7, 'text': 'hi'})
+        self.assertEqual(task.data, data)
+
+    def test_encode_payload_reuses_kept_body(self):
+        dumps_mock = Mock(return_value='{}')
+
+        with patch('notification_pusher.json_codec', np.json_codec._replace(dumps=dumps_mock)):
+            with patch('notification_pusher.MAX_CACHED_BODIES', 2):
+                for task_id, action in ((1, 'retry'), (2, 'ack'), (1, 'defer'), (3, 'retry'), (4, 'retry')):
+                    task = Task(task_id, {'callback_url': 'fakeurl1.com'})
+                    np.keep_payload(task, action, np.encode_payload(task))
+
+        self.assertEqual(dumps_mock.call_count, 4)
+        self.assertEqual(np.encoded_bodies.keys(), [3, 4])
+
+    def test_notification_worker_keeps_body_to_resend(self):
+        q = Queue()
+        pool_mock = Mock(None)
+
+        with patch('notification_pusher.session_pool', pool_mock):
+            for status_code in (200, 503):
+                pool_mock.post.return_value.status_code = status_code
+                np.notification_worker(Task(status_code, {'callback_url': 'fakeurl1.com'}), q)
+
+        self.assertEqual(np.encoded_bodies.keys(), [503])
+
     def test_notification_worker_with_exc(self):
         q = Queue()
         task3 = Task(3, {'callback_url': 'fakeurl3.com'})
 
-        with patch('requests.post', Mock(side_effect=requests.RequestException())):
+        pool_mock = Mock(None)
+        pool_mock.post.side_effect = requests.RequestException()
+        with patch('notification_pusher.session_pool', pool_mock):
             with patch('notification_pusher.logger.exception', Mock(None)):
                 np.notification_worker(task3, q)
 
         resulting_task = q.get()
         self.assertEqual(resulting_task[1], 'bury')
 
-    def test_done_with_processed_tasks(self):
+    def test_notification_worker_retries_connection_errors(self):
+        q = Queue()
+        pool_mock = Mock(None)
+
+        with patch('notification_pusher.session_pool', pool_mock):
+            with patch('notification_pusher.logger.exception', Mock(None)):
+                for exc in (requests.ConnectionError(), requests.Timeout()):
+                    pool_mock.post.side_effect = exc
+                    np.notification_worker(Task(3, {'callback_url': 'fakeurl3.com'}), q)
+
+        self.assertEqual([q.get()[1], q.get()[1]], ['retry', 'retry'])
+
+    def test_notification_worker_classifies_responses(self):
+        q = Queue()
+        pool_mock = Mock(None)
+
+        with patch('notification_pusher.session_pool', pool_mock):
+            for status_code in (201, 404, 503):
+                pool_mock.post.return_value.status_code = status_code
+                np.notification_worker(Task(4, {'callback_url': 'fakeurl4.com'}), q)
+
+        self.assertEqual([q.get()[1] for _ in xrange(3)], ['ack', 'bury', 'retry'])
+
+    def test_notification_worker_defers_rejected_hosts(self):
+        q = Queue()
+        pool_mock = Mock(None)
+        guard_mock = Mock(None)
+        guard_mock.host.return_value = 'fakeurl5.com'
+        guard_mock.acquire.return_value = 'open'
+
+        with patch('notification_pusher.session_pool', pool_mock):
+            with patch('notification_pusher.host_guard', guard_mock):
+                np.notification_worker(Task(5, {'callback_url': 'http://fakeurl5.com/'}), q)
+
+        self.assertEqual(q.get()[1], 'defer')
+        self.assertFalse(pool_mock.post.called)
+        self.assertFalse(guard_mock.release.called)
+
+    def test_notification_worker_reports_to_host_guard(self):
+        q = Queue()
+        pool_mock = Mock(None)
+        guard_mock = Mock(None)
+        guard_mock.host.return_value = 'fakeurl6.com'
+        guard_mock.acquire.return_value = None
+
+        with patch('notification_pusher.session_pool', pool_mock):
+            with patch('notification_pusher.host_guard', guard_mock):
+                for status_code in (200, 404, 502):
+                    pool_mock.post.return_value.status_code = status_code
+                    np.notification_worker(Task(6, {'callback_url': 'http://fakeurl6.com/'}), q)
+                pool_mock.post.side_effect = requests.Timeout()
+                with patch('notification_pusher.logger.exception', Mock(None)):
+                    np.notification_worker(Task(6, {'callback_url': 'http://fakeurl6.com/'}), q)
+
+        guard_mock.host.assert_called_with('http://fakeurl6.com/')
+        self.assertEqual(guard_mock.acquire.call_count, 4)
+        self.assertEqual(
+            [call[0][:2] for call in guard_mock.release.call_args_list],
+            [('fakeurl6.com', False), ('fakeurl6.com', False), ('fakeurl6.com', True), ('fakeurl6.com', True)]
+        )
+
+    def test_notification_worker_acks_delivered_tasks(self):
+        q = Queue()
+        pool_mock = Mock(None)
+        pool_mock.post.return_value.status_code = 200
+        task = Task(7, {'callback_url': 'http://fakeurl7.com/'})
+
+        with patch('notification_pusher.session_pool', pool_mock):
+            with patch('notification_pusher.delivery_log', DeliveryLog(10)):
+                np.notification_worker(task, q)
+                np.notification_worker(task, q)
+                task.data['text'] = 'changed'
+                np.notification_worker(task, q)
+
+        self.assertEqual([q.get()[1] for _ in xrange(3)], ['ack'] * 3)
+        self.assertEqual(pool_mock.post.call_count, 2)
+
+    def test_notification_worker_remembers_only_acked_tasks(self):
+        q = Queue()
+        pool_mock = Mock(None)
+        pool_mock.post.return_value.status_code = 503
+        task = Task(7, {'callback_url': 'http://fakeurl7.com/'})
+
+        with patch('notification_pusher.session_pool', pool_mock):
+            with patch('notification_pusher.delivery_log', DeliveryLog(10)):
+                np.notification_worker(task, q)
+                np.notification_worker(task, q)
+                delivered = len(np.delivery_log)
+
+        self.assertEqual([q.get()[1] for _ in xrange(2)], ['retry'] * 2)
+        self.assertEqual(pool_mock.post.call_count, 2)
+        self.assertEqual(delivered, 0)
+
+    def test_response_action(self):
+        self.assertEqual(np.response_action(200), 'ack')
+        self.assertEqual(np.response_action(204), 'ack')
+        self.assertEqual(np.response_action(302), 'bury')
+        self.assertEqual(np.response_action(400), 'bury')
+        self.assertEqual(np.response_action(408), 'retry')
+        self.assertEqual(np.response_action(429), 'retry')
+        self.assertEqual(np.response_action(500), 'retry')
+
+    def test_batch_worker(self):
+        q = Queue()
+        batch = Batch('http://fakeurl8.com/push', [
+            Task(1, {'callback_url': 'http://fakeurl8.com/push', 'a': 1}),
+            Task(2, {'callback_url': 'http://fakeurl8.com/push', 'a': 2}),
+        ])
+        pool_mock = Mock(None)
+        pool_mock.post.return_value.status_code = 200
+        pool_mock.post.return_value.content = 'ok'
+
+        with patch('notification_pusher.session_pool', pool_mock):
+            np.batch_worker(batch, q, timeout=5)
+
+        pool_mock.post.assert_called_once_with('http://fakeurl8.com/push', data=mock.ANY, timeout=5)
+        self.assertEqual(
+            json.loads(pool_mock.post.call_args[1]['data']), [{'id': 1, 'a': 1}, {'id': 2, 'a': 2}]
+        )
+        self.assertEqual([q.get()[:2] for _ in xrange(2)], [(batch.tasks[0], 'ack'), (batch.tasks[1], 'ack')])
+        self.assertEqual(np.host_guard.states()['fakeurl8.com']['in_flight'], 0)
+
+    def test_batch_worker_skips_delivered_tasks(self):
+        q = Queue()
+        tasks = [Task(number, {'callback_url': 'http://fakeurl8.com/'}) for number in (1, 2, 3)]
+        log = DeliveryLog(10)
+        log.add(2, np.encode_payload(tasks[1]))
+        pool_mock = Mock(None)
+        pool_mock.post.return_value.status_code = 200
+        pool_mock.post.return_value.content = '{"3": 400}'
+
+        with patch('notification_pusher.session_pool', pool_mock):
+            with patch('notification_pusher.delivery_log', log):
+                np.batch_worker(Batch('http://fakeurl8.com/', tasks), q)
+                log.add(1, np.encode_payload(tasks[0]))
+                np.batch_worker(Batch('http://fakeurl8.com/', tasks[:2]), q)
+
+        self.assertEqual(
+            [(item[0].task_id, item[1]) for item in [q.get() for _ in xrange(5)]],
+            [(2, 'ack'), (1, 'ack'), (3, 'bury'), (1, 'ack'), (2, 'ack')]
+        )
+        self.assertEqual([task['id'] for task in json.loads(pool_mock.post.call_args[1]['data'])], [1, 3])
+        self.assertEqual(pool_mock.post.call_count, 1)
+        self.assertEqual(len(log), 2)
+
+    def test_batch_worker_uses_statuses_of_tasks(self):
+        q = Queue()
+        tasks = [Task(number, {'callback_url': 'http://fakeurl8.com/'}) for number in (1, 2, 3)]
+        pool_mock = Mock(None)
+        pool_mock.post.return_value.status_code = 200
+        pool_mock.post.return_value.content = '{"2": 400, "3": 503}'
+
+        with patch('notification_pusher.session_pool', pool_mock):
+            np.batch_worker(Batch('http://fakeurl8.com/', tasks), q)
+
+        self.assertEqual([q.get()[1] for _ in xrange(3)], ['ack', 'bury', 'retry'])
+
+    def test_batch_worker_applies_batch_status(self):
+        q = Queue()
+        tasks = [Task(number, {'callback_url': 'http://fakeurl8.com/'}) for number in (1, 2)]
+        pool_mock = Mock(None)
+
+        with patch('notification_pusher.session_pool', pool_mock):
+            pool_mock.post.return_value.status_code = 503
+            pool_mock.post.return_value.content = '{"1": 200}'
+            np.batch_worker(Batch('http://fakeurl8.com/', tasks), q)
+            pool_mock.post.side_effect = requests.Timeout()
+            with patch('notification_pusher.logger.exception', Mock(None)):
+                np.batch_worker(Batch('http://fakeurl8.com/', tasks), q)
+
+        self.assertEqual([q.get()[1] for _ in xrange(4)], ['retry'] * 4)
+
+    def test_notification_worker_throttles_rate_limited_hosts(self):
+        q = Queue()
+        pool_mock = Mock(None)
+        pool_mock.post.return_value.status_code = 200
+        task = Task(5, {'callback_url': 'http://fakeurl5.com/'})
+
+        with patch('notification_pusher.session_pool', pool_mock):
+            with patch('notification_pusher.host_guard', HostGuard(rate_limits={'*.com': (0.01, 1)})):
+                np.notification_worker(task, q)
+                np.notification_worker(task, q)
+
+        self.assertEqual([q.get()[1] for _ in xrange(2)], ['ack', 'throttle'])
+        self.assertEqual(pool_mock.post.call_count, 1)
+        self.assertIn(5, np.encoded_bodies)
+
+    def test_batch_worker_defers_rejected_hosts(self):
         q = Queue()
+        tasks = [Task(number, {'callback_url': 'http://fakeurl8.com/'}) for number in (1, 2)]
+        pool_mock = Mock(None)
+        guard_mock = Mock(None)
+        guard_mock.acquire.return_value = 'busy'
+
+        with patch('notification_pusher.session_pool', pool_mock):
+            with patch('notification_pusher.host_guard', guard_mock):
+                np.batch_worker(Batch('http://fakeurl8.com/', tasks), q)
+
+        self.assertEqual([q.get()[1] for _ in xrange(2)], ['defer', 'defer'])
+        self.assertFalse(pool_mock.post.called)
+
+    def test_batch_actions_ignore_unknown_body(self):
+        tasks = [Task(1, {})]
+        response = Mock(None)
+        response.status_code = 204
+
+        for content in (None, '', 'ok', '[400]', '{"1": "bad"}'):
+            response.content = content
+            self.assertEqual(np.batch_actions(tasks, response), ['ack'])
+
+    def test_batch_actions_by_notification_id(self):
+        tasks = [Task(1, {}), Task(9, {np.ORIGIN_FIELD: 2})]
+        response = Mock(None)
+        response.status_code = 200
+        response.content = '{"1": 200, "2": 503, "9": 400}'
+
+        self.assertEqual(np.batch_actions(tasks, response), ['ack', 'retry'])
+
+    def test_replace_batcher_keeps_pending_batches(self):
+        config = Mock(None)
+        config.BATCH_CALLBACKS = {'fakeurl8.com': (10, 1)}
+        np.replace_batcher(config)
+        np.batcher.add('http://fakeurl8.com/', Task(1, {}), now=0)
+
+        config.BATCH_CALLBACKS = {}
+        np.replace_batcher(config)
+
+        self.assertIsNone(np.batcher.rule('http://fakeurl8.com/'))
+        self.assertEqual(len(np.batcher.due(now=1)[0].tasks), 1)
+
+    def make_committer(self, items=()):
+        config = Mock(None)
+        config.SLEEP = 0.01
+        config.COMMIT_BATCH_SIZE = 2
+        config.COMMIT_INTERVAL = 0.01
+        config.COMMIT_RETRIES = 2
+        config.COMMIT_RETRY_DELAY = 0.5
+        config.RETRY_MAX_ATTEMPTS = 3
+        config.RETRY_DELAY = 1
+        config.RETRY_MAX_DELAY = 3
+        config.HOST_DEFER_DELAY = 7
+        processed_task_queue = gevent_queue.Queue()
+        for item in items:
+            processed_task_queue.put(item)
+        return np.Committer(config, np.Semaphore(), processed_task_queue)
+
+    def test_committer_commit(self):
         task1 = mock.Mock()
         task2 = mock.Mock()
-        q.put((task1, 'ack'))
-        q.put((task2, 'bury'))
+        committer = self.make_committer()
+        committed = np.committed_tasks.value
+        lag_count = np.commit_lag.count
+        np.encoded_bodies[task1.task_id] = '{}'
 
-        np.done_with_processed_tasks(q)
+        committer.commit([(task1, 'ack', 0), (task2, 'bury', 0)])
 
         self.assertTrue(task1.ack.called)
         self.assertTrue(task2.bury.called)
-        self.assertEqual(q.qsize(), 0)
+        self.assertNotIn(task1.task_id, np.encoded_bodies)
+        self.assertEqual(np.committed_tasks.value - committed, 2)
+        self.assertEqual(np.commit_lag.count - lag_count, 2)
+        self.assertFalse(committer.tube_lock.locked())
 
-    def test_done_with_processed_tasks_with_exc(self):
-        q = Queue()
+    @patch('notification_pusher.sleep')
+    def test_committer_retries_failed_tasks(self, sleep_m):
         task1 = mock.Mock()
-        q.put((task1, 'ack'))
+        task1.ack = mock.Mock(side_effect=[tarantool.DatabaseError(), None])
+        task2 = mock.Mock()
+        committer = self.make_committer()
 
-        exc_mock = Mock()
-        task1.ack = mock.Mock(side_effect=tarantool.DatabaseError())
-        with patch('notification_pusher.logger.exception', exc_mock):
-            np.done_with_processed_tasks(q)
+        with patch('notification_pusher.logger.exception') as exc_mock:
+            committer.commit([(task1, 'ack', 0), (task2, 'ack', 0)])
 
         self.assertTrue(exc_mock.called)
+        self.assertEqual(task1.ack.call_count, 2)
+        self.assertEqual(task2.ack.call_count, 1)
+        sleep_m.assert_called_once_with(0.5)
 
-    def test_done_with_processed_tasks_empty_queue(self):
-        q = Mock(None)
-        q.qsize = Mock(return_value=42)
-        q.get_nowait = Mock(side_effect=gevent_queue.Empty)
+    @patch('notification_pusher.sleep')
+    def test_committer_retries_after_any_queue_error(self, sleep_m):
+        task1, task2, task3 = mock.Mock(), mock.Mock(), self.make_failed_task(0)
+        task1.ack = mock.Mock(side_effect=[socket.error(104, 'Connection reset by peer'), None])
+        task2.ack = mock.Mock(side_effect=[np.QueueError('no such task'), None])
+        task3.meta = mock.Mock(side_effect=[socket.error(32, 'Broken pipe'), task3.meta.return_value])
+        committer = self.make_committer()
+        committer.pipeline = 4
+
+        with patch('notification_pusher.logger.exception'):
+            committer.commit([(task1, 'ack', 0), (task2, 'ack', 0), (task3, 'retry', 0)])
+
+        self.assertEqual([task1.ack.call_count, task2.ack.call_count, task3.meta.call_count], [2, 2, 2])
+        self.assertTrue(task3.queue.tube.return_value.put.called)
+        self.assertTrue(task3.ack.called)
+        sleep_m.assert_called_once_with(0.5)
+
+    def test_committer_pipelines_commits(self):
+        tasks = [mock.Mock() for _ in xrange(4)]
+        for task in tasks:
+            task.ack = mock.Mock(side_effect=lambda: gevent.sleep(0.05))
+        committer = self.make_committer()
+        committer.pipeline = 4
+
+        started_at = time.time()
+        committer.commit([(task, 'ack', 0) for task in tasks])
+
+        self.assertLess(time.time() - started_at, 0.15)
+        self.assertTrue(all(task.ack.called for task in tasks))
 
-        np.done_with_processed_tasks(q)
+    @patch('notification_pusher.sleep')
+    def test_committer_gives_up(self, sleep_m):
+        task = mock.Mock()
+        task.bury = mock.Mock(side_effect=tarantool.DatabaseError())
+        committer = self.make_committer()
+        errors = np.commit_errors.value
+
+        with patch('notification_pusher.logger.exception'):
+            with patch('notification_pusher.logger.error') as error_m:
+                committer.commit([(task, 'bury', 0)])
+
+        self.assertEqual(task.bury.call_count, 3)
+        self.assertEqual(np.commit_errors.value - errors, 3)
+        self.assertEqual(sleep_m.call_args_list, [mock.call(0.5), mock.call(1.0)])
+        self.assertTrue(error_m.called)
+
+    def make_failed_task(self, attempts, data=None, ttl=0):
+        task = mock.Mock()
+        task.task_id = 1
+        task.tube = 'tube'
+        task.data = dict(data or {})
+        if attempts:
+            task.data[np.ATTEMPTS_FIELD] = attempts
+        task.meta.return_value = {'created': 0, 'ttl': ttl * 1e6, 'ttr': 60e6, 'pri': 2, 'now': 30e6}
+        task.queue.tube.return_value.put.return_value.task_id = 11
+        return task
+
+    def requeued(self, task):
+        put = task.queue.tube.return_value.put
+        self.assertEqual(put.call_count, 1)
+        task.queue.tube.assert_called_with('tube')
+        data, options = put.call_args[0][0], put.call_args[1]
+        return data, options
+
+    def test_committer_retry_requeues_with_backoff(self):
+        committer = self.make_committer()
+        tasks = [self.make_failed_task(attempts, {'text': 'hi'}) for attempts in (0, 1)]
+        retried = np.retried_tasks.value
+
+        committer.commit([(task, 'retry', 0) for task in tasks])
+
+        for task, attempts, delay in zip(tasks, (1, 2), (1, 2)):
+            data, options = self.requeued(task)
+            self.assertEqual(data, {'text': 'hi', np.ATTEMPTS_FIELD: attempts, np.ORIGIN_FIELD: 1})
+            self.assertEqual(options, {'delay': delay, 'ttl': 0, 'ttr': 60, 'pri': 2})
+            self.assertTrue(task.ack.called)
+            self.assertFalse(task.release.called)
+        self.assertEqual(np.retried_tasks.value - retried, 2)
+        self.assertEqual(committer.requeued, {})
+
+    def test_committer_retry_caps_delay(self):
+        committer = self.make_committer()
+        committer.config.RETRY_MAX_ATTEMPTS = 10
+        task = self.make_failed_task(4)
+
+        committer.retry(task)
+
+        self.assertEqual(self.requeued(task)[1]['delay'], 3)
+
+    def test_committer_retry_buries_after_max_attempts(self):
+        committer = self.make_committer()
+        exhausted = self.make_failed_task(2)
+        own_limit = self.make_failed_task(2, {'max_attempts': 4})
+
+        with patch('notification_pusher.logger.warning') as warning_m:
+            committer.retry(exhausted)
+            committer.retry(own_limit)
+
+        self.assertTrue(exhausted.bury.called)
+        self.assertFalse(exhausted.queue.tube.return_value.put.called)
+        self.assertTrue(warning_m.called)
+        self.assertEqual(self.requeued(own_limit)[1]['delay'], 3)
+
+    def test_committer_retry_keeps_notification_id_and_ttl(self):
+        committer = self.make_committer()
+        task = self.make_failed_task(1, {np.ORIGIN_FIELD: 7}, ttl=100)
+        task.task_id = 10
+        np.encoded_bodies[10] = '{"id": 7}'
+
+        committer.retry(task)
+
+        data, options = self.requeued(task)
+        self.assertEqual(data[np.ORIGIN_FIELD], 7)
+        self.assertEqual(options['ttl'], 68)
+        self.assertEqual(np.encoded_bodies, {11: '{"id": 7}'})
+
+    def test_committer_retry_releases_task_about_to_expire(self):
+        committer = self.make_committer()
+        task = self.make_failed_task(0, ttl=30.5)
+
+        committer.retry(task)
+
+        task.release.assert_called_once_with(delay=1)
+        self.assertFalse(task.queue.tube.return_value.put.called)
+        self.assertFalse(task.ack.called)
 
-        self.assertRaises(gevent_queue.Empty)
+    @patch('notification_pusher.sleep')
+    def test_committer_requeues_once_when_ack_fails(self, sleep_m):
+        committer = self.make_committer()
+        task = self.make_failed_task(0)
+        task.ack.side_effect = [socket.error(104, 'Connection reset by peer'), None]
+
+        with patch('notification_pusher.logger.exception'):
+            committer.commit([(task, 'retry', 0)])
+
+        self.requeued(task)
+        self.assertEqual(task.ack.call_count, 2)
+        self.assertEqual(committer.requeued, {})
+
+    def test_committer_defer(self):
+        committer = self.make_committer()
+        task = self.make_failed_task(0, {'callback_url': 'http://fakeurl7.com/'})
+        deferred = np.deferred_tasks.value
+
+        committer.commit([(task, 'defer', 0)])
+
+        task.release.assert_called_once_with(delay=7)
+        self.assertEqual(np.deferred_tasks.value - deferred, 1)
+
+    def test_committer_throttle(self):
+        committer = self.make_committer()
+        tasks = [self.make_failed_task(0, {'callback_url': 'http://fakeurl7.com/'}) for _ in xrange(3)]
+        throttled = np.throttled_tasks.value
+
+        with patch('notification_pusher.host_guard', HostGuard(rate_limits={'fakeurl7.com': (10, 1)})):
+            np.host_guard.acquire('fakeurl7.com')
+            committer.commit([(task, 'throttle', 0) for task in tasks])
+
+        delays = [task.release.call_args[1]['delay'] for task in tasks]
+        for delay, expected in zip(delays, (0.1, 0.2, 0.3)):
+            self.assertAlmostEqual(delay, expected, delta=0.02)
+        self.assertEqual(np.throttled_tasks.value - throttled, 3)
+
+    def test_committer_defer_until_probe(self):
+        committer = self.make_committer()
+        task = self.make_failed_task(0, {'callback_url': 'http://fakeurl7.com/'})
+        np.host_guard.breaker('fakeurl7.com').open(time.time() + 100)
+
+        committer.defer(task)
+
+        delay = task.release.call_args[1]['delay']
+        self.assertTrue(100 < delay <= 130)
+
+    def test_committer_retry_does_not_count_deferrals(self):
+        committer = self.make_committer()
+        task = self.make_failed_task(1, {'callback_url': 'http://fakeurl7.com/'})
+
+        for _ in xrange(4):
+            committer.defer(task)
+        committer.retry(task)
+
+        data, options = self.requeued(task)
+        self.assertEqual((data[np.ATTEMPTS_FIELD], options['delay']), (2, 2))
+        self.assertFalse(task.bury.called)
+
+    def test_committer_collect_by_size(self):
+        items = [(Task(number, {}), 'ack', 0) for number in xrange(3)]
+        committer = self.make_committer(items)
+
+        self.assertEqual(committer.collect(timeout=1), items[:2])
+        self.assertEqual(committer.collect(timeout=1), items[2:])
+        self.assertEqual(committer.collect(timeout=0.01), [])
+
+    def test_committer_collect_by_time(self):
+        item = (Task(1, {}), 'ack', 0)
+        committer = self.make_committer([item])
+        late_item = (Task(2, {}), 'ack', 0)
+        gevent.spawn_later(0.1, committer.processed_task_queue.put, late_item)
+
+        self.assertEqual(committer.collect(timeout=1), [item])
+        self.assertEqual(committer.collect(timeout=1), [late_item])
+
+    def test_committer_flushes_on_stop(self):
+        tasks = [mock.Mock() for _ in xrange(5)]
+        committer = self.make_committer([(task, 'ack', 0) for task in tasks])
+
+        committer.stop()
+        committer.run()
+
+        self.assertTrue(all(task.ack.called for task in tasks))
+        self.assertTrue(committer.processed_task_queue.empty())
 
     @patch('notification_pusher.run_application', True)
     @patch('notification_pusher.exit_code', 0)
@@ -182,14 +715,22 @@ class NotificationPusherTestCase(unittest.TestCase):
         signal_m.SIGHUP = 30
         signal_m.SIGQUIT = 40
 
+        reload_handler_mock = Mock(None)
+        inherited = Mock(None)
+
         with patch('gevent.signal', gsig_mock):
             with patch('notification_pusher.stop_handler', stop_handler_mock):
-                np.install_signal_handlers()
+                with patch('notification_pusher.reload_handler', reload_handler_mock):
+                    with patch('notification_pusher.signal_handlers', [inherited]):
+                        np.install_signal_handlers()
+                        handlers = list(np.signal_handlers)
 
         gsig_mock.assert_any_call(10, stop_handler_mock, 10)
         gsig_mock.assert_any_call(20, stop_handler_mock, 20)
-        gsig_mock.assert_any_call(30, stop_handler_mock, 30)
+        gsig_mock.assert_any_call(30, reload_handler_mock, 30)
         gsig_mock.assert_any_call(40, stop_handler_mock, 40)
+        self.assertTrue(inherited.cancel.called)
+        self.assertEqual(handlers, [gsig_mock.return_value] * 4)
 
     def test_configure(self):
         config = Mock(None)
@@ -200,95 +741,1025 @@ class NotificationPusherTestCase(unittest.TestCase):
         config.QUEUE_TAKE_TIMEOUT = 10
         config.WORKER_POOL_SIZE = 10
         config.SLEEP = 10
+        config.QUEUE_BACKEND = 'tarantool'
+        config.QUEUE_CONNECTIONS = None
+        config.QUEUE_LANES = {}
+        config.HTTP_ENGINE = 'requests'
+        config.HTTP_MAX_CONNECTIONS_PER_HOST = 4
+        config.HTTP_IDLE_TIMEOUT = 15
+        config.HTTP_CONNECT_TIMEOUT = 2
+        config.HTTP_READ_TIMEOUT = None
+        config.ADAPTIVE_READ_TIMEOUT = False
+        config.HOST_MAX_CONCURRENCY = 3
+        config.HOST_RATE_LIMITS = {'*.example.com': (10, 20)}
+        config.PROCESSES = 1
+        config.BATCH_CALLBACKS = {'partner.example.com': (10, 1)}
+        config.ORDERED_CALLBACKS = ('ordered.example.com',)
+        config.ORDERING_MAX_PENDING = 10
+        config.ORDERING_MAX_TASKS = 100
+        config.JSON_CODEC = 'json'
+        config.ADAPTIVE_CONCURRENCY = False
+        config.DEDUP_CACHE_SIZE = 10
+        config.DEDUP_FILE = None
 
         queue_mock = Mock(None)
         process_queue_mock = Mock(None)
-        pool_mock = Mock(None)
+        workers_mock = Mock(None)
 
-        with patch('tarantool_queue.Queue', queue_mock):
+        with patch('tarantool_queue.tarantool_queue.Queue', queue_mock):
             with patch('gevent.queue.Queue', process_queue_mock):
-                with patch('notification_pusher.Pool', pool_mock):
-                    np.configure(config)
+                with patch('notification_pusher.Workers', workers_mock):
+                    with patch('notification_pusher.session_pool', None):
+                        with patch('notification_pusher.replace_resolver') as replace_resolver_m:
+                            tubes, workers, processed_task_queue = np.configure(config)
+                        session_pool = np.session_pool
+                        host_guard = np.host_guard
 
         queue_mock.assert_called_once_with(host=config.QUEUE_HOST, port=config.QUEUE_PORT, space=config.QUEUE_SPACE)
-        pool_mock.assert_called_once_with(config.WORKER_POOL_SIZE)
-        self.assertTrue(process_queue_mock.called)
+        process_queue_mock.assert_any_call(config.WORKER_POOL_SIZE)
+        workers_mock.assert_called_once_with(config, process_queue_mock(), process_queue_mock())
+        self.assertIs(workers, workers_mock())
+        self.assertEqual(len(tubes), 1)
+        self.assertEqual(session_pool.max_connections, 4)
+        self.assertEqual(session_pool.idle_timeout, 15)
+        self.assertEqual(session_pool.connect_timeout, 2)
+        self.assertEqual(host_guard.max_concurrency, 3)
+        self.assertEqual(host_guard.rate_limits.rule('partner.example.com'), (10, 20))
+        self.assertEqual(np.batcher.rule('http://partner.example.com/push'), (10, 1))
+        self.assertEqual((np.sequencer.callbacks, np.sequencer.max_pending), ({'ordered.example.com'}, 10))
+        self.assertEqual(np.json_codec.name, 'json')
+        self.assertEqual(np.delivery_log.max_size, 10)
+        replace_resolver_m.assert_called_once_with(config)
+
+    def test_replace_host_guard_splits_rate_limits_between_processes(self):
+        config = Mock(None)
+        config.HOST_MAX_CONCURRENCY = 3
+        config.HOST_RATE_LIMITS = {'*.example.com': (10, 20), 'slow.example.com': (1, 2), 'fast.example.com': None}
+        config.PROCESSES = 4
+        for name in ('WINDOW', 'MIN_CALLS', 'ERROR_RATE', 'SLOW_CALL', 'SLOW_RATE', 'RESET_TIMEOUT'):
+            setattr(config, 'BREAKER_' + name, 1)
+
+        with patch('notification_pusher.host_guard', None):
+            np.replace_host_guard(config)
+            host_guard = np.host_guard
+
+        self.assertEqual(host_guard.rate_limits.rule('a.example.com'), (2.5, 5.0))
+        self.assertEqual(host_guard.rate_limits.rule('slow.example.com'), (0.25, 1.0))
+        self.assertIsNone(host_guard.rate_limits.rule('fast.example.com'))
+        self.assertEqual(host_guard.max_concurrency, 3)
+        self.assertEqual(config.HOST_RATE_LIMITS['*.example.com'], (10, 20))
+
+    def test_configure_with_lanes(self):
+        config = Mock(None)
+        config.QUEUE_HOST = '1.1.1.1'
+        config.QUEUE_PORT = '6666'
+        config.QUEUE_SPACE = 30
+        config.QUEUE_BACKEND = 'tarantool'
+        config.QUEUE_CONNECTIONS = 2
+        config.QUEUE_TUBE = 'unused'
+        config.QUEUE_LANES = {'bulk': (1, 0), 'urgent': (4, 2)}
+        config.QUEUE_TAKE_TIMEOUT = 10
+        config.WORKER_POOL_SIZE = 10
+        queue = Mock(None)
+        queue.tube = Mock(side_effect=lambda name: 'tube ' + name)
+        replaced = dict.fromkeys((
+            'replace_resolver', 'replace_session_pool', 'replace_read_timeouts', 'replace_host_guard',
+            'replace_batcher', 'replace_sequencer', 'replace_json_codec', 'replace_delivery_log',
+            'replace_concurrency_limiter'
+        ), mock.DEFAULT)
+
+        with patch('notification_pusher.create_queue', Mock(return_value=queue)):
+            with patch.multiple('notification_pusher', **replaced):
+                tubes, workers, _ = np.configure(config)
+
+        self.assertEqual(tubes, ['tube urgent', 'tube bulk'])
+        self.assertIsInstance(workers.intake_queue, LaneQueue)
+        self.assertEqual(
+            [(lane.name, lane.weight, lane.reserved) for lane in workers.intake_queue.lanes.values()],
+            [('urgent', 4, 2), ('bulk', 1, 0)]
+        )
+        self.assertEqual(workers.intake_queue.maxsize, 10)
+
+    def test_report_lanes(self):
+        lanes = LaneQueue([Lane('urgent'), Lane('bulk')])
+        lanes.lanes['urgent'].taken = 10
+        urgent, bulk = Mock(None), Mock(None)
+        urgent.opt = {'tube': 'urgent'}
+        urgent.statistics.return_value = {'tasks': {'ready': '5'}}
+        bulk.opt = {'tube': 'bulk'}
+        bulk.statistics.side_effect = tarantool.DatabaseError('down')
+
+        with patch('notification_pusher.logger.warning') as warning_m:
+            np.report_lanes([urgent, bulk], lanes, 10.0)
+
+        self.assertEqual((lanes.lanes['urgent'].ready_gauge.value, lanes.lanes['urgent'].lag_gauge.value), (5, 5.0))
+        self.assertTrue(warning_m.called)
+
+    @patch('gevent.get_hub')
+    def test_replace_resolver(self, get_hub_m):
+        config = Mock(None)
+        config.DNS_RESOLVER = 'block'
+        config.DNS_CACHE_TTL = 30
+        config.DNS_NEGATIVE_TTL = 2
+        config.DNS_PREFETCH = 5
+        config.DNS_CACHE_SIZE = 100
+        hub = get_hub_m.return_value
+        previous = hub.resolver
+
+        np.replace_resolver(config)
+
+        self.assertTrue(previous.close.called)
+        self.assertIsInstance(hub.resolver, CachingResolver)
+        self.assertEqual(type(hub.resolver.resolver).__name__, 'BlockingResolver')
+        self.assertEqual(
+            (hub.resolver.ttl, hub.resolver.negative_ttl, hub.resolver.prefetch, hub.resolver.max_size),
+            (30, 2, 5, 100)
+        )
+
+    @patch('gevent.get_hub')
+    def test_replace_resolver_with_unknown_resolver(self, get_hub_m):
+        config = Mock(None)
+        config.DNS_RESOLVER = 'dnspython'
+        previous = get_hub_m.return_value.resolver
 
-    def test_add_worker(self):
-        worker_mock = Mock(None)
-        greenlet_mock = Mock(return_value=worker_mock)
-        config_mock = Mock(None)
-        config_mock.HTTP_CONNECTION_TIMEOUT = 1000
-        task_mock = Mock(None)
+        with self.assertRaises(ValueError):
+            np.replace_resolver(config)
+
+        self.assertIs(get_hub_m.return_value.resolver, previous)
+        self.assertFalse(previous.close.called)
+
+    @patch('notification_pusher.replace_resolver')
+    @patch('notification_pusher.load_config_from_pyfile')
+    def test_reload_config_replaces_resolver(self, load_conf_m, replace_m):
+        config = np.Config()
+        config.filepath = '/test/config.py'
+        config.DNS_CACHE_TTL = 60
+        new_config = np.Config()
+        new_config.DNS_CACHE_TTL = 10
+        load_conf_m.return_value = new_config
+
+        np.reload_config(config, Mock(None))
+
+        replace_m.assert_called_once_with(config, mock.ANY)
+        self.assertEqual(replace_m.call_args[0][1].ttl, 10)
+
+    def test_replace_session_pool(self):
+        config = Mock(None)
+        config.HTTP_ENGINE = 'requests'
+        config.HTTP_MAX_CONNECTIONS_PER_HOST = 2
+        config.HTTP_IDLE_TIMEOUT = 5
+        config.HTTP_CONNECT_TIMEOUT = 1
+        old_pool = Mock(None)
+
+        with patch('notification_pusher.session_pool', old_pool):
+            np.replace_session_pool(config)
+            new_pool = np.session_pool
+
+        self.assertTrue(old_pool.close.called)
+        self.assertIsInstance(new_pool, SessionPool)
+        self.assertEqual(new_pool.max_connections, 2)
+        self.assertEqual(new_pool.idle_timeout, 5)
+        self.assertEqual(new_pool.connect_timeout, 1)
+
+    def test_replace_session_pool_with_curl(self):
+        config = Mock(None)
+        config.HTTP_ENGINE = 'curl'
+        config.HTTP_MAX_CONNECTIONS_PER_HOST = 2
+        config.HTTP_IDLE_TIMEOUT = 5
+        config.HTTP_CONNECT_TIMEOUT = None
+
+        with patch('notification_pusher.session_pool', None):
+            np.replace_session_pool(config)
+            new_pool = np.session_pool
+
+        self.assertIsInstance(new_pool, CurlPool)
+        self.assertEqual(new_pool.max_connections, 2)
+        self.assertEqual(new_pool.idle_timeout, 5)
+        new_pool.close()
+
+    def test_replace_session_pool_with_unknown_engine(self):
+        config = Mock(None)
+        config.HTTP_ENGINE = 'urllib'
+        old_pool = Mock(None)
+
+        with patch('notification_pusher.session_pool', old_pool):
+            with self.assertRaises(ValueError):
+                np.replace_session_pool(config)
+            self.assertIs(np.session_pool, old_pool)
+
+        self.assertFalse(old_pool.close.called)
+
+    def test_replace_read_timeouts(self):
+        config = Mock(None)
+        config.HTTP_READ_TIMEOUT = None
+        config.ADAPTIVE_READ_TIMEOUT = False
+
+        np.replace_read_timeouts(config)
+        self.assertIsNone(np.read_timeouts)
+
+        config.HTTP_READ_TIMEOUT = 5
+        np.replace_read_timeouts(config)
+        self.assertIsInstance(np.read_timeouts, FixedTimeouts)
+        self.assertEqual(np.read_timeouts.read_timeout('a.example.com'), 5)
+
+        config.ADAPTIVE_READ_TIMEOUT = True
+        config.HTTP_READ_TIMEOUT_PERCENTILE = 0.9
+        config.HTTP_READ_TIMEOUT_FACTOR = 2
+        config.HTTP_READ_TIMEOUT_MIN = 1
+        config.HTTP_READ_TIMEOUT_MAX = 10
+        np.replace_read_timeouts(config)
+        timeouts = np.read_timeouts
+        self.assertIsInstance(timeouts, AdaptiveTimeouts)
+        self.assertEqual(
+            (timeouts.default, timeouts.percentile, timeouts.factor, timeouts.floor, timeouts.ceiling),
+            (5, 0.9, 2, 1, 10)
+        )
+
+    @patch('notification_pusher.replace_read_timeouts')
+    @patch('notification_pusher.load_config_from_pyfile')
+    def test_reload_config_replaces_read_timeouts(self, load_conf_m, replace_m):
+        config = np.Config()
+        config.filepath = '/test/config.py'
+        config.HTTP_READ_TIMEOUT_FACTOR = 3
+        new_config = np.Config()
+        new_config.HTTP_READ_TIMEOUT_FACTOR = 4
+        load_conf_m.return_value = new_config
+
+        np.reload_config(config, Mock(None))
+
+        replace_m.assert_called_once_with(config)
+
+    def test_post_callback_uses_read_timeout_of_host(self):
         pool_mock = Mock(None)
-        queue_mock = Mock(None)
-        notify_mock = Mock(None)
+        pool_mock.post.return_value.status_code = 200
+        timeouts = Mock(None)
+        timeouts.read_timeout.return_value = 1.5
+
+        with patch('notification_pusher.session_pool', pool_mock):
+            with patch('notification_pusher.read_timeouts', timeouts):
+                np.post_callback('http://fakeurl9.com/', '{}', timeout=5)
+                pool_mock.post.side_effect = requests.Timeout()
+                with self.assertRaises(requests.Timeout):
+                    np.post_callback('http://fakeurl9.com/', '{}', timeout=5)
+                pool_mock.post.side_effect = requests.ConnectionError()
+                with self.assertRaises(requests.ConnectionError):
+                    np.post_callback('http://fakeurl9.com/', '{}', timeout=5)
+
+        timeouts.read_timeout.assert_called_with('fakeurl9.com')
+        pool_mock.post.assert_called_with('http://fakeurl9.com/', data='{}', timeout=5, read_timeout=1.5)
+        self.assertEqual([call[0][0] for call in timeouts.observe.call_args_list], ['fakeurl9.com'] * 2)
+
+    @patch('notification_pusher.run_application', True)
+    @patch('notification_pusher.capture.record_task')
+    def test_take_tasks(self, record_m):
+        config = Mock(None)
+        config.QUEUE_TAKE_TIMEOUT = 10
+        task = Task(1, {})
+        results = [task, None]
+
+        def take(timeout):
+            result = results.pop(0)
+            if not results:
+                stop_app(None)
+            return result
+
+        tube = Mock(None)
+        tube.take = Mock(side_effect=take)
+        intake_queue = gevent_queue.Queue()
+        tube_lock = np.Semaphore()
 
-        with patch('notification_pusher.notification_worker', notify_mock):
-            with patch('notification_pusher.Greenlet', greenlet_mock):
-                np.add_worker(config_mock, task_mock, 42, pool_mock, queue_mock)
+        record_m.side_effect = lambda task: self.assertTrue(tube_lock.locked())
 
-        greenlet_mock.assert_called_with(notify_mock, task_mock, queue_mock,
-                                         timeout=config_mock.HTTP_CONNECTION_TIMEOUT, verify=False)
-        pool_mock.add.assert_called_with(worker_mock)
-        self.assertTrue(worker_mock.start.called)
+        np.take_tasks(config, tube, tube_lock, intake_queue)
+
+        tube.take.assert_called_with(config.QUEUE_TAKE_TIMEOUT)
+        self.assertEqual(tube.take.call_count, 2)
+        self.assertEqual(intake_queue.qsize(), 1)
+        self.assertIs(intake_queue.get(), task)
+        record_m.assert_called_once_with(task)
+        self.assertFalse(tube_lock.locked())
+
+    @patch('notification_pusher.run_application', True)
+    @patch('notification_pusher.capture.record_task', Mock())
+    def test_take_tasks_survives_queue_errors(self):
+        config = Mock(None)
+        config.QUEUE_TAKE_TIMEOUT = 10
+        config.SLEEP_ON_FAIL = 5
+        task = Task(1, {})
+        results = [tarantool.NetworkError('connection lost'), task]
+
+        def take(timeout):
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            stop_app(None)
+            return result
+
+        tube = Mock(None)
+        tube.take = Mock(side_effect=take)
+        intake_queue = gevent_queue.Queue()
+        tube_lock = np.Semaphore()
+
+        with patch('notification_pusher.sleep') as sleep_m:
+            with patch('notification_pusher.logger.exception'):
+                np.take_tasks(config, tube, tube_lock, intake_queue)
+
+        sleep_m.assert_any_call(5)
+        self.assertEqual(tube.take.call_count, 2)
+        self.assertIs(intake_queue.get_nowait(), task)
+        self.assertFalse(tube_lock.locked())
+
+    @patch('notification_pusher.run_application', True)
+    @patch('notification_pusher.capture.record_task', Mock())
+    def test_take_tasks_passes_on_tasks_that_can_not_be_routed(self):
+        config = Mock(None)
+        config.QUEUE_TAKE_TIMEOUT = 10
+        tasks = [Task(1, ['not', 'a', 'dict']), Task(2, None), Task(3, {'callback_url': 'http://fakeurl9.com/'})]
+
+        def take(timeout):
+            if len(tasks) == 1:
+                stop_app(None)
+            return tasks.pop(0)
+
+        tube = Mock(None)
+        tube.take = Mock(side_effect=take)
+        intake_queue = gevent_queue.Queue()
+
+        with patch('notification_pusher.batcher', Batcher({'fakeurl8.com': (2, 10)})):
+            with patch('notification_pusher.logger.warning') as warning_m:
+                np.take_tasks(config, tube, np.Semaphore(), intake_queue)
+
+        self.assertEqual([intake_queue.get_nowait().task_id for _ in xrange(3)], [1, 2, 3])
+        self.assertEqual(warning_m.call_count, 2)
+
+    @patch('notification_pusher.run_application', True)
+    @patch('notification_pusher.capture.record_task', Mock())
+    def test_take_tasks_collects_batches(self):
+        config = Mock(None)
+        config.QUEUE_TAKE_TIMEOUT = 10
+        url = 'http://fakeurl8.com/push'
+        tasks = [Task(1, {'callback_url': url}), Task(2, {'callback_url': 'http://fakeurl9.com/'}),
+                 Task(3, {'callback_url': url}), Task(4, {'callback_url': url})]
+
+        def take(timeout):
+            if len(tasks) == 1:
+                stop_app(None)
+            return tasks.pop(0)
+
+        tube = Mock(None)
+        tube.take = Mock(side_effect=take)
+        intake_queue = gevent_queue.Queue()
+
+        with patch('notification_pusher.batcher', Batcher({url: (2, 10)})):
+            np.take_tasks(config, tube, np.Semaphore(), intake_queue)
+            pending = len(np.batcher)
+
+        self.assertEqual(intake_queue.get().task_id, 2)
+        batch = intake_queue.get()
+        self.assertEqual((batch.url, [task.task_id for task in batch.tasks]), (url, [1, 3]))
+        self.assertTrue(intake_queue.empty())
+        self.assertEqual(pending, 1)
+
+    @patch('notification_pusher.run_application', True)
+    def test_flush_batches(self):
+        config = Mock(None)
+        config.SLEEP = 10
+        intake_queue = gevent_queue.Queue()
+        np.batcher = Batcher({'fakeurl8.com': (10, 0.01)})
+        np.batcher.add('http://fakeurl8.com/', Task(1, {}))
+
+        with patch('notification_pusher.sleep', Mock(side_effect=stop_app)) as sleep_m:
+            np.flush_batches(config, intake_queue)
+
+        self.assertEqual(intake_queue.qsize(), 0)
+        self.assertLessEqual(sleep_m.call_args[0][0], 0.01)
+
+        np.run_application = True
+        gevent.sleep(0.02)
+        with patch('notification_pusher.sleep', Mock(side_effect=stop_app)) as sleep_m:
+            np.flush_batches(config, intake_queue)
+
+        self.assertEqual(intake_queue.get().url, 'http://fakeurl8.com/')
+        sleep_m.assert_called_once_with(10)
+
+    def make_workers(self):
+        config = Mock(None)
+        config.SLEEP = 0.01
+        config.HTTP_CONNECTION_TIMEOUT = 1000
+        workers = np.Workers(config, gevent_queue.Queue(1), gevent_queue.Queue())
+        self.addCleanup(workers.kill)
+        return workers
+
+    @patch('notification_pusher.run_application', True)
+    @patch('notification_pusher.notification_worker')
+    def test_workers_process_tasks(self, notify_mock):
+        workers = self.make_workers()
+        task = Task(1, {})
+
+        workers.resize(2)
+        workers.intake_queue.put(task)
+        gevent.sleep(0.05)
+
+        notify_mock.assert_called_once_with(task, workers.processed_task_queue, timeout=1000, verify=False)
+        self.assertEqual(workers.running, 2)
+        self.assertEqual(workers.intake_queue.maxsize, 2)
+
+    @patch('notification_pusher.run_application', True)
+    @patch('notification_pusher.batch_worker')
+    def test_workers_process_batches(self, batch_mock):
+        workers = self.make_workers()
+        batch = Batch('http://fakeurl8.com/', [Task(1, {})])
+
+        workers.resize(1)
+        workers.intake_queue.put(batch)
+        gevent.sleep(0.05)
+
+        batch_mock.assert_called_once_with(batch, workers.processed_task_queue, timeout=1000, verify=False)
+
+    @patch('notification_pusher.run_application', True)
+    @patch('notification_pusher.notification_worker', Mock(side_effect=KeyError('callback_url')))
+    def test_workers_survive_errors(self):
+        workers = self.make_workers()
+
+        workers.resize(1)
+        with patch('notification_pusher.logger.exception') as exception_m:
+            workers.intake_queue.put(Task(1, {}))
+            gevent.sleep(0.05)
+
+        self.assertTrue(exception_m.called)
+        self.assertEqual(workers.running, 1)
+
+    @patch('notification_pusher.run_application', True)
+    @patch('notification_pusher.notification_worker')
+    def test_workers_bury_tasks_that_can_not_be_routed(self, notify_mock):
+        workers = self.make_workers()
+        malformed = [Task(1, ['not', 'a', 'dict']), Task(2, None)]
+        task = Task(3, {})
+
+        workers.resize(1)
+        with patch('notification_pusher.logger.error'):
+            for item in malformed + [task]:
+                workers.intake_queue.put(item)
+            gevent.sleep(0.05)
+
+        self.assertEqual(
+            [workers.processed_task_queue.get_nowait()[:2] for _ in malformed],
+            [(malformed[0], 'bury'), (malformed[1], 'bury')]
+        )
+        notify_mock.assert_called_once_with(task, workers.processed_task_queue, timeout=1000, verify=False)
+        self.assertEqual(workers.running, 1)
+
+    def test_touch_held_tasks(self):
+        waiting, failing = mock.Mock(), mock.Mock()
+        failing.touch.side_effect = tarantool.DatabaseError('Task is not taken')
+        sequencer = Sequencer(max_pending=5)
+        for key, task in (('a', mock.Mock()), ('a', waiting), ('a', failing)):
+            sequencer.add(key, task)
+        tube_lock = np.Semaphore()
+        touched = np.ordering_touches.value
+
+        with patch('notification_pusher.sequencer', sequencer):
+            with patch('notification_pusher.logger.warning') as warning_m:
+                np.touch_held_tasks(tube_lock, pipeline=4)
+
+        self.assertTrue(waiting.touch.called)
+        self.assertTrue(failing.touch.called)
+        self.assertEqual(warning_m.call_count, 1)
+        self.assertEqual(np.ordering_touches.value - touched, 2)
+        self.assertFalse(tube_lock.locked())
+
+    @patch('notification_pusher.run_application', True)
+    def test_workers_drain(self):
+        workers = self.make_workers()
+        workers.intake_queue.maxsize = 3
+        fast, slow, waiting = Task(1, {}), Task(2, {}), Task(3, {})
+
+        def deliver(task, task_queue, *args, **kwargs):
+            gevent.sleep(0.01 if task is fast else 10)
+            task_queue.put((task, 'ack', time.time()))
+
+        with patch('notification_pusher.notification_worker', Mock(side_effect=deliver)):
+            workers.resize(2)
+            workers.intake_queue.put(fast)
+            workers.intake_queue.put(slow)
+            gevent.sleep(0)
+            workers.intake_queue.put(waiting)
+            unfinished = workers.drain(0.1)
+
+        self.assertEqual(unfinished, [slow, waiting])
+        self.assertIs(workers.processed_task_queue.get_nowait()[0], fast)
+        self.assertEqual((workers.running, workers.busy, workers.current), (0, 0, {}))
+
+    def make_ordered_workers(self, deliver, size=2):
+        workers = self.make_workers()
+        workers.config.RETRY_MAX_ATTEMPTS = 3
+        workers.config.RETRY_DELAY = 0.01
+        workers.config.RETRY_MAX_DELAY = 1
+        workers.intake_queue.maxsize = 10
+        patcher = patch('notification_pusher.notification_worker', Mock(side_effect=deliver))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        workers.resize(size)
+        workers.intake_queue.maxsize = 10
+        return workers
+
+    def processed(self, workers):
+        queue = workers.processed_task_queue
+        return [(task.task_id, action) for task, action, _ in [queue.get_nowait() for _ in xrange(queue.qsize())]]
+
+    @patch('notification_pusher.run_application', True)
+    def test_workers_count_tasks_of_lanes(self):
+        busy = []
+        lanes = LaneQueue([Lane('urgent'), Lane('bulk')])
+
+        def deliver(task, task_queue, *args, **kwargs):
+            busy.append([lane.busy for lane in lanes.lanes.values()])
+            task_queue.put((task, 'ack', time.time()))
+
+        workers = np.Workers(self.make_workers().config, lanes, gevent_queue.Queue())
+        self.addCleanup(workers.kill)
+        with patch('notification_pusher.notification_worker', Mock(side_effect=deliver)):
+            workers.resize(1)
+            task = Task(1, {})
+            task.tube = 'bulk'
+            lanes.put(task)
+            gevent.sleep(0.05)
+
+        self.assertEqual(busy, [[0, 1]])
+        self.assertEqual(lanes.lanes['bulk'].busy, 0)
+        self.assertEqual(lanes.lanes['bulk'].queue.maxsize, 1)
+
+    @patch('notification_pusher.run_application', True)
+    def test_workers_deliver_tasks_of_key_in_order(self):
+        events = []
+
+        def deliver(task, task_queue, *args, **kwargs):
+            events.append(('start', task.task_id))
+            gevent.sleep(0.02)
+            events.append(('end', task.task_id))
+            task_queue.put((task, 'ack', time.time()))
+
+        workers = self.make_ordered_workers(deliver, size=3)
+        for task_id, key in ((1, 'a'), (2, 'a'), (3, 'b'), (4, 'a')):
+            workers.intake_queue.put(Task(task_id, {'ordering_key': key}))
+        gevent.sleep(0.15)
+
+        self.assertEqual(
+            [event for event in events if event[1] != 3],
+            [('start', 1), ('end', 1), ('start', 2), ('end', 2), ('start', 4), ('end', 4)]
+        )
+        self.assertLess(events.index(('start', 3)), events.index(('end', 1)))
+        self.assertEqual(sorted(self.processed(workers)), [(task_id, 'ack') for task_id in (1, 2, 3, 4)])
+        self.assertEqual((np.sequencer.keys, len(np.sequencer)), ({}, 0))
+
+    @patch('notification_pusher.run_application', True)
+    def test_workers_retry_ordered_task_in_place(self):
+        delivered = []
+
+        def deliver(task, task_queue, *args, **kwargs):
+            delivered.append(task.task_id)
+            action = 'retry' if delivered.count(task.task_id) == 1 and task.task_id == 1 else 'ack'
+            task_queue.put((task, action, time.time()))
+
+        workers = self.make_ordered_workers(deliver)
+        workers.intake_queue.put(Task(1, {'ordering_key': 'a'}))
+        workers.intake_queue.put(Task(2, {'ordering_key': 'a'}))
+        gevent.sleep(0.1)
+
+        self.assertEqual(delivered, [1, 1, 2])
+        self.assertEqual(self.processed(workers), [(1, 'ack'), (2, 'ack')])
+
+    @patch('notification_pusher.run_application', True)
+    def test_workers_skip_failed_ordered_task(self):
+        def deliver(task, task_queue, *args, **kwargs):
+            task_queue.put((task, 'retry' if task.task_id == 1 else 'ack', time.time()))
+
+        workers = self.make_ordered_workers(deliver)
+        workers.config.ORDERING_FAILURE = 'skip'
+        workers.intake_queue.put(Task(1, {'ordering_key': 'a', 'max_attempts': 2}))
+        workers.intake_queue.put(Task(2, {'ordering_key': 'a'}))
+        gevent.sleep(0.1)
+
+        self.assertEqual(self.processed(workers), [(1, 'bury'), (2, 'ack')])
+
+    @patch('notification_pusher.run_application', True)
+    def test_workers_bury_tasks_behind_failed_ordered_task(self):
+        delivered = []
+
+        def deliver(task, task_queue, *args, **kwargs):
+            delivered.append(task.task_id)
+            gevent.sleep(0.01)
+            task_queue.put((task, 'retry', time.time()))
+
+        workers = self.make_ordered_workers(deliver)
+        workers.config.ORDERING_FAILURE = 'bury'
+        for task_id in (1, 2, 3):
+            workers.intake_queue.put(Task(task_id, {'ordering_key': 'a', 'max_attempts': 1}))
+        gevent.sleep(0.05)
+
+        self.assertEqual(delivered, [1])
+        self.assertEqual(self.processed(workers), [(1, 'bury'), (2, 'bury'), (3, 'bury')])
+        self.assertEqual(len(np.sequencer), 0)
+
+    @patch('notification_pusher.run_application', True)
+    def test_workers_defer_tasks_beyond_key_limit(self):
+        release = Event()
+
+        def deliver(task, task_queue, *args, **kwargs):
+            release.wait()
+            task_queue.put((task, 'ack', time.time()))
+
+        np.sequencer = Sequencer(max_pending=1)
+        workers = self.make_ordered_workers(deliver)
+        for task_id in (1, 2, 3):
+            workers.intake_queue.put(Task(task_id, {'ordering_key': 'a'}))
+        gevent.sleep(0.02)
+        release.set()
+        gevent.sleep(0.02)
+
+        self.assertEqual(self.processed(workers), [(3, 'defer'), (1, 'ack'), (2, 'ack')])
+
+    @patch('notification_pusher.run_application', True)
+    def test_workers_drain_returns_delayed_ordered_tasks(self):
+        def deliver(task, task_queue, *args, **kwargs):
+            task_queue.put((task, 'defer', time.time()))
+
+        np.host_guard = HostGuard()
+        workers = self.make_ordered_workers(deliver)
+        workers.config.HOST_DEFER_DELAY = 10
+        task = Task(1, {'ordering_key': 'a', 'callback_url': 'http://fakeurl8.com/'})
+        workers.intake_queue.put(task)
+        gevent.sleep(0.02)
+
+        self.assertEqual(workers.drain(0.01), [task])
+        self.assertEqual((len(workers.delayed), workers.delayed_keys), (0, {}))
+
+    @patch('notification_pusher.run_application', True)
+    @patch('notification_pusher.capture.record_task', Mock())
+    def test_take_tasks_does_not_batch_ordered_tasks(self):
+        config = Mock(None)
+        config.QUEUE_TAKE_TIMEOUT = 10
+        url = 'http://fakeurl8.com/push'
+        task = Task(1, {'callback_url': url, 'ordering_key': 'a'})
+
+        def take(timeout):
+            stop_app(None)
+            return task
+
+        tube = Mock(None)
+        tube.take = Mock(side_effect=take)
+        intake_queue = gevent_queue.Queue()
+
+        with patch('notification_pusher.batcher', Batcher({url: (2, 10)})):
+            np.take_tasks(config, tube, np.Semaphore(), intake_queue)
+
+        self.assertIs(intake_queue.get_nowait(), task)
+
+    def test_replace_delivery_log(self):
+        config = Mock(None)
+        config.DEDUP_CACHE_SIZE = 10
+        config.DEDUP_FILE = None
+
+        np.replace_delivery_log(config)
+        previous = np.delivery_log
+        previous.add(1, '{}')
+
+        config.DEDUP_CACHE_SIZE = 5
+        np.replace_delivery_log(config)
+        self.assertEqual(np.delivery_log.max_size, 5)
+        self.assertTrue(np.delivery_log.seen(1, '{}'))
+
+        config.DEDUP_CACHE_SIZE = 0
+        np.replace_delivery_log(config)
+        self.assertIsNone(np.delivery_log)
+
+    @patch('notification_pusher.process_number', 3)
+    def test_replace_delivery_log_with_file_per_process(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        config = Mock(None)
+        config.DEDUP_CACHE_SIZE = 10
+        config.DEDUP_FILE = os.path.join(directory, 'delivered.{process}.log')
+
+        np.replace_delivery_log(config)
+        np.delivery_log.add(1, '{}')
+        np.delivery_log.close()
+
+        self.assertEqual(np.delivery_log.path, os.path.join(directory, 'delivered.3.log'))
+        self.assertTrue(os.path.exists(np.delivery_log.path))
+
+    @patch('notification_pusher.run_application', True)
+    def test_take_tasks_returns_task_held_when_killed(self):
+        config = Mock(None)
+        config.QUEUE_TAKE_TIMEOUT = 10
+        task = Task(1, {})
+        tube = Mock(None)
+        tube.take.return_value = task
+        intake_queue = gevent_queue.Queue(1)
+        intake_queue.put(Task(0, {}))
+        tube_lock = np.Semaphore()
+
+        with patch('notification_pusher.capture.record_task', Mock()):
+            taker = gevent.spawn(np.take_tasks, config, tube, tube_lock, intake_queue)
+            gevent.sleep(0.01)
+            with tube_lock:
+                taker.kill()
+
+        self.assertIs(taker.value, task)
+        self.assertEqual(tube.take.call_count, 1)
+
+    @patch('notification_pusher.run_application', True)
+    def test_flush_batches_returns_batches_when_killed(self):
+        config = Mock(None)
+        config.SLEEP = 10
+        intake_queue = gevent_queue.Queue(1)
+        intake_queue.put(Task(0, {}))
+        np.batcher = Batcher({'fakeurl8.com': (10, 0)})
+        np.batcher.add('http://fakeurl8.com/', Task(1, {}))
+
+        flusher = gevent.spawn(np.flush_batches, config, intake_queue)
+        gevent.sleep(0.01)
+        flusher.kill()
+
+        self.assertEqual([batch.url for batch in flusher.value], ['http://fakeurl8.com/'])
+
+    def test_drain(self):
+        config = Mock(None)
+        config.SHUTDOWN_TIMEOUT = 5
+        tasks = [Task(number, {'callback_url': 'http://fakeurl8.com/'}) for number in xrange(6)]
+        taker = Mock(None)
+        taker.value = tasks[1]
+        flusher = Mock(None)
+        flusher.value = [Batch('http://fakeurl8.com/', [tasks[2]])]
+        workers = Mock(None)
+        workers.drain.return_value = [tasks[0]]
+        processed_task_queue = gevent_queue.Queue()
+        tube_lock = np.Semaphore()
+        taker.kill.side_effect = lambda: self.assertTrue(tube_lock.locked())
+        np.batcher = Batcher({'fakeurl8.com': (10, 10)})
+        np.batcher.add('http://fakeurl8.com/', tasks[3])
+        np.batcher.add('http://fakeurl8.com/', tasks[4])
+        np.sequencer.add('key', tasks[0])
+        np.sequencer.add('key', tasks[5])
+
+        np.drain(config, tube_lock, [taker], flusher, workers, processed_task_queue)
+
+        self.assertTrue(taker.kill.called)
+        self.assertTrue(flusher.kill.called)
+        workers.drain.assert_called_once_with(5)
+        released = [processed_task_queue.get_nowait() for _ in xrange(processed_task_queue.qsize())]
+        self.assertEqual([(task, action) for task, action, _ in released], [(task, 'release') for task in tasks])
+        self.assertEqual(len(np.batcher), 0)
+        self.assertEqual(len(np.sequencer), 0)
+
+    @patch('notification_pusher.run_application', True)
+    def test_workers_resize(self):
+        workers = self.make_workers()
+
+        workers.resize(4)
+        gevent.sleep(0)
+        self.assertEqual(workers.running, 4)
+
+        workers.resize(1)
+        self.assertEqual(workers.retiring, 3)
+        workers.resize(2)
+        self.assertEqual(workers.retiring, 2)
+        gevent.sleep(0.05)
+
+        self.assertEqual(workers.running, 2)
+        self.assertEqual(workers.retiring, 0)
+        self.assertEqual(len(workers.group), 2)
+        self.assertEqual(workers.spawned, 4)
+
+    @patch('notification_pusher.run_application', True)
+    def test_workers_track_peak_busy(self):
+        workers = self.make_workers()
+        release = Event()
+
+        with patch('notification_pusher.notification_worker', Mock(side_effect=lambda *args, **kwargs: release.wait())):
+            workers.resize(3)
+            for task_id in (1, 2):
+                workers.intake_queue.put(Task(task_id, {}))
+                gevent.sleep(0.02)
+            self.assertEqual(workers.busy, 2)
+            release.set()
+            gevent.sleep(0.02)
+
+        self.assertEqual(workers.busy, 0)
+        self.assertEqual(workers.take_peak_busy(), 2)
+        self.assertEqual(workers.take_peak_busy(), 0)
+        self.assertEqual(workers.size, 3)
+
+    def test_replace_concurrency_limiter(self):
+        config = Mock(None)
+        config.WORKER_POOL_SIZE = 10
+        config.ADAPTIVE_CONCURRENCY = True
+        config.CONCURRENCY_MIN = 2
+        config.CONCURRENCY_MAX = 50
+        config.CONCURRENCY_INCREASE = 3
+        config.CONCURRENCY_DECREASE = 0.7
+        config.CONCURRENCY_LATENCY = 0.5
+        config.CONCURRENCY_ERROR_RATE = 0.2
+
+        np.replace_concurrency_limiter(config)
+        limiter = np.concurrency_limiter
+
+        self.assertEqual(
+            (limiter.limit, limiter.min_limit, limiter.max_limit, limiter.increase, limiter.decrease,
+             limiter.latency, limiter.error_rate),
+            (10, 2, 50, 3, 0.7, 0.5, 0.2)
+        )
+        self.assertEqual(np.concurrency_limit.value, 10)
+
+        config.ADAPTIVE_CONCURRENCY = False
+        np.replace_concurrency_limiter(config)
+        self.assertIsNone(np.concurrency_limiter)
+
+    def test_adjust_concurrency(self):
+        workers = Mock(None)
+        workers.size = 10
+        workers.take_peak_busy.return_value = 10
+        limiter = Mock(None)
+        limiter.update.return_value = (12, 'all workers busy')
+        increases = np.concurrency_increases.value
+
+        with patch('notification_pusher.concurrency_limiter', limiter):
+            np.adjust_concurrency(workers)
+
+        limiter.update.assert_called_once_with(True)
+        workers.resize.assert_called_once_with(12)
+        self.assertEqual(np.concurrency_limit.value, 12)
+        self.assertEqual(np.concurrency_increases.value - increases, 1)
+
+    def test_adjust_concurrency_decreases(self):
+        workers = Mock(None)
+        workers.size = 10
+        workers.take_peak_busy.return_value = 4
+        limiter = Mock(None)
+        limiter.update.return_value = (5, 'degraded')
+        decreases = np.concurrency_decreases.value
+
+        with patch('notification_pusher.concurrency_limiter', limiter):
+            with patch('notification_pusher.logger.warning') as warning_m:
+                np.adjust_concurrency(workers)
+
+        limiter.update.assert_called_once_with(False)
+        workers.resize.assert_called_once_with(5)
+        warning_m.assert_called_once_with('Decrease worker pool size %s -> %s: %s.', 10, 5, 'degraded')
+        self.assertEqual(np.concurrency_decreases.value - decreases, 1)
+
+    def test_adjust_concurrency_without_change(self):
+        workers = Mock(None)
+        workers.size = 10
+        workers.take_peak_busy.return_value = 10
+        limiter = Mock(None)
+        limiter.update.return_value = None
+
+        with patch('notification_pusher.concurrency_limiter', limiter):
+            np.adjust_concurrency(workers)
+
+        self.assertFalse(workers.resize.called)
+
+    def test_post_callback_reports_to_concurrency_limiter(self):
+        pool_mock = Mock(None)
+        pool_mock.post.return_value.status_code = 503
+        limiter = Mock(None)
+
+        with patch('notification_pusher.session_pool', pool_mock):
+            with patch('notification_pusher.concurrency_limiter', limiter):
+                np.post_callback('http://fakeurl9.com/', '{}')
+
+        self.assertEqual(limiter.observe.call_count, 1)
+        self.assertTrue(limiter.observe.call_args[0][1])
 
     @patch('notification_pusher.run_application', True)
     @patch('notification_pusher.configure')
-    @patch('notification_pusher.done_with_processed_tasks')
-    @patch('notification_pusher.add_worker')
-    def test_main_loop_when_app_is_running(self, add_work_mock, done_mock, configure_mock):
+    @patch('notification_pusher.Committer')
+    @patch('notification_pusher.take_tasks', Mock(None))
+    @patch('notification_pusher.drain', Mock(None))
+    @patch('notification_pusher.adjust_concurrency')
+    def test_main_loop_adjusts_concurrency(self, adjust_m, committer_mock, configure_mock):
+        config_mock = Mock(None)
+        config_mock.SLEEP = 0.01
+        config_mock.METRICS_INTERVAL = 60
+        config_mock.CONCURRENCY_INTERVAL = 0
+        limiter = Mock(None)
+        limiter.limit = 7
+        workers_mock = Mock(None)
+        configure_mock.return_value = [Mock(None)], workers_mock, gevent_queue.Queue()
+        adjust_m.side_effect = lambda *args: stop_app(None)
+
+        with patch('notification_pusher.concurrency_limiter', limiter):
+            np.main_loop(config_mock)
+
+        workers_mock.resize.assert_called_once_with(7)
+        adjust_m.assert_called_once_with(workers_mock)
+
+    @patch('notification_pusher.run_application', True)
+    @patch('notification_pusher.configure')
+    @patch('notification_pusher.Committer')
+    @patch('notification_pusher.take_tasks')
+    @patch('notification_pusher.drain')
+    @patch('notification_pusher.metrics.report')
+    def test_main_loop_when_app_is_running(self, report_mock, drain_mock, take_mock, committer_mock, configure_mock):
         config_mock = Mock(None)
-        config_mock.QUEUE_TAKE_TIMEOUT = 10
         config_mock.SLEEP = 10
-        task_mock = Mock(None)
+        config_mock.WORKER_POOL_SIZE = 5
+        config_mock.METRICS_INTERVAL = 0
         tube_mock = Mock(None)
-        tube_mock.take = Mock(return_value=task_mock)
-        pool_mock = Mock(None)
-        pool_mock.free_count = Mock(return_value=5)
-        queue_mock = Mock(None)
-        configure_mock.return_value = tube_mock, pool_mock, queue_mock
+        workers_mock = Mock(None)
+        processed_task_queue = gevent_queue.Queue()
+        configure_mock.return_value = [tube_mock], workers_mock, processed_task_queue
         sleep_mock = Mock(side_effect=stop_app)
 
-        with patch('notification_pusher.sleep', sleep_mock):
-            np.main_loop(config_mock)
+        with patch('gevent.spawn') as spawn_mock:
+            spawn_mock.return_value.ready.return_value = False
+            with patch('notification_pusher.sleep', sleep_mock):
+                np.main_loop(config_mock)
 
         configure_mock.assert_called_once_with(config_mock)
-        self.assertTrue(pool_mock.free_count.called)
-        self.assertEqual(tube_mock.take.call_count, 5)
-        tube_mock.take.assert_call_any(config_mock.QUEUE_TAKE_TIMEOUT)
-        done_mock.assert_called_once_with(queue_mock)
+        workers_mock.resize.assert_called_once_with(5)
+        committer_mock.assert_called_once_with(config_mock, mock.ANY, processed_task_queue, 1)
+        spawn_mock.assert_any_call(take_mock, config_mock, tube_mock, mock.ANY, workers_mock.intake_queue)
+        spawn_mock.assert_any_call(committer_mock().run)
         sleep_mock.assert_called_once_with(config_mock.SLEEP)
+        report_mock.assert_called_once_with(np.logger, prefix='pusher.')
+        drain_mock.assert_called_once_with(
+            config_mock, mock.ANY, [spawn_mock()], spawn_mock(), workers_mock, processed_task_queue
+        )
+        self.assertTrue(committer_mock().stop.called)
+        self.assertTrue(spawn_mock().join.called)
 
     @patch('notification_pusher.run_application', True)
     @patch('notification_pusher.configure')
-    @patch('notification_pusher.done_with_processed_tasks')
-    @patch('notification_pusher.add_worker')
-    def test_main_loop_when_app_is_running_but_no_tasks(self, add_work_mock, done_mock, configure_mock):
+    @patch('notification_pusher.Committer')
+    @patch('notification_pusher.take_tasks', Mock(side_effect=lambda *args: gevent.sleep(1)))
+    @patch('notification_pusher.drain', Mock(None))
+    def test_main_loop_restarts_dead_committer(self, committer_mock, configure_mock):
         config_mock = Mock(None)
-        config_mock.QUEUE_TAKE_TIMEOUT = 10
-        config_mock.SLEEP = 10
-        tube_mock = Mock(None)
-        tube_mock.take = Mock(return_value=None)
-        pool_mock = Mock(None)
-        pool_mock.free_count = Mock(return_value=5)
-        queue_mock = Mock(None)
-        configure_mock.return_value = tube_mock, pool_mock, queue_mock
-        sleep_mock = Mock(side_effect=stop_app)
+        config_mock.SLEEP = 0.01
+        config_mock.METRICS_INTERVAL = 60
+        config_mock.WORKER_POOL_SIZE = 5
+        configure_mock.return_value = [Mock(None)], Mock(None), gevent_queue.Queue()
+        runs = []
 
-        with patch('notification_pusher.sleep', sleep_mock):
-            np.main_loop(config_mock)
+        def run():
+            runs.append(True)
+            if len(runs) == 1:
+                raise np.QueueError('committer failed')
+            stop_app(None)
 
-        self.assertFalse(add_work_mock.called)
+        committer_mock.return_value.run = run
+
+        with patch('notification_pusher.logger.error') as error_m:
+            with patch.object(gevent.get_hub(), 'print_exception'):
+                np.main_loop(config_mock)
+
+        self.assertEqual(len(runs), 2)
+        error_m.assert_called_once_with('%s exited with %r, restart it.', 'Committer', mock.ANY)
+
+    @patch('notification_pusher.run_application', True)
+    @patch('notification_pusher.configure')
+    @patch('notification_pusher.Committer')
+    @patch('notification_pusher.take_tasks')
+    @patch('notification_pusher.drain', Mock(None))
+    def test_main_loop_restarts_dead_takers(self, take_mock, committer_mock, configure_mock):
+        config_mock = Mock(None)
+        config_mock.SLEEP = 0.01
+        config_mock.METRICS_INTERVAL = 60
+        config_mock.WORKER_POOL_SIZE = 5
+        tubes = [Mock(None), Mock(None)]
+        configure_mock.return_value = tubes, Mock(None), gevent_queue.Queue()
+        taken = []
+
+        def take_tasks(config, tube, tube_lock, intake_queue):
+            taken.append(tube)
+            if len(taken) == 3:
+                stop_app(None)
+            if tube is tubes[0] and taken.count(tube) == 1:
+                raise AttributeError('data')
+            gevent.sleep(1)
+
+        take_mock.side_effect = take_tasks
+        committer_mock.return_value.run = lambda: gevent.sleep(0.2)
+
+        with patch('notification_pusher.logger.error') as error_m:
+            with patch.object(gevent.get_hub(), 'print_exception'):
+                np.main_loop(config_mock)
+
+        self.assertEqual(taken, [tubes[0], tubes[1], tubes[0]])
+        error_m.assert_called_once_with('%s exited with %r, restart it.', 'Taker#0', mock.ANY)
 
     @patch('notification_pusher.run_application', False)
     @patch('notification_pusher.configure')
+    @patch('notification_pusher.drain', Mock(None))
     @patch('notification_pusher.logger.info')
     def test_main_loop_when_app_is_not_running(self, info_mock, configure_mock):
         config_mock = Mock(None)
-        configure_mock.return_value = Mock(None), Mock(None), Mock(None)
+        configure_mock.return_value = [Mock(None)], Mock(None), Mock(None)
 
-        np.main_loop(config_mock)
+        with patch('notification_pusher.Committer'):
+            np.main_loop(config_mock)
 
         info_mock.assert_called_once_with('Stop application loop.')
 
@@ -310,6 +1781,8 @@ class NotificationPusherTestCase(unittest.TestCase):
         conf_mock = Mock(None)
         conf_mock.LOGGING = 'test'
         conf_mock.SLEEP_ON_FAIL = 100
+        conf_mock.CAPTURE_FILE = None
+        conf_mock.PROCESSES = 1
         main_m.side_effect = stop_app
         parse_cmd_m.return_value = args_mock
         load_conf_m.return_value = conf_mock
@@ -344,6 +1817,8 @@ class NotificationPusherTestCase(unittest.TestCase):
         conf_mock = Mock(None)
         conf_mock.LOGGING = 'test'
         conf_mock.SLEEP_ON_FAIL = 100
+        conf_mock.CAPTURE_FILE = None
+        conf_mock.PROCESSES = 1
         main_m.side_effect = Exception('err')
         sleep_m.side_effect = stop_app
         parse_cmd_m.return_value = args_mock
@@ -371,6 +1846,8 @@ class NotificationPusherTestCase(unittest.TestCase):
         conf_mock = Mock(None)
         conf_mock.LOGGING = 'test'
         conf_mock.SLEEP_ON_FAIL = 100
+        conf_mock.CAPTURE_FILE = None
+        conf_mock.PROCESSES = 1
         main_m.side_effect = stop_app
         parse_cmd_m.return_value = args_mock
         load_conf_m.return_value = conf_mock
@@ -397,10 +1874,311 @@ class NotificationPusherTestCase(unittest.TestCase):
         conf_mock = Mock(None)
         conf_mock.LOGGING = 'test'
         conf_mock.SLEEP_ON_FAIL = 100
+        conf_mock.CAPTURE_FILE = None
+        conf_mock.PROCESSES = 1
         main_m.side_effect = stop_app
         parse_cmd_m.return_value = args_mock
         load_conf_m.return_value = conf_mock
 
         np.main([])
 
-        self.assertFalse(create_pid_m.called)
\ No newline at end of file
+        self.assertFalse(create_pid_m.called)
+
+    @patch('notification_pusher.run_application', True)
+    @patch('notification_pusher.parse_cmd_args', Mock(return_value=argparse.Namespace(
+        daemon=False, pidfile=None, config='test')))
+    @patch('notification_pusher.load_config_from_pyfile')
+    @patch('notification_pusher.patch_all', Mock())
+    @patch('notification_pusher.dictConfig', Mock())
+    @patch('notification_pusher.install_signal_handlers', Mock())
+    @patch('notification_pusher.Supervisor')
+    @patch('notification_pusher.run')
+    def test_main_prefork(self, run_m, supervisor_m, load_conf_m):
+        conf_mock = Mock(None)
+        conf_mock.PROCESSES = 3
+        load_conf_m.return_value = conf_mock
+        supervisor_m.return_value.run.return_value = 143
+
+        self.assertEqual(np.main(['pusher']), 143)
+
+        supervisor_m.assert_called_once_with(conf_mock)
+        self.assertFalse(run_m.called)
+
+    def make_supervisor(self, processes=2):
+        config = Mock(None)
+        config.PROCESSES = processes
+        config.SLEEP_ON_FAIL = 10
+        config.filepath = '/test/config.py'
+        supervisor = np.Supervisor(config)
+        process_mock = Mock(side_effect=lambda **kwargs: Mock(None, pid=100 + len(supervisor.processes)))
+        patcher = patch('notification_pusher.multiprocessing.Process', process_mock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return supervisor, process_mock
+
+    def test_supervisor_spawn(self):
+        supervisor, process_mock = self.make_supervisor()
+
+        supervisor.spawn()
+        supervisor.spawn()
+
+        self.assertEqual(process_mock.call_count, 2)
+        process_mock.assert_called_with(
+            target=np.run_process, args=(supervisor.config, 1, supervisor.pid), name='pusher.process#1'
+        )
+        self.assertTrue(supervisor.processes[0].start.called)
+        self.assertTrue(supervisor.processes[0].daemon)
+
+    def test_supervisor_restarts_exited_process(self):
+        supervisor, process_mock = self.make_supervisor()
+        supervisor.spawn()
+        crashed = supervisor.processes[0]
+        crashed.is_alive.return_value = False
+        crashed.exitcode = -9
+        supervisor.processes[1].is_alive.return_value = True
+
+        with patch('notification_pusher.logger.error') as error_m:
+            supervisor.reap()
+        supervisor.spawn()
+        self.assertTrue(error_m.called)
+        self.assertEqual(process_mock.call_count, 2)
+
+        supervisor.started_at[0] -= 10
+        supervisor.spawn()
+        self.assertEqual(process_mock.call_count, 3)
+        self.assertIsNot(supervisor.processes[0], crashed)
+
+    @patch('notification_pusher.os.kill')
+    @patch('notification_pusher.load_config_from_pyfile')
+    def test_supervisor_reload(self, load_conf_m, kill_m):
+        supervisor, _ = self.make_supervisor()
+        supervisor.spawn()
+        new_config = np.Config()
+        new_config.PROCESSES = 1
+        load_conf_m.return_value = new_config
+
+        supervisor.reload()
+
+        self.assertEqual(supervisor.config.PROCESSES, 1)
+        kill_m.assert_any_call(100, np.signal.SIGHUP)
+        kill_m.assert_any_call(101, np.signal.SIGTERM)
+
+    @patch('notification_pusher.exit_code', 130)
+    @patch('notification_pusher.os.kill')
+    def test_supervisor_stop_forwards_signal(self, kill_m):
+        supervisor, _ = self.make_supervisor()
+        supervisor.spawn()
+        for process in supervisor.processes.values():
+            process.exitcode = 130
+
+        self.assertEqual(supervisor.stop(), 130)
+
+        kill_m.assert_any_call(100, np.signal.SIGINT)
+        kill_m.assert_any_call(101, np.signal.SIGINT)
+        self.assertTrue(supervisor.processes == {})
+
+    @patch('notification_pusher.exit_code', 143)
+    @patch('notification_pusher.os.kill', Mock())
+    def test_supervisor_stop_reports_failed_process(self):
+        supervisor, _ = self.make_supervisor(processes=3)
+        supervisor.spawn()
+        supervisor.processes[0].exitcode = 0
+        supervisor.processes[1].exitcode = -9
+        supervisor.processes[2].exitcode = 1
+
+        self.assertEqual(supervisor.stop(), 137)
+
+    @patch('notification_pusher.run_application', True)
+    def test_watch_parent(self):
+        config = Mock(None)
+        config.SLEEP = 0
+
+        with patch('notification_pusher.os.getppid', Mock(side_effect=[42, 1])):
+            with patch('notification_pusher.logger.error'):
+                np.watch_parent(config, 42)
+
+        self.assertFalse(np.run_application)
+
+    @patch('notification_pusher.install_signal_handlers')
+    @patch('notification_pusher.run', Mock(return_value=143))
+    @patch('notification_pusher.logging.shutdown')
+    def test_run_process(self, shutdown_m, install_m):
+        config = Mock(None)
+
+        with patch('gevent.spawn') as spawn_m:
+            with self.assertRaises(SystemExit) as context:
+                np.run_process(config, 1, 42)
+
+        self.assertEqual(context.exception.code, 143)
+        self.assertTrue(install_m.called)
+        self.assertTrue(shutdown_m.called)
+        spawn_m.assert_called_once_with(np.watch_parent, config, 42)
+
+    @patch('notification_pusher.reload_requested', False)
+    def test_reload_handler(self):
+        np.reload_handler(1)
+
+        self.assertTrue(np.reload_requested)
+
+    @patch('notification_pusher.reload_requested', True)
+    @patch('notification_pusher.dictConfig')
+    @patch('notification_pusher.load_config_from_pyfile')
+    def test_reload_config(self, load_conf_m, dictConf_m):
+        config = np.Config()
+        config.filepath = '/test/config.py'
+        config.WORKER_POOL_SIZE = 10
+        config.QUEUE_TUBE = 'tube'
+        config.LOGGING = {'version': 1}
+        new_config = np.Config()
+        new_config.WORKER_POOL_SIZE = 20
+        new_config.QUEUE_TUBE = 'other'
+        new_config.LOGGING = {'version': 1}
+        load_conf_m.return_value = new_config
+        workers_mock = Mock(None)
+
+        with patch('notification_pusher.logger.warning') as warning_m:
+            np.reload_config(config, workers_mock)
+
+        self.assertFalse(np.reload_requested)
+        load_conf_m.assert_called_once_with('/test/config.py')
+        workers_mock.resize.assert_called_once_with(20)
+        self.assertEqual(config.WORKER_POOL_SIZE, 20)
+        self.assertEqual(config.QUEUE_TUBE, 'tube')
+        self.assertTrue(warning_m.called)
+        self.assertFalse(dictConf_m.called)
+
+    @patch('notification_pusher.replace_host_guard')
+    @patch('notification_pusher.load_config_from_pyfile')
+    def test_reload_config_replaces_host_guard(self, load_conf_m, replace_m):
+        config = np.Config()
+        config.filepath = '/test/config.py'
+        config.BREAKER_ERROR_RATE = 0.5
+        new_config = np.Config()
+        new_config.BREAKER_ERROR_RATE = 0.2
+        load_conf_m.return_value = new_config
+
+        np.reload_config(config, Mock(None))
+
+        replace_m.assert_called_once_with(config)
+
+    @patch('notification_pusher.load_config_from_pyfile')
+    def test_reload_config_enables_adaptive_concurrency(self, load_conf_m):
+        config = np.Config()
+        config.filepath = '/test/config.py'
+        config.WORKER_POOL_SIZE = 10
+        config.ADAPTIVE_CONCURRENCY = False
+        new_config = np.Config()
+        new_config.WORKER_POOL_SIZE = 10
+        new_config.ADAPTIVE_CONCURRENCY = True
+        new_config.CONCURRENCY_MAX = 8
+        load_conf_m.return_value = new_config
+        workers_mock = Mock(None)
+
+        np.reload_config(config, workers_mock)
+
+        self.assertEqual(np.concurrency_limiter.limit, 8)
+        workers_mock.resize.assert_called_once_with(8)
+
+    @patch('notification_pusher.replace_session_pool')
+    @patch('notification_pusher.load_config_from_pyfile')
+    def test_reload_config_switches_http_engine(self, load_conf_m, replace_m):
+        config = np.Config()
+        config.filepath = '/test/config.py'
+        config.HTTP_ENGINE = 'requests'
+        new_config = np.Config()
+        new_config.HTTP_ENGINE = 'curl'
+        load_conf_m.return_value = new_config
+
+        np.reload_config(config, Mock(None))
+
+        replace_m.assert_called_once_with(config, mock.ANY)
+        pool = replace_m.call_args[0][1]
+        pool.close()
+        self.assertIsInstance(pool, CurlPool)
+
+    @patch('notification_pusher.replace_session_pool')
+    @patch('notification_pusher.load_config_from_pyfile')
+    def test_reload_config_replaces_session_pool(self, load_conf_m, replace_m):
+        config = np.Config()
+        config.filepath = '/test/config.py'
+        config.HTTP_MAX_CONNECTIONS_PER_HOST = 10
+        new_config = np.Config()
+        new_config.HTTP_MAX_CONNECTIONS_PER_HOST = 2
+        load_conf_m.return_value = new_config
+
+        np.reload_config(config, Mock(None))
+
+        replace_m.assert_called_once_with(config, mock.ANY)
+        self.assertEqual(replace_m.call_args[0][1].max_connections, 2)
+
+    @patch('notification_pusher.load_config_from_pyfile')
+    def test_reload_config_with_invalid_values_keeps_current_config(self, load_conf_m):
+        config = np.Config()
+        config.filepath = '/test/config.py'
+        config.WORKER_POOL_SIZE = 10
+        config.HTTP_ENGINE = 'requests'
+        config.HTTP_MAX_CONNECTIONS_PER_HOST = 10
+        config.JSON_CODEC = 'json'
+        workers_mock = Mock(None)
+        pool = Mock(None)
+
+        for name, value in (('HTTP_ENGINE', 'bogus'), ('JSON_CODEC', 'bogus'), ('DNS_RESOLVER', 'bogus')):
+            new_config = np.Config()
+            new_config.WORKER_POOL_SIZE = 20
+            new_config.HTTP_ENGINE = 'requests'
+            new_config.HTTP_MAX_CONNECTIONS_PER_HOST = 2
+            new_config.JSON_CODEC = 'json'
+            setattr(new_config, name, value)
+            load_conf_m.return_value = new_config
+            make_m = Mock(side_effect=np.make_session_pool)
+
+            with patch('notification_pusher.session_pool', pool):
+                with patch('notification_pusher.make_session_pool', make_m):
+                    with patch('notification_pusher.logger.exception') as exception_m:
+                        np.reload_config(config, workers_mock)
+                self.assertIs(np.session_pool, pool)
+
+            self.assertTrue(exception_m.called)
+            if name != 'HTTP_ENGINE':
+                # the pool of the new settings was built but not installed
+                self.assertEqual(make_m.call_count, 1)
+            self.assertEqual(
+                (config.WORKER_POOL_SIZE, config.HTTP_ENGINE, config.HTTP_MAX_CONNECTIONS_PER_HOST, config.JSON_CODEC),
+                (10, 'requests', 10, 'json')
+            )
+            self.assertFalse(hasattr(config, 'DNS_RESOLVER'))
+        self.assertFalse(workers_mock.resize.called)
+        self.assertFalse(pool.close.called)
+
+    @patch('notification_pusher.load_config_from_pyfile', Mock(side_effect=SyntaxError()))
+    def test_reload_config_with_broken_file(self):
+        config = np.Config()
+        config.filepath = '/test/config.py'
+        config.WORKER_POOL_SIZE = 10
+
+        workers_mock = Mock(None)
+
+        with patch('notification_pusher.logger.exception'):
+            np.reload_config(config, workers_mock)
+
+        self.assertEqual(config.WORKER_POOL_SIZE, 10)
+        self.assertFalse(workers_mock.resize.called)
+
+    @patch('notification_pusher.run_application', True)
+    @patch('notification_pusher.reload_requested', True)
+    @patch('notification_pusher.configure')
+    @patch('notification_pusher.Committer')
+    @patch('notification_pusher.reload_config')
+    @patch('notification_pusher.take_tasks', Mock(None))
+    @patch('notification_pusher.drain', Mock(None))
+    def test_main_loop_reloads_config(self, reload_m, committer_mock, configure_mock):
+        config_mock = Mock(None)
+        config_mock.SLEEP = 0.01
+        config_mock.METRICS_INTERVAL = 60
+        workers_mock = Mock(None)
+        configure_mock.return_value = [Mock(None)], workers_mock, gevent_queue.Queue()
+        reload_m.side_effect = lambda *args: stop_app(None)
+
+        np.main_loop(config_mock)
+
+        reload_m.assert_called_once_with(config_mock, workers_mock)
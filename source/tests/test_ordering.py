@@ -0,0 +1,92 @@
+import unittest
+
+from lib.ordering import FULL, RUN, WAIT, Sequencer
+
+
+class Task(object):
+    def __init__(self, task_id, data):
+        self.task_id = task_id
+        self.data = data
+
+
+class SequencerCase(unittest.TestCase):
+    def setUp(self):
+        self.sequencer = Sequencer(['Partner.example.com', 'http://other.example.com/ordered'], max_pending=2)
+
+    def test_key(self):
+        key = self.sequencer.key
+
+        self.assertEqual(key(Task(1, {'ordering_key': 'order-1', 'callback_url': 'http://a.example.com/'})), 'order-1')
+        self.assertEqual(key(Task(2, {'ordering_key': 7})), 7)
+        self.assertEqual(
+            key(Task(3, {'callback_url': 'http://partner.example.com/push'})), 'http://partner.example.com/push'
+        )
+        self.assertEqual(
+            key(Task(4, {'callback_url': 'http://other.example.com/ordered'})), 'http://other.example.com/ordered'
+        )
+        self.assertIsNone(key(Task(5, {'callback_url': 'http://other.example.com/push'})))
+        self.assertIsNone(key(Task(6, {'ordering_key': None, 'callback_url': 'http://a.example.com/'})))
+        self.assertIsNone(key(Task(7, {'ordering_key': ['not', 'hashable']})))
+        self.assertIsNone(Sequencer().key(Task(8, {'callback_url': 'http://partner.example.com/push'})))
+
+    def test_tasks_of_key_run_one_by_one(self):
+        first, second, third, other = Task(1, {}), Task(2, {}), Task(3, {}), Task(4, {})
+
+        self.assertEqual(self.sequencer.add('a', first), RUN)
+        self.assertEqual(self.sequencer.add('a', second), WAIT)
+        self.assertEqual(self.sequencer.add('a', third), WAIT)
+        self.assertEqual(self.sequencer.add('b', other), RUN)
+        self.assertEqual(len(self.sequencer), 2)
+
+        self.assertIs(self.sequencer.done('a'), second)
+        self.assertIs(self.sequencer.done('a'), third)
+        self.assertIsNone(self.sequencer.done('a'))
+        self.assertIsNone(self.sequencer.done('b'))
+        self.assertEqual((self.sequencer.keys, len(self.sequencer)), ({}, 0))
+
+    def test_pending_tasks_are_bounded(self):
+        self.sequencer.max_tasks = 3
+        for task_id in xrange(3):
+            self.sequencer.add('a', Task(task_id, {}))
+
+        self.assertEqual(self.sequencer.add('a', Task(3, {})), FULL)
+        self.assertEqual(self.sequencer.add('b', Task(4, {})), RUN)
+        self.assertEqual(self.sequencer.add('b', Task(5, {})), WAIT)
+        self.assertEqual(self.sequencer.add('b', Task(6, {})), FULL)
+        self.assertEqual(self.sequencer.add('c', Task(7, {})), FULL)
+
+    def test_delayed_head_runs_again(self):
+        head = Task(1, {})
+        self.sequencer.add('a', head)
+        self.sequencer.add('a', Task(2, {}))
+
+        self.assertEqual(self.sequencer.delay('a'), 1)
+        self.assertEqual(self.sequencer.delay('a', failed=False), 1)
+        self.assertEqual(len(self.sequencer), 3)
+        self.assertEqual(self.sequencer.add('a', head), RUN)
+        self.assertEqual((self.sequencer.attempts('a'), len(self.sequencer)), (1, 2))
+
+        self.sequencer.done('a')
+        self.assertEqual(self.sequencer.attempts('a'), 0)
+
+    def test_held_tasks(self):
+        head, waiting, delayed, other = Task(1, {}), Task(2, {}), Task(3, {}), Task(4, {})
+        self.sequencer.add('a', head)
+        self.sequencer.add('a', waiting)
+        self.sequencer.add('b', delayed)
+        self.sequencer.add('c', other)
+        self.sequencer.delay('b')
+
+        self.assertEqual(sorted(task.task_id for task in self.sequencer.held_tasks()), [2, 3])
+
+    def test_discard_and_drain(self):
+        waiting = [Task(2, {}), Task(3, {})]
+        self.sequencer.add('a', Task(1, {}))
+        for task in waiting:
+            self.sequencer.add('a', task)
+        self.sequencer.add('b', Task(4, {}))
+        self.sequencer.add('b', Task(5, {}))
+
+        self.assertEqual(self.sequencer.discard('a'), waiting)
+        self.assertEqual([task.task_id for task in self.sequencer.drain()], [5])
+        self.assertEqual((self.sequencer.keys, len(self.sequencer)), ({}, 0))
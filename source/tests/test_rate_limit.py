@@ -0,0 +1,51 @@
+import unittest
+
+from lib.rate_limit import RateLimits, TokenBucket
+
+
+class RateLimitCase(unittest.TestCase):
+    def test_bucket_allows_burst_then_rate(self):
+        bucket = TokenBucket(10, 3, now=0)
+
+        self.assertEqual([bucket.take(now=0) for _ in xrange(4)], [True, True, True, False])
+        self.assertFalse(bucket.take(now=0.05))
+        self.assertTrue(bucket.take(now=0.1))
+        self.assertFalse(bucket.take(now=0.1))
+
+    def test_bucket_is_capped_by_burst(self):
+        bucket = TokenBucket(10, 2, now=0)
+        bucket.take(now=0)
+
+        self.assertTrue(bucket.ready(now=100))
+        self.assertEqual(bucket.tokens, 2)
+
+    def test_reserve_spreads_deferred_requests(self):
+        bucket = TokenBucket(4, 1, now=0)
+        bucket.take(now=0)
+
+        self.assertEqual([bucket.reserve(now=0) for _ in xrange(3)], [0.25, 0.5, 0.75])
+        self.assertEqual([bucket.take(now=now) for now in (0.25, 0.5, 0.75)], [True, True, True])
+        self.assertEqual(bucket.reserve(now=0.75), 0.25)
+
+    def test_rules(self):
+        limits = RateLimits({
+            'Partner.example.com': (1, 1), '*.example.com': (10, 10), '*.api.example.com': (5, 5),
+            'free.example.com': None, '*': (100, 100),
+        })
+
+        self.assertEqual(limits.rule('partner.example.com'), (1, 1))
+        self.assertEqual(limits.rule('a.api.example.com'), (5, 5))
+        self.assertEqual(limits.rule('b.example.com'), (10, 10))
+        self.assertIsNone(limits.rule('free.example.com'))
+        self.assertEqual(limits.rule('example.org'), (100, 100))
+        self.assertIsNone(RateLimits().rule('example.org'))
+
+    def test_bucket_per_host(self):
+        limits = RateLimits({'*.example.com': (10, 10)})
+
+        first = limits.bucket('a.example.com')
+        self.assertIs(limits.bucket('a.example.com'), first)
+        self.assertIsNot(limits.bucket('b.example.com'), first)
+        self.assertIsNone(limits.bucket('example.org'))
+        self.assertTrue(limits)
+        self.assertFalse(RateLimits({}))
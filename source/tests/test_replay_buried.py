@@ -0,0 +1,148 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import mock
+
+import replay_buried
+from lib import memory_queue as mq
+
+
+class ReplayBuriedCase(unittest.TestCase):
+    def setUp(self):
+        mq.drop_storage(43)
+        self.queue = mq.Queue(space=43)
+        self.tube = self.queue.tube('pusher')
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        mq.drop_storage(43)
+        shutil.rmtree(self.dir)
+
+    def bury(self, *urls):
+        ids = []
+        for url in urls:
+            self.tube.put({'callback_url': url})
+            task = self.tube.take(0)
+            task.bury()
+            ids.append(task.task_id)
+        return ids
+
+    def replay(self, task_filter=None, **kwargs):
+        kwargs.setdefault('progress_interval', 0)
+        return replay_buried.Replay(
+            self.queue, 'pusher', task_filter or replay_buried.TaskFilter(), 1000, burst=1000, **kwargs
+        )
+
+    def buried_ids(self):
+        return [task.task_id for task, created in self.queue.buried('pusher')]
+
+    def test_replay_digs_buried_tasks(self):
+        ids = self.bury('http://a.example.com/', 'http://b.example.com/')
+
+        replay = self.replay()
+        replay.run()
+
+        self.assertEqual(self.buried_ids(), [])
+        self.assertEqual(replay.done, 2)
+        self.assertEqual(sorted(task.task_id for task in (self.tube.take(0), self.tube.take(0))), sorted(ids))
+
+    def test_filter_by_host(self):
+        ids = self.bury('http://a.example.com/', 'http://B.example.org/x', 'http://c.example.com/')
+
+        self.replay(replay_buried.TaskFilter(hosts=['*.example.org', 'C.example.com'])).run()
+
+        self.assertEqual(self.buried_ids(), ids[:1])
+
+    def test_filter_by_age(self):
+        self.bury('http://a.example.com/')
+        [(task, created)] = replay_buried.buried_tasks(self.queue, 'pusher', 0, 10)
+        task_filter = replay_buried.TaskFilter(min_age=10, max_age=20)
+
+        self.assertTrue(task_filter(task, created, created + 15))
+        self.assertFalse(task_filter(task, created, created + 5))
+        self.assertFalse(task_filter(task, created, created + 25))
+
+    def test_scan_pages_and_limit(self):
+        ids = self.bury(*['http://a.example.com/{}'.format(number) for number in xrange(5)])
+
+        with mock.patch('replay_buried.PAGE_SIZE', 2):
+            self.assertEqual(self.replay().scan(), ids)
+            self.assertEqual(self.replay(limit=3).scan(), ids[:3])
+
+    def test_dry_run_digs_nothing(self):
+        ids = self.bury('http://a.example.com/')
+
+        replay = self.replay(dry_run=True)
+        replay.run()
+
+        self.assertEqual(replay.total, 1)
+        self.assertEqual(self.buried_ids(), ids)
+
+    def test_task_that_is_not_buried_anymore_is_skipped(self):
+        ids = self.bury('http://a.example.com/')
+        replay = self.replay()
+        self.queue.peek(ids[0]).dig()
+
+        replay.dig(ids[0])
+
+        self.assertEqual((replay.done, replay.gone), (0, 1))
+
+    def test_state_file_resumes_replay(self):
+        path = os.path.join(self.dir, 'replay.state')
+        ids = self.bury('http://a.example.com/', 'http://b.example.com/')
+
+        replay = self.replay(state_path=path, limit=1)
+        replay.run()
+        replay.close()
+        # the pusher buried the replayed task again
+        self.tube.take(0).bury()
+
+        replay = self.replay(state_path=path)
+        replay.run()
+        replay.close()
+
+        self.assertEqual(replay.total, 1)
+        self.assertEqual(self.buried_ids(), ids[:1])
+        with open(path) as state_file:
+            self.assertEqual(state_file.read().split(), ids)
+
+    def test_replay_is_paced(self):
+        self.bury(*['http://a.example.com/{}'.format(number) for number in xrange(5)])
+        replay = replay_buried.Replay(self.queue, 'pusher', replay_buried.TaskFilter(), 50, progress_interval=60)
+
+        started_at = time.time()
+        replay.run()
+
+        self.assertGreaterEqual(time.time() - started_at, 0.07)
+        self.assertEqual(replay.done, 5)
+
+    def test_main_replays_tubes_of_lanes(self):
+        urgent, bulk = self.queue.tube('urgent'), self.queue.tube('bulk')
+        for tube in (urgent, bulk, bulk, self.tube):
+            tube.put({'callback_url': 'http://a.example.com/'})
+            tube.take(0).bury()
+        config = mock.Mock(None)
+        config.QUEUE_HOST, config.QUEUE_PORT, config.QUEUE_SPACE = 'localhost', 0, 43
+        config.QUEUE_BACKEND = 'memory'
+        config.QUEUE_TUBE = 'pusher'
+        config.QUEUE_LANES = {'bulk': (1, 0), 'urgent': (4, 1)}
+
+        with mock.patch('replay_buried.load_config_from_pyfile', mock.Mock(return_value=config)):
+            with mock.patch('logging.basicConfig'):
+                replay_buried.main(['replay_buried.py', '-c', 'pusher.py', '-n', '2', '-r', '1000'])
+                lanes_left = [len(self.queue.buried(name)) for name in ('urgent', 'bulk', 'pusher')]
+                replay_buried.main(['replay_buried.py', '-c', 'pusher.py', '--tube', 'pusher'])
+                tube_left = [len(self.queue.buried(name)) for name in ('urgent', 'bulk', 'pusher')]
+
+        self.assertEqual(lanes_left, [0, 1, 1])
+        self.assertEqual(tube_left, [0, 1, 0])
+
+    def test_duration(self):
+        self.assertEqual(
+            [replay_buried.duration(value) for value in ('90', '30s', '2m', '1.5h', '1d')],
+            [90, 30, 120, 5400, 86400]
+        )
+        self.assertRaises(replay_buried.argparse.ArgumentTypeError, replay_buried.duration, '2w')
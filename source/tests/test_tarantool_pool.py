@@ -0,0 +1,188 @@
+import socket
+import struct
+import time
+import unittest
+
+import gevent
+from gevent.server import StreamServer
+from tarantool.error import NetworkError
+
+from lib import tarantool_pool
+from lib.utils import create_queue
+
+
+def read_exactly(sock, size):
+    data = ''
+    while len(data) < size:
+        try:
+            chunk = sock.recv(size - len(data))
+        except socket.error:
+            return None
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+
+def read_field(body, offset):
+    # field lengths in the tests are below 128, so the base128 length is one byte
+    size = ord(body[offset])
+    return body[offset + 1:offset + 1 + size], offset + 1 + size
+
+
+def pack_field(value):
+    return chr(len(value)) + value
+
+
+class FakeTarantool(object):
+    """
+    Tarantool 1.5 answering CALL requests with a tuple of the function name and arguments.
+    sleep(seconds) answers after a delay, drop() closes the connection.
+    """
+    def __init__(self):
+        self.server = StreamServer(('127.0.0.1', 0), self.handle)
+        self.server.start()
+        self.port = self.server.server_port
+        self.connections = 0
+
+    def handle(self, sock, address):
+        self.connections += 1
+        while True:
+            header = read_exactly(sock, 12)
+            if header is None:
+                break
+            request_type, length, request_id = struct.unpack('<LLL', header)
+            body = read_exactly(sock, length)
+            name, offset = read_field(body, 4)
+            args = []
+            cardinality, offset = struct.unpack_from('<L', body, offset)[0], offset + 4
+            for _ in xrange(cardinality):
+                arg, offset = read_field(body, offset)
+                args.append(arg)
+            if name == 'drop':
+                break
+            gevent.spawn(self.answer, sock, request_type, request_id, name, args)
+        sock.close()
+
+    def answer(self, sock, request_type, request_id, name, args):
+        if name == 'sleep':
+            gevent.sleep(float(args[0]))
+        fields = ''.join(pack_field(field) for field in [name] + args)
+        body = struct.pack('<LLL', 0, 1, len(fields)) + struct.pack('<L', 1 + len(args)) + fields
+        try:
+            sock.sendall(struct.pack('<LLL', request_type, len(body), request_id) + body)
+        except Exception:
+            pass
+
+    def stop(self):
+        self.server.stop()
+
+
+class TarantoolPoolCase(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeTarantool()
+        self.connection = tarantool_pool.MultiplexedConnection('127.0.0.1', self.server.port, reconnect_delay=0.01)
+
+    def tearDown(self):
+        self.connection.close()
+        self.server.stop()
+
+    def call(self, name, *args):
+        return list(self.connection.call(name, args or ('x',))[0])
+
+    def test_call(self):
+        self.assertEqual(self.call('box.echo', 'a', 'b'), ['box.echo', 'a', 'b'])
+        self.assertEqual(self.call('box.echo', 'c'), ['box.echo', 'c'])
+        self.assertEqual(self.server.connections, 1)
+
+    def test_requests_overlap_and_answers_may_come_out_of_order(self):
+        finished = []
+
+        def call(delay):
+            result = self.call('sleep', delay)
+            finished.append(result[1])
+
+        greenlets = [gevent.spawn(call, delay) for delay in ('0.2', '0.1', '0')]
+        gevent.joinall(greenlets, timeout=1)
+
+        self.assertEqual(finished, ['0', '0.1', '0.2'])
+        self.assertEqual(self.connection.busy, 0)
+
+    def test_killed_reader_hands_reading_over(self):
+        slow = gevent.spawn(self.call, 'sleep', '0.2')
+        gevent.sleep(0.01)
+        fast = gevent.spawn(self.call, 'sleep', '0.05')
+        gevent.sleep(0.01)
+
+        slow.kill()
+        fast.join(timeout=1)
+
+        self.assertEqual(fast.value, ['sleep', '0.05'])
+        self.assertEqual(self.call('box.echo', 'a'), ['box.echo', 'a'])
+        self.assertEqual(self.server.connections, 1)
+
+    def test_failure_fails_pending_requests_and_reconnects(self):
+        errors = []
+
+        def call():
+            try:
+                self.call('sleep', '0.5')
+            except NetworkError as exc:
+                errors.append(exc)
+
+        pending = gevent.spawn(call)
+        gevent.sleep(0.01)
+
+        self.assertRaises(NetworkError, self.call, 'drop')
+        pending.join(timeout=1)
+
+        self.assertEqual(len(errors), 1)
+        self.assertFalse(self.connection.connected)
+        self.assertEqual(self.call('box.echo', 'a'), ['box.echo', 'a'])
+        self.assertEqual(self.server.connections, 2)
+
+    def test_pool_keeps_session_calls_on_first_connection(self):
+        pool = tarantool_pool.ConnectionPool('127.0.0.1', self.server.port, size=2)
+        pool.connections[0].connected = pool.connections[1].connected = True
+        pool.connections[0].waiters[1] = tarantool_pool.Waiter()
+
+        self.assertIs(pool.connection('queue.take'), pool.connections[0])
+        self.assertIs(pool.connection('queue.ack'), pool.connections[0])
+        self.assertIs(pool.connection('queue.put'), pool.connections[1])
+
+    def test_pool_connects_more_connections_under_load(self):
+        pool = tarantool_pool.ConnectionPool('127.0.0.1', self.server.port, size=3)
+        self.addCleanup(pool.close)
+
+        self.assertEqual(list(pool.call('box.echo', ('a',))[0]), ['box.echo', 'a'])
+        self.assertEqual([connection.connected for connection in pool.connections], [True, False, False])
+
+        calls = [gevent.spawn(pool.call, 'sleep', ('0.05',)) for _ in xrange(3)]
+        gevent.joinall(calls, timeout=1)
+
+        self.assertEqual([list(call.value[0]) for call in calls], [['sleep', '0.05']] * 3)
+        self.assertEqual([connection.connected for connection in pool.connections], [True, True, True])
+        self.assertEqual(self.server.connections, 3)
+
+    def test_pool_skips_recently_failed_connections(self):
+        pool = tarantool_pool.ConnectionPool('127.0.0.1', self.server.port, size=2, reconnect_delay=10)
+        pool.connections[0].failed_at = time.time()
+
+        self.assertIs(pool.connection('queue.put'), pool.connections[1])
+        pool.connections[1].failed_at = time.time()
+        self.assertIs(pool.connection('queue.put'), pool.connections[0])
+
+    def test_pool_calls(self):
+        pool = tarantool_pool.ConnectionPool('127.0.0.1', self.server.port, size=2)
+
+        self.assertEqual(list(pool.call('queue.take', ('0', 'tube'))[0]), ['queue.take', '0', 'tube'])
+        pool.close()
+
+    def test_create_queue_shares_pool_of_server(self):
+        first = create_queue('127.0.0.1', self.server.port, 0, connections=2)
+        second = create_queue('127.0.0.1', self.server.port, 1, connections=2)
+
+        self.assertIsInstance(first, tarantool_pool.PooledQueue)
+        self.assertIs(first.tnt, second.tnt)
+        self.assertEqual(len(first.tnt.connections), 2)
+        self.assertNotIsInstance(create_queue('127.0.0.1', self.server.port, 0), tarantool_pool.PooledQueue)
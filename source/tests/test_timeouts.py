@@ -0,0 +1,59 @@
+import unittest
+
+from lib.timeouts import AdaptiveTimeouts, FixedTimeouts
+
+
+class AdaptiveTimeoutsCase(unittest.TestCase):
+    def make_timeouts(self):
+        return AdaptiveTimeouts(default=2, percentile=0.9, factor=2, floor=0.5, ceiling=5, window=100, min_samples=20)
+
+    def observe(self, timeouts, host, durations):
+        for elapsed in durations:
+            timeouts.observe(host, elapsed)
+
+    def test_default_until_enough_samples(self):
+        timeouts = self.make_timeouts()
+        self.observe(timeouts, 'a.example.com', [0.5] * 19)
+
+        self.assertEqual(timeouts.read_timeout('a.example.com'), 2)
+        self.assertEqual(timeouts.read_timeout('b.example.com'), 2)
+        self.assertEqual(timeouts.snapshot(), {})
+
+    def test_timeout_from_percentile(self):
+        timeouts = self.make_timeouts()
+        self.observe(timeouts, 'a.example.com', [0.5] * 17 + [1.0] * 3)
+
+        self.assertEqual(timeouts.read_timeout('a.example.com'), 2.0)
+        self.assertEqual(timeouts.snapshot(), {'a.example.com': 2.0})
+
+    def test_timeout_is_bounded(self):
+        timeouts = self.make_timeouts()
+        self.observe(timeouts, 'fast.example.com', [0.01] * 20)
+        self.observe(timeouts, 'slow.example.com', [10] * 20)
+
+        self.assertEqual(timeouts.read_timeout('fast.example.com'), 0.5)
+        self.assertEqual(timeouts.read_timeout('slow.example.com'), 5)
+
+    def test_hosts_are_separate(self):
+        timeouts = self.make_timeouts()
+        self.observe(timeouts, 'a.example.com', [0.3] * 20)
+        self.observe(timeouts, 'b.example.com', [1.5] * 20)
+
+        self.assertAlmostEqual(timeouts.read_timeout('a.example.com'), 0.6)
+        self.assertAlmostEqual(timeouts.read_timeout('b.example.com'), 3.0)
+
+    def test_timeout_is_recomputed_periodically(self):
+        timeouts = self.make_timeouts()
+        self.observe(timeouts, 'a.example.com', [0.3] * 20)
+        self.observe(timeouts, 'a.example.com', [2.0] * 9)
+        self.assertAlmostEqual(timeouts.read_timeout('a.example.com'), 0.6)
+
+        timeouts.observe('a.example.com', 2.0)
+        self.assertEqual(timeouts.read_timeout('a.example.com'), 4.0)
+
+    def test_fixed_timeouts(self):
+        timeouts = FixedTimeouts(3)
+        timeouts.observe('a.example.com', 10)
+
+        self.assertEqual(timeouts.read_timeout('a.example.com'), 3)
+        self.assertEqual(timeouts.snapshot(), {})
@@ -117,6 +117,7 @@ class WorkerCase(unittest.TestCase):
         config.MAX_REDIRECTS = 10
         config.USER_AGENT = 'abc'
         config.QUEUE_TAKE_TIMEOUT = 50
+        config.CAPTURE_FILE = None
 
         task_mock = Mock(None)
         task_mock.ack = Mock(None)
@@ -148,6 +149,7 @@ class WorkerCase(unittest.TestCase):
         config.MAX_REDIRECTS = 10
         config.USER_AGENT = 'abc'
         config.QUEUE_TAKE_TIMEOUT = 50
+        config.CAPTURE_FILE = None
 
         task_mock = Mock(None)
         task_mock.ack = Mock(side_effect=DatabaseError())
@@ -173,6 +175,7 @@ class WorkerCase(unittest.TestCase):
         config.MAX_REDIRECTS = 10
         config.USER_AGENT = 'abc'
         config.QUEUE_TAKE_TIMEOUT = 50
+        config.CAPTURE_FILE = None
         config.RECHECK_DELAY = 1000
 
         task_mock = Mock(None)
@@ -201,6 +204,7 @@ class WorkerCase(unittest.TestCase):
         config.MAX_REDIRECTS = 10
         config.USER_AGENT = 'abc'
         config.QUEUE_TAKE_TIMEOUT = 50
+        config.CAPTURE_FILE = None
 
         task_mock = Mock(None)
         task_mock.ack = Mock(None)
@@ -224,6 +228,7 @@ class WorkerCase(unittest.TestCase):
     def test_worker_when_no_task_at_all(self, path_exs_m, get_tubes_m, get_redirect_m):
         config = Mock(None)
         config.QUEUE_TAKE_TIMEOUT = 50
+        config.CAPTURE_FILE = None
 
         in_tube_mock = Mock(None)
         out_tube_mock = Mock(None)
@@ -235,4 +240,56 @@ class WorkerCase(unittest.TestCase):
 
         wr.worker(config, 666)
 
-        self.assertFalse(get_redirect_m.called)
\ No newline at end of file
+        self.assertFalse(get_redirect_m.called)
+
+    @patch('lib.worker.reload_requested', True)
+    @patch('lib.worker.dictConfig')
+    @patch('lib.worker.load_config_from_pyfile')
+    def test_reload_config(self, load_conf_m, dictConf_m):
+        config = Mock(None)
+        config.filepath = '/test/config.py'
+        config.HTTP_TIMEOUT = 3
+        config.INPUT_QUEUE_TUBE = 'url.queue'
+        new_config = Mock(None)
+        new_config.HTTP_TIMEOUT = 5
+        new_config.INPUT_QUEUE_TUBE = 'url.queue'
+        load_conf_m.return_value = new_config
+
+        self.assertFalse(wr.reload_config(config))
+        self.assertEqual(config.HTTP_TIMEOUT, 5)
+        self.assertFalse(wr.reload_requested)
+
+        new_config.INPUT_QUEUE_TUBE = 'other.queue'
+        self.assertTrue(wr.reload_config(config))
+
+    @patch('lib.worker.get_tubes')
+    @patch('lib.worker.reload_config')
+    @patch('os.path.exists')
+    def test_worker_reconnects_after_reload(self, path_exs_m, reload_m, get_tubes_m):
+        config = Mock(None)
+        config.QUEUE_TAKE_TIMEOUT = 50
+        config.CAPTURE_FILE = None
+        in_tube_mock = Mock(None)
+        in_tube_mock.take = Mock(return_value=None)
+        get_tubes_m.return_value = in_tube_mock, Mock(None)
+        path_exs_m.side_effect = [True, False]
+        reload_m.return_value = True
+
+        with patch('lib.worker.reload_requested', True):
+            wr.worker(config, 666)
+
+        reload_m.assert_called_once_with(config)
+        self.assertEqual(get_tubes_m.call_count, 2)
+
+    @patch('lib.worker.get_tubes')
+    @patch('os.path.exists', Mock(return_value=True))
+    def test_worker_when_retired(self, get_tubes_m):
+        config = Mock(None)
+        config.CAPTURE_FILE = None
+        in_tube_mock = Mock(None)
+        get_tubes_m.return_value = in_tube_mock, Mock(None)
+
+        with patch('lib.worker.retire_requested', True):
+            wr.worker(config, 666)
+
+        self.assertFalse(in_tube_mock.take.called)